@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/collectors/enrichment.py
+# DESCRIPTION: Enriquecimento de processos (update_static_info) fora do
+#              caminho dos eventos, num conjunto limitado de threads.
+#
+#              O primeiro evento de um PID desconhecido e todo exec liam
+#              cgroup, attr/current, cada fd, um os.stat por arquivo aberto,
+#              /proc/PID/maps, fdinfo e wchan, e ainda calculavam o MD5 do
+#              executavel inteiro, tudo dentro do tratamento do evento. Um
+#              binario grande ou um pico de execs parava a decodificacao, os
+#              lotes enchiam e o kernel passava a recusar envios.
+#
+#              Agora o tratamento so registra o evento e enfileira o no. Os
+#              pedidos sao deduplicados por (pid, start_time): enquanto um
+#              pedido espera na fila, outro para o mesmo processo nao gera
+#              segunda leitura, porque a que esta na fila ainda vai ler o
+#              /proc atual.
+#
+# STATES:      node.enrichment diz em que ponto o no ficou:
+#                None        nunca pedido (capturas anteriores a este modulo)
+#                "pending"   na fila ou em leitura quando a janela fechou
+#                "complete"  lido
+#                "failed"    processo saiu antes, fila cheia ou erro
+#              O laudo mostra pending/failed: os campos estaticos desse no
+#              estao incompletos, e nao vazios porque nada foi encontrado. O
+#              filho de um fork herda o estado do pai junto com os dados.
+#
+# CACHE:       Cada ciclo do daemon zera a arvore (reset) e relia tudo de
+#              novo, inclusive o MD5 do executavel, de daemons que nao mudam
+#              ha semanas. StaticFactsCache guarda, por PID, os fatos caros e
+#              estaveis (proveniencia e hash do executavel) junto da
+#              identidade do processo: starttime do kernel e o inode/tamanho/
+#              mtime/ctime de /proc/PID/exe. Enquanto a identidade bate eles
+#              sao reaproveitados; exec, saida ou troca do binario os descartam.
+#              O resto (fds, fanotify, maps, cgroups, contexto de seguranca)
+#              continua lido a cada ciclo, e as razoes e selos sao
+#              recalculados dos fatos em todo no: cada captura continua
+#              descrevendo a sua janela, so deixa de refazer o que nao mudou.
+#
+# WINDOW:      Cada pedido leva a janela do no (ProcessTree.window). O worker
+#              le /proc num rascunho do no e so o aplica, sob o lock do pool,
+#              se a janela ainda estiver aberta; close_window() pega o mesmo
+#              lock. Assim, depois que stop() ou rotate() fecham a janela, a
+#              arvore dela pode ser agregada e serializada sem um worker
+#              escrevendo nos nos, mesmo que o drain tenha estourado o prazo.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import queue
+import threading
+
+ENRICH_PENDING = "pending"
+ENRICH_COMPLETE = "complete"
+ENRICH_FAILED = "failed"
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_PENDING = 4096
+DEFAULT_CACHE_ENTRIES = 32768
+
+
+def enrichment_key(node):
+    """Identidade do processo: o PID sozinho pode ter sido reutilizado."""
+    return (node.pid, node.start_time)
+
+
+def process_identity(pid):
+    """
+    (starttime, alvo de /proc/PID/exe, dev, ino, tamanho, mtime_ns, ctime_ns),
+    ou None sem executavel (thread de kernel) ou com o processo ausente.
+
+    O stat e feito em /proc/PID/exe, que leva ao inode em uso mesmo com o
+    binario apagado ou em memfd.
+    """
+    try:
+        with open("/proc/%d/stat" % pid, "rb") as f:
+            raw = f.read()
+        starttime = int(raw[raw.rfind(b")") + 1:].split()[19])
+        exe = "/proc/%d/exe" % pid
+        link = os.readlink(exe)
+        st = os.stat(exe)
+    except (OSError, ValueError, IndexError):
+        return None
+    return (starttime, link, st.st_dev, st.st_ino, st.st_size,
+            st.st_mtime_ns, st.st_ctime_ns)
+
+
+class StaticFactsCache(object):
+    """
+    Fatos estaticos por PID que sobrevivem ao reset() da arvore.
+
+    get() so devolve os fatos se a identidade atual do processo for a mesma
+    de quando foram lidos. Limitado a max_entries (sai o mais antigo); com 0
+    nada e guardado.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max(0, int(max_entries))
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pid, identity):
+        with self._lock:
+            entrada = self._entries.get(pid)
+            if entrada is not None and entrada[0] == identity:
+                self.hits += 1
+                return entrada[1]
+            self.misses += 1
+            return None
+
+    def put(self, pid, identity, facts):
+        if not self.max_entries or identity is None: return
+        with self._lock:
+            self._entries.pop(pid, None)
+            while len(self._entries) >= self.max_entries:
+                del self._entries[next(iter(self._entries))]
+            self._entries[pid] = (identity, facts)
+
+    def forget(self, pid):
+        """Exec: nova imagem com o mesmo PID e starttime, talvez o mesmo binario."""
+        with self._lock:
+            self._entries.pop(pid, None)
+
+    def prune(self, live_pids):
+        """Descarta os PIDs que sairam."""
+        with self._lock:
+            for pid in [p for p in self._entries if p not in live_pids]:
+                del self._entries[pid]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def enrich_node(node, cache=None, hashes=None):
+    """
+    Le o contexto estatico de um no e registra o resultado em node.enrichment.
+
+    Chamado pelos workers e, sem pool, direto pela arvore (varredura de /proc).
+    Com cache (StaticFactsCache) os fatos caros de um processo inalterado sao
+    reaproveitados; hashes (ExeHashCache) evita rehashear o mesmo binario.
+    Retorna True se o no ficou completo.
+    """
+    try:
+        node.update_static_info(cache, hashes)
+    except Exception as e:
+        node.enrichment = ENRICH_FAILED
+        node.enrichment_error = str(e) or type(e).__name__
+        return False
+    # update_static_info nao falha com o processo ausente, so devolve vazio;
+    # sem /proc/PID no fim, o que veio pode estar pela metade ou nem existir.
+    # As heuristicas sobre a linha de comando valem mesmo assim.
+    if not os.path.isdir("/proc/%d" % node.pid):
+        node.enrichment = ENRICH_FAILED
+        node.enrichment_error = "process exited before enrichment finished"
+        return False
+    node.enrichment = ENRICH_COMPLETE
+    node.enrichment_error = None
+    return True
+
+
+class EnrichmentPool(object):
+    """
+    Fila deduplicada de nos a enriquecer e as threads que a consomem.
+
+    submit() nunca bloqueia: com max_pending pedidos na fila, o no e marcado
+    "failed" e o evento segue. drain() espera, no maximo timeout segundos, a
+    fila esvaziar. close_window() descarta o que ainda for de uma janela
+    encerrada.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 enrich=enrich_node):
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.enrich = enrich
+        self._queue = queue.Queue()
+        # chave -> (no, janela): o no e resolvido so quando o worker pega a
+        # chave, o que permite redirecionar um pedido pendente para a copia
+        # mais nova do no.
+        self._pending = {}
+        self.window = 0
+        self._busy = 0
+        self._cond = threading.Condition()
+        self._threads = []
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self.stale = 0
+
+    def start(self):
+        """Sobe as threads, uma vez por processo."""
+        if self._threads: return
+        for i in range(self.workers):
+            t = threading.Thread(target=self._run, name="si-enrich-%d" % i)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, node, window=0):
+        """
+        Enfileira o no da janela window; devolve False se a fila estava
+        cheia.
+        """
+        key = enrichment_key(node)
+        with self._cond:
+            if key in self._pending:
+                self._pending[key] = (node, window)
+                node.enrichment = ENRICH_PENDING
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                node.enrichment = ENRICH_FAILED
+                node.enrichment_error = "enrichment queue full"
+                return False
+            self._pending[key] = (node, window)
+            self._busy += 1
+            node.enrichment = ENRICH_PENDING
+        self._queue.put(key)
+        return True
+
+    def pending(self):
+        """Pedidos na fila ou em leitura."""
+        with self._cond:
+            return self._busy
+
+    def drain(self, timeout=None):
+        """Espera a fila esvaziar; devolve quantos pedidos ficaram sem leitura."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._busy == 0, timeout)
+            return self._busy
+
+    def close_window(self, window):
+        """
+        Passa a aceitar so pedidos da janela window. Os das anteriores deixam
+        de ser aplicados; ao retornar, nenhum esta no meio da aplicacao.
+        """
+        with self._cond:
+            self.window = window
+
+    def _run(self):
+        while True:
+            key = self._queue.get()
+            with self._cond:
+                job = self._pending.pop(key, None)
+            try:
+                if job is not None:
+                    self._read(*job)
+            except Exception:
+                # enrich_node ja trata os erros; isto so protege a thread.
+                self.failed += 1
+            finally:
+                with self._cond:
+                    self._busy -= 1
+                    self._cond.notify_all()
+
+    def _read(self, node, window):
+        """Le o rascunho do no e o aplica se a janela ainda estiver aberta."""
+        if window != self.window:
+            self.stale += 1
+            return
+        rascunho = node.enrichment_draft(
+            lambda md5, sha256: self._late_hashes(node, window, md5, sha256))
+        ok = self.enrich(rascunho)
+        with self._cond:
+            if window != self.window:
+                self.stale += 1
+                return
+            node.absorb_enrichment(rascunho)
+        if ok:
+            self.completed += 1
+        else:
+            self.failed += 1
+
+    def _late_hashes(self, node, window, md5, sha256):
+        """Hash de binario grande que ficou pronto depois da leitura."""
+        with self._cond:
+            if window == self.window:
+                node._hashes_ready(md5, sha256)
@@ -17,11 +17,12 @@ import time
 import logging
 from src.core.engine import SysInspectorEngine
 from src.collectors.system_inventory import collect_full_inventory
+from src.probes.blk_latency import attach_disk_latency
 from src.collectors.persistence import collect_persistence
 from src.core.findings import sort_findings, dedupe_findings, summarize_by_severity
 
 
-def summarize_metrics(processes):
+def summarize_metrics(processes, health=None):
     """
     Resume as metricas quentes de uma captura a partir da arvore ja agregada
     (aggregate_stats roda em engine.stop). Alimenta as colunas estruturadas da
@@ -30,7 +31,8 @@ def summarize_metrics(processes):
     compartilhado por snapshot e daemon para manter um unico modelo.
 
     PARAMETER processes: dict pid -> dados do processo (data['processes']).
-    Retorna dict com chaves cpu, mem, pids, score.
+    PARAMETER health: data['capture_health'] do motor, quando houver.
+    Retorna dict com chaves cpu, mem, pids, score, lost.
     """
     nodes = list(processes.values()) if processes else []
 
@@ -73,7 +75,12 @@ def summarize_metrics(processes):
     except Exception:
         mem_used = 0
 
-    return {"cpu": cpu_avg, "mem": mem_used, "pids": pids, "score": score}
+    # Eventos perdidos na janela: diferente de zero, a captura esta incompleta
+    # e a frota precisa mostrar isso sem descriptografar o blob.
+    lost = _number((health or {}).get("lost_events"), int)
+
+    return {"cpu": cpu_avg, "mem": mem_used, "pids": pids, "score": score,
+            "lost": lost}
 
 
 def correlate_findings_with_processes(findings, processes):
@@ -184,15 +191,22 @@ class CollectionManager:
                 time.sleep(1)
 
             # 3. Stop Engine (Freeze state)
-            self.engine.stop()
+            # A duracao medida, e nao a pedida: o laco acima passa do alvo em
+            # ate um segundo, e o percentual de CPU e dividido por ela.
+            elapsed = time.time() - start_time
+            self.engine.stop(duration=elapsed)
 
             # 4. Static Collection
             self.logger.info("[COLLECT] Gathering static system inventory...")
             full_data = collect_full_inventory()
 
             # 5. Merge Dynamic Data
-            # This calls the updated ProcessTree logic (Duration, EDR Wchan, etc.)
+            # This calls the updated ProcessTree logic (Duration, Context Tags, etc.)
             full_data['processes'] = self.engine.tree.to_json()
+            full_data['capture_health'] = self.engine.capture_health
+            # Percentis de latencia de bloco de cada disco, na propria topologia.
+            attach_disk_latency(full_data.get('storage'),
+                                self.engine.capture_health.get('disk_latency'))
 
             # 6. Static forensic findings (persistence mechanisms).
             # Roda depois da janela eBPF para nao competir com a captura.
@@ -205,7 +219,7 @@ class CollectionManager:
             full_data['findings_summary'] = summarize_by_severity(findings)
 
             # 7. Metadata
-            full_data['capture_duration'] = duration
+            full_data['capture_duration'] = round(elapsed, 3)
             full_data['mode'] = self.config.get('general', {}).get('mode', 'unknown')
 
             self.logger.info(f"[COLLECT] Capture complete. {len(full_data['processes'])} processes tracked, "
@@ -216,10 +216,10 @@ def _collect_immutable_files():
     intermitente. Achado no coletor e a fonte unica e confiavel.
 
     Usa o mesmo scanner limitado (teto de arquivos, orcamento de tempo, sem
-    seguir socket/FIFO) de process_tree, para nao manter duas varreduras do mesmo
+    seguir socket/FIFO) de immutable.py, para nao manter duas varreduras do mesmo
     fato divergindo.
     """
-    from src.collectors.process_tree import _immutable_files_in
+    from src.collectors.immutable import _immutable_files_in
 
     findings = []
     for entrada in _immutable_files_in(IMMUTABLE_WATCH_DIRS):
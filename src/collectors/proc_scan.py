@@ -0,0 +1,368 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/collectors/proc_scan.py
+# DESCRIPTION: Leitura de /proc para a arvore de processos: a listagem dos
+#              PIDs, a varredura que poe cada um na arvore e os arquivos por
+#              processo que o enriquecimento le (cgroup, maps, fd, fdinfo,
+#              attr/current).
+#
+# WHY:         Separado de process_tree.py, que fica com o no, o esquema e a
+#              agregacao. Aqui so ha acesso ao sistema de arquivos.
+#
+# HOW:         ProcScanMixin e herdado por ProcessTree. Usa o estado da arvore:
+#              nodes, scan_workers, boot_time, add_or_update e
+#              _check_global_anomalies.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Get System Clock Ticks (usually 100) for uptime calc
+try:
+    CLK_TCK = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+except:
+    CLK_TCK = 100
+
+
+def _get_container_info(pid):
+    """Parses cgroup to find Docker/K8s/Podman IDs."""
+    c_id, c_type = None, "host"
+    try:
+        with open(f"/proc/{pid}/cgroup", "r") as f:
+            for line in f:
+                if "docker" in line:
+                    parts = line.split("docker")[-1]
+                    c_id = ''.join(filter(str.isalnum, parts))[:12]
+                    c_type = "docker"
+                    break
+                elif "kubepods" in line:
+                    c_type = "k8s"
+                    if "pod" in line:
+                        parts = line.split("pod")[-1]
+                        c_id = ''.join(filter(str.isalnum, parts))[:12]
+                        break
+                elif "libpod" in line:
+                    c_type = "podman"
+                    parts = line.split("libpod-")[-1]
+                    c_id = ''.join(filter(str.isalnum, parts))[:12]
+                    break
+    except: pass
+    return c_id, c_type
+
+
+def _get_raw_cgroups(pid):
+    """Reads all cgroup entries for detail display."""
+    cgroups = []
+    try:
+        with open(f"/proc/{pid}/cgroup", "r") as f:
+            for line in f:
+                cgroups.append(line.strip())
+    except: pass
+    return cgroups
+
+
+def _read_maps(pid):
+    """Scans /proc/PID/maps to find loaded libraries."""
+    libs = set()
+    try:
+        with open(f"/proc/{pid}/maps", "r") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) > 5:
+                    path = parts[5]
+                    if path.startswith("/") and not path.startswith(("/dev", "[", "/sys", "/proc")):
+                        libs.add(path)
+    except: pass
+    return list(libs)
+
+
+def _read_security_context(pid):
+    """Reads SELinux/AppArmor context."""
+    try:
+        with open(f"/proc/{pid}/attr/current", "r") as f:
+            return f.read().strip().replace('\x00', '')
+    except:
+        return "unconfined"
+
+
+FANOTIFY_FD = "anon_inode:[fanotify]"
+
+
+def _check_fanotify(pid, open_fds=None):
+    """
+    Parses /proc/PID/fdinfo to find Fanotify flags.
+
+    So le o fdinfo dos descritores que apontam para um grupo fanotify. Com
+    open_fds (alvos de /proc/PID/fd ja lidos por _scan_open_fds) e sem
+    nenhum fanotify entre eles, nem lista o diretorio: e o caso de quase todo
+    processo, e permite reler isto a cada ciclo.
+    """
+    if open_fds is not None and FANOTIFY_FD not in open_fds: return False
+    try:
+        fd_dir = f"/proc/{pid}/fd"
+        if not os.path.exists(fd_dir): return False
+
+        inspector_details = {"found": False, "mode": "Unknown", "flags": ""}
+
+        for fd_file in os.listdir(fd_dir):
+            try:
+                if os.readlink(os.path.join(fd_dir, fd_file)) != FANOTIFY_FD: continue
+                with open(f"/proc/{pid}/fdinfo/{fd_file}", "r") as f:
+                    content = f.read()
+                    if "fanotify" in content:
+                        inspector_details["found"] = True
+                        match = re.search(r"fanotify flags:([0-9a-fA-F]+)", content)
+                        if match:
+                            hex_flags = int(match.group(1), 16)
+                            inspector_details["flags"] = hex(hex_flags)
+                            if hex_flags == 0:
+                                inspector_details["mode"] = "ASYNC (Log Only)"
+                            else:
+                                inspector_details["mode"] = "SYNC (Blocking Inspection)"
+                        return inspector_details
+            except: continue
+    except: pass
+    return False
+
+
+def _scan_open_fds(pid):
+    """
+    Scans /proc/PID/fd to get currently open files.
+    [FIX] Removed incorrect logic that skipped normal configuration files.
+    """
+    files = set()
+    try:
+        fd_dir = f"/proc/{pid}/fd"
+        if not os.path.exists(fd_dir): return files
+        for fd in os.listdir(fd_dir):
+            try:
+                path = os.readlink(os.path.join(fd_dir, fd))
+
+                if path.startswith("/"):
+                    pass
+
+                # Special handling for abstract sockets/pipes often appearing with type prefixes
+                if path.startswith(("socket:", "pipe:", "anon_inode:")):
+                    files.add(path)
+                    continue
+
+                if path == "/dev/null":
+                    files.add(path)
+                    continue
+
+                files.add(path)
+            except: pass
+    except: pass
+    return files
+
+
+def _get_udp_stats():
+    """Reads global UDP OutDatagrams from /proc/net/snmp."""
+    try:
+        with open("/proc/net/snmp", "r") as f:
+            for line in f:
+                if line.startswith("Udp:"):
+                    parts = line.split()
+                    if parts[1].isdigit():
+                        return int(parts[4])
+    except: pass
+    return 0
+
+
+def _live_pids():
+    """
+    PIDs presentes em /proc agora: uma unica listagem, sem abrir nada.
+
+    E o que permite reconciliar a arvore com o host sem reler os arquivos de
+    cada processo: so os PIDs novos precisam ser lidos.
+    """
+    try:
+        with os.scandir('/proc') as it:
+            return {int(e.name) for e in it if e.name.isdigit()}
+    except OSError:
+        return set()
+
+
+# Threads da varredura completa de /proc. As leituras soltam o GIL; com 1 (ou
+# com poucos PIDs, caso do reconcile) a varredura e sequencial.
+DEFAULT_SCAN_WORKERS = 4
+_SCAN_POOL_MIN_PIDS = 64
+
+
+def _read_at(dir_fd, name):
+    """Conteudo (bytes) de um arquivo relativo ao diretorio aberto (openat)."""
+    fd = os.open(name, os.O_RDONLY, dir_fd=dir_fd)
+    try:
+        partes = []
+        while True:
+            bloco = os.read(fd, 65536)
+            if not bloco: break
+            partes.append(bloco)
+        return b"".join(partes)
+    finally:
+        os.close(fd)
+
+
+def _parse_stat(raw):
+    """
+    (comm, state, ppid, nice, starttime) de /proc/PID/stat. O comm vai entre
+    parenteses e pode conter espacos e ')', por isso o corte no ULTIMO ')'.
+    """
+    fim = raw.rfind(b')')
+    comm = raw[raw.find(b'(') + 1:fim].decode('utf-8', 'replace')
+    rest = raw[fim + 1:].split()
+    nice = int(rest[16]) if len(rest) > 16 else 0
+    starttime = int(rest[19]) if len(rest) > 19 else None
+    return comm, rest[0].decode(), int(rest[1]), nice, starttime
+
+
+def _status_field(raw, key):
+    """
+    Primeiro valor de uma linha de /proc/PID/status (b'Uid', b'VmRSS'), sem
+    montar o dicionario do arquivo inteiro. None se a linha nao existe.
+    """
+    marca = b'\n' + key + b':'
+    i = raw.find(marca)
+    if i < 0: return None
+    i += len(marca)
+    fim = raw.find(b'\n', i)
+    campo = raw[i:fim if fim >= 0 else len(raw)].split()
+    return campo[0] if campo else None
+
+
+def _format_duration(seconds):
+    """Formats seconds into 14D 6h 35m."""
+    d = datetime(1, 1, 1) + timedelta(seconds=seconds)
+    days = d.day - 1
+    hours = d.hour
+    mins = d.minute
+
+    parts = []
+    if days > 0: parts.append(f"{days}D")
+    if hours > 0: parts.append(f"{hours}h")
+    if mins > 0: parts.append(f"{mins}m")
+    if not parts: return f"{d.second}s"
+    return " ".join(parts)
+
+
+class ProcScanMixin:
+    """Varredura de /proc e reconciliacao da arvore com os PIDs vivos."""
+
+    def reconcile(self):
+        """
+        Acerta a arvore com /proc sem varrer tudo de novo.
+
+        Uma listagem de /proc diz quem entrou e quem saiu desde a ultima
+        leitura; so os PIDs novos tem os arquivos lidos. Cobre o que os eventos
+        de fork/exit nao trouxeram (perda de eventos, orcamento do processo,
+        intervalo entre capturas com as sondas sem leitura).
+
+        Retorna a lista de PIDs acrescentados.
+        """
+        vivos = _live_pids()
+        # Copia das chaves: a thread de eventos insere nos durante a varredura.
+        for pid in [p for p in list(self.nodes) if p not in vivos]:
+            self.nodes.pop(pid, None)
+        novos = [p for p in vivos if p not in self.nodes]
+        if novos:
+            self.scan_proc_fs(novos)
+        return novos
+
+    def scan_proc_fs(self, pids=None):
+        """
+        Le /proc e acrescenta os processos a arvore.
+
+        Sem argumento e a varredura completa (partida do motor, arvore vazia);
+        com uma lista de PIDs le so esses, que e o que reconcile() usa. Com
+        muitos PIDs a leitura (e o enriquecimento de cada no) e dividida entre
+        scan_workers threads: open/read em /proc soltam o GIL.
+        """
+        completa = pids is None
+        if completa:
+            print("[*] Scanning /proc...")
+            self._check_global_anomalies()
+            pids = sorted(_live_pids())
+        my_pid = os.getpid()
+        pids = [p for p in pids if p != my_pid]
+        inicio = time.perf_counter()
+
+        # Pre-read system uptime for calculations
+        try:
+            with open('/proc/uptime', 'r') as uf:
+                sys_uptime = float(uf.readline().split()[0])
+        except: sys_uptime = 0
+
+        def le(pid):
+            try: return bool(self._scan_pid(pid, sys_uptime))
+            except Exception: return False
+
+        workers = max(1, int(self.scan_workers or 1))
+        if workers == 1 or len(pids) < _SCAN_POOL_MIN_PIDS:
+            count = sum(le(pid) for pid in pids)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                count = sum(pool.map(le, pids, chunksize=32))
+        if completa:
+            print(f"[+] Static Scan Complete. Found {count} processes "
+                  f"({time.perf_counter() - inicio:.2f}s, {workers} threads).")
+        return count
+
+    def _scan_pid(self, pid, sys_uptime):
+        """
+        Le um PID e o poe na arvore. O diretorio e aberto uma vez e os arquivos
+        relativos a ele (openat); do status so sai a linha Uid, o resto vem do
+        stat, e o fstat do diretorio da o inicio sem outro stat por caminho.
+        """
+        try:
+            dir_fd = os.open(f"/proc/{pid}", os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return False
+        try:
+            try:
+                name, state, ppid, nice, starttime = _parse_stat(_read_at(dir_fd, 'stat'))
+                status = _read_at(dir_fd, 'status')
+                start_time = os.fstat(dir_fd).st_ctime
+            except (OSError, ValueError, IndexError):
+                return False
+
+            luid = None
+            try:
+                val = _read_at(dir_fd, 'loginuid').strip()
+                if val: luid = int(val)
+            except (OSError, ValueError): pass
+
+            try:
+                raw = _read_at(dir_fd, 'cmdline')
+                if raw:
+                    full_cmd = raw.replace(b'\0', b' ').decode('utf-8', 'ignore').strip()
+                    if full_cmd: name = full_cmd
+            except OSError: pass
+        finally:
+            os.close(dir_fd)
+
+        uid = _status_field(status, b'Uid')
+        uid = int(uid) if uid and uid.isdigit() else 0
+        prio_val = 120 + nice
+        duration_str = ""
+        start_ts_abs = ""
+        if starttime is not None:
+            # [v0.70] Duration Calc
+            starttime_sec = starttime / CLK_TCK
+            duration_str = _format_duration(sys_uptime - starttime_sec)
+            abs_start = self.boot_time + timedelta(seconds=starttime_sec)
+            start_ts_abs = abs_start.strftime("%a, %d %b %Y at %H:%M")
+
+        self.add_or_update(pid, ppid, name, uid, prio_val, luid,
+                           proc={"state": state, "duration_str": duration_str,
+                                 "start_ts_abs": start_ts_abs, "start_time": start_time})
+
+        rss_kb = _status_field(status, b'VmRSS')
+        if rss_kb and rss_kb.isdigit():
+            node = self.nodes.get(pid)
+            if node: node.rss = int(rss_kb) * 1024
+        return True
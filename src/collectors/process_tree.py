@@ -9,6 +9,7 @@
 #              - FEAT: Added 'Duration' (Uptime - Starttime) calculation.
 #              - FEAT: Added 'Started ON' absolute timestamp.
 #              - FEAT: Horizontal EDR Detection (Wchan check) -> Badge 🧊
+#                (now measured off-CPU time in BPF: src/probes/offcpu.py)
 #
 # AUTHOR: Mario Luz (Sys-Inspector Project)
 # ==============================================================================
@@ -16,15 +17,23 @@
 import os
 import pwd
 import grp
-import hashlib
-import glob
-import re
 import time
 # import sys
-import subprocess
-import shutil
+import threading
+from functools import lru_cache
 from datetime import datetime, timedelta
 
+from src.collectors.enrichment import (enrich_node, process_identity, StaticFactsCache,
+                                       ENRICH_PENDING)
+from src.collectors.tree_index import TreeIndex
+from src.collectors.immutable import _check_immutable_path, _immutable_files_in
+from src.collectors.proc_scan import (ProcScanMixin, _get_container_info, _get_raw_cgroups,
+                                      _read_maps, _read_security_context, _check_fanotify,
+                                      _scan_open_fds, _get_udp_stats, _live_pids,
+                                      DEFAULT_SCAN_WORKERS)
+from src.core.hash_cache import ExeHashCache, HASH_PENDING
+from src.probes.offcpu import EDR_WAIT_REASON
+
 # ------------------------------------------------------------------------------
 # CONSTANTS: BITMASK SCORING
 # ------------------------------------------------------------------------------
@@ -38,6 +47,11 @@ SCORE_NET_ISSUE = 64
 SCORE_ZOMBIE = 128
 SCORE_IMMUTABLE = 256
 
+# Selos que sobem do filho para os ancestrais em aggregate_stats (alem de
+# qualquer selo com "WARN" no nome).
+BUBBLE_TAGS = frozenset(("SSH", "SUDO", "UNSAFE", "MINER", "EDR/AV", "CONTAINER", "GPU",
+                         "NET ERR", "NEW", "WARN", "ZOMBIE", "EDR-WAIT", "🧊"))
+
 # Diretorios de onde um binario legitimo normalmente NAO e executado.
 UNSAFE_EXEC_PREFIXES = ("/tmp/", "/dev/shm/", "/var/tmp/", "/run/shm/")
 
@@ -62,18 +76,12 @@ def unsafe_path_in_cmdline(cmdline):
     return None
 
 
-# Get System Clock Ticks (usually 100) for uptime calc
-try:
-    CLK_TCK = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
-except:
-    CLK_TCK = 100
-
-
 # ------------------------------------------------------------------------------
 # HELPER FUNCTIONS
 # ------------------------------------------------------------------------------
+@lru_cache(maxsize=4096)
 def get_username(uid):
-    """Resolves UID to Username."""
+    """Resolves UID to Username (memoized: called per open file)."""
     try:
         if uid == 4294967295 or uid == -1: return "unset"
         return pwd.getpwuid(uid).pw_name
@@ -81,402 +89,297 @@ def get_username(uid):
         return str(uid)
 
 
-def calculate_md5(filepath):
-    """Calculates MD5 hash of a file."""
-    if not os.path.exists(filepath): return "N/A"
+@lru_cache(maxsize=4096)
+def _group_name(gid):
     try:
-        hasher = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        return grp.getgrgid(gid).gr_name
     except:
-        return "ACCESS_DENIED"
-
+        return str(gid)
 
-def _get_container_info(pid):
-    """Parses cgroup to find Docker/K8s/Podman IDs."""
-    c_id, c_type = None, "host"
-    try:
-        with open(f"/proc/{pid}/cgroup", "r") as f:
-            for line in f:
-                if "docker" in line:
-                    parts = line.split("docker")[-1]
-                    c_id = ''.join(filter(str.isalnum, parts))[:12]
-                    c_type = "docker"
-                    break
-                elif "kubepods" in line:
-                    c_type = "k8s"
-                    if "pod" in line:
-                        parts = line.split("pod")[-1]
-                        c_id = ''.join(filter(str.isalnum, parts))[:12]
-                        break
-                elif "libpod" in line:
-                    c_type = "podman"
-                    parts = line.split("libpod-")[-1]
-                    c_id = ''.join(filter(str.isalnum, parts))[:12]
-                    break
-    except: pass
-    return c_id, c_type
-
-
-def _get_raw_cgroups(pid):
-    """Reads all cgroup entries for detail display."""
-    cgroups = []
-    try:
-        with open(f"/proc/{pid}/cgroup", "r") as f:
-            for line in f:
-                cgroups.append(line.strip())
-    except: pass
-    return cgroups
 
+# Sem o cache da arvore (no enriquecido fora dela), hashes so em memoria.
+_LOCAL_HASHES = ExeHashCache()
 
-def _read_maps(pid):
-    """Scans /proc/PID/maps to find loaded libraries."""
-    libs = set()
-    try:
-        with open(f"/proc/{pid}/maps", "r") as f:
-            for line in f:
-                parts = line.split()
-                if len(parts) > 5:
-                    path = parts[5]
-                    if path.startswith("/") and not path.startswith(("/dev", "[", "/sys", "/proc")):
-                        libs.add(path)
-    except: pass
-    return list(libs)
-
-
-def _read_security_context(pid):
-    """Reads SELinux/AppArmor context."""
-    try:
-        with open(f"/proc/{pid}/attr/current", "r") as f:
-            return f.read().strip().replace('\x00', '')
-    except:
-        return "unconfined"
 
+# ------------------------------------------------------------------------------
+# CORE CLASSES
+# ------------------------------------------------------------------------------
+# Esquema do ProcessNode: (campo, padrao). O no e "slotted" e um campo no
+# padrao nao ocupa nada na instancia: a leitura de um slot vazio cai em
+# __getattr__, que devolve o padrao. set/list/dict sao fabricas: o objeto so
+# e criado (e guardado) na primeira leitura, quando vai ser preenchido. Num
+# host com milhares de threads de kernel ociosas a maior parte dos campos
+# nunca sai do padrao. A criacao passa por _LAZY_LOCK: a thread de eventos e
+# a de enriquecimento escrevem nas mesmas colecoes (context_tags, open_files,
+# detection_reasons...), e duas criando a mesma ao mesmo tempo perderiam o
+# que uma delas gravou.
+NODE_FIELDS = (
+    ("pid", 0), ("ppid", 0), ("cmd", ""), ("uid", 0), ("prio", 120), ("nice", 0),
+    ("username", ""), ("loginuid", None), ("loginuser", None),
+    ("state", "R"),
+
+    # Fim do processo, quando o kernel o informou (sched_process_exit):
+    # instante real (epoch) e o status cru (codigo << 8 | sinal).
+    ("end_time", 0), ("exit_code", None),
+
+    # Resources
+    ("vsz", 0), ("rss", 0), ("cpu_usage_pct", 0.0),
+    ("cpu_time_ns", 0),       # Tempo em CPU na janela (sched_switch)
+    ("start_time", 0),
+
+    # [v0.70] Time Metrics
+    ("duration_str", ""), ("start_ts_abs", ""),
+
+    # Extended Context
+    ("gpu_usage", False), ("container_id", None), ("container_type", "host"),
+    ("cgroups", list), ("is_inspector", False), ("inspector_data", None),
+    ("is_inspected", False), ("security_context", "N/A"),
+
+    # Metrics (Own)
+    ("read_bytes_delta", 0), ("write_bytes_delta", 0),
+    ("net_tx_bytes", 0), ("net_rx_bytes", 0), ("tcp_retrans", 0), ("tcp_drops", 0),
+    # Fluxos com mais pacotes descartados na janela (src/probes/drop_flows.py)
+    # e quantos descartes ficaram em fluxos fora da lista.
+    ("drop_flows", list), ("drop_flows_omitted", 0),
+    # Descartes como texto ("DROP: ..."), so preenchido em capturas antigas
+    # reabertas no laudo; sai sempre no JSON, vazio, como antes.
+    ("network_drops_details", list),
+    # Destinos de saida mais usados na janela (src/probes/connections.py)
+    # e o uso somado dos que ficaram fora da tabela. connections guarda os
+    # rotulos desses destinos ("IPv4 -> ip:porta"), como sempre guardou.
+    ("connection_table", list), ("connections_omitted", 0),
+
+    ("io_latency_tot", 0), ("io_ops_count", 0),
+    # Percentis da latencia de bloco da janela (src/probes/blk_latency.py);
+    # vazio sem requisicao de disco.
+    ("blk_latency", dict),
+    # Tempo dormindo (estados de engine.offcpu_states) e, dele, o passado
+    # em caminhos de inspecao de seguranca, por ponto de espera (ms).
+    ("offcpu_ms", 0.0), ("edr_wait_ms", 0.0), ("edr_wait_sites", dict),
+    # Por thread (tid -> contadores), so com engine.io_per_thread ligado.
+    ("io_threads", dict),
+
+    # Eventos descartados no kernel por passar do orcamento do processo
+    # (total e por tipo: "open", "exec", ...). Diferente de zero, o
+    # processo foi ruidoso e parte do que fez nao esta em open_files etc.
+    ("suppressed_events", 0), ("suppressed_by_type", dict),
+
+    # Tree Metrics (Accumulated)
+    ("tree_read", 0), ("tree_write", 0), ("tree_read_delta", 0), ("tree_write_delta", 0),
+    ("tree_net_tx", 0), ("tree_net_rx", 0), ("tree_io_latency", 0),
+    ("tree_tcp_drops", 0), ("tree_tcp_retrans", 0),
+
+    # Alerting
+    ("tree_has_alert", False), ("tree_max_score", 0), ("anomaly_score", 0),
+    ("context_tags", list), ("md5", "Calculating..."), ("sha256", ""),
+
+    # Proveniencia do executavel (/proc/PID/exe): caminho real, se foi
+    # apagado do disco ainda em execucao, se roda apenas em memoria
+    # (memfd) e os MAC times do binario, para a analise temporal.
+    ("exe_path", ""), ("exe_deleted", False), ("exe_memfd", False),
+    ("exe_size", 0), ("exe_mtime", 0), ("exe_ctime", 0), ("exe_atime", 0),
+
+    ("libs", list),
+    ("open_files", set),
+    ("file_metadata", dict),  # [NEW] Stores permissions/owner
+    ("connections", set),
+    ("is_new", False),
+
+    ("detection_reasons", list),
+
+    # Leitura do contexto estatico (update_static_info), feita fora do
+    # tratamento do evento: ver src/collectors/enrichment.py.
+    ("enrichment", None), ("enrichment_error", None),
+)
+
+_NODE_DEFAULTS = dict(NODE_FIELDS)
+_LAZY_LOCK = threading.Lock()
+
+# Slots sem padrao (hasattr diz se existem) e fora do JSON: tags_accumulated
+# e refeito por aggregate_stats e children so existe na arvore reidratada.
+_NODE_EXTRA_SLOTS = ("tags_accumulated", "children")
+_SLOT_SET = frozenset(_NODE_DEFAULTS) | frozenset(_NODE_EXTRA_SLOTS)
 
-def _check_fanotify(pid):
-    """Parses /proc/PID/fdinfo to find Fanotify flags."""
-    try:
-        fd_dir = f"/proc/{pid}/fdinfo"
-        if not os.path.exists(fd_dir): return False
 
-        inspector_details = {"found": False, "mode": "Unknown", "flags": ""}
+class ProcessNode:
+    """Represents a single process in the tree."""
+    __slots__ = tuple(f for f, _ in NODE_FIELDS) + _NODE_EXTRA_SLOTS
 
-        for fd_file in os.listdir(fd_dir):
-            try:
-                with open(os.path.join(fd_dir, fd_file), "r") as f:
-                    content = f.read()
-                    if "fanotify" in content:
-                        inspector_details["found"] = True
-                        match = re.search(r"fanotify flags:([0-9a-fA-F]+)", content)
-                        if match:
-                            hex_flags = int(match.group(1), 16)
-                            inspector_details["flags"] = hex(hex_flags)
-                            if hex_flags == 0:
-                                inspector_details["mode"] = "ASYNC (Log Only)"
-                            else:
-                                inspector_details["mode"] = "SYNC (Blocking Inspection)"
-                        return inspector_details
-            except: continue
-    except: pass
-    return False
-
-
-def _check_wchan(pid):
-    """
-    [v0.70 NEW] Checks /proc/pid/wchan for EDR/AV latency.
-    Returns: True if blocked by security tool.
-    """
-    try:
-        with open(f"/proc/{pid}/wchan", "r") as f:
-            wchan = f.read().strip()
-            # Signatures of AV scanning/interception
-            if any(x in wchan for x in ["fanotify", "fsnotify", "av_scan", "sophos", "falcon"]):
-                return True, wchan
-    except:
-        pass
-    return False, ""
+    def __init__(self, pid, ppid, cmd, uid, prio=120, loginuid=None):
+        self.pid = pid
+        self.ppid = ppid
+        self.cmd = cmd
+        self.uid = uid
+        if prio == 0: prio = 120
+        if prio != 120:
+            self.prio = prio
+            self.nice = prio - 120
 
+        self.username = get_username(uid)
+        if loginuid is not None:
+            self.loginuid = loginuid
+            self.loginuser = get_username(loginuid)
 
-def _scan_open_fds(pid):
-    """
-    Scans /proc/PID/fd to get currently open files.
-    [FIX] Removed incorrect logic that skipped normal configuration files.
-    """
-    files = set()
-    try:
-        fd_dir = f"/proc/{pid}/fd"
-        if not os.path.exists(fd_dir): return files
-        for fd in os.listdir(fd_dir):
+    def __getattr__(self, name):
+        # So chamado com o slot vazio (ou nome fora do esquema).
+        try:
+            padrao = _NODE_DEFAULTS[name]
+        except KeyError:
+            raise AttributeError(name) from None
+        if isinstance(padrao, type):
+            with _LAZY_LOCK:
+                # Outra thread pode ter criado a colecao enquanto esta esperava.
+                try:
+                    return object.__getattribute__(self, name)
+                except AttributeError:
+                    padrao = padrao()
+                    object.__setattr__(self, name, padrao)
+        return padrao
+
+    def _stored(self):
+        """(campo, valor) dos slots preenchidos: o que a instancia guarda."""
+        for campo in self.__slots__:
             try:
-                path = os.readlink(os.path.join(fd_dir, fd))
-
-                if path.startswith("/"):
-                    pass
-
-                # Special handling for abstract sockets/pipes often appearing with type prefixes
-                if path.startswith(("socket:", "pipe:", "anon_inode:")):
-                    files.add(path)
-                    continue
-
-                if path == "/dev/null":
-                    files.add(path)
-                    continue
-
-                files.add(path)
-            except: pass
-    except: pass
-    return files
-
-
-def _check_immutable_path(path):
-    """Checks if a directory has immutable (i) or append-only (a) attributes."""
-    if not shutil.which("lsattr"): return False
-    try:
-        cmd = ["lsattr", "-d", path]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
-        out, _ = proc.communicate(timeout=0.5)
-        if out:
-            attrs = out.split()[0]
-            if 'i' in attrs or 'a' in attrs:
-                return attrs
-    except: pass
-    return False
-
-
-def _immutable_files_in(dirs, cap=20, max_scan=50000, budget_s=2.5):
-    """
-    Arquivos imutaveis (i) ou append-only (a) DENTRO dos diretorios gravaveis.
-
-    A checagem anterior olhava so o atributo do PROPRIO diretorio (`lsattr -d`),
-    e por isso nao via o caso mais comum e mais relevante: um ARQUIVO tornado
-    imutavel dentro de um diretorio gravavel. E tecnica corrente de anti-remocao
-    -- o artefato nao pode ser apagado pelos meios normais nem por root sem antes
-    remover o atributo. Foi o que o cenario de teste plantava
-    (`/tmp/chaos_artifacts/immutable.dat`) e que passava despercebido.
-
-    RECENTES PRIMEIRO: um artefato de anti-remocao acabou de ser criado, entao a
-    travessia visita cada diretorio em ordem de modificacao decrescente. Assim o
-    arquivo recem-marcado e checado no comeco, e a deteccao nao depende de quantos
-    arquivos ANTIGOS enchem o /tmp nem da ordem arbitraria do os.walk. Foi a falha
-    que a certificacao do chaos pegou: com ~17 mil arquivos em /tmp o artefato
-    (planto ha segundos) ficava para o fim da varredura e o orcamento de tempo se
-    esgotava antes de alcanca-lo, num host, enquanto noutro com /tmp enxuto era
-    detectado. Ordenando por recencia, o artefato aparece primeiro nos dois.
-    """
-    if not shutil.which("lsattr"):
-        return []
+                yield campo, object.__getattribute__(self, campo)
+            except AttributeError:
+                continue
 
-    deadline = time.time() + budget_s
-    achados = []
-    escaneados = [0]
+    @classmethod
+    def from_dict(cls, data):
+        """
+        No a partir de um processo serializado (to_dict), para o laudo de uma
+        captura gravada. Chaves fora dos slots sao ignoradas; open_files e
+        connections voltam a ser set.
+        """
+        node = cls.__new__(cls)
+        for campo, valor in data.items():
+            if campo not in _SLOT_SET: continue
+            if campo in ("open_files", "connections") and isinstance(valor, list):
+                valor = set(valor)
+            setattr(node, campo, valor)
+        return node
+
+    def to_dict(self):
+        """
+        Processo no formato da captura, direto do esquema: todo campo de
+        NODE_FIELDS (preenchido ou padrao, colecoes vazias inclusive), sets
+        como listas.
+        """
+        d = {}
+        for campo, padrao in NODE_FIELDS:
+            try:
+                valor = object.__getattribute__(self, campo)
+            except AttributeError:
+                valor = padrao() if isinstance(padrao, type) else padrao
+            if isinstance(valor, set):
+                valor = list(valor)
+            d[campo] = valor
+        return d
+
+    # Campos que descrevem a JANELA, e nao o processo: zerados quando o no
+    # atravessa para a janela seguinte no modo continuo (carry_over).
+    WINDOW_FIELDS = {
+        "cpu_usage_pct": 0.0, "cpu_time_ns": 0,
+        "read_bytes_delta": 0, "write_bytes_delta": 0,
+        "net_tx_bytes": 0, "net_rx_bytes": 0,
+        "tcp_retrans": 0, "tcp_drops": 0, "drop_flows_omitted": 0,
+        "connections_omitted": 0, "offcpu_ms": 0.0, "edr_wait_ms": 0.0,
+        "io_latency_tot": 0, "io_ops_count": 0,
+        "suppressed_events": 0,
+        "tree_read": 0, "tree_write": 0,
+        "tree_read_delta": 0, "tree_write_delta": 0,
+        "tree_net_tx": 0, "tree_net_rx": 0, "tree_io_latency": 0,
+        "tree_tcp_drops": 0, "tree_tcp_retrans": 0,
+        "tree_has_alert": False, "tree_max_score": 0, "anomaly_score": 0,
+        "is_new": False,
+    }
+
+    # Colecoes da janela: recomecam vazias (o slot fica vazio, e o padrao).
+    WINDOW_COLLECTIONS = ("drop_flows", "connection_table", "blk_latency", "edr_wait_sites",
+                          "io_threads", "suppressed_by_type", "open_files", "file_metadata",
+                          "connections", "tags_accumulated", "children")
+
+    # Tags que dependem do que aconteceu na janela, e nao do processo.
+    WINDOW_TAGS = ("NET ERR", "EDR-WAIT", "🧊")
+
+    def carry_over(self):
+        """
+        Copia do no para a janela seguinte, sem reler /proc.
 
-    def _checar(caminho):
+        Identidade e contexto estatico (comando, usuario, conteiner, binario,
+        bibliotecas) seguem; contadores, arquivos abertos e conexoes da janela
+        recomecam do zero. Listas sao copiadas: aggregate_stats altera as da
+        janela encerrada, e elas nao podem vazar para a seguinte.
         """
-        lsattr num UNICO arquivo, com timeout proprio.
-
-        Por arquivo, e nao em lote, de proposito. Um lsattr sobre um arquivo sob
-        I/O pesado (medido: o io_test.dat de 5MB reescrito com fsync em loop faz
-        o lsattr do lote levar ~50s) BLOQUEIA. Em lote, esse unico arquivo lento
-        estoura o timeout e leva junto o RESULTADO do artefato que estava no
-        mesmo lote. Isolado, o arquivo lento custa so o proprio timeout e nao
-        contamina o achado. Foi a causa raiz que a certificacao do chaos revelou.
+        novo = ProcessNode.__new__(ProcessNode)
+        for campo, valor in self._stored():
+            # Campo da janela fica vazio no novo no: volta ao padrao.
+            if campo not in self.WINDOW_FIELDS and campo not in self.WINDOW_COLLECTIONS:
+                setattr(novo, campo, valor)
+
+        novo.context_tags = [t for t in self.context_tags if t not in self.WINDOW_TAGS]
+        novo.detection_reasons = [r for r in self.detection_reasons
+                                  if not r.startswith(EDR_WAIT_REASON)]
+        return novo
+
+    def record_edr_wait(self, sites_ns, min_ms):
         """
-        proc = None
-        try:
-            proc = subprocess.Popen(
-                ["lsattr", "-d", caminho],
-                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
-                universal_newlines=True)
-            out, _ = proc.communicate(timeout=1)
-        except Exception:
-            if proc:
-                try: proc.kill()
-                except Exception: pass
+        Tempo da janela bloqueado em caminhos de inspecao de seguranca, por
+        ponto de espera, medido no kernel (src/probes/offcpu.py). A partir de
+        min_ms o processo ganha o selo EDR-WAIT.
+        """
+        self.edr_wait_sites = {s: round(ns / 1e6, 3) for s, ns in sites_ns.items()}
+        self.edr_wait_ms = round(sum(sites_ns.values()) / 1e6, 3)
+        if not self.edr_wait_sites or self.edr_wait_ms < min_ms:
             return
-        for line in (out or "").splitlines():
-            partes = line.split(None, 1)
-            if len(partes) != 2:
-                continue
-            attrs, achado = partes[0], partes[1]
-            if 'i' in attrs or 'a' in attrs:
-                achados.append("%s (%s)" % (achado, attrs))
-
-    def _mtime(entrada):
-        try:
-            return entrada.stat(follow_symlinks=False).st_mtime
-        except OSError:
-            return 0
-
-    def _varrer(raiz):
+        principal = max(self.edr_wait_sites, key=self.edr_wait_sites.get)
+        if "EDR-WAIT" not in self.context_tags:
+            self.context_tags.append("EDR-WAIT")
+            self.context_tags.append("🧊")  # ICE CUBE
+        self.detection_reasons.append(
+            f"{EDR_WAIT_REASON} {principal} ({self.edr_wait_ms:.1f} ms blocked in window)")
+
+    # Lidos de novo so com exec, saida ou troca do binario (StaticFactsCache);
+    # o resto de update_static_info e relido a cada enriquecimento. fanotify
+    # nao entra: a marca e aberta e fechada sem exec nem troca do binario.
+    STATIC_FACTS = ("exe_path", "exe_deleted", "exe_memfd", "md5", "sha256", "exe_size",
+                    "exe_mtime", "exe_ctime", "exe_atime")
+
+    # O que update_static_info grava no no, fora as colecoes (ver
+    # absorb_enrichment): e o que um rascunho de enriquecimento devolve.
+    ENRICHED_FIELDS = ("container_id", "container_type", "cgroups", "security_context",
+                       "gpu_usage", "libs", "is_inspector", "inspector_data",
+                       "enrichment", "enrichment_error") + STATIC_FACTS
+
+    def enrichment_draft(self, hashes_ready=None):
         """
-        Travessia recursiva. Subdiretorios sao visitados por RECENCIA (o artefato
-        recem-plantado primeiro), para a deteccao nao depender de quantos
-        arquivos velhos enchem o /tmp. Arquivos sao checados um a um.
-
-        So arquivos REGULARES entram: imutabilidade nao se aplica a socket ou
-        FIFO, e o lsattr sobre socket BLOQUEIA ate o timeout.
+        Rascunho do no para o pool de enriquecimento: so a identidade do
+        processo e os arquivos ja vistos. O worker le /proc nele, e nao no no
+        da arvore, que pode estar sendo serializado numa janela ja fechada.
+        hashes_ready recebe o hash de um binario grande quando ele ficar pronto
+        (padrao: o proprio no).
         """
-        if time.time() > deadline or escaneados[0] >= max_scan:
-            return True
-        try:
-            entradas = list(os.scandir(raiz))
-        except OSError:
-            return False
-
-        subdirs = []
-        for e in entradas:
+        rascunho = _EnrichmentDraft.__new__(_EnrichmentDraft)
+        for campo in ("pid", "ppid", "cmd", "uid", "username", "start_time", "gpu_usage"):
+            setattr(rascunho, campo, getattr(self, campo))
+        rascunho.open_files = set(self.open_files)
+        rascunho.hashes_ready = hashes_ready or self._hashes_ready
+        return rascunho
+
+    def absorb_enrichment(self, rascunho):
+        """Aplica no no o que update_static_info gravou no rascunho."""
+        for campo in self.ENRICHED_FIELDS:
             try:
-                if e.is_symlink():
-                    continue
-                if e.is_dir(follow_symlinks=False):
-                    subdirs.append(e)
-                    continue
-                if not e.is_file(follow_symlinks=False):
-                    continue
-            except OSError:
+                setattr(self, campo, object.__getattribute__(rascunho, campo))
+            except AttributeError:
                 continue
-            _checar(e.path)
-            escaneados[0] += 1
-            if len(achados) >= cap or time.time() > deadline \
-                    or escaneados[0] >= max_scan:
-                return True
-
-        subdirs.sort(key=_mtime, reverse=True)
-        for sd in subdirs:
-            if _varrer(sd.path):
-                return True
-        return False
-
-    for d in dirs:
-        if not os.path.isdir(d):
-            continue
-        if _varrer(d):
-            break
-
-    return achados[:cap]
-
-
-def _get_udp_stats():
-    """Reads global UDP OutDatagrams from /proc/net/snmp."""
-    try:
-        with open("/proc/net/snmp", "r") as f:
-            for line in f:
-                if line.startswith("Udp:"):
-                    parts = line.split()
-                    if parts[1].isdigit():
-                        return int(parts[4])
-    except: pass
-    return 0
-
-
-def _format_duration(seconds):
-    """Formats seconds into 14D 6h 35m."""
-    d = datetime(1, 1, 1) + timedelta(seconds=seconds)
-    days = d.day - 1
-    hours = d.hour
-    mins = d.minute
-
-    parts = []
-    if days > 0: parts.append(f"{days}D")
-    if hours > 0: parts.append(f"{hours}h")
-    if mins > 0: parts.append(f"{mins}m")
-    if not parts: return f"{d.second}s"
-    return " ".join(parts)
-
-
-# ------------------------------------------------------------------------------
-# CORE CLASSES
-# ------------------------------------------------------------------------------
-class ProcessNode:
-    """Represents a single process in the tree."""
-    def __init__(self, pid, ppid, cmd, uid, prio=120, loginuid=None):
-        self.pid = pid
-        self.ppid = ppid
-        self.cmd = cmd
-        self.uid = uid
-        if prio == 0: prio = 120
-        self.prio = prio
-        self.nice = prio - 120
+        self.open_files.update(rascunho.open_files)
+        self.file_metadata.update(rascunho.file_metadata)
+        for tag in rascunho.context_tags:
+            if tag not in self.context_tags: self.context_tags.append(tag)
+        self.detection_reasons.extend(rascunho.detection_reasons)
 
-        self.username = get_username(uid)
-        self.loginuid = loginuid
-        self.loginuser = get_username(loginuid) if loginuid is not None else None
-
-        self.state = "R"
-
-        # Resources
-        self.vsz = 0
-        self.rss = 0
-        self.cpu_usage_pct = 0.0
-        self.cpu_start_ticks = 0
-        self.start_time = 0
-
-        # [v0.70] Time Metrics
-        self.duration_str = ""
-        self.start_ts_abs = ""
-
-        # Extended Context
-        self.gpu_usage = False
-        self.container_id = None
-        self.container_type = "host"
-        self.cgroups = []
-        self.is_inspector = False
-        self.inspector_data = None
-        self.is_inspected = False
-        self.security_context = "N/A"
-
-        # Metrics (Own)
-        self.read_bytes_delta = 0
-        self.write_bytes_delta = 0
-        self.net_tx_bytes = 0
-        self.net_rx_bytes = 0
-        self.tcp_retrans = 0
-        self.tcp_drops = 0
-        self.network_drops_details = []
-
-        self.io_latency_tot = 0
-        self.io_ops_count = 0
-
-        # Tree Metrics (Accumulated)
-        self.tree_read = 0
-        self.tree_write = 0
-        self.tree_read_delta = 0
-        self.tree_write_delta = 0
-        self.tree_net_tx = 0
-        self.tree_net_rx = 0
-        self.tree_io_latency = 0
-        self.tree_tcp_drops = 0
-        self.tree_tcp_retrans = 0
-
-        # Alerting
-        self.tree_has_alert = False
-        self.tree_max_score = 0
-        self.anomaly_score = 0
-        self.context_tags = []
-        self.md5 = "Calculating..."
-
-        # Proveniencia do executavel (/proc/PID/exe): caminho real, se foi
-        # apagado do disco ainda em execucao, se roda apenas em memoria
-        # (memfd) e os MAC times do binario, para a analise temporal.
-        self.exe_path = ""
-        self.exe_deleted = False
-        self.exe_memfd = False
-        self.exe_size = 0
-        self.exe_mtime = 0
-        self.exe_ctime = 0
-        self.exe_atime = 0
-
-        self.libs = []
-        self.open_files = set()
-        self.file_metadata = {}  # [NEW] Stores permissions/owner
-        self.connections = set()
-        self.is_new = False
-
-        self.detection_reasons = []
-
-    def update_static_info(self):
+    def update_static_info(self, cache=None, hashes=None):
         """Enriches process data with static information."""
         cid, ctype = _get_container_info(self.pid)
         if cid:
@@ -491,18 +394,20 @@ class ProcessNode:
         static_files = _scan_open_fds(self.pid)
         self.open_files.update(static_files)
 
+        # Agente de seguranca (fanotify): relido a cada ciclo, pelos fds acima.
+        fano_res = _check_fanotify(self.pid, static_files)
+        self.is_inspector = bool(fano_res and fano_res["found"])
+        self.inspector_data = fano_res if self.is_inspector else None
+
         # Capture Metadata (Owner/Perms) for open files
-        for f in self.open_files:
+        # list(): o tratamento de eventos acrescenta arquivos enquanto isto roda.
+        for f in list(self.open_files):
             if f.startswith("/"):
                 try:
                     st = os.stat(f)
                     mode = oct(st.st_mode & 0o777)[2:]
                     u_name = get_username(st.st_uid)
-                    try:
-                        g_name = grp.getgrgid(st.st_gid).gr_name
-                    except:
-                        g_name = str(st.st_gid)
-
+                    g_name = _group_name(st.st_gid)
                     self.file_metadata[f] = f"{u_name}:{g_name} {mode}"
                 except:
                     self.file_metadata[f] = ""  # Failed to stat (e.g. permission denied)
@@ -531,28 +436,32 @@ class ProcessNode:
             self.detection_reasons.append(f"Heuristic Name Match: '{self.cmd}' [+{SCORE_GPU}]")
             if "MINER" not in self.context_tags: self.context_tags.append("MINER")
 
-        fano_res = _check_fanotify(self.pid)
-        if fano_res and fano_res["found"]:
-            self.is_inspector = True
-            self.inspector_data = fano_res
-            if "EDR/AV" not in self.context_tags: self.context_tags.append("EDR/AV")
-
-        # [v0.70] EDR Horizontal Detection (Wchan check)
-        if self.state in ['S', 'D']:
-            is_frozen, reason = _check_wchan(self.pid)
-            if is_frozen:
-                self.context_tags.append("EDR-WAIT")
-                self.context_tags.append("🧊")  # ICE CUBE
-                self.detection_reasons.append(f"Latency: Waiting for {reason}")
+        # [v0.70] EDR Horizontal Detection: medido no kernel (offcpu_ns) e
+        # aplicado por record_edr_wait no fim da janela, nao lido de wchan.
 
         if "sshd" in cmd_lower or "ssh" in cmd_lower:
             if "SSH" not in self.context_tags: self.context_tags.append("SSH")
         if "sudo" in cmd_lower:
             if "SUDO" not in self.context_tags: self.context_tags.append("SUDO")
 
-        self._collect_exe_provenance()
+        # Fatos caros (proveniencia e MD5 do binario): do cache se o processo e
+        # o mesmo; selos e razoes saem deles em todo no, lidos ou reaproveitados.
+        identidade = process_identity(self.pid) if cache is not None else None
+        fatos = cache.get(self.pid, identidade) if identidade is not None else None
+        if fatos is None:
+            self._collect_exe_provenance(hashes)
+            # Hash ainda na fila de segundo plano: o proximo ciclo rele.
+            if identidade is not None and self.md5 != HASH_PENDING:
+                cache.put(self.pid, identidade, {f: getattr(self, f) for f in self.STATIC_FACTS})
+        else:
+            for campo, valor in fatos.items():
+                setattr(self, campo, valor)
 
-    def _collect_exe_provenance(self):
+        if self.is_inspector and "EDR/AV" not in self.context_tags:
+            self.context_tags.append("EDR/AV")
+        self._apply_exe_provenance()
+
+    def _collect_exe_provenance(self, hashes=None):
         """
         Coleta a proveniencia do executavel a partir de /proc/PID/exe.
 
@@ -564,23 +473,48 @@ class ProcessNode:
         carrega essa informacao.
 
         Guarda tambem os MAC times e o tamanho do binario, que sustentam a
-        analise temporal (quando o arquivo foi criado/alterado/acessado).
+        analise temporal (quando o arquivo foi criado/alterado/acessado). MD5 e
+        SHA-256 vem do ExeHashCache, com o mesmo stat que da os MAC times.
         """
         try:
             link = os.readlink(f"/proc/{self.pid}/exe")
         except Exception:
             self.md5 = "N/A"
+            self.exe_path = ""
             return
 
         exe = link
-        if link.endswith(" (deleted)"):
-            self.exe_deleted = True
+        self.exe_deleted = link.endswith(" (deleted)")
+        if self.exe_deleted:
             exe = link[:-len(" (deleted)")]
-        if exe.startswith("/memfd:"):
-            self.exe_memfd = True
+        self.exe_memfd = exe.startswith("/memfd:")
 
         self.exe_path = exe
 
+        hashes = hashes or _LOCAL_HASHES
+        try:
+            self.md5, self.sha256, st = hashes.digests(exe, on_done=self._hashes_ready)
+            self.exe_size = st.st_size
+            self.exe_mtime = st.st_mtime
+            self.exe_ctime = st.st_ctime
+            self.exe_atime = st.st_atime
+        except FileNotFoundError:
+            # Binario ausente do disco (apagado ou apenas em memoria).
+            self.md5 = "N/A (not on disk)"
+        except Exception:
+            self.md5 = "N/A"
+
+    def _hashes_ready(self, md5, sha256):
+        """Hash de um binario grande, calculado em segundo plano."""
+        if self.md5 == HASH_PENDING:
+            self.md5, self.sha256 = md5, sha256
+
+    def _apply_exe_provenance(self):
+        """Razoes e selos da proveniencia (binario apagado, memfd, caminho inseguro)."""
+        exe = self.exe_path
+        if not exe:
+            return
+
         if self.exe_deleted:
             self.detection_reasons.append(
                 f"Executable deleted from disk while running: {exe} [+{SCORE_DELETED}]")
@@ -607,28 +541,34 @@ class ProcessNode:
             if "UNSAFE" not in self.context_tags:
                 self.context_tags.append("UNSAFE")
 
-        try:
-            if os.path.exists(exe):
-                self.md5 = calculate_md5(exe)
-                st = os.stat(exe)
-                self.exe_size = st.st_size
-                self.exe_mtime = st.st_mtime
-                self.exe_ctime = st.st_ctime
-                self.exe_atime = st.st_atime
-            else:
-                # Binario ausente do disco (apagado ou apenas em memoria).
-                self.md5 = "N/A (not on disk)"
-        except Exception:
-            self.md5 = "N/A"
 
+class _EnrichmentDraft(ProcessNode):
+    """Rascunho de ProcessNode.enrichment_draft: o hash tardio vai para o dono."""
+    __slots__ = ("hashes_ready",)
+
+    def _hashes_ready(self, md5, sha256):
+        self.hashes_ready(md5, sha256)
 
-class ProcessTree:
+
+class ProcessTree(ProcScanMixin):
     """Manages the hierarchy of processes."""
     def __init__(self):
         self.nodes = {}
         self.prev_udp_out = 0
         self.first_scan = True
 
+        # Pool de enriquecimento (EnrichmentPool), quando o motor fornece um.
+        # Sem ele o enriquecimento e feito na hora, por quem chamou.
+        self.enricher = None
+        # Janela dos nos atuais: o pool so aplica o enriquecimento de um no
+        # enquanto a janela dele estiver aberta (close_window).
+        self.window = 0
+        self.scan_workers = DEFAULT_SCAN_WORKERS
+        # Fatos estaticos caros por PID; atravessa reset() e rotate().
+        self.static_cache = StaticFactsCache()
+        # Hashes de executaveis por identidade do arquivo (src/core/hash_cache.py).
+        self.hash_cache = ExeHashCache()
+
         # Get System Boot Time for absolute timestamps
         try:
             with open('/proc/uptime', 'r') as f:
@@ -652,24 +592,136 @@ class ProcessTree:
         memoria do agente.
 
         O tempo de inicializacao e preservado: ele descreve o host, nao a
-        captura, e recalcula-lo a cada ciclo so introduziria imprecisao.
+        captura, e recalcula-lo a cada ciclo so introduziria imprecisao. O
+        static_cache tambem: os nos sao todos recriados e relidos, so o MD5 e
+        o fanotify de um processo que nao mudou sao reaproveitados.
         """
         self.nodes = {}
         self.prev_udp_out = 0
         self.first_scan = True
+        self.static_cache.prune(_live_pids())
+
+    def rotate(self):
+        """
+        Separa a janela encerrada e prepara esta arvore para a seguinte.
 
-    def add_or_update(self, pid, ppid, cmd, uid, prio, loginuid=None, state="R", duration_str="", start_ts_abs=""):
+        Modo continuo: a arvore viva nunca e recriada (o motor continua
+        entregando eventos a ela), so os nos sao trocados. Quem segue vivo
+        atravessa com carry_over; quem terminou fica apenas na janela fechada,
+        que e devolvida como uma ProcessTree propria.
+        """
+        fechada = ProcessTree.__new__(ProcessTree)
+        fechada.__dict__.update(self.__dict__)
+        self.nodes = {}
+        self.close_window()
+
+        # Quem saiu com evento de exit ja tem end_time; a listagem de /proc
+        # cobre a saida que o kernel nao chegou a entregar (perda, orcamento).
+        vivos = _live_pids()
+        self.static_cache.prune(vivos)
+
+        # list(): a thread de eventos ainda pode estar escrevendo no dicionario
+        # antigo. Um no que ela ja criou na arvore nova prevalece.
+        for pid, node in list(fechada.nodes.items()):
+            if getattr(node, "end_time", 0) or pid not in vivos:
+                continue
+            novo = self.nodes.setdefault(pid, node.carry_over())
+            # Pedido ainda na fila: passa a preencher a copia viva. O no da
+            # janela fechada fica "pending", que e o que ele de fato e.
+            if getattr(novo, "enrichment", None) == ENRICH_PENDING and novo is not node:
+                self.enrich(novo, deferred=True)
+        return fechada
+
+    def close_window(self):
+        """
+        Encerra a janela dos nos atuais. Daqui em diante o pool nao escreve
+        mais neles: pedidos ainda na fila sao descartados (o no fica "pending")
+        e uma leitura em curso nao e aplicada. Quando isto retorna, nenhum
+        worker esta no meio de uma escrita nesses nos.
+        """
+        self.window += 1
+        if self.enricher is not None:
+            self.enricher.close_window(self.window)
+
+    def enrich(self, node, deferred=False):
+        """
+        Le o contexto estatico do no (cgroup, fds, maps, binario).
+
+        deferred=True entrega ao pool e volta em seguida; e o caso do
+        tratamento de eventos, que nao pode esperar /proc nem o MD5 do
+        executavel. Sem pool, ou com deferred=False, le na hora.
+        """
+        if deferred and self.enricher is not None:
+            self.enricher.submit(node, self.window)
+        else:
+            enrich_node(node, self.static_cache, self.hash_cache)
+
+    def fork(self, pid, ppid, cmd, uid, prio, loginuid=None, ts=None):
+        """
+        Registra um processo recem-criado (evento de fork do kernel).
+
+        O filho nasce como copia do pai: mesmo binario, conteiner, cgroups e
+        contexto de seguranca. Copiar o no do pai evita reler /proc para um
+        processo que, na maioria das vezes, faz exec ou sai em milissegundos.
+        Sem o pai na arvore cai no caminho normal, com leitura de /proc.
+        """
+        if pid == 0: return None
+        if pid in self.nodes: return self.nodes[pid]
+
+        pai = self.nodes.get(ppid)
+        if pai is None:
+            return self.add_or_update(pid, ppid, cmd, uid, prio, loginuid)
+
+        node = pai.carry_over()
+        node.pid = pid
+        node.ppid = ppid
+        node.start_time = ts or time.time()
+        node.start_ts_abs = datetime.fromtimestamp(node.start_time).strftime("%a, %d %b %Y at %H:%M")
+        node.duration_str = ""
+        node.end_time = 0
+        node.exit_code = None
+        node.is_new = True
+        self.nodes[pid] = node
+        return node
+
+    def mark_exit(self, pid, ts, exit_code=None):
+        """
+        Marca o fim de um processo (evento de exit do kernel).
+
+        O no continua na arvore: o processo existiu nesta janela e o laudo
+        dela precisa mostra-lo. Ele so nao atravessa para a seguinte.
+        """
+        node = self.nodes.get(pid)
+        if node is None: return None
+        node.end_time = ts
+        node.exit_code = exit_code
+        node.state = "X"
+        return node
+
+    def add_or_update(self, pid, ppid, cmd, uid, prio, loginuid=None, deferred=False, proc=None):
+        """
+        No do processo, criado na primeira vez. proc traz o que a leitura de
+        /proc achou (state, duration_str, start_ts_abs, start_time); eventos
+        do kernel nao o passam.
+        """
         if pid == 0: return None
+        proc = proc or {}
+        state = proc.get("state", "R")
+        duration_str = proc.get("duration_str", "")
+        start_ts_abs = proc.get("start_ts_abs", "")
+        start_time = proc.get("start_time")
 
         if pid not in self.nodes:
             node = ProcessNode(pid, ppid, cmd, uid, prio, loginuid)
-            try: node.start_time = os.path.getctime(f"/proc/{pid}")
-            except: node.start_time = time.time()
+            if start_time is None:
+                try: start_time = os.path.getctime(f"/proc/{pid}")
+                except: start_time = time.time()
+            node.start_time = start_time
             node.state = state
             node.duration_str = duration_str
             node.start_ts_abs = start_ts_abs
-            node.update_static_info()
             self.nodes[pid] = node
+            self.enrich(node, deferred)
         else:
             node = self.nodes[pid]
             # [FIX] Robust Command Logic
@@ -698,93 +750,6 @@ class ProcessTree:
     def get(self, pid):
         return self.nodes.get(pid)
 
-    def scan_proc_fs(self):
-        print("[*] Scanning /proc...")
-        my_pid = os.getpid()
-        count = 0
-
-        self._check_global_anomalies()
-
-        # Pre-read system uptime for calculations
-        try:
-            with open('/proc/uptime', 'r') as uf:
-                sys_uptime = float(uf.readline().split()[0])
-        except: sys_uptime = 0
-
-        for path in glob.glob('/proc/[0-9]*'):
-            try:
-                pid_str = os.path.basename(path)
-                if not pid_str.isdigit(): continue
-                pid = int(pid_str)
-                if pid == my_pid: continue
-
-                info = {}
-                try:
-                    with open(os.path.join(path, 'status'), 'r') as f:
-                        s = f.read()
-                    info = {l.split(':')[0]: l.split(':', 1)[1].strip() for l in s.splitlines() if ':' in l}
-                except: continue
-
-                prio_val = 120  # Default
-                duration_str = ""
-                start_ts_abs = ""
-
-                try:
-                    with open(os.path.join(path, 'stat'), 'r') as f:
-                        stat_content = f.read().strip()
-                        last_paren_idx = stat_content.rfind(')')
-                        if last_paren_idx != -1:
-                            rest = stat_content[last_paren_idx + 1:].strip().split()
-                            if len(rest) >= 20:  # Ensure we have starttime field
-                                nice_val = int(rest[16])
-                                prio_val = 120 + nice_val
-
-                                # [v0.70] Duration Calc
-                                starttime_jiffies = int(rest[19])
-                                starttime_sec = starttime_jiffies / CLK_TCK
-                                duration_sec = sys_uptime - starttime_sec
-                                duration_str = _format_duration(duration_sec)
-
-                                abs_start = self.boot_time + timedelta(seconds=starttime_sec)
-                                start_ts_abs = abs_start.strftime("%a, %d %b %Y at %H:%M")
-
-                except: pass
-
-                name = info.get('Name', '?')
-                ppid = int(info.get('PPid', 0))
-                uid_str = info.get('Uid', '0').split()[0]
-                uid = int(uid_str) if uid_str.isdigit() else 0
-                state_raw = info.get('State', 'R')
-                state = state_raw.split()[0]
-
-                luid = None
-                try:
-                    luid_path = os.path.join(path, 'loginuid')
-                    if os.path.exists(luid_path):
-                        with open(luid_path, 'r') as f:
-                            val = f.read().strip()
-                            if val: luid = int(val)
-                except: luid = None
-
-                try:
-                    with open(os.path.join(path, 'cmdline'), 'rb') as f:
-                        raw = f.read()
-                        if raw:
-                            full_cmd = raw.replace(b'\0', b' ').decode('utf-8', 'ignore').strip()
-                            if full_cmd: name = full_cmd
-                except: pass
-
-                self.add_or_update(pid, ppid, name, uid, prio_val, luid, state, duration_str, start_ts_abs)
-                count += 1
-
-                if 'VmRSS' in info:
-                    node = self.nodes.get(pid)
-                    if node:
-                        try: node.rss = int(info['VmRSS'].replace('kB', '')) * 1024
-                        except: pass
-            except Exception: continue
-        print(f"[+] Static Scan Complete. Found {count} processes.")
-
     def _check_global_anomalies(self):
         """Runs global environment checks (Network & File System)."""
         curr_udp = _get_udp_stats()
@@ -809,7 +774,20 @@ class ProcessTree:
         self.immutable_alert = bad_dirs if bad_dirs else []
 
     def aggregate_stats(self):
-        """Bubble up stats AND BADGES using Recursive DFS."""
+        """Bubble up stats AND BADGES in one bottom-up pass (tree_index.py)."""
+        pids = list(self.nodes)
+        nodes = list(self.nodes.values())
+        pos = {pid: i for i, pid in enumerate(pids)}
+        parent = [pos.get(int(n.ppid), -1) for n in nodes]
+        # PID 1 e PID 2 sao sempre raizes; quem tem o pai fora da captura
+        # (orfao, pai ja saiu) fica pendurado no PID 1, como antes.
+        init = pos.get(1)
+        for i, pid in enumerate(pids):
+            if pid == 1 or pid == 2:
+                parent[i] = -1
+            elif parent[i] < 0 and init is not None:
+                parent[i] = init
+        arvore = TreeIndex(parent)
 
         # [FIX item1] Identify kernel threads: PID 2 (kthreadd) and its whole
         # subtree. TCP drop/retransmit events fired in softirq context get
@@ -817,18 +795,10 @@ class ProcessTree:
         # socket owner. Those are false-positive NET ERR alerts, so kernel
         # threads are excluded from NET ERR (badge, score and tree aggregation).
         # User processes always descend from PID 1, so this set is exact.
-        kthread_children = {}
-        for _pid, _n in self.nodes.items():
-            kthread_children.setdefault(int(_n.ppid), []).append(_pid)
+        kthreadd = pos.get(2)
         self.kernel_pids = set()
-        if 2 in self.nodes:
-            _stack = [2]
-            while _stack:
-                _kp = _stack.pop()
-                if _kp in self.kernel_pids:
-                    continue
-                self.kernel_pids.add(_kp)
-                _stack.extend(kthread_children.get(_kp, []))
+        if kthreadd is not None:
+            self.kernel_pids = {pids[i] for i in arvore.subtree(kthreadd)}
 
         for n in self.nodes.values():
             n.anomaly_score = 0
@@ -866,98 +836,67 @@ class ProcessTree:
             n.tree_has_alert = (n.anomaly_score > 0)
             n.tree_max_score = n.anomaly_score
 
-        children_map = {}
-        for pid, node in self.nodes.items():
-            if node.ppid not in children_map: children_map[node.ppid] = []
-            children_map[node.ppid].append(pid)
-
-        all_pids = set(self.nodes.keys())
-        roots = [pid for pid in all_pids if self.nodes[pid].ppid not in all_pids]
-
-        for root_pid in roots:
-            if root_pid != 1 and root_pid != 2:
-                if 1 in self.nodes:
-                    if 1 not in children_map: children_map[1] = []
-                    if root_pid not in children_map[1]:
-                        children_map[1].append(root_pid)
-
-        visited = set()
-
-        def accumulate_recursive(pid):
-            if pid in visited: return self.nodes[pid]
-            visited.add(pid)
-            node = self.nodes[pid]
-
-            node.tree_read = node.read_bytes_delta
-            node.tree_write = node.write_bytes_delta
-            node.tree_read_delta = node.read_bytes_delta
-            node.tree_write_delta = node.write_bytes_delta
-            node.tree_net_tx = node.net_tx_bytes
-            node.tree_net_rx = node.net_rx_bytes
-            node.tree_io_latency = node.io_latency_tot
-            # [FIX item1] Kernel threads do not own sockets; drop their softirq-
-            # attributed TCP counters so they neither alert nor bubble up.
-            if node.pid in self.kernel_pids:
-                node.tree_tcp_drops = 0
-                node.tree_tcp_retrans = 0
-            else:
-                node.tree_tcp_drops = node.tcp_drops
-                node.tree_tcp_retrans = node.tcp_retrans
-
-            if pid == 1 and hasattr(self, 'immutable_alert') and self.immutable_alert:
-                for alert in self.immutable_alert:
-                    node.detection_reasons.append(f"Filesystem Anomaly: {alert} [+{SCORE_IMMUTABLE}]")
-                    node.anomaly_score |= SCORE_IMMUTABLE
-                    node.tags_accumulated.add("UNSAFE")
-
-            if pid in children_map:
-                for child_pid in children_map[pid]:
-                    if child_pid in self.nodes:
-                        child = accumulate_recursive(child_pid)
-
-                        node.tree_read += child.tree_read
-                        node.tree_write += child.tree_write
-                        node.tree_read_delta += child.tree_read_delta
-                        node.tree_write_delta += child.tree_write_delta
-                        node.tree_net_tx += child.tree_net_tx
-                        node.tree_net_rx += child.tree_net_rx
-                        node.tree_io_latency += child.tree_io_latency
-                        node.tree_tcp_drops += child.tree_tcp_drops
-                        node.tree_tcp_retrans += child.tree_tcp_retrans
-
-                        if child.state == 'Z':
-                            node.anomaly_score |= SCORE_ZOMBIE
-                            if "ZOMBIE_PARENT" not in node.tags_accumulated:
-                                node.tags_accumulated.add("WARN")
-
-                        if child.tree_max_score > node.tree_max_score:
-                            node.tree_max_score = child.tree_max_score
-                        if child.tree_has_alert:
-                            node.tree_has_alert = True
-
-                        whitelist = ["SSH", "SUDO", "UNSAFE", "MINER", "EDR/AV", "CONTAINER", "GPU", "NET ERR", "NEW", "WARN", "ZOMBIE", "EDR-WAIT", "🧊"]
-                        for tag in child.tags_accumulated:
-                            if tag in whitelist or "WARN" in tag:
-                                node.tags_accumulated.add(tag)
-            return node
-
-        if 1 in self.nodes: accumulate_recursive(1)
-        if 2 in self.nodes: accumulate_recursive(2)
-        for r in roots:
-            accumulate_recursive(r)
-
-        for n in self.nodes.values():
+        alcancado = arvore.reachable()
+        if init is not None and getattr(self, 'immutable_alert', None):
+            raiz = nodes[init]
+            for alert in self.immutable_alert:
+                raiz.detection_reasons.append(f"Filesystem Anomaly: {alert} [+{SCORE_IMMUTABLE}]")
+                raiz.anomaly_score |= SCORE_IMMUTABLE
+                raiz.tags_accumulated.add("UNSAFE")
+
+        for i, n in enumerate(nodes):
+            if n.state == 'Z' and parent[i] >= 0 and alcancado[i]:
+                pai = nodes[parent[i]]
+                pai.anomaly_score |= SCORE_ZOMBIE
+                if "ZOMBIE_PARENT" not in pai.tags_accumulated:
+                    pai.tags_accumulated.add("WARN")
+
+        # Contadores da propria posicao; tree_read e tree_read_delta (idem
+        # write) partem do mesmo valor. [FIX item1] Kernel threads do not own
+        # sockets; their softirq-attributed TCP counters neither alert nor
+        # bubble up.
+        leitura, escrita, tx, rx, latencia, drops, retrans = [], [], [], [], [], [], []
+        maximos, selos, bits = [], [], {}
+        for n in nodes:
+            leitura.append(n.read_bytes_delta)
+            escrita.append(n.write_bytes_delta)
+            tx.append(n.net_tx_bytes)
+            rx.append(n.net_rx_bytes)
+            latencia.append(n.io_latency_tot)
+            kernel = n.pid in self.kernel_pids
+            drops.append(0 if kernel else n.tcp_drops)
+            retrans.append(0 if kernel else n.tcp_retrans)
+            maximos.append(n.tree_max_score)
+            mascara = 0
+            for tag in n.tags_accumulated:
+                if tag in BUBBLE_TAGS or "WARN" in tag:
+                    bit = bits.get(tag)
+                    if bit is None:
+                        bit = bits[tag] = 1 << len(bits)
+                    mascara |= bit
+            selos.append(mascara)
+
+        somas, maximos, subiram = arvore.accumulate(
+            (leitura, escrita, tx, rx, latencia, drops, retrans), maximos, selos)
+        leitura, escrita, tx, rx, latencia, drops, retrans = somas
+        tag_do_bit = {bit: tag for tag, bit in bits.items()}
+
+        for i, n in enumerate(nodes):
+            if alcancado[i]:
+                n.tree_read = n.tree_read_delta = leitura[i]
+                n.tree_write = n.tree_write_delta = escrita[i]
+                n.tree_net_tx, n.tree_net_rx = tx[i], rx[i]
+                n.tree_io_latency = latencia[i]
+                n.tree_tcp_drops, n.tree_tcp_retrans = drops[i], retrans[i]
+                n.tree_max_score = maximos[i]
+                n.tree_has_alert = maximos[i] > 0
+                novos = subiram[i] & ~selos[i]
+                while novos:
+                    bit = novos & -novos
+                    n.tags_accumulated.add(tag_do_bit[bit])
+                    novos ^= bit
             n.context_tags = list(n.tags_accumulated)
 
     def to_json(self):
-        serialized_nodes = {}
-        for pid, node in self.nodes.items():
-            d = vars(node).copy()
-            if 'tags_accumulated' in d: del d['tags_accumulated']
-            if isinstance(d.get('open_files'), set): d['open_files'] = list(d['open_files'])
-            if isinstance(d.get('connections'), set): d['connections'] = list(d['connections'])
-            if 'network_drops_details' not in d: d['network_drops_details'] = []
-            if 'detection_reasons' not in d: d['detection_reasons'] = []
-            if 'cgroups' not in d: d['cgroups'] = []
-            serialized_nodes[pid] = d
-        return serialized_nodes
+        """Processos no formato da captura, um dict por no direto do esquema."""
+        return {pid: node.to_dict() for pid, node in self.nodes.items()}
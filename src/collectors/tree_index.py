@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/collectors/tree_index.py
+# DESCRIPTION: Arvore de processos como indice de pais, para somar contadores
+#              e selos de cada subarvore (ProcessTree.aggregate_stats).
+#
+# WHY:         A agregacao era uma DFS recursiva: cada aresta copiava nove
+#              contadores de atributo em atributo e fundia um set de tags, e
+#              uma cadeia funda (shell que abre shell, runner de CI) chegava
+#              perto do limite de recursao do Python. Aqui a arvore vira um
+#              vetor parent[i] (posicao do pai, -1 na raiz) e cada subarvore e
+#              resolvida numa passada de baixo para cima, por nivel, sem
+#              recursao e sem tocar nos nos.
+#
+# HOW:         Profundidade e raiz de cada posicao saem de saltos de ponteiro
+#              (parent, avo, bisavo...): log2(n) passadas vetorizadas. Quem
+#              nunca chega a um parent -1 esta num ciclo e fica de fora, como
+#              ficava na DFS, que so partia das raizes. Os contadores ficam
+#              numa matriz contigua (n x k); os selos, num bitmask por posicao;
+#              cada nivel soma, tira o maximo e faz OR no nivel de cima.
+#
+# NOTES:       NumPy e opcional. Sem ele, o mesmo algoritmo roda com
+#              array('q') e um laco simples. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _ancestors_py(parent):
+    """(depth, root) por posicao; depth -1 e root -1 para quem esta em ciclo."""
+    n = len(parent)
+    # -2 ainda nao visto, -3 no caminho que esta sendo subido
+    depth = [-2] * n
+    root = [-1] * n
+    for i in range(n):
+        if depth[i] != -2: continue
+        caminho = []
+        j = i
+        while j >= 0 and depth[j] == -2:
+            depth[j] = -3
+            caminho.append(j)
+            j = parent[j]
+        if j < 0:
+            d, r = -1, caminho[-1]
+        elif depth[j] < 0:
+            d, r = None, -1
+        else:
+            d, r = depth[j], root[j]
+        for k in reversed(caminho):
+            if d is None:
+                depth[k] = -1
+            else:
+                d += 1
+                depth[k], root[k] = d, r
+    return depth, root
+
+
+def _ancestors_np(parent):
+    n = len(parent)
+    tem_pai = parent >= 0
+    salto = np.where(tem_pai, parent, np.arange(n))
+    dist = tem_pai.astype(np.int64)
+    # 2**bit_length(n) > n: basta para qualquer cadeia sem ciclo
+    for _ in range(max(1, n.bit_length())):
+        seguinte = salto[salto]
+        if np.array_equal(seguinte, salto): break
+        dist += dist[salto]
+        salto = seguinte
+    ciclo = parent[salto] >= 0
+    return np.where(ciclo, -1, dist), np.where(ciclo, -1, salto)
+
+
+class TreeIndex(object):
+    """
+    Arvore pelo vetor de pais: parent[i] e a posicao do pai de i, ou -1.
+    depth[i] e a distancia ate a raiz de i (root[i]); -1 nos dois para
+    posicoes que nao chegam a uma raiz (ciclo).
+    """
+
+    def __init__(self, parent, use_numpy=None):
+        self.numpy = (np is not None) if use_numpy is None else bool(use_numpy and np)
+        if self.numpy:
+            self.parent = np.asarray(parent, dtype=np.int64)
+            self.depth, self.root = _ancestors_np(self.parent)
+        else:
+            self.parent = array.array('q', parent)
+            depth, root = _ancestors_py(self.parent)
+            self.depth, self.root = array.array('q', depth), array.array('q', root)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def reachable(self):
+        """Lista de bool: a posicao chega a uma raiz."""
+        if self.numpy:
+            return (self.depth >= 0).tolist()
+        return [d >= 0 for d in self.depth]
+
+    def subtree(self, pos):
+        """Posicoes cuja raiz e pos (pos precisa ser raiz)."""
+        if self.numpy:
+            return np.nonzero(self.root == pos)[0].tolist()
+        return [i for i, r in enumerate(self.root) if r == pos]
+
+    def accumulate(self, sums, maxes, masks):
+        """
+        Valor de cada posicao -> valor da subarvore inteira.
+        sums: colunas de inteiros somadas; maxes: inteiros, maximo; masks:
+        inteiros (bitmasks), OR. Devolve (sums, maxes, masks) como listas.
+        Posicoes fora de arvore (ciclo) voltam com o proprio valor.
+        """
+        if self.numpy:
+            return self._accumulate_np(sums, maxes, masks)
+        return self._accumulate_py(sums, maxes, masks)
+
+    def _accumulate_py(self, sums, maxes, masks):
+        parent, depth = self.parent, self.depth
+        ordem = [i for i in range(len(parent)) if depth[i] > 0]
+        ordem.sort(key=depth.__getitem__, reverse=True)
+        arestas = [(i, parent[i]) for i in ordem]
+
+        colunas = []
+        for valores in sums:
+            col = array.array('q', valores)
+            for i, p in arestas:
+                col[p] += col[i]
+            colunas.append(col.tolist())
+        maxes = list(maxes)
+        masks = list(masks)
+        for i, p in arestas:
+            if maxes[i] > maxes[p]: maxes[p] = maxes[i]
+            masks[p] |= masks[i]
+        return colunas, maxes, masks
+
+    def _accumulate_np(self, sums, maxes, masks):
+        parent, depth = self.parent, self.depth
+        n = len(parent)
+        mat = np.array(sums, dtype=np.int64).reshape(len(sums), n).T.copy()
+        mx = np.array(maxes, dtype=np.int64)
+        # Ate 64 selos distintos cabem num uint64; acima disso, int do Python.
+        largo = max(masks, default=0).bit_length() > 64
+        mk = np.array(masks, dtype=object if largo else np.uint64)
+
+        pos = np.nonzero(depth > 0)[0]
+        if len(pos):
+            pos = pos[np.argsort(depth[pos], kind='stable')]
+            fundo = int(depth[pos[-1]])
+            inicio = np.searchsorted(depth[pos], np.arange(1, fundo + 2))
+            for nivel in range(fundo, 0, -1):
+                sel = pos[inicio[nivel - 1]:inicio[nivel]]
+                cima = parent[sel]
+                np.add.at(mat, cima, mat[sel])
+                np.maximum.at(mx, cima, mx[sel])
+                np.bitwise_or.at(mk, cima, mk[sel])
+        return ([c.tolist() for c in mat.T], mx.tolist(),
+                [int(m) for m in mk.tolist()])
@@ -24,6 +24,7 @@ import logging
 from src.core.engine import SysInspectorEngine
 # [FIXED] Importing the function directly, not a non-existent class
 from src.collectors.system_inventory import collect_full_inventory
+from src.probes.blk_latency import attach_disk_latency
 from src.collectors.manager import (summarize_metrics, collect_findings,
                                     correlate_findings_with_processes)
 from src.core.findings import summarize_by_severity
@@ -67,6 +68,12 @@ class DaemonController:
         self.interval = config['daemon'].get('interval', 15)
         self.capture_duration = config['daemon'].get('capture_duration', 15)
 
+        # Modo continuo: sondas e thread de leitura ficam no ar a vida toda do
+        # agente e cada captura e cortada por engine.rotate(). Sem ele, o
+        # intervalo entre capturas e tempo cego (15s/15s = metade do tempo).
+        # Lido so na partida: alternar exige reiniciar o agente.
+        self.continuous = bool(config['daemon'].get('continuous', False))
+
         # Store-and-forward: coleta local primeiro, entrega ao servidor quando
         # possivel. Fica inativo enquanto nao houver destino e token
         # configurados, preservando o comportamento puramente local.
@@ -159,6 +166,8 @@ class DaemonController:
             # Instantiating the correct class name
             engine = SysInspectorEngine(self.config)
             self.logger.info("[CORE] eBPF Engine initialized/compiled.")
+            # Hashes de executaveis sobrevivem a reinicios, no banco local.
+            engine.tree.hash_cache.open_db(getattr(self.db, "db_path", None))
         except Exception as e:
             self.logger.critical(f"eBPF Engine Init Failed: {e}")
             return
@@ -197,6 +206,9 @@ class DaemonController:
 
         # Cleanup on exit
         # engine.cleanup()  # on future
+        # No modo continuo o motor fica rodando entre ciclos; para aqui.
+        if getattr(engine, "running", False):
+            engine.stop()
         self.logger.info("[DAEMON] Shutdown complete.")
 
     def _handle_commands(self, engine, comandos):
@@ -378,6 +390,10 @@ class DaemonController:
         """
         self.logger.info(f"[CYCLE #{cycle_id}] Starting Capture Phase ({self.capture_duration}s)...")
 
+        if self.continuous:
+            self._collect_continuous(engine, cycle_id)
+            return
+
         # A. Cada captura precisa descrever a janela dela, e nao a soma de tudo
         # que ja passou pelo agente. O motor e reaproveitado entre ciclos para
         # evitar recompilar os probes, mas a arvore que ele carrega tem que
@@ -387,6 +403,7 @@ class DaemonController:
 
         # B. Start eBPF Polling
         engine.start()
+        inicio = time.time()
 
         # Wait for capture duration (responsive sleep)
         elapsed = 0
@@ -397,7 +414,9 @@ class DaemonController:
             elapsed += 1
 
         # B. Stop eBPF Polling
-        engine.stop()
+        # Duracao medida: e por ela que o tempo em CPU vira percentual.
+        duracao = time.time() - inicio
+        engine.stop(duration=duracao)
 
         if self.shutdown_event.is_set():
             return
@@ -405,13 +424,45 @@ class DaemonController:
         # C. Retrieve Data
         # Finaliza a agregacao da arvore (tags, scores).
         engine.tree.aggregate_stats()
+        self._store_capture(engine, engine.tree, cycle_id, round(duracao, 3))
+
+    def _collect_continuous(self, engine, cycle_id):
+        """
+        Captura no modo continuo: o motor sobe uma vez e cada janela e cortada
+        por rotacao, sem parar as sondas.
+
+        A janela vai do corte anterior ate este, e inclui o intervalo ocioso do
+        ciclo: e exatamente o tempo que o modo normal deixava sem observacao. A
+        duracao gravada e a medida, nao a configurada.
+        """
+        if not engine.running:
+            engine.tree.reset()
+            engine.start()
+
+        elapsed = 0
+        while elapsed < self.capture_duration:
+            if self.shutdown_event.is_set():
+                return
+            time.sleep(1)
+            elapsed += 1
+
+        tree = engine.rotate()
+        if tree is None or self.shutdown_event.is_set():
+            return
+
+        duracao = engine.capture_health.get("window_seconds") or self.capture_duration
+        self._store_capture(engine, tree, cycle_id, duracao)
 
+    def _store_capture(self, engine, tree, cycle_id, duration):
+        """Monta, cifra e grava a captura de uma janela ja agregada."""
         # Modelo unico de captura: mesmo shape do snapshot e do live, com os
         # processos no topo em 'processes', para o renderizador reidratar sem
         # precisar conhecer formatos diferentes por modo.
         full_data = collect_full_inventory()
-        full_data['processes'] = engine.tree.to_json()
-        full_data['capture_duration'] = self.capture_duration
+        full_data['processes'] = tree.to_json()
+        full_data['capture_health'] = engine.capture_health
+        attach_disk_latency(full_data.get('storage'), engine.capture_health.get('disk_latency'))
+        full_data['capture_duration'] = duration
         full_data['mode'] = 'daemon'
         full_data['agent_uuid'] = self.agent_uuid
         full_data['cycle'] = cycle_id
@@ -427,7 +478,8 @@ class DaemonController:
         full_data['findings_summary'] = summarize_by_severity(findings)
 
         # D. Metricas quentes (mesmo helper compartilhado do snapshot).
-        metrics = summarize_metrics(full_data['processes'])
+        metrics = summarize_metrics(full_data['processes'],
+                                    full_data['capture_health'])
 
         # E. Encrypt
         self.logger.debug(f"[CYCLE #{cycle_id}] Encrypting payload...")
@@ -26,6 +26,7 @@ from socketserver import ThreadingMixIn
 from src.version import __version__
 from src.core.engine import SysInspectorEngine
 from src.collectors.system_inventory import collect_full_inventory
+from src.probes.blk_latency import attach_disk_latency
 from src.collectors.manager import summarize_metrics, collect_findings
 from src.core.findings import summarize_by_severity
 from src.exporters.html_report import generate_report, generate_table_fragment
@@ -199,6 +200,9 @@ class LiveController:
                 # 2. Package (modelo unico: processos no topo em 'processes')
                 full_inv = collect_full_inventory()
                 full_inv['processes'] = self.engine.tree.to_json()
+                full_inv['capture_health'] = self.engine.capture_health
+                attach_disk_latency(full_inv.get('storage'),
+                                    self.engine.capture_health.get('disk_latency'))
                 full_inv['agent_uuid'] = self.db.agent_id
                 full_inv['mode'] = 'live'
 
@@ -209,7 +213,8 @@ class LiveController:
 
                 # 3. Encrypt + Save (cifrado como os demais modos, com as
                 # colunas quentes preenchidas via helper compartilhado).
-                metrics = summarize_metrics(full_inv['processes'])
+                metrics = summarize_metrics(full_inv['processes'],
+                                            full_inv['capture_health'])
                 bundle = encrypt_data(full_inv, self.pub_key)
                 if self.db.insert_snapshot(bundle, agent_uuid=self.db.agent_id, metrics=metrics):
                     self.update_count += 1
@@ -1540,6 +1540,13 @@ class ServerHTTPHandler(BaseHTTPRequestHandler):
                             "Sem privilegio o laudo sai incompleto sem erro aparente")
                     + _selo(detectar.get("cgroup_v2"), "cgroup2",
                             "Muda como conteiner e limite de recurso sao identificados"))
+                modo = detectar.get("attach_mode")
+                if modo:
+                    previsto = "" if detectar.get("attach_mode_active") else " (previsto)"
+                    deteccao += _selo(modo != "kprobe", _esc(modo + previsto),
+                                      "Anexacao de openat, connect e I/O: fentry e "
+                                      "tracepoint sao estaveis e baratos; kprobe e o "
+                                      "ultimo recurso, mais caro em funcoes quentes")
 
             if not caps:
                 cenario = "-"
@@ -1919,6 +1926,19 @@ class ServerHTTPHandler(BaseHTTPRequestHandler):
             fqdn_html = ""
             seen_html = ""
 
+            # Captura incompleta: o kernel descartou eventos na ultima janela
+            # (agente atrasado, buffer cheio). O laudo continua valido para o
+            # que mostra, mas a ausencia de um evento nele nao prova nada.
+            perdidos = int(a.get('lost_events') or 0)
+            lost_html = ""
+            if perdidos:
+                lost_html = ("<div title='O kernel descartou %d evento(s) na "
+                             "ultima captura deste agente: a ausencia de um "
+                             "evento no laudo nao prova que ele nao ocorreu' "
+                             "style='color:#ffd166;font-size:11px'>&#9888; "
+                             "captura incompleta (%d perdidos)</div>"
+                             % (perdidos, perdidos))
+
             # UPTIME: do HOST (desde o boot) e do AGENTE (desde que subiu). Os
             # dois separados de proposito: um agente reiniciado num host antigo,
             # ou um host recem-ligado com o agente de sempre, sao leituras
@@ -1968,7 +1988,7 @@ class ServerHTTPHandler(BaseHTTPRequestHandler):
                 <td>
                     <a href='/agent/{uuid}' style='color:#4ec9b0; font-size:1.1em; font-weight:bold; text-decoration:none;'>{host}</a>
                     <br><small style='color:#666; font-family:monospace'>{uuid}</small>
-                    {fqdn_html}{seen_html}
+                    {fqdn_html}{seen_html}{lost_html}
                 </td>
                 <td style='color:#ccc'>{ip}</td>
                 <td>{fqdn_col}</td>
@@ -67,13 +67,9 @@ class SnapshotController:
 
         # 1. Create Nodes
         for pid, p_data in processes_dict.items():
-            # Create a dummy node with attributes from dict
-            node = ProcessNode(int(pid), 0, "", 0)  # Init with defaults
-            node.__dict__.update(p_data)  # Inject all dict data into object
-
-            # Fix Types (Sets/Lists) that JSON flattened
-            if isinstance(node.open_files, list): node.open_files = set(node.open_files)
-            if isinstance(node.connections, list): node.connections = set(node.connections)
+            # Node from the serialized fields (sets restored, defaults for the rest)
+            node = ProcessNode.from_dict(p_data)
+            node.pid = int(pid)
 
             # Handle tags_accumulated safely
             # Since to_json removes it, we recreate it from context_tags (which is persisted)
@@ -120,7 +116,8 @@ class SnapshotController:
             # 3. PERSISTENCE (Store-and-Forward)
             # Save the BLOB to SQLite, com as metricas quentes resumidas
             # (antes iam sempre zeradas por falta do argumento metrics).
-            metrics = summarize_metrics(full_data.get('processes', {}))
+            metrics = summarize_metrics(full_data.get('processes', {}),
+                                        full_data.get('capture_health'))
 
             # Cadeia de custodia: digest do conteudo em claro, assinatura do
             # agente e elo com a captura anterior. Fica ao lado do blob cifrado
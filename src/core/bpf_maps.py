@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/core/bpf_maps.py
+# DESCRIPTION: Leitura e limpeza, por janela, dos mapas de contadores das
+#              sondas (I/O, CPU, rede, descartes, conexoes, latencia de bloco,
+#              tempo fora da CPU, eventos suprimidos).
+#
+# WHY:         Sao a metade do motor que nao trata evento: no inicio da janela
+#              os mapas sao zerados (_reset_*) e no fim a geracao fechada e
+#              lida e apagada (_collect_*, via _drain_generation). Ficam aqui
+#              para engine.py tratar do ciclo de vida e do caminho dos eventos.
+#
+# HOW:         MapCollectorMixin e herdado por SysInspectorEngine. Usa o estado do
+#              motor: bpf, tree, running, capture_health, os limites lidos da
+#              configuracao (drop_flows_top, conn_top, io_events_debug,
+#              edr_wait_min_ms), os caches _batch_ops, _drop_reasons e
+#              _block_devices, e os metodos _batch_ops_available e _wall_clock.
+#
+# NOTES:       Sem dependencia de bcc: os mapas chegam prontos em self.bpf.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import time
+
+from src.probes.rate_limit import kind_name
+from src.probes.drop_flows import flow_record, top_flows, reason_names
+from src.probes.connections import conn_record, top_connections, conn_label
+from src.probes.blk_latency import percentiles, block_devices, devt_name
+from src.probes.offcpu import edr_wait_site
+from src.core.overhead import LEVEL_NO_IO_EVENTS
+
+# Mapas de contadores de rede, lidos e zerados a cada janela.
+NETWORK_COUNTER_MAPS = ("net_bytes_sent", "net_bytes_recv",
+                        "tcp_retrans_map", "tcp_drop_map", "drop_flows",
+                        "conn_stats")
+
+# Histogramas de latencia de bloco (por disco e por processo), por janela.
+BLOCK_LATENCY_MAPS = ("blk_lat_dev", "blk_lat_pid")
+
+
+def _counter_total(value):
+    """
+    Valor de um contador lido de um mapa: a soma das copias por CPU quando o
+    mapa e per-CPU (o BCC devolve uma posicao por CPU), ou o proprio u64.
+    """
+    try:
+        return sum(value)
+    except TypeError:
+        return value.value
+
+
+class MapCollectorMixin:
+    """Mapas de contadores por janela: zerar no inicio, ler no fim."""
+
+    def _disable_batch_ops(self, erro):
+        print(f"[WARN] BPF batch map operations unavailable ({erro}); "
+              "falling back to per-key reads.")
+        self._batch_ops = False
+
+    def _clear_map(self, table):
+        """
+        Esvazia um mapa. Em lote sao poucas chamadas de sistema; o clear() do
+        BCC apaga chave por chave.
+        """
+        if self._batch_ops_available(table):
+            try:
+                table.items_delete_batch()
+                return
+            except Exception as e:
+                self._disable_batch_ops(e)
+        table.clear()
+
+    def _drain_generation(self, table, gen):
+        """
+        Entradas de uma geracao de um mapa de contadores, ja removidas dele.
+
+        A geracao volta a ser a corrente duas janelas depois; o que ficasse no
+        mapa seria somado a uma janela que nao o produziu.
+
+        Em lote (kernel 5.6+) ler e apagar custam poucas chamadas de sistema
+        por mapa, e nao uma por chave. Com o motor parado (stop) nenhuma outra
+        geracao esta em uso e o mapa inteiro sai num lookup-and-delete; o que
+        houver da outra geracao e resto da troca e e descartado. Em rotate() a
+        geracao nova segue viva: o mapa e lido em lote e so as chaves da
+        geracao fechada sao apagadas, tambem em lote. Sem lote, a troca de
+        geracoes continua garantindo o mesmo resultado, chave a chave.
+        """
+        if self._batch_ops_available(table):
+            try:
+                if not self.running:
+                    return [(k, v) for k, v in table.items_lookup_and_delete_batch()
+                            if k.gen == gen]
+                itens = [(k, v) for k, v in table.items_lookup_batch() if k.gen == gen]
+                if itens:
+                    table.items_delete_batch((table.Key * len(itens))(*[k for k, _v in itens]))
+                return itens
+            except Exception as e:
+                self._disable_batch_ops(e)
+
+        itens = [(k, v) for k, v in table.items() if k.gen == gen]
+        for k, _v in itens:
+            try:
+                del table[k]
+            except KeyError:
+                pass
+        return itens
+
+    def _reset_io_counters(self):
+        """
+        Zera os agregados de I/O no inicio da janela.
+
+        As sondas continuam anexadas entre capturas; sem zerar, a janela somaria
+        tambem o I/O do periodo ocioso e o de processos ja encerrados.
+        """
+        if not self.bpf: return
+        try:
+            self._clear_map(self.bpf["io_stats"])
+        except Exception as e:
+            print(f"[WARN] Could not reset io_stats: {e}")
+
+    def _reset_network_counters(self):
+        """
+        Zera os contadores de rede no inicio da janela.
+
+        As sondas seguem anexadas entre capturas; sem zerar, o trafego do
+        intervalo ocioso entraria na janela seguinte.
+        """
+        if not self.bpf: return
+        for nome in NETWORK_COUNTER_MAPS:
+            try:
+                self._clear_map(self.bpf[nome])
+            except Exception as e:
+                print(f"[WARN] Could not reset {nome}: {e}")
+
+    def _reset_block_latency(self):
+        """Zera os histogramas de latencia de bloco no inicio da janela."""
+        if not self.bpf: return
+        for nome in BLOCK_LATENCY_MAPS:
+            try:
+                self._clear_map(self.bpf[nome])
+            except Exception as e:
+                print(f"[WARN] Could not reset {nome}: {e}")
+
+    def _reset_offcpu(self):
+        """Zera o tempo fora da CPU e as pilhas no inicio da janela."""
+        if not self.bpf: return
+        try:
+            self._clear_map(self.bpf["offcpu_ns"])
+            # Mapa de pilhas nao aceita operacao em lote: chave por chave.
+            self.bpf["offcpu_stacks"].clear()
+        except Exception as e:
+            print(f"[WARN] Could not reset offcpu_ns: {e}")
+
+    def _reset_open_seen(self):
+        """
+        Esquece os caminhos ja enviados no inicio da janela.
+
+        A arvore e refeita a cada captura; sem limpar, um arquivo aberto na
+        janela anterior nunca apareceria na seguinte.
+        """
+        if not self.bpf: return
+        try:
+            self._clear_map(self.bpf["open_seen"])
+        except Exception as e:
+            print(f"[WARN] Could not reset open_seen: {e}")
+
+    def _reset_cpu_counters(self):
+        """
+        Zera o tempo em CPU no inicio da janela.
+
+        As sondas seguem anexadas entre capturas; sem zerar, o intervalo ocioso
+        do ciclo entraria na conta da janela seguinte.
+        """
+        if not self.bpf: return
+        try:
+            self._clear_map(self.bpf["cpu_ns"])
+        except Exception as e:
+            print(f"[WARN] Could not reset cpu_ns: {e}")
+
+    def _reset_suppressed(self):
+        """Zera as contagens de eventos suprimidos no inicio da janela."""
+        if not self.bpf: return
+        try:
+            self._clear_map(self.bpf["suppressed_events"])
+        except Exception as e:
+            print(f"[WARN] Could not reset suppressed_events: {e}")
+
+    def _reset_lost_counters(self):
+        """Zera a contagem de perdas e de eventos no inicio da janela."""
+        self._window_events = 0
+        self._lost_reported = 0
+        self._window_started = time.time()
+        if not self.bpf: return
+        try:
+            self.bpf["submit_lost"].clear()
+        except Exception as e:
+            print(f"[WARN] Could not reset submit_lost: {e}")
+
+    def _collect_cpu_counters(self, duration, tree=None, gen=0):
+        """
+        Reads the on-CPU time per process (cpu_ns) of one generation.
+
+        Vale tambem para o processo que nasceu e morreu dentro da janela, que
+        a leitura de /proc/PID/stat no inicio e no fim nunca via.
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+        duration = duration if duration and duration > 0 else 1
+
+        for k, v in self._drain_generation(self.bpf["cpu_ns"], gen):
+            node = tree.get(k.pid)
+            if not node: continue
+            node.cpu_time_ns = v.value
+            node.cpu_usage_pct = v.value / 1e9 / duration * 100.0
+
+    def _collect_io_counters(self, tree=None, gen=0):
+        """Reads the in-kernel I/O aggregates (io_stats) of one generation."""
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+
+        # Com o modo de depuracao os eventos 'R'/'W' ja somaram os mesmos
+        # totais em _handle_record; somar de novo dobraria o I/O. Se o
+        # governador os cortou na janela, os agregados voltam a valer.
+        nivel = (self.capture_health.get("overhead") or {}).get("level", 0)
+        eventos_io = self.io_events_debug and nivel < LEVEL_NO_IO_EVENTS
+
+        for k, v in self._drain_generation(self.bpf["io_stats"], gen):
+            node = tree.get(k.pid)
+            if not node: continue
+
+            if not eventos_io:
+                node.read_bytes_delta += v.read_bytes
+                node.write_bytes_delta += v.write_bytes
+                node.io_latency_tot += v.latency_ns
+                node.io_ops_count += v.latency_ops
+
+            if k.tid:
+                node.io_threads[k.tid] = {
+                    "read_bytes": v.read_bytes, "write_bytes": v.write_bytes,
+                    "read_ops": v.read_ops, "write_ops": v.write_ops,
+                    "latency_ns": v.latency_ns}
+
+    def _collect_network_counters(self, tree=None, gen=0):
+        """Reads BPF Maps for high-volume metrics (one generation)."""
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+
+        # Cada mapa sai com a propria geracao lida e apagada: a janela ve so o
+        # que aconteceu nela, e a chave de um PID morto nao sobrevive a ela.
+        # net_bytes_* sao per-CPU: _counter_total soma as copias aqui, uma vez
+        # por janela, em vez de o kernel disputar um valor por pacote.
+        def get_map_val(bpf_map):
+            for k, v in self._drain_generation(bpf_map, gen):
+                node = tree.get(k.pid)
+                if node: yield node, _counter_total(v)
+
+        for node, val in get_map_val(self.bpf["net_bytes_sent"]): node.net_tx_bytes = val
+        for node, val in get_map_val(self.bpf["net_bytes_recv"]): node.net_rx_bytes = val
+        for node, val in get_map_val(self.bpf["tcp_retrans_map"]):
+            node.tcp_retrans = val
+            if val > 0:
+                node.anomaly_score += 2
+                if "NET ERR" not in node.context_tags: node.context_tags.append("NET ERR")
+        for node, val in get_map_val(self.bpf["tcp_drop_map"]):
+            node.tcp_drops = max(node.tcp_drops, val)
+            if val > 0:
+                node.anomaly_score += 5
+                if "NET ERR" not in node.context_tags: node.context_tags.append("NET ERR")
+
+        self._collect_drop_flows(tree, gen)
+        self._collect_connections(tree, gen)
+
+    def _collect_drop_flows(self, tree=None, gen=0):
+        """
+        Le os fluxos de descarte de uma geracao e guarda, em cada processo, os
+        drop_flows_top com mais descartes; os demais viram drop_flows_omitted.
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+        if self._drop_reasons is None:
+            self._drop_reasons = reason_names()
+
+        por_pid = {}
+        for k, v in self._drain_generation(self.bpf["drop_flows"], gen):
+            if tree.get(k.pid) is None: continue
+            por_pid.setdefault(k.pid, []).append(flow_record(
+                k, count=v.count, nbytes=v.bytes,
+                first_seen=self._wall_clock(v.first_ns),
+                last_seen=self._wall_clock(v.last_ns),
+                names=self._drop_reasons))
+
+        for pid, flows in por_pid.items():
+            node = tree.get(pid)
+            node.drop_flows, node.drop_flows_omitted = top_flows(flows, self.drop_flows_top)
+
+    def _collect_connections(self, tree=None, gen=0):
+        """
+        Le os destinos de uma geracao e guarda, em cada processo, os conn_top
+        mais usados; o uso dos demais vira connections_omitted.
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+
+        por_pid = {}
+        for k, v in self._drain_generation(self.bpf["conn_stats"], gen):
+            if tree.get(k.pid) is None: continue
+            por_pid.setdefault(k.pid, []).append(conn_record(
+                k.family, bytearray(k.daddr), k.dport, k.proto,
+                count=v.count, nbytes=v.bytes,
+                first_seen=self._wall_clock(v.first_ns),
+                last_seen=self._wall_clock(v.last_ns)))
+
+        for pid, conns in por_pid.items():
+            node = tree.get(pid)
+            node.connection_table, node.connections_omitted = top_connections(conns, self.conn_top)
+            node.connections = set(conn_label(c) for c in node.connection_table)
+
+    def _collect_block_latency(self, tree=None, gen=0):
+        """
+        Le os histogramas de latencia de bloco de uma geracao: p50/p95/p99 em
+        node.blk_latency e, por disco, em capture_health['disk_latency'].
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+
+        por_pid = {}
+        for k, v in self._drain_generation(self.bpf["blk_lat_pid"], gen):
+            if tree.get(k.pid) is None: continue
+            hist = por_pid.setdefault(k.pid, {})
+            hist[k.slot] = hist.get(k.slot, 0) + _counter_total(v)
+        for pid, hist in por_pid.items():
+            tree.get(pid).blk_latency = percentiles(hist)
+
+        por_disco = {}
+        for k, v in self._drain_generation(self.bpf["blk_lat_dev"], gen):
+            hist = por_disco.setdefault(k.dev, {})
+            hist[k.slot] = hist.get(k.slot, 0) + _counter_total(v)
+        if self._block_devices is None or any(d not in self._block_devices for d in por_disco):
+            self._block_devices = block_devices()
+        self.capture_health["disk_latency"] = {
+            devt_name(dev, self._block_devices): percentiles(hist)
+            for dev, hist in por_disco.items()}
+
+    def _collect_offcpu(self, tree=None, gen=0):
+        """
+        Le o tempo fora da CPU de uma geracao: o total em node.offcpu_ms e, por
+        ponto de espera em caminho de inspecao, o que decide o EDR-WAIT.
+
+        Cada pilha e resolvida uma vez por janela. No fim as pilhas que nada
+        mais referencia saem da tabela: cheia, ela recusa pilhas novas.
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+        stacks = self.bpf["offcpu_stacks"]
+
+        sitios = {}
+        esperas = {}
+        for k, v in self._drain_generation(self.bpf["offcpu_ns"], gen):
+            node = tree.get(k.pid)
+            if not node: continue
+            ns = _counter_total(v)
+            node.offcpu_ms += ns / 1e6
+            if k.stack_id not in sitios:
+                sitios[k.stack_id] = edr_wait_site(self._stack_symbols(stacks, k.stack_id))
+            sitio = sitios[k.stack_id]
+            if sitio:
+                por_sitio = esperas.setdefault(k.pid, {})
+                por_sitio[sitio] = por_sitio.get(sitio, 0) + ns
+
+        for pid, por_sitio in esperas.items():
+            tree.get(pid).record_edr_wait(por_sitio, self.edr_wait_min_ms)
+        self._prune_offcpu_stacks()
+
+    def _stack_symbols(self, stacks, stack_id):
+        """Simbolos da pilha do kernel, do topo para a base ([] se perdida)."""
+        if stack_id < 0: return []
+        try:
+            return [self.bpf.ksym(addr) for addr in stacks.walk(stack_id)]
+        except Exception:
+            return []
+
+    def _prune_offcpu_stacks(self):
+        """Apaga as pilhas que nem a geracao viva nem uma espera aberta usam."""
+        try:
+            usadas = set(k.stack_id for k in self.bpf["offcpu_ns"].keys())
+            usadas.update(v.stack_id for v in self.bpf["offcpu_start"].values())
+            stacks = self.bpf["offcpu_stacks"]
+            for k in list(stacks.keys()):
+                if k.value not in usadas:
+                    try:
+                        del stacks[k]
+                    except KeyError:
+                        pass
+        except Exception as e:
+            print(f"[WARN] Could not prune offcpu_stacks: {e}")
+
+    def _collect_suppressed(self, tree=None, gen=0):
+        """
+        Reads the events the kernel dropped for being over budget (one generation).
+
+        Processo que ja saiu da arvore so entra no total da janela, em
+        capture_health['suppressed_events'].
+        """
+        if not self.bpf: return
+        tree = self.tree if tree is None else tree
+
+        total = 0
+        for k, v in self._drain_generation(self.bpf["suppressed_events"], gen):
+            total += v.value
+            node = tree.get(k.pid)
+            if not node: continue
+            node.suppressed_events += v.value
+            kind = kind_name(k.kind)
+            node.suppressed_by_type[kind] = node.suppressed_by_type.get(kind, 0) + v.value
+
+        self.capture_health["suppressed_events"] = total
+        if total:
+            print(f"[WARN] {total} events suppressed by the per-process budget.")
@@ -30,6 +30,7 @@
 # AUTHOR: Mario Luz (Sys-Inspector Project)
 # ==============================================================================
 
+import importlib.util
 import os
 import logging
 import subprocess
@@ -88,13 +89,27 @@ def detection_capabilities():
         pass
 
     # A presenca do modulo bcc e o que separa um agente capaz de instrumentar o
-    # kernel de um que so consegue ler /proc.
+    # kernel de um que so consegue ler /proc. find_spec so procura o modulo:
+    # nao o executa, e nao deixa o bcc importado num processo que so consulta.
     try:
-        import bcc            # noqa: F401
-        caps["ebpf"] = True
-    except Exception:
+        caps["ebpf"] = importlib.util.find_spec("bcc") is not None
+    except (ImportError, ValueError):
         caps["ebpf"] = False
 
+    # Como openat, connect e I/O de disco estao anexados (fentry, tracepoint ou
+    # kprobe). Antes de o motor carregar as sondas, o modo que "auto" escolheria
+    # aqui, marcado como previsto: custo e cobertura do laudo dependem dele.
+    try:
+        from src.probes import attach
+        caps["attach_mode"] = attach.active_mode()
+        caps["attach_mode_active"] = caps["attach_mode"] is not None
+        if caps["attach_mode"] is None:
+            release = caps["kernel"].split("-", maxsplit=1)[0].split(".")
+            kernel = tuple(int(p) for p in release[:2] if p.isdigit())
+            caps["attach_mode"] = attach.choose_attach_mode("auto", kernel, btf=caps["btf"])
+    except Exception:
+        caps["attach_mode"] = None
+
     # cgroup v2 muda como se identifica conteiner e limite de recurso.
     try:
         with open("/proc/mounts", "r") as fh:
@@ -141,6 +156,9 @@ def summarize(capacidades):
     partes.append("eBPF" if detectar.get("ebpf") else "SEM eBPF")
     if detectar.get("btf"):
         partes.append("BTF")
+    if detectar.get("attach_mode"):
+        previsto = "" if detectar.get("attach_mode_active") else " (previsto)"
+        partes.append("sondas: %s%s" % (detectar["attach_mode"], previsto))
     if not detectar.get("root", True):
         partes.append("SEM root")
 
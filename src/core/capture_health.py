@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/core/capture_health.py
+# DESCRIPTION: Eventos perdidos por janela e dimensionamento do buffer de perf.
+#
+# WHY:         Quando o agente fica para tras, o kernel descarta amostras e a
+#              captura continua parecendo completa. Um laudo sem o processo que
+#              importava, mas com aparencia integra, e pior que laudo nenhum:
+#              induz a concluir que aquilo nao aconteceu. Esta classe conta o
+#              que se perdeu em cada janela para o numero viajar com a captura
+#              (payload cifrado e coluna quente lost_events).
+#
+# SIZING:      O tamanho do buffer de perf (page_cnt, por CPU) sai da taxa de
+#              eventos das janelas anteriores, com folga, dentro de um teto de
+#              memoria. Perda na janela anterior dobra o tamanho, mesmo que a
+#              taxa media pareca caber: perda e rajada, e a media a esconde.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import collections
+
+PAGE_SIZE = 4096
+
+# Padrao do BCC para open_perf_buffer; nunca abaixo disso.
+MIN_PAGE_CNT = 8
+
+# Intervalo maximo entre duas leituras do buffer (timeout do poll, em s).
+POLL_INTERVAL_S = 0.2
+
+# Folga sobre a taxa observada: absorve rajadas dentro da janela.
+HEADROOM = 4
+
+# Registro medio: cabecalho de 48 bytes mais a cauda, arredondado para cima
+# para cobrir os caminhos de 'E'/'O'.
+AVG_RECORD_BYTES = 128
+
+# Janelas anteriores consideradas no dimensionamento.
+HISTORY = 5
+
+
+def _floor_pow2(n):
+    p = 1
+    while p * 2 <= n:
+        p *= 2
+    return p
+
+
+def _ceil_pow2(n):
+    p = 1
+    while p < n:
+        p *= 2
+    return p
+
+
+def max_page_cnt(max_mb, ncpu):
+    """Maior page_cnt por CPU (potencia de dois) que cabe no teto de memoria."""
+    por_cpu = int(max_mb * 1024 * 1024 / PAGE_SIZE / max(1, ncpu))
+    return max(MIN_PAGE_CNT, _floor_pow2(max(1, por_cpu)))
+
+
+def choose_page_cnt(peak_rate, lost, ncpu, max_mb, current=MIN_PAGE_CNT,
+                    record_bytes=AVG_RECORD_BYTES):
+    """
+    page_cnt por CPU para a proxima janela.
+
+    PARAMETER peak_rate: maior taxa (eventos/s) das janelas recentes.
+    PARAMETER lost: eventos perdidos na ultima janela.
+    PARAMETER max_mb: teto de memoria dos buffers, somados todos os CPUs.
+    PARAMETER current: tamanho em uso; com perda, o minimo e o dobro dele.
+    """
+    por_cpu = peak_rate / float(max(1, ncpu))
+    bytes_needed = por_cpu * record_bytes * POLL_INTERVAL_S * HEADROOM
+    pages = _ceil_pow2(max(1, int(bytes_needed / PAGE_SIZE) + 1))
+    if lost:
+        pages = max(pages, current * 2)
+    return min(max(MIN_PAGE_CNT, pages), max_page_cnt(max_mb, ncpu))
+
+
+class CaptureHealth(object):
+    """
+    Contabilidade de uma janela de captura: eventos recebidos e perdidos.
+
+    'complete' e False sempre que algo se perdeu, e so isso: o laudo continua
+    sendo gravado, mas ninguem deve tomar a ausencia de um evento como prova.
+    """
+
+    def __init__(self, transport="perf", page_cnt=MIN_PAGE_CNT, attach_mode=None):
+        self.transport = transport
+        self.attach_mode = attach_mode
+        self.page_cnt = page_cnt
+        self.rates = collections.deque(maxlen=HISTORY)
+        self.last = {}
+
+    def peak_rate(self):
+        return max(self.rates) if self.rates else 0.0
+
+    def close_window(self, events, lost_per_cpu, lost_reported, seconds):
+        """
+        Fecha a janela e devolve o resumo que vai para a captura.
+
+        PARAMETER lost_per_cpu: dict cpu -> envios recusados pelo kernel.
+        PARAMETER lost_reported: total informado pelo callback de perda do BCC.
+            Os dois medem o mesmo fenomeno por caminhos diferentes; vale o
+            maior, para nunca subestimar a perda.
+        """
+        per_cpu = {int(c): int(n) for c, n in (lost_per_cpu or {}).items() if n}
+        lost = max(sum(per_cpu.values()), int(lost_reported or 0))
+        seconds = max(float(seconds or 0), 0.001)
+
+        # A taxa conta o que o kernel TENTOU enviar, nao so o que chegou: medir
+        # apenas o recebido subestimaria justamente as janelas que transbordaram.
+        self.rates.append((events + lost) / seconds)
+
+        self.last = {
+            "transport": self.transport,
+            "attach_mode": self.attach_mode,
+            "page_cnt": self.page_cnt,
+            "events": int(events),
+            "lost_events": lost,
+            "lost_per_cpu": per_cpu,
+            "window_seconds": round(seconds, 3),
+            "complete": lost == 0,
+        }
+        return self.last
@@ -135,7 +135,11 @@ class DatabaseManager:
                                       # ("qual host esta pior?") sem
                                       # descriptografar captura por captura.
                                       # Guarda numeros, nunca o conteudo.
-                                      ("findings_summary", "TEXT")):
+                                      ("findings_summary", "TEXT"),
+                                      # Eventos que o kernel descartou na
+                                      # janela. Diferente de zero: captura
+                                      # incompleta, visivel na frota.
+                                      ("lost_events", "INTEGER DEFAULT 0")):
                     try:
                         conn.execute("ALTER TABLE snapshots ADD COLUMN %s %s"
                                      % (column, ctype))
@@ -223,8 +227,8 @@ class DatabaseManager:
                         agent_uuid, timestamp,
                         cpu_avg, mem_used_mb, pids_count, alert_score, is_alert,
                         json_blob, synced, digest, previous_digest, custody,
-                        findings_summary
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?)
+                        findings_summary, lost_events
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0, ?, ?, ?, ?, ?)
                 """, (
                     agent_uuid,
                     time.time(),
@@ -237,7 +241,8 @@ class DatabaseManager:
                     (custody or {}).get('digest'),
                     (custody or {}).get('previous_digest'),
                     json.dumps(custody) if custody else None,
-                    json.dumps(findings_summary) if findings_summary else None
+                    json.dumps(findings_summary) if findings_summary else None,
+                    metrics.get('lost', 0)
                 ))
                 # Guarda o id da linha recem-inserida para retorno ao chamador
                 # (antes retornava True, o que fazia o log exibir "ID: True").
@@ -446,7 +451,7 @@ class DatabaseManager:
                 # a captura de forma idempotente no reenvio.
                 cursor = conn.execute("""
                     SELECT id, json_blob, cpu_avg, mem_used_mb, pids_count,
-                           alert_score, custody, findings_summary
+                           alert_score, custody, findings_summary, lost_events
                     FROM snapshots
                     WHERE synced=0
                     ORDER BY id ASC LIMIT ?
@@ -463,7 +468,8 @@ class DatabaseManager:
                         'data': json.loads(r['json_blob']),
                         'metrics': {'cpu': r['cpu_avg'], 'mem': r['mem_used_mb'],
                                     'pids': r['pids_count'],
-                                    'score': r['alert_score']},
+                                    'score': r['alert_score'],
+                                    'lost': r['lost_events'] or 0},
                         'custody': _load(r['custody']),
                         'findings_summary': _load(r['findings_summary']),
                     })
@@ -536,7 +542,8 @@ class DatabaseManager:
                            a.clock_offset, a.clock_measured,
                            s.timestamp AS last_capture,
                            s.alert_score, s.is_alert, s.cpu_avg,
-                           s.mem_used_mb, s.pids_count, s.findings_summary
+                           s.mem_used_mb, s.pids_count, s.findings_summary,
+                           s.lost_events
                     FROM agents a
                     LEFT JOIN snapshots s ON s.id = (
                         SELECT id FROM snapshots
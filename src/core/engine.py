@@ -14,23 +14,106 @@
 # AUTHOR: Mario Luz (Sys-Inspector Project)
 # ==============================================================================
 
+import functools
 import os
 # import sys
 import time
+import ctypes as ct
 import socket
 import struct
 import traceback
 import threading
-from bcc import BPF
+
+# bcc so e necessario para carregar as sondas. Sem ele o motor ainda importa e
+# trata eventos gravados ou sinteticos (src/probes/replay.py), o que permite
+# medir o caminho dos eventos em qualquer maquina, sem root nem kernel.
+try:
+    from bcc import BPF
+except ImportError:
+    BPF = None
 
 # Internal Modules
 from src.utils.config_loader import load_config
 from src.probes.loader import load_probe_source
-from src.collectors.process_tree import ProcessTree, unsafe_path_in_cmdline
+from src.probes.batch import EventBatcher, DEFAULT_BATCH_BYTES, DEFAULT_BATCHES
+from src.probes.rate_limit import rate_limit_slots, RL_KINDS
+from src.probes.replay import RecordWriter
+from src.probes.attach import (choose_attach_mode, set_active_mode, MODE_CFLAGS,
+                               MODE_FENTRY, MODE_TRACEPOINT, MODE_KPROBE,
+                               IO_TRACEPOINTS, IO_FUNCTIONS, CONN_KPROBES)
+from src.probes.drop_flows import flow_record, add_flow, DEFAULT_TOP_FLOWS
+from src.probes.connections import (conn_record, add_connection, conn_label,
+                                    DEFAULT_TOP_CONNECTIONS)
+from src.probes.offcpu import (states_mask, DEFAULT_OFFCPU_STATES,
+                               DEFAULT_EDR_WAIT_MIN_MS)
+from src.probes.cache import ProbeCache, probe_identity, identity_key, DEFAULT_CACHE_DIR
+from src.core.bpf_maps import MapCollectorMixin
+from src.core.capture_health import CaptureHealth, choose_page_cnt, MIN_PAGE_CNT
+from src.core.overhead import (OverheadGovernor, LEVEL_NAMES, LEVEL_NO_IO_EVENTS,
+                               LEVEL_SAMPLED_OPENS, LEVEL_NO_VFS_PROBES,
+                               DEFAULT_CPU_BUDGET_PCT, DEFAULT_MEM_BUDGET_MB,
+                               DEFAULT_RECOVER_WINDOWS)
+from src.core.hash_cache import (ExeHashCache, DEFAULT_BACKGROUND_MB,
+                                 DEFAULT_MAX_ENTRIES as DEFAULT_HASH_ENTRIES)
+from src.collectors.process_tree import ProcessTree, unsafe_path_in_cmdline, DEFAULT_SCAN_WORKERS
+from src.collectors.enrichment import (EnrichmentPool, StaticFactsCache, enrich_node,
+                                       DEFAULT_WORKERS, DEFAULT_MAX_PENDING,
+                                       DEFAULT_CACHE_ENTRIES)
 # from src.collectors.system_inventory import collect_full_inventory
 
+# Indices do mapa agent_settings (espelham os #define de base_trace.c).
+SETTING_IO_EVENTS = 0
+SETTING_IO_PER_TID = 1
+SETTING_AGENT_PID = 2
+SETTING_OPEN_DEDUPE = 3
+SETTING_GENERATION = 4
+SETTING_OPEN_SAMPLE = 5
+SETTING_OFFCPU_STATES = 6
+
+# Tempo para uma sonda que leu a geracao antiga terminar de escrever nela,
+# antes de o motor ler e apagar essa geracao (modo continuo).
+ROTATE_GRACE_S = 0.05
+
+# Mapa open_deny_prefixes (espelha DENY_PREFIX_MAX/DENY_PREFIX_LEN).
+DENY_PREFIX_MAX = 8
+DENY_PREFIX_LEN = 32
+DEFAULT_OPEN_DENY_PREFIXES = ("/proc", "/sys", "/dev", "/run")
+
+# Ring buffer: kernel 5.8+ e um BCC que saiba consumi-lo.
+RINGBUF_MIN_KERNEL = (5, 8)
+
+# Operacoes em lote nos mapas (BPF_MAP_LOOKUP_AND_DELETE_BATCH etc.): 5.6+.
+BATCH_OPS_MIN_KERNEL = (5, 6)
+
+
+def _kernel_version(release=None):
+    """(major, minor) do kernel em execucao, ou (0, 0) se ilegivel."""
+    try:
+        release = release or os.uname().release
+        major, minor = release.split(".")[:2]
+        return int(major), int("".join(c for c in minor if c.isdigit()) or 0)
+    except Exception:
+        return (0, 0)
+
 
-class SysInspectorEngine:
+def choose_transport(requested="auto", release=None, bpf_cls=None):
+    """
+    Decide entre 'ringbuf' e 'perf'.
+
+    Pedir ring buffer explicitamente num kernel que nao o tem cai para perf com
+    aviso, em vez de deixar a compilacao falhar e o host sem coleta.
+    """
+    requested = (requested or "auto").lower()
+    if requested == "perf":
+        return "perf"
+    capaz = (_kernel_version(release) >= RINGBUF_MIN_KERNEL and
+             hasattr(bpf_cls or BPF, "ring_buffer_poll"))
+    if requested == "ringbuf" and not capaz:
+        print("[WARN] Ring buffer requested but unsupported here; using perf buffer.")
+    return "ringbuf" if capaz else "perf"
+
+
+class SysInspectorEngine(MapCollectorMixin):
     """
     The central controller for the Sys-Inspector agent.
     Manages the lifecycle of BPF probes and data collection loops.
@@ -51,7 +134,141 @@ class SysInspectorEngine:
         # O buffer de perf e aberto uma unica vez por processo; ver _poll_loop.
         self._perf_buffer_aberto = False
         self.bpf = None
-        self.clk_tck = os.sysconf(os.sysconf_names['SC_CLK_TCK'])
+
+        # I/O de disco e agregado no kernel (io_stats) e lido uma vez no stop().
+        # O evento por syscall so existe para depuracao: em host carregado ele
+        # ocupa um core do agente e transborda o buffer de perf.
+        engine_cfg = self.config.get('engine') or {}
+        self.io_events_debug = bool(engine_cfg.get('io_events_debug', False))
+        self.io_per_thread = bool(engine_cfg.get('io_per_thread', False))
+
+        # Transporte dos eventos: ring buffer compartilhado (5.8+) ou buffers
+        # de perf por CPU. A escolha final acontece no _init_bpf.
+        self.transport_requested = engine_cfg.get('transport', 'auto')
+        self.ringbuf_pages = int(engine_cfg.get('ringbuf_pages', 64))
+        self.transport = None
+
+        # Como openat, connect e I/O de disco sao anexados: fentry, tracepoint
+        # ou kprobe (src/probes/attach.py). Decidido em _init_bpf.
+        self.attach_requested = engine_cfg.get('attach_mode', 'auto')
+        self.attach_mode = None
+
+        # openat: prefixos descartados e deduplicacao (processo, caminho) feitos
+        # no kernel. O mesmo filtro segue no Python como rede de seguranca para
+        # prefixos que nao cabem no mapa.
+        self.open_deny_prefixes = tuple(
+            engine_cfg.get('open_deny_prefixes', DEFAULT_OPEN_DENY_PREFIXES) or ())
+        self.open_dedupe = bool(engine_cfg.get('open_dedupe', True))
+        self.open_seen_entries = int(engine_cfg.get('open_seen_entries', 16384))
+
+        # Eventos perdidos por janela e tamanho do buffer de perf, escolhido a
+        # partir da taxa das janelas anteriores dentro de um teto de memoria.
+        self.perf_buffer_max_mb = int(engine_cfg.get('perf_buffer_max_mb', 64))
+        self.page_cnt = MIN_PAGE_CNT
+        self.health = CaptureHealth(page_cnt=self.page_cnt)
+        self.capture_health = {}
+        self._window_events = 0
+        self._lost_reported = 0
+        self._window_started = None
+
+        # Orcamento de eventos por (processo, tipo), aplicado no kernel. O que
+        # passa do limite vira contagem em suppressed_events, nao evento.
+        self.rate_limit_enabled = bool(engine_cfg.get('rate_limit_enabled', True))
+        self.rate_limits = engine_cfg.get('rate_limits') or {}
+        self.rate_buckets = int(engine_cfg.get('rate_buckets', 16384))
+
+        # Descartes de pacote somados por fluxo no kernel (drop_flows); cada
+        # processo leva os drop_flows_top fluxos com mais descartes.
+        self.drop_flow_entries = int(engine_cfg.get('drop_flow_entries', 8192))
+        self.drop_flows_top = max(1, int(engine_cfg.get('drop_flows_top', DEFAULT_TOP_FLOWS)))
+        self._drop_reasons = None
+        # dev_t -> nome do disco, relido quando aparece um disco novo.
+        self._block_devices = None
+
+        # Tempo fora da CPU por pilha do kernel (offcpu_ns); o que cai em
+        # caminho de inspecao de seguranca sustenta o selo EDR-WAIT.
+        self.offcpu_states = engine_cfg.get('offcpu_states', DEFAULT_OFFCPU_STATES)
+        self.offcpu_stacks = int(engine_cfg.get('offcpu_stacks', 4096))
+        self.edr_wait_min_ms = float(engine_cfg.get('edr_wait_min_ms', DEFAULT_EDR_WAIT_MIN_MS))
+
+        # Conexoes de saida somadas por destino no kernel (conn_stats); cada
+        # processo leva os conn_top destinos mais usados.
+        self.conn_entries = int(engine_cfg.get('conn_entries', 16384))
+        self.conn_top = max(1, int(engine_cfg.get('conn_top', DEFAULT_TOP_CONNECTIONS)))
+
+        # Arvore mantida pelos eventos de fork/exec/exit; /proc so e varrido
+        # inteiro com a arvore vazia, e reconciliado (listagem + PIDs novos) a
+        # cada proc_reconcile_s segundos no modo continuo.
+        self.proc_reconcile_s = int(engine_cfg.get('proc_reconcile_s', 300))
+        self._last_reconcile = 0.0
+
+        # Gravador opcional dos registros brutos (engine.record_file, pelo
+        # worker de decodificacao) e registros que o tratador nao digeriu.
+        self.recorder = None
+        self.event_errors = 0
+
+        # Leitura de /proc e MD5 do binario para processos novos e execs, num
+        # pool proprio: a thread de leitura so enfileira o no. No fim da
+        # janela o stop() espera ate enrich_drain_s; o que nao terminou sai no
+        # laudo como "pending".
+        # O cache de fatos estaticos (MD5, fanotify) atravessa os ciclos: um
+        # daemon que nao mudou nao e reperfilado a cada captura.
+        self.tree.static_cache = StaticFactsCache(
+            int(engine_cfg.get('enrich_cache_entries', DEFAULT_CACHE_ENTRIES)))
+        # Hashes por identidade do arquivo; o daemon liga a persistencia no
+        # banco local (open_db). Binarios grandes sao hasheados em segundo plano.
+        self.tree.hash_cache = ExeHashCache(
+            max_entries=int(engine_cfg.get('hash_cache_entries', DEFAULT_HASH_ENTRIES)),
+            background_bytes=int(float(engine_cfg.get('hash_background_mb', DEFAULT_BACKGROUND_MB))
+                                 * 1024 * 1024))
+        self.enricher = EnrichmentPool(
+            workers=int(engine_cfg.get('enrich_workers', DEFAULT_WORKERS)),
+            max_pending=int(engine_cfg.get('enrich_max_pending', DEFAULT_MAX_PENDING)),
+            enrich=functools.partial(enrich_node, cache=self.tree.static_cache,
+                                     hashes=self.tree.hash_cache))
+        self.tree.enricher = self.enricher
+        self.tree.scan_workers = int(engine_cfg.get('scan_workers', DEFAULT_SCAN_WORKERS))
+        self.enrich_drain_s = float(engine_cfg.get('enrich_drain_s', 2.0))
+
+        # Custo das sondas (tempo BPF e CPU da thread de leitura) e RSS do
+        # agente medidos por janela; acima do orcamento as sondas descem de
+        # nivel, e o nivel ativo vai na captura. Ver src/core/overhead.py.
+        self.governor = OverheadGovernor(
+            cpu_budget_pct=float(engine_cfg.get('overhead_cpu_pct', DEFAULT_CPU_BUDGET_PCT)),
+            mem_budget_mb=float(engine_cfg.get('overhead_mem_mb', DEFAULT_MEM_BUDGET_MB)),
+            recover_windows=int(engine_cfg.get('overhead_recover_windows', DEFAULT_RECOVER_WINDOWS)),
+            enabled=bool(engine_cfg.get('overhead_governor', True)))
+        self.overhead_open_sample = max(2, int(engine_cfg.get('overhead_open_sample', 10)))
+
+        # Decodificacao em lotes fora da thread de leitura: o callback do BCC
+        # so copia bytes, e um worker desempacota e atualiza a arvore, na
+        # ordem de chegada. A CPU do worker entra no custo das sondas.
+        self.batcher = EventBatcher(
+            self._handle_decoded,
+            batch_bytes=int(engine_cfg.get('decode_batch_kb', DEFAULT_BATCH_BYTES // 1024)) * 1024,
+            batches=int(engine_cfg.get('decode_batches', DEFAULT_BATCHES)),
+            on_batch=self._record_batch,
+            cpu_clock=self.governor.decode_clock)
+        self._overhead_level = 0
+        self._vfs_attached = False
+
+        # Gravacao dos registros brutos para reproducao sem kernel
+        # (src/probes/replay.py). Vazio desliga.
+        self.record_file = engine_cfg.get('record_file') or ""
+
+        # Leitura e remocao em lote dos mapas de contadores; None = ainda nao
+        # decidido (depende do kernel e do BCC, ver _batch_ops_available).
+        self._batch_ops = None
+
+        # Geracao corrente dos mapas de contadores (0/1). So alterna em
+        # rotate(); fora do modo continuo fica em 0.
+        self.generation = 0
+
+        # Objeto compilado das sondas em disco, pela identidade do build
+        # (kernel, BTF/cabecalhos, fonte, flags, BCC): partida e CMD_RESTART
+        # sem clang quando nada disso mudou. Ver src/probes/cache.py.
+        self.probe_cache = ProbeCache(engine_cfg.get('probe_cache_dir', DEFAULT_CACHE_DIR))
+        self.probe_key = None
 
         # [v0.70] Threading Control
         self.running = False
@@ -62,26 +279,49 @@ class SysInspectorEngine:
         """Compiles and loads the eBPF programs into the Kernel."""
         if self.bpf: return  # Already initialized
 
-        print("[*] Compiling eBPF probes...")
+        if BPF is None:
+            print("[ERROR] Failed to load eBPF: bcc is not installed.")
+            return
+
         # [FIX] Pass filename string explicitly
         source_code = load_probe_source("base_trace.c")
 
-        try:
-            self.bpf = BPF(text=source_code)
-
-            # Attach Probes (Syscalls)
-            self.bpf.attach_kprobe(event=self.bpf.get_syscall_fnname("execve"), fn_name="syscall__execve")
-            self.bpf.attach_kprobe(event=self.bpf.get_syscall_fnname("openat"), fn_name="syscall__openat")
-
-            # Attach Probes (Network Connection Tracking)
-            self.bpf.attach_kprobe(event="tcp_v4_connect", fn_name="kprobe__tcp_v4_connect")
+        self.transport = choose_transport(self.transport_requested)
+        cflags = []
+        if self.transport == "ringbuf":
+            cflags += ["-DSI_RINGBUF", f"-DSI_RINGBUF_PAGES={self.ringbuf_pages}"]
+        cflags.append(f"-DSI_OPEN_SEEN_ENTRIES={self.open_seen_entries}")
+        cflags.append(f"-DSI_RATE_BUCKETS={self.rate_buckets}")
+        cflags.append(f"-DSI_DROP_FLOWS={self.drop_flow_entries}")
+        cflags.append(f"-DSI_CONN_ENTRIES={self.conn_entries}")
+        cflags.append(f"-DSI_OFFCPU_STACKS={self.offcpu_stacks}")
+        self.attach_mode = choose_attach_mode(self.attach_requested, _kernel_version(),
+                                              bpf_cls=BPF)
+        cflags += MODE_CFLAGS[self.attach_mode]
+        print(f"[*] Event transport: {self.transport}")
+        print(f"[*] Probe attach mode: {self.attach_mode}")
+        self.health.transport = self.transport
+        self.health.attach_mode = self.attach_mode
+
+        # O modulo do cache usa o bcc, presente daqui em diante.
+        from src.probes import cached_bpf
+        identity = probe_identity(source_code, cflags, bcc_version=cached_bpf.BCC_VERSION)
+        self.probe_key = identity_key(identity)
 
-            # Attach Probes (Disk I/O Latency)
-            self.bpf.attach_kprobe(event="vfs_read", fn_name="kprobe__vfs_read")
-            self.bpf.attach_kretprobe(event="vfs_read", fn_name="kretprobe__vfs_read")
+        try:
+            self.bpf = self._load_cached_probes(cached_bpf)
+            if self.bpf is not None:
+                try:
+                    self._attach_probes()
+                except Exception as e:
+                    print(f"[WARN] Cached eBPF object failed to attach ({e}); compiling from source.")
+                    self._drop_cached_probes()
 
-            self.bpf.attach_kprobe(event="vfs_write", fn_name="kprobe__vfs_write")
-            self.bpf.attach_kretprobe(event="vfs_write", fn_name="kretprobe__vfs_write")
+            if self.bpf is None:
+                print("[*] Compiling eBPF probes...")
+                self.bpf = BPF(text=source_code, cflags=cflags)
+                self._attach_probes()
+                self._store_probe_object(cached_bpf, identity)
 
             print("[+] eBPF Probes attached successfully.")
         except Exception as e:
@@ -89,22 +329,211 @@ class SysInspectorEngine:
             traceback.print_exc()
             # Don't exit here, allow Manager to handle it
 
-    def _get_cpu_ticks(self, pid):
+    def _load_cached_probes(self, cached_bpf):
+        """
+        Sondas a partir do objeto em cache desta identidade, sem compilar; None
+        quando nao ha objeto ou o kernel o recusou (a entrada e descartada).
+        """
+        entry = self.probe_cache.lookup(self.probe_key)
+        if entry is None: return None
         try:
-            with open(f"/proc/{pid}/stat", "r") as f:
-                parts = f.read().split()
-                return int(parts[13]) + int(parts[14])
-        except: return 0
-
-    def _update_cpu_stats(self, duration):
-        """Calculates CPU usage percentage for all nodes."""
-        for pid, node in self.tree.nodes.items():
-            end_ticks = self._get_cpu_ticks(pid)
-            if end_ticks > 0 and node.cpu_start_ticks > 0:
-                delta = end_ticks - node.cpu_start_ticks
-                try:
-                    node.cpu_usage_pct = (delta / float(self.clk_tck)) / duration * 100.0
-                except: pass
+            bpf = cached_bpf.CachedBPF(entry)
+        except Exception as e:
+            print(f"[WARN] Cached eBPF object rejected ({e}); compiling from source.")
+            self.probe_cache.discard(self.probe_key)
+            return None
+        print(f"[*] eBPF probes loaded from cache ({self.probe_key[:12]}).")
+        return bpf
+
+    def _drop_cached_probes(self):
+        """Desfaz uma carga do cache que falhou depois de criada."""
+        try:
+            self.bpf.cleanup()
+        except Exception:
+            pass
+        self.bpf = None
+        self._vfs_attached = False
+        self.probe_cache.discard(self.probe_key)
+
+    def _store_probe_object(self, cached_bpf, identity):
+        """Guarda o objeto recem-compilado para a proxima partida."""
+        if not self.probe_cache.cache_dir: return
+        try:
+            obj = cached_bpf.object_from_module(self.bpf.module)
+        except Exception as e:
+            print(f"[WARN] eBPF object not cached: {e}")
+            return
+        if self.probe_cache.store(self.probe_key, identity, obj):
+            print(f"[*] eBPF object cached ({self.probe_key[:12]}).")
+
+    def _attach_probes(self):
+        """Ajustes do agent_settings e as anexacoes que o BCC nao faz na carga."""
+        self._apply_settings()
+
+        # Attach Probes
+        # Tracepoints e kfuncs (fork/exec/exit sempre; openat, connect e
+        # I/O nos modos tracepoint e fentry) o BCC anexa na carga. So o
+        # modo kprobe precisa anexar aqui, alem das kprobes de conexao
+        # que cada modo tem (envio UDP, IPv6).
+        if self.attach_mode == MODE_KPROBE:
+            self.bpf.attach_kprobe(event=self.bpf.get_syscall_fnname("openat"), fn_name="syscall__openat")
+            self._attach_vfs()
+        else:
+            self._vfs_attached = True
+        self._attach_conn_probes()
+        set_active_mode(self.attach_mode)
+
+    def _apply_settings(self):
+        """Writes the runtime flags into the agent_settings BPF map."""
+        settings = self.bpf["agent_settings"]
+        settings[ct.c_int(SETTING_AGENT_PID)] = ct.c_ulonglong(os.getpid())
+        level = self._overhead_level
+        settings[ct.c_int(SETTING_IO_EVENTS)] = ct.c_ulonglong(
+            int(self.io_events_debug and level < LEVEL_NO_IO_EVENTS))
+        settings[ct.c_int(SETTING_OPEN_SAMPLE)] = ct.c_ulonglong(
+            self.overhead_open_sample if level >= LEVEL_SAMPLED_OPENS else 0)
+        settings[ct.c_int(SETTING_IO_PER_TID)] = ct.c_ulonglong(int(self.io_per_thread))
+        settings[ct.c_int(SETTING_OPEN_DEDUPE)] = ct.c_ulonglong(int(self.open_dedupe))
+        settings[ct.c_int(SETTING_GENERATION)] = ct.c_ulonglong(self.generation)
+        settings[ct.c_int(SETTING_OFFCPU_STATES)] = ct.c_ulonglong(states_mask(self.offcpu_states))
+        self._apply_open_filter()
+        self._apply_rate_limits()
+
+    def _attach_conn_probes(self):
+        """
+        Anexa as kprobes de conexao do modo em uso (attach.CONN_KPROBES).
+
+        Funcao que o kernel nao tem (IPv6 desligado, simbolo inline) so deixa
+        aquele caminho sem contagem: as demais seguem.
+        """
+        for evento, fn_name in CONN_KPROBES[self.attach_mode]:
+            try:
+                self.bpf.attach_kprobe(event=evento, fn_name=fn_name)
+            except Exception as e:
+                print(f"[WARN] Could not attach {evento} probe: {e}")
+
+    def _attach_vfs(self):
+        """Anexa as sondas de I/O de disco (entrada e retorno) no modo em uso."""
+        if self._vfs_attached: return
+        if self.attach_mode == MODE_TRACEPOINT:
+            for tp in IO_TRACEPOINTS:
+                self.bpf.attach_tracepoint(tp=tp, fn_name="tracepoint__" + tp.replace(":", "__"))
+        elif self.attach_mode == MODE_FENTRY:
+            # Kernels anteriores ao 5.10 nao reanexam um programa fentry ja
+            # desanexado: o I/O fica desligado ate o agente reiniciar.
+            try:
+                for nome in self._io_kfuncs():
+                    if nome.startswith("kretfunc__"):
+                        self.bpf.attach_kretfunc(fn_name=nome)
+                    else:
+                        self.bpf.attach_kfunc(fn_name=nome)
+            except Exception as e:
+                print(f"[WARN] Could not re-attach fentry I/O probes: {e}")
+                return
+        else:
+            for fn in IO_FUNCTIONS:
+                self.bpf.attach_kprobe(event=fn, fn_name=f"trace_{fn}_entry")
+                self.bpf.attach_kretprobe(event=fn, fn_name=f"trace_{fn}_return")
+        self._vfs_attached = True
+
+    def _detach_vfs(self):
+        """
+        Desanexa as sondas de I/O de disco, as mais frequentes do agente (toda
+        leitura e escrita do host). A entrada sai junto com o retorno: sozinha
+        ela encheria io_start com timestamps que ninguem consome.
+        """
+        if not self._vfs_attached: return
+        if self.attach_mode == MODE_TRACEPOINT:
+            alvos = [(tp, lambda tp=tp: self.bpf.detach_tracepoint(tp)) for tp in IO_TRACEPOINTS]
+        elif self.attach_mode == MODE_FENTRY:
+            alvos = [(nome, lambda nome=nome: (self.bpf.detach_kretfunc if nome.startswith("kretfunc__")
+                                               else self.bpf.detach_kfunc)(fn_name=nome))
+                     for nome in self._io_kfuncs()]
+        else:
+            alvos = []
+            for fn in IO_FUNCTIONS:
+                alvos.append((fn, lambda fn=fn: self.bpf.detach_kretprobe(event=fn)))
+                alvos.append((fn, lambda fn=fn: self.bpf.detach_kprobe(event=fn)))
+        for nome, desanexa in alvos:
+            try:
+                desanexa()
+            except Exception as e:
+                print(f"[WARN] Could not detach {nome} probes: {e}")
+        self._vfs_attached = False
+
+    def _io_kfuncs(self):
+        """Nomes dos programas fentry/fexit de I/O (o BCC os prefixa com kfunc__[vmlinux__])."""
+        sufixos = tuple("__" + fn for fn in IO_FUNCTIONS)
+        nomes = []
+        for nome in self.bpf.funcs:
+            nome = nome.decode() if isinstance(nome, bytes) else nome
+            if nome.startswith(("kfunc__", "kretfunc__")) and nome.endswith(sufixos):
+                nomes.append(nome)
+        return nomes
+
+    def _bpf_prog_fds(self):
+        """Descritores dos programas carregados, para o run_time_ns do governador."""
+        if not self.bpf: return []
+        try:
+            return [f.fd for f in self.bpf.funcs.values()]
+        except Exception:
+            return []
+
+    def _govern(self):
+        """
+        Fecha a medicao de custo da janela em capture_health['overhead'] e
+        aplica o nivel que o governador escolheu para a seguinte.
+        """
+        self.capture_health["overhead"] = self.governor.close(self._bpf_prog_fds())
+        novo = self.governor.level
+        if novo == self._overhead_level: return
+        print(f"[WARN] Probe overhead {self.capture_health['overhead']['cpu_pct']}% CPU, "
+              f"{self.capture_health['overhead']['rss_mb']} MB: probe level "
+              f"{LEVEL_NAMES[self._overhead_level]} -> {LEVEL_NAMES[novo]}.")
+        self._overhead_level = novo
+        if not self.bpf: return
+        self._apply_settings()
+        if novo >= LEVEL_NO_VFS_PROBES:
+            self._detach_vfs()
+        else:
+            try:
+                self._attach_vfs()
+            except Exception as e:
+                print(f"[WARN] Could not reattach vfs probes: {e}")
+
+    def _apply_open_filter(self):
+        """
+        Pushes the deny prefixes into the open_deny_prefixes BPF map.
+
+        Prefixo longo demais ou alem das vagas do mapa fica so no filtro do
+        Python: o evento ainda chega, mas e descartado como antes.
+        """
+        table = self.bpf["open_deny_prefixes"]
+        slot = 0
+        for prefix in self.open_deny_prefixes:
+            raw = prefix.encode('utf-8')
+            if not raw: continue
+            if len(raw) > DENY_PREFIX_LEN or slot >= DENY_PREFIX_MAX:
+                print(f"[WARN] Open filter: '{prefix}' filtered in user space only.")
+                continue
+            leaf = table.Leaf()
+            leaf.len = len(raw)
+            leaf.prefix = raw
+            table[ct.c_int(slot)] = leaf
+            slot += 1
+
+        for idx in range(slot, DENY_PREFIX_MAX):
+            table[ct.c_int(idx)] = table.Leaf()
+
+    def _apply_rate_limits(self):
+        """Pushes rate and burst per event kind into the rate_limits BPF map."""
+        table = self.bpf["rate_limits"]
+        slots = rate_limit_slots(self.rate_limits, self.rate_limit_enabled)
+        for idx in range(RL_KINDS):
+            leaf = table.Leaf()
+            if idx < len(slots):
+                leaf.rate, leaf.burst = slots[idx]
+            table[ct.c_int(idx)] = leaf
 
     def _check_heuristics(self, node):
         """Applies static anomaly detection rules."""
@@ -125,47 +554,108 @@ class SysInspectorEngine:
 
         node.anomaly_score += score
 
-    def _handle_bpf_event(self, cpu, data, size):
-        """Callback for eBPF perf buffer events (User Space processing)."""
-        event = self.bpf["events"].event(data)
+    # Os dois callbacks rodam na thread de leitura e so copiam o registro para
+    # o lote corrente; o tratamento acontece no worker (_handle_decoded).
+    def _handle_perf_event(self, cpu, data, size):
+        """Callback for the per-CPU perf buffer."""
+        self._window_events += 1
+        self.batcher.add(data, size)
+
+    def _handle_ringbuf_event(self, ctx, data, size):
+        """Callback for the shared ring buffer."""
+        self._window_events += 1
+        self.batcher.add(data, size)
+
+    @staticmethod
+    def _wall_clock(ktime_ns):
+        """Converte bpf_ktime_get_ns (CLOCK_MONOTONIC) para epoch."""
+        if not ktime_ns: return time.time()
+        return ktime_ns / 1e9 + (time.time() - time.monotonic())
+
+    def _handle_lost(self, lost):
+        """Lost-sample callback of the perf buffer (count since last call)."""
+        self._lost_reported += lost
+
+    def _record_batch(self, view, sizes):
+        """Grava os registros brutos de um lote, no worker de decodificacao."""
+        if self.recorder is None: return
+        try:
+            self.recorder.write_batch(view, sizes)
+        except Exception:
+            self.recorder = None  # disco cheio etc.: para de gravar
+
+    def _handle_decoded(self, event):
+        """Processes one decoded record, in the decode worker."""
+        try:
+            self._handle_record(event)
+        except Exception:
+            # Um registro que o tratador nao digere nao pode derrubar o worker.
+            self.event_errors += 1
+
+    def _handle_record(self, event):
+        """Processes one decoded record from the kernel (User Space processing)."""
         pid = event.pid
+        ev_type = event.type_id
+
+        # Ciclo de vida: nao passam por add_or_update, que leria /proc de um
+        # filho que ainda e copia do pai ou de um processo que ja saiu.
+        if ev_type == 'F':
+            self.tree.fork(pid, event.ppid, event.comm, event.uid, event.prio,
+                           event.loginuid, ts=time.time())
+            return
+        if ev_type == 'X':
+            self.tree.mark_exit(pid, self._wall_clock(event.exit_ns), event.exit_code)
+            return
 
         # Pass loginuid to process tree
         node = self.tree.add_or_update(
             pid,
             event.ppid,
-            event.comm.decode('utf-8', 'replace'),
+            event.comm,
             event.uid,
             event.prio,
-            event.loginuid
+            event.loginuid,
+            deferred=True
         )
 
         if node is None: return
 
         node.rss = max(node.rss, event.mem_peak_rss)
 
-        ev_type = event.type_id.decode('utf-8', 'replace')
-        filename = event.filename.decode('utf-8', 'replace')
+        filename = event.filename
 
         if ev_type == 'E':  # Execve
             node.cmd = filename
             node.is_new = True
-            node.update_static_info()
+            # Nova imagem: binario, maps e fds mudaram. As heuristicas daqui
+            # so olham a linha de comando e nao esperam o pool. O PID e o
+            # starttime continuam os mesmos: o cache de fatos e descartado.
+            self.tree.static_cache.forget(node.pid)
+            self.tree.enrich(node, deferred=True)
             self._check_heuristics(node)
 
         elif ev_type == 'O':  # OpenAt
-            if not filename.startswith(("/proc", "/sys", "/dev", "/run")):
+            # O kernel ja descartou os prefixos e as repeticoes; o filtro aqui
+            # cobre os prefixos que ficaram fora do mapa.
+            if not filename.startswith(self.open_deny_prefixes):
                 node.open_files.add(filename)
 
         elif ev_type == 'N':  # Network Connect
+            # A sonda agrega as conexoes em conn_stats; registros 'N' so vem
+            # de gravacoes antigas (TCP IPv4), e entram na mesma tabela.
             try:
-                dst = socket.inet_ntop(socket.AF_INET, struct.pack("I", event.daddr))
-                port = socket.ntohs(event.dport)
-                conn_str = f"IPv4 -> {dst}:{port}"
-                if conn_str not in node.connections:  # Avoid duplicates
-                    node.connections.append(conn_str)  # v0.70 uses List for JSON compat
-            except: pass
+                agora = time.time()
+                conn = conn_record(socket.AF_INET, struct.pack("I", event.daddr),
+                                   event.dport, socket.IPPROTO_TCP,
+                                   first_seen=agora, last_seen=agora)
+                if add_connection(node.connection_table, conn, self.conn_top):
+                    node.connections.add(conn_label(conn))
+                else:
+                    node.connections_omitted += 1
+            except Exception: pass
 
+        # 'R'/'W' so chegam com engine.io_events_debug ligado; no modo normal
+        # os mesmos totais vem de io_stats em _collect_io_counters.
         elif ev_type == 'R':  # Read
             node.read_bytes_delta += event.io_bytes
             if event.io_latency_ns > 0:
@@ -179,18 +669,14 @@ class SysInspectorEngine:
                 node.io_ops_count += 1
 
         elif ev_type == 'D':  # Packet Drop
+            # A sonda agrega os descartes em drop_flows; registros 'D' so vem
+            # de gravacoes antigas, e entram na mesma lista limitada.
             try:
-                src = socket.inet_ntop(socket.AF_INET, struct.pack("I", event.saddr))
-                dst = socket.inet_ntop(socket.AF_INET, struct.pack("I", event.daddr))
-                proto_map = {6: "TCP", 17: "UDP", 1: "ICMP"}
-                proto_name = proto_map.get(event.proto, f"IP({event.proto})")
-                sport = socket.ntohs(event.sport)
-                dport = socket.ntohs(event.dport)
-
-                drop_msg = f"DROP: {src}:{sport} -> {dst}:{dport} ({proto_name})"
-
-                if hasattr(node, 'network_drops_details'):
-                    node.network_drops_details.append(drop_msg)
+                agora = time.time()
+                flow = flow_record(event, nbytes=event.net_len,
+                                   first_seen=agora, last_seen=agora)
+                if not add_flow(node.drop_flows, flow, self.drop_flows_top):
+                    node.drop_flows_omitted += 1
 
                 node.tcp_drops += 1
                 node.anomaly_score += 5
@@ -198,29 +684,104 @@ class SysInspectorEngine:
 
             except Exception: pass
 
-    def _collect_network_counters(self):
-        """Reads BPF Maps for high-volume metrics."""
-        if not self.bpf: return
-
-        def get_map_val(bpf_map):
-            for k, v in bpf_map.items():
-                pid = k.value
-                val = v.value
-                node = self.tree.get(pid)
-                if node: yield node, val
-
-        for node, val in get_map_val(self.bpf["net_bytes_sent"]): node.net_tx_bytes = val
-        for node, val in get_map_val(self.bpf["net_bytes_recv"]): node.net_rx_bytes = val
-        for node, val in get_map_val(self.bpf["tcp_retrans_map"]):
-            node.tcp_retrans = val
-            if val > 0:
-                node.anomaly_score += 2
-                if "NET ERR" not in node.context_tags: node.context_tags.append("NET ERR")
-        for node, val in get_map_val(self.bpf["tcp_drop_map"]):
-            node.tcp_drops = max(node.tcp_drops, val)
-            if val > 0:
-                node.anomaly_score += 5
-                if "NET ERR" not in node.context_tags: node.context_tags.append("NET ERR")
+    def _open_recorder(self):
+        """Abre o arquivo de gravacao (engine.record_file), uma vez por processo."""
+        if not self.record_file or self.recorder is not None: return
+        try:
+            self.recorder = RecordWriter(self.record_file)
+            print(f"[*] Recording raw events to {self.record_file}")
+        except OSError as e:
+            print(f"[WARN] Could not open record file {self.record_file}: {e}")
+
+    def _drain_enrichment(self):
+        """
+        Da ao pool de enriquecimento ate enrich_drain_s para terminar a fila.
+
+        O que sobrar fica "pending" no no e e contado na saude da captura: o
+        laudo mostra que aquele contexto estatico nao foi lido, em vez de
+        parecer que nao havia nada a ler.
+        """
+        restantes = self.enricher.drain(self.enrich_drain_s)
+        self.capture_health["enrichment_pending"] = restantes
+        if restantes:
+            print(f"[WARN] {restantes} processes still waiting for enrichment at window close.")
+
+    def _close_capture_health(self, gen=0):
+        """
+        Fecha a contabilidade da janela em self.capture_health.
+
+        Le as recusas de envio por CPU (submit_lost) e soma ao que o callback
+        de perda do BCC informou; os controladores gravam o resultado na
+        captura e na coluna quente lost_events.
+        """
+        per_cpu = {}
+        if self.bpf:
+            try:
+                table = self.bpf["submit_lost"]
+                valores = table[ct.c_int(gen)]
+                per_cpu = {cpu: int(n) for cpu, n in enumerate(valores) if n}
+                del table[ct.c_int(gen)]  # Array: zera o slot da geracao
+            except Exception as e:
+                print(f"[WARN] Could not read submit_lost: {e}")
+
+        agora = time.time()
+        segundos = agora - (self._window_started or agora)
+        self.capture_health = self.health.close_window(
+            self._window_events, per_cpu, self._lost_reported, segundos)
+        self._window_events = 0
+        self._lost_reported = 0
+        self._window_started = agora
+
+        if self.capture_health["lost_events"]:
+            print(f"[WARN] Capture incomplete: {self.capture_health['lost_events']} "
+                  f"events lost (page_cnt={self.page_cnt}).")
+
+    def _resize_perf_buffer(self):
+        """
+        Ajusta page_cnt do buffer de perf entre janelas.
+
+        Cresce quando a taxa recente pede ou quando houve perda; so encolhe
+        com folga de 4x, para nao reabrir o buffer a cada janela. A reabertura
+        fecha os leitores de cada CPU antes, ou os descritores vazariam como
+        no defeito descrito em _poll_loop. O ring buffer tem tamanho fixado na
+        compilacao e fica fora daqui.
+        """
+        if self.transport != "perf" or not self.bpf: return
+
+        desejado = choose_page_cnt(self.health.peak_rate(),
+                                   self.health.last.get("lost_events", 0),
+                                   os.cpu_count() or 1, self.perf_buffer_max_mb,
+                                   current=self.page_cnt)
+        if desejado == self.page_cnt: return
+        if self.page_cnt > desejado > self.page_cnt // 4: return
+
+        if self._perf_buffer_aberto:
+            table = self.bpf["events"]
+            try:
+                # Uma chave por CPU possivel; del de uma CPU sem leitor aberto
+                # nao faz nada. BCC sem keys() no array: os indices, direto.
+                try:
+                    cpus = [k.value for k in table.keys()]
+                except AttributeError:
+                    cpus = range(len(table))
+                for cpu in cpus:
+                    del table[cpu]
+            except Exception as e:
+                print(f"[WARN] Could not resize perf buffer: {e}")
+                return
+            self._perf_buffer_aberto = False
+
+        print(f"[*] Perf buffer: {self.page_cnt} -> {desejado} pages per CPU.")
+        self.page_cnt = desejado
+        self.health.page_cnt = desejado
+
+    def _batch_ops_available(self, table):
+        """Kernel e BCC com operacoes em lote nos mapas (decidido uma vez)."""
+        if self._batch_ops is None:
+            self._batch_ops = (_kernel_version() >= BATCH_OPS_MIN_KERNEL and
+                               hasattr(table, "items_lookup_and_delete_batch") and
+                               hasattr(table, "items_delete_batch"))
+        return self._batch_ops
 
     # --------------------------------------------------------------------------
     # [v0.70] NEW THREADING MODEL (Non-Blocking)
@@ -248,19 +809,38 @@ class SysInspectorEngine:
             #
             # O objeto BPF sobrevive entre ciclos (_init_bpf tem guarda), entao o
             # buffer continua valido e uma unica abertura basta.
+            #
+            # Vale igual para o ring buffer: um unico buffer, aberto uma vez.
+            # A unica reabertura e a de _resize_perf_buffer, que fecha antes os
+            # leitores de cada CPU e so entao baixa a flag.
             if not self._perf_buffer_aberto:
-                self.bpf["events"].open_perf_buffer(self._handle_bpf_event)
+                if self.transport == "ringbuf":
+                    self.bpf["events"].open_ring_buffer(self._handle_ringbuf_event)
+                else:
+                    self.bpf["events"].open_perf_buffer(self._handle_perf_event,
+                                                        page_cnt=self.page_cnt,
+                                                        lost_cb=self._handle_lost)
                 self._perf_buffer_aberto = True
 
+            poll = (self.bpf.ring_buffer_poll if self.transport == "ringbuf"
+                    else self.bpf.perf_buffer_poll)
+            relogio = self.governor.poll_clock
+            relogio.thread_started()
             while self.running:
                 # Poll with short timeout to check 'self.running'
-                self.bpf.perf_buffer_poll(timeout=200)
+                poll(timeout=200)
+                self.batcher.flush()
+                # CPU desta thread (copia dos eventos para o lote): e o que o
+                # governador cobra das sondas, junto com a do worker de
+                # decodificacao e o run_time_ns delas.
+                relogio.tick()
 
         except KeyboardInterrupt:
             pass
         except Exception as e:
             print(f"[ERROR] BPF Poll Loop Error: {e}")
         finally:
+            self.batcher.flush()
             print("[DEBUG] BPF Polling Thread Stopped.")
 
     def start(self):
@@ -269,22 +849,45 @@ class SysInspectorEngine:
             if self.running: return
 
             # 1. Init Static Data
-            self.tree.scan_proc_fs()
-            for pid, node in self.tree.nodes.items():
-                node.cpu_start_ticks = self._get_cpu_ticks(pid)
+            # Arvore vazia (partida, reset entre capturas): varredura completa.
+            # Senao so a diferenca: as sondas ficaram sem leitura desde o stop.
+            if self.tree.nodes:
+                self.tree.reconcile()
+            else:
+                self.tree.scan_proc_fs()
+            self._last_reconcile = time.time()
 
             # 2. Load Probes
             self._init_bpf()
+            self._reset_io_counters()
+            self._reset_network_counters()
+            self._reset_block_latency()
+            self._reset_offcpu()
+            self._reset_cpu_counters()
+            self._reset_open_seen()
+            self._reset_suppressed()
+            self._resize_perf_buffer()
+            self._reset_lost_counters()
+            self.governor.begin(self._bpf_prog_fds())
 
             # 3. Start Thread
             print("[*] Starting BPF Engine (Threaded)...")
             self.running = True
+            self._open_recorder()
+            self.batcher.start()
+            self.enricher.start()
             self.poll_thread = threading.Thread(target=self._poll_loop)
             self.poll_thread.daemon = True
             self.poll_thread.start()
 
-    def stop(self):
-        """Stops the engine and aggregates stats."""
+    def stop(self, duration=None):
+        """
+        Stops the engine and aggregates stats.
+
+        PARAMETER duration: duracao real da janela em segundos, medida por quem
+                            a conduziu. Sem ela vale a medida pelo proprio motor
+                            entre start() e stop().
+        """
         with self.lock:
             if not self.running: return
 
@@ -293,15 +896,97 @@ class SysInspectorEngine:
 
             if self.poll_thread:
                 self.poll_thread.join(timeout=2.0)
+            self.batcher.drain()
+            if self.recorder is not None:
+                self.recorder.flush()
+            self._close_capture_health(self.generation)
+            self._govern()
+            self._drain_enrichment()
+            # Daqui em diante nenhum worker escreve nos nos desta janela.
+            self.tree.close_window()
+            # last_used dos hashes achados em memoria nesta janela, em lote.
+            self.tree.hash_cache.flush()
 
             # Finalize
-            # We assume duration=1 just to trigger the math;
-            # Manager might pass actual duration if we changed signature,
-            # but usually manager calls this at end of interval.
-            self._update_cpu_stats(duration=30)  # Default/Approx
-            self._collect_network_counters()
+            segundos = duration or self.capture_health.get("window_seconds") or 1
+            self._collect_cpu_counters(segundos, gen=self.generation)
+            self._collect_io_counters(gen=self.generation)
+            self._collect_block_latency(gen=self.generation)
+            self._collect_offcpu(gen=self.generation)
+            self._collect_network_counters(gen=self.generation)
+            self._collect_suppressed(gen=self.generation)
             self.tree.aggregate_stats()
 
+    def rotate(self):
+        """
+        Corta a janela sem parar as sondas nem a thread de leitura (modo continuo).
+
+        Troca a geracao dos mapas numa unica escrita, separa a arvore da janela
+        encerrada e le os contadores dela enquanto o kernel ja conta na outra
+        geracao. Nao ha intervalo cego entre janelas, e o custo por ciclo de
+        subir a thread e varrer /proc desaparece.
+
+        Os eventos ainda no buffer no instante da troca sao lidos depois dela e
+        caem na janela nova; e a mesma fronteira difusa de qualquer corte feito
+        com o sistema em movimento.
+
+        Retorna a arvore da janela encerrada, ja agregada, ou None se o motor
+        nao estiver rodando. O resumo da janela fica em self.capture_health.
+        """
+        with self.lock:
+            if not self.running or not self.bpf: return None
+
+            fechada = self.generation
+            self.generation ^= 1
+            self.bpf["agent_settings"][ct.c_int(SETTING_GENERATION)] = \
+                ct.c_ulonglong(self.generation)
+            # Os lotes ja entregues sao da janela que fecha: tratados antes
+            # de a arvore girar. So eles: o que a leitura copia durante a
+            # espera fica para a janela nova (ver DRAIN em batch.py).
+            self.batcher.drain()
+            tree = self.tree.rotate()
+            time.sleep(ROTATE_GRACE_S)
+
+            self._close_capture_health(fechada)
+            self._govern()
+            # Sem espera aqui: a rotacao da arvore fechou a janela (o pool nao
+            # escreve mais nos nos dela) e redirecionou os pedidos ainda na
+            # fila para as copias vivas.
+            self.capture_health["enrichment_pending"] = self.enricher.pending()
+            segundos = self.capture_health.get("window_seconds") or 1
+
+            self._collect_cpu_counters(segundos, tree, fechada)
+
+            # Reconciliacao periodica com /proc: o que os eventos de fork nao
+            # trouxeram entra aqui.
+            if time.time() - self._last_reconcile >= self.proc_reconcile_s:
+                self.tree.reconcile()
+                self._last_reconcile = time.time()
+
+            self._collect_io_counters(tree, fechada)
+            self._collect_block_latency(tree, fechada)
+            self._collect_offcpu(tree, fechada)
+            self._collect_network_counters(tree, fechada)
+            self._collect_suppressed(tree, fechada)
+            self._drain_generation(self.bpf["open_seen"], fechada)
+            tree.aggregate_stats()
+            return tree
+
+    def replay(self, source):
+        """
+        Trata um fluxo gravado ou sintetico (replay.ReplaySource) sem kernel.
+
+        Os registros entram pelo callback do perf buffer e seguem o caminho de
+        uma captura real (lote, worker, _handle_record, arvore); so as sondas e
+        os mapas ficam de fora. Retorna quantos registros foram entregues, ja
+        todos tratados.
+        """
+        self.batcher.start()
+        self.enricher.start()
+        n = source.feed(self._handle_perf_event, self.batcher.flush)
+        self.batcher.drain()
+        return n
+
     # --- Legacy Wrappers (Kept for compatibility) ---
     def run_snapshot(self, duration=30, output_file=None):
         """Blocking wrapper for old behavior."""
@@ -342,6 +342,21 @@ def events_from_capture(payload, agent_uuid, capture_id=None, clock_offset=0.0):
             severity=(risk_level(proc.get("anomaly_score")) or ""),
             clock_offset=clock_offset, capture_id=capture_id))
 
+        # O fim tem instante proprio quando o kernel informou a saida
+        # (sched_process_exit). Processo que so sumiu de /proc nao gera
+        # evento: a hora seria a da leitura, nao a do fim.
+        fim = proc.get("end_time") or 0
+        if fim:
+            status = proc.get("exit_code")
+            eventos.append(make_event(
+                fim, EV_PROCESS_END, agent_uuid,
+                subject=(proc.get("cmd") or "")[:300],
+                detail={"pid": proc.get("pid"), "ppid": proc.get("ppid"),
+                        "exit_status": (status >> 8) & 0xff if status is not None else None,
+                        "signal": status & 0x7f if status is not None else None,
+                        "lifetime_s": round(fim - inicio, 3)},
+                clock_offset=clock_offset, capture_id=capture_id))
+
         for conexao in (proc.get("connections") or [])[:10]:
             eventos.append(make_event(
                 inicio, EV_CONNECTION, agent_uuid, subject=str(conexao),
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/core/hash_cache.py
+# DESCRIPTION: Cache persistente de hashes de executaveis, pela identidade do
+#              arquivo.
+#
+# WHY:         calculate_md5 relia o executavel inteiro, em blocos de 4 KB,
+#              para cada no: duzentos bash, sshd ou java sao o mesmo binario
+#              hasheado duzentas vezes por ciclo, e de novo a cada partida do
+#              agente. O hash agora e guardado pela identidade do arquivo
+#              (st_dev, st_ino, tamanho, mtime_ns, ctime_ns): enquanto ela nao
+#              muda o conteudo tambem nao mudou, e qualquer escrita, chmod ou
+#              substituicao do binario muda o ctime e forca a releitura.
+#
+# HOW:         Uma leitura calcula MD5 e SHA-256 juntos, com buffer de 1 MB.
+#              Acima de background_bytes o arquivo vai para uma fila com uma
+#              thread propria e o no sai com HASH_PENDING; quando o hash fica
+#              pronto, quem pediu e avisado e o proximo ciclo ja o encontra.
+#              Na frente do banco fica um dicionario em memoria (LRU), para o
+#              mesmo binario nao custar uma consulta SQLite por processo.
+#
+# WHERE:       Tabela exe_hashes no banco local do agente, ao lado do registro
+#              de comandos (ExecutionLedger). Sem banco (db_path None, ou banco
+#              inacessivel) o cache vive so em memoria. Limitado a max_entries
+#              linhas: sai quem foi usado ha mais tempo. O uso (last_used) e
+#              anotado em memoria a cada acerto e gravado em lote, a cada
+#              TOUCH_BATCH chaves ou TOUCH_FLUSH_S segundos, antes de cada
+#              remocao e em flush(): sem isso o binario mais usado, sempre
+#              achado na memoria, parecia o mais velho no banco.
+#
+# NOTES:       Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import hashlib
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+
+LOG = logging.getLogger("HashCache")
+
+HASH_PENDING = "Hashing (queued)"
+HASH_DENIED = "ACCESS_DENIED"
+
+DEFAULT_MAX_ENTRIES = 20000
+DEFAULT_BACKGROUND_MB = 64
+
+CHUNK = 1024 * 1024
+
+# Gravacao em lote de last_used dos acertos (ver WHERE).
+TOUCH_BATCH = 256
+TOUCH_FLUSH_S = 60.0
+
+
+def file_key(st):
+    """Identidade do arquivo: muda com qualquer alteracao de conteudo."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns)
+
+
+def hash_fd(fd):
+    """(md5, sha256) do conteudo de um descritor, numa unica leitura."""
+    md5, sha = hashlib.md5(), hashlib.sha256()
+    buf = bytearray(CHUNK)
+    vista = memoryview(buf)
+    with os.fdopen(os.dup(fd), "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n: break
+            md5.update(vista[:n])
+            sha.update(vista[:n])
+    return md5.hexdigest(), sha.hexdigest()
+
+
+class ExeHashCache(object):
+    """Hashes por identidade de arquivo, em memoria e no banco local."""
+
+    def __init__(self, db_path=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 background_bytes=DEFAULT_BACKGROUND_MB * 1024 * 1024):
+        self.db_path = None
+        self.max_entries = max(1, int(max_entries))
+        self.background_bytes = int(background_bytes)
+        # LRU: o acerto vai para o fim, a remocao sai do comeco.
+        self._mem = OrderedDict()
+        # chave -> instante do ultimo uso, ainda nao gravado no banco
+        self._touched = {}
+        self._touch_flushed = time.monotonic()
+        self._lock = threading.Lock()
+        # chave -> avisos de quem espera o hash em segundo plano
+        self._queued = {}
+        self._queue = queue.Queue()
+        self._worker = None
+        self.hashed = 0
+        self.hits = 0
+        if db_path:
+            self.open_db(db_path)
+
+    # --------------------------------------------------------------------------
+    # BANCO
+    # --------------------------------------------------------------------------
+    def _conn(self):
+        conn = sqlite3.connect(self.db_path, timeout=30.0)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def open_db(self, db_path):
+        """Passa a persistir no banco do agente; sem sucesso fica em memoria."""
+        self.db_path = db_path
+        try:
+            with closing(self._conn()) as conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS exe_hashes (
+                        dev INTEGER NOT NULL,
+                        ino INTEGER NOT NULL,
+                        size INTEGER NOT NULL,
+                        mtime_ns INTEGER NOT NULL,
+                        ctime_ns INTEGER NOT NULL,
+                        md5 TEXT NOT NULL,
+                        sha256 TEXT NOT NULL,
+                        last_used REAL NOT NULL,
+                        PRIMARY KEY (dev, ino, size, mtime_ns, ctime_ns)
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_exe_hashes_used "
+                             "ON exe_hashes(last_used)")
+                conn.commit()
+        except Exception as exc:
+            LOG.error("Hash cache schema failed: %s", exc)
+            self.db_path = None
+
+    def _db_get(self, key):
+        if not self.db_path: return None
+        try:
+            with closing(self._conn()) as conn:
+                linha = conn.execute(
+                    "SELECT md5, sha256 FROM exe_hashes WHERE dev = ? AND ino = ? "
+                    "AND size = ? AND mtime_ns = ? AND ctime_ns = ?", key).fetchone()
+                if linha is None: return None
+                return linha["md5"], linha["sha256"]
+        except Exception as exc:
+            LOG.error("Hash cache lookup failed: %s", exc)
+            return None
+
+    def _db_put(self, key, md5, sha256):
+        if not self.db_path: return
+        try:
+            with closing(self._conn()) as conn:
+                # O uso anotado em memoria entra antes da remocao por last_used.
+                self._write_touched(conn)
+                conn.execute(
+                    "INSERT OR REPLACE INTO exe_hashes "
+                    "(dev, ino, size, mtime_ns, ctime_ns, md5, sha256, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", key + (md5, sha256, time.time()))
+                conn.execute(
+                    "DELETE FROM exe_hashes WHERE rowid IN (SELECT rowid FROM exe_hashes "
+                    "ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+                conn.commit()
+        except Exception as exc:
+            LOG.error("Hash cache write failed: %s", exc)
+
+    def _write_touched(self, conn):
+        with self._lock:
+            tocados, self._touched = self._touched, {}
+            self._touch_flushed = time.monotonic()
+        conn.executemany(
+            "UPDATE exe_hashes SET last_used = ? WHERE dev = ? AND ino = ? "
+            "AND size = ? AND mtime_ns = ? AND ctime_ns = ?",
+            [(quando,) + key for key, quando in tocados.items()])
+
+    def flush(self):
+        """Grava no banco o last_used dos acertos anotados em memoria."""
+        if not self.db_path or not self._touched: return
+        try:
+            with closing(self._conn()) as conn:
+                self._write_touched(conn)
+                conn.commit()
+        except Exception as exc:
+            LOG.error("Hash cache flush failed: %s", exc)
+
+    # --------------------------------------------------------------------------
+    # CONSULTA
+    # --------------------------------------------------------------------------
+    def _remember(self, key, hashes):
+        with self._lock:
+            self._mem.pop(key, None)
+            while len(self._mem) >= self.max_entries:
+                self._mem.popitem(last=False)
+            self._mem[key] = hashes
+
+    def _lookup(self, key):
+        with self._lock:
+            hashes = self._mem.get(key)
+            if hashes is not None:
+                self._mem.move_to_end(key)
+        if hashes is None:
+            hashes = self._db_get(key)
+            if hashes is not None:
+                self._remember(key, hashes)
+        if hashes is None:
+            return None
+        self.hits += 1
+        if self.db_path:
+            with self._lock:
+                self._touched[key] = time.time()
+                cheio = (len(self._touched) >= TOUCH_BATCH or
+                         time.monotonic() - self._touch_flushed >= TOUCH_FLUSH_S)
+            if cheio:
+                self.flush()
+        return hashes
+
+    def _hash_path(self, path):
+        """Le e guarda; a chave vem do fstat do arquivo efetivamente lido."""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return HASH_DENIED, HASH_DENIED
+        try:
+            key = file_key(os.fstat(fd))
+            hashes = hash_fd(fd)
+        except OSError:
+            return HASH_DENIED, HASH_DENIED
+        finally:
+            os.close(fd)
+        self.hashed += 1
+        self._remember(key, hashes)
+        self._db_put(key, *hashes)
+        return hashes
+
+    def digests(self, path, on_done=None):
+        """
+        (md5, sha256, stat) do arquivo. O stat e o de path (OSError se nao
+        existe). Arquivo acima de background_bytes e ainda sem hash volta com
+        HASH_PENDING; on_done(md5, sha256) e chamado quando ele ficar pronto.
+        """
+        st = os.stat(path)
+        key = file_key(st)
+        hashes = self._lookup(key)
+        if hashes is not None:
+            return hashes[0], hashes[1], st
+        if self.background_bytes and st.st_size > self.background_bytes:
+            self._enqueue(key, path, on_done)
+            return HASH_PENDING, HASH_PENDING, st
+        md5, sha256 = self._hash_path(path)
+        return md5, sha256, st
+
+    # --------------------------------------------------------------------------
+    # SEGUNDO PLANO
+    # --------------------------------------------------------------------------
+    def _enqueue(self, key, path, on_done):
+        with self._lock:
+            avisos = self._queued.get(key)
+            novo = avisos is None
+            if novo:
+                avisos = self._queued[key] = []
+            if on_done is not None:
+                avisos.append(on_done)
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="si-exe-hash")
+                self._worker.daemon = True
+                self._worker.start()
+        if novo:
+            self._queue.put((key, path))
+
+    def _run(self):
+        while True:
+            key, path = self._queue.get()
+            try:
+                md5, sha256 = self._hash_path(path)
+            except Exception as exc:
+                LOG.error("Background hash failed for %s: %s", path, exc)
+                md5 = sha256 = HASH_DENIED
+            with self._lock:
+                avisos = self._queued.pop(key, [])
+            for aviso in avisos:
+                try:
+                    aviso(md5, sha256)
+                except Exception:
+                    pass
+            self._queue.task_done()
+
+    def pending(self):
+        """Arquivos na fila de segundo plano."""
+        with self._lock:
+            return len(self._queued)
+
+    def drain(self):
+        """Espera a fila de segundo plano esvaziar (testes e ferramentas)."""
+        self._queue.join()
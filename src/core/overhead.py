@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: src/core/overhead.py
+# DESCRIPTION: Custo do proprio agente por janela e degradacao das sondas
+#              quando ele passa do orcamento.
+#
+# WHY:         O agente promete ficar abaixo de um teto de CPU no host
+#              inspecionado, e nada o fazia cumprir: num host de carga
+#              anomala o custo cresce junto com a carga, justamente quando o
+#              dono da aplicacao menos o tolera. A cada janela o custo e
+#              medido e, acima do orcamento, o agente desce um nivel; abaixo
+#              com folga por algumas janelas seguidas, sobe um de volta.
+#
+# WHAT:        So conta o que os niveis reduzem: o tempo das sondas BPF no
+#              kernel e a CPU das threads que leem o buffer e decodificam e
+#              tratam os eventos (relogio de CPU por thread, ThreadCpuClock;
+#              poll_cpu_pct no resumo soma as duas). Enriquecimento,
+#              agregacao, serializacao e envio tambem gastam CPU, mas nao
+#              dependem do nivel das sondas: contados, um laudo pesado
+#              derrubaria sondas sem baixar o custo. RSS continua sendo o do
+#              processo inteiro.
+#
+# LEVELS:      0 full              tudo ligado
+#              1 no_io_events      sem eventos 'R'/'W' por syscall (debug)
+#              2 sampled_opens     openat amostrado (1 em N) no kernel
+#              3 no_vfs_probes     kprobes de vfs_read/vfs_write desanexadas:
+#                                  sem I/O de disco por processo
+#              O nivel ativo vai em cada captura (capture_health['overhead']):
+#              quem le o laudo sabe que sinais estavam reduzidos.
+#
+# BPF TIME:    run_time_ns de /proc/self/fdinfo/<fd> de cada programa so e
+#              preenchido com kernel.bpf_stats_enabled=1 (5.1+). O agente nao
+#              liga o sysctl por conta propria; sem ele a parcela BPF fica None
+#              e o orcamento vale so para a thread de leitura.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import time
+
+LEVEL_FULL = 0
+LEVEL_NO_IO_EVENTS = 1
+LEVEL_SAMPLED_OPENS = 2
+LEVEL_NO_VFS_PROBES = 3
+LEVEL_NAMES = ("full", "no_io_events", "sampled_opens", "no_vfs_probes")
+
+# Sinais reduzidos em cada nivel, cumulativos.
+LEVEL_REDUCES = ((), ("io_events",), ("io_events", "open_events"),
+                 ("io_events", "open_events", "disk_io"))
+
+DEFAULT_CPU_BUDGET_PCT = 2.0
+DEFAULT_MEM_BUDGET_MB = 256
+DEFAULT_RECOVER_WINDOWS = 3
+
+# Para subir de volta o custo precisa ficar abaixo desta fracao do orcamento:
+# sem a folga o nivel oscilaria a cada janela perto do limite. A memoria tem
+# folga menor porque o Python raramente devolve ao sistema o que liberou.
+RECOVER_RATIO = 0.5
+MEM_RECOVER_RATIO = 0.8
+
+
+class ThreadCpuClock(object):
+    """
+    CPU acumulada de uma thread do caminho dos eventos (leitura ou
+    decodificacao), somada entre as threads que se sucedem (no modo snapshot
+    cada captura sobe uma thread de leitura nova).
+
+    A propria thread chama thread_started() ao subir e tick() depois de cada
+    poll (ou lote): o relogio de CPU de uma thread (CLOCK_THREAD_CPUTIME_ID) so pode
+    ser lido por ela. seconds() pode ser lido de qualquer thread e fica
+    atrasado no maximo um poll.
+    """
+
+    def __init__(self):
+        self._total = 0.0
+        self._ultimo = 0.0
+
+    def thread_started(self):
+        """Thread nova: o relogio dela comeca do zero."""
+        self._ultimo = 0.0
+
+    def tick(self):
+        agora = time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID)
+        self._total += max(agora - self._ultimo, 0.0)
+        self._ultimo = agora
+
+    def seconds(self):
+        return self._total
+
+
+def process_rss_bytes():
+    """RSS atual do agente (nao o pico de ru_maxrss)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def bpf_run_time_ns(prog_fds):
+    """
+    Soma de run_time_ns dos programas BPF, ou None se o kernel nao a expoe.
+
+    PARAMETER prog_fds: descritores dos programas carregados pelo agente.
+    """
+    total, achou = 0, False
+    for fd in prog_fds:
+        try:
+            with open("/proc/self/fdinfo/%d" % fd, "r") as f:
+                for linha in f:
+                    if linha.startswith("run_time_ns:"):
+                        total += int(linha.split(":", 1)[1])
+                        achou = True
+                        break
+        except (OSError, ValueError):
+            continue
+    # Zero em todos: bpf_stats_enabled desligado, nao sondas de custo nulo.
+    return total if achou and total else None
+
+
+class OverheadGovernor(object):
+    """
+    Mede o custo das sondas entre begin() e close() e escolhe o nivel seguinte.
+
+    close() desce no maximo um nivel por janela acima do orcamento e sobe um
+    depois de recover_windows janelas seguidas abaixo de RECOVER_RATIO dele.
+    CPU em percentual de UM core, como no top: 2.0 = 2% de uma CPU.
+    """
+
+    def __init__(self, cpu_budget_pct=DEFAULT_CPU_BUDGET_PCT,
+                 mem_budget_mb=DEFAULT_MEM_BUDGET_MB,
+                 recover_windows=DEFAULT_RECOVER_WINDOWS, enabled=True,
+                 clock=time.monotonic, cpu=None,
+                 rss=process_rss_bytes, bpf_ns=bpf_run_time_ns):
+        self.cpu_budget_pct = float(cpu_budget_pct)
+        self.mem_budget_mb = float(mem_budget_mb)
+        self.recover_windows = max(1, int(recover_windows))
+        self.enabled = enabled
+        self.level = LEVEL_FULL
+        # A thread de leitura e o worker de decodificacao marcam a propria
+        # CPU aqui (ver ThreadCpuClock).
+        self.poll_clock = ThreadCpuClock()
+        self.decode_clock = ThreadCpuClock()
+        self._clock, self._rss, self._bpf_ns = clock, rss, bpf_ns
+        self._cpu = cpu or self.event_cpu_seconds
+        self._base = None
+        self._calmas = 0
+        self.last = {}
+
+    def event_cpu_seconds(self):
+        """CPU das threads de leitura e de decodificacao dos eventos."""
+        return self.poll_clock.seconds() + self.decode_clock.seconds()
+
+    def _amostra(self, prog_fds):
+        return (self._clock(), self._cpu(), self._bpf_ns(prog_fds))
+
+    def begin(self, prog_fds=()):
+        """
+        Marca o inicio da medicao, uma vez. As janelas seguintes emendam na
+        anterior: o intervalo entre capturas (serializacao, cifragem, gravacao,
+        sondas ainda anexadas) tambem e custo do agente no host.
+        """
+        if self._base is None:
+            self._base = self._amostra(prog_fds)
+
+    def close(self, prog_fds=()):
+        """
+        Fecha a janela: devolve o resumo que vai para a captura, com o nivel
+        que esteve ativo nela, e ja decide o nivel da proxima (self.level).
+        """
+        agora = self._amostra(prog_fds)
+        base = self._base or agora
+        self._base = agora
+
+        parede = max(agora[0] - base[0], 0.001)
+        leitura_pct = 100.0 * max(agora[1] - base[1], 0.0) / parede
+        bpf_pct = None
+        if agora[2] is not None and base[2] is not None:
+            bpf_pct = 100.0 * max(agora[2] - base[2], 0) / 1e9 / parede
+        total_pct = leitura_pct + (bpf_pct or 0.0)
+        rss_mb = self._rss() / (1024.0 * 1024.0)
+
+        ativo = self.level
+        acima = total_pct > self.cpu_budget_pct or rss_mb > self.mem_budget_mb
+        folgado = (total_pct < self.cpu_budget_pct * RECOVER_RATIO and
+                   rss_mb < self.mem_budget_mb * MEM_RECOVER_RATIO)
+
+        if self.enabled:
+            if acima:
+                self._calmas = 0
+                self.level = min(self.level + 1, LEVEL_NO_VFS_PROBES)
+            elif folgado and self.level > LEVEL_FULL:
+                self._calmas += 1
+                if self._calmas >= self.recover_windows:
+                    self._calmas = 0
+                    self.level -= 1
+            else:
+                self._calmas = 0
+
+        self.last = {
+            "level": ativo,
+            "level_name": LEVEL_NAMES[ativo],
+            "reduced_signals": list(LEVEL_REDUCES[ativo]),
+            "next_level": self.level,
+            "cpu_pct": round(total_pct, 3),
+            "poll_cpu_pct": round(leitura_pct, 3),
+            "bpf_cpu_pct": None if bpf_pct is None else round(bpf_pct, 3),
+            "rss_mb": round(rss_mb, 1),
+            "cpu_budget_pct": self.cpu_budget_pct,
+            "mem_budget_mb": self.mem_budget_mb,
+            "over_budget": acima,
+        }
+        return self.last
@@ -21,6 +21,9 @@ from src.core.findings import (SEV_INFO, SEVERITY_ORDER, confidence_label,
                                custody_label, custody_level, CONF_CONFIRMED,
                                CONF_PROBABLE, CONF_HEURISTIC, CUSTODY_NONE)
 from src.core import risk
+from src.probes.drop_flows import flow_label, DEFAULT_TOP_FLOWS
+from src.probes.connections import conn_label
+from src.probes.blk_latency import format_latency
 from src.core.attack import describe, technique_url, used_techniques
 
 
@@ -289,7 +292,7 @@ def _render_badges(node, tree=None):
         "UNSAFE": ("☢️", "t-unsafe", "Unsafe Path (/tmp, /dev/shm)"),
         "EDR/AV": ("💊", "t-edr", "Security Inspectors - EDR/AV"),
         "INSPECTOR": ("💊", "t-edr", "Security Inspectors - EDR/AV"),
-        "EDR-WAIT": ("🧊", "t-edr", "Process Frozen by EDR/AV (Wchan Wait)"),
+        "EDR-WAIT": ("🧊", "t-edr", "Process Blocked by EDR/AV (Measured Off-CPU Wait)"),
         "GPU": ("🕹️", "t-gpu", "Accessing GPU Resources"),
         "CONTAINER": ("📦", "t-cont", "Containerized Process"),
         "ZOMBIE": ("🧟", "t-zombie", "Zombie Process"),
@@ -478,11 +481,115 @@ def _render_exe_provenance(node):
             f"<table class='ctx-tbl'>{body}</table></div>")
 
 
+def _render_suppressed(node):
+    """
+    Linha de eventos descartados no kernel pelo orcamento do processo. Sem ela
+    o laudo de um processo ruidoso pareceria completo: os arquivos e conexoes
+    acima do limite simplesmente nao estariam la.
+    """
+    total = getattr(node, "suppressed_events", 0) or 0
+    if not total:
+        return ""
+    por_tipo = getattr(node, "suppressed_by_type", None) or {}
+    detalhe = ", ".join(f"{_esc(k)}: {v}" for k, v in
+                        sorted(por_tipo.items(), key=lambda kv: kv[1], reverse=True))
+    detalhe = f" ({detalhe})" if detalhe else ""
+    return ("<tr><td class='ctx-lbl'>Event Budget:</td>"
+            f"<td class='ctx-val' style='color:var(--yel)'>{total} events suppressed{detalhe}</td></tr>")
+
+
+def _render_drop_flows(node):
+    """
+    Fluxos com mais pacotes descartados, ja agregados e limitados no kernel e
+    no motor (src/probes/drop_flows.py): contagem, bytes, motivo do kernel e
+    primeira/ultima ocorrencia. Capturas antigas trazem so as strings de
+    network_drops_details, contadas aqui como antes.
+    """
+    flows = getattr(node, "drop_flows", None) or []
+    legado = getattr(node, "network_drops_details", None) or []
+    if not flows and not legado:
+        return ""
+
+    html = "<div style='margin-top:10px; border-top:1px dashed #444; padding-top:5px'>"
+    html += "<span style='color:var(--red); font-weight:bold; font-size:11px'> BLOCKED PACKETS BY FLOW:</span>"
+    html += "<div class='list-box' style='max-height:150px; margin-top:5px'>"
+
+    if flows:
+        for f in flows:
+            motivo = f" {_esc(f['reason'])}" if f.get("reason") else ""
+            janela = f"{_fmt_epoch(f.get('first_seen'))} .. {_fmt_epoch(f.get('last_seen'))}"
+            html += (f"<div class='mono' style='color:#ff6b6b; font-size:11px; margin-left:5px' title='{janela}'>"
+                     f"{_esc(flow_label(f))}{motivo} "
+                     f"<span style='color:#fff;font-weight:bold'>[x{f['count']}]</span> "
+                     f"<span style='color:#888'>{format_bytes(f.get('bytes', 0))}</span></div>")
+    else:
+        counts = {}
+        for drop in legado:
+            counts[drop] = counts.get(drop, 0) + 1
+        for pair, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)[:DEFAULT_TOP_FLOWS]:
+            html += f"<div class='mono' style='color:#ff6b6b; font-size:11px; margin-left:5px'>{_esc(pair)} <span style='color:#fff;font-weight:bold'>[x{count}]</span></div>"
+
+    omitidos = getattr(node, "drop_flows_omitted", 0) or 0
+    if omitidos:
+        html += f"<div style='color:#777; font-style:italic; margin-left:5px; margin-top:2px'>... and {omitidos} more drops in other flows.</div>"
+
+    html += "</div></div>"
+    return html
+
+
+def _render_connections(node):
+    """
+    Destinos de saida da janela, ja agregados e limitados no kernel e no
+    motor (src/probes/connections.py): contagem (connect no TCP, envios no
+    UDP), bytes e primeira/ultima vez. Capturas antigas trazem so os rotulos
+    de node.connections.
+    """
+    tabela = getattr(node, "connection_table", None) or []
+    if not tabela and not node.connections:
+        return "<div class='d-na' style='margin-left:10px'>No active connections</div>"
+    if not tabela:
+        return "".join(f"<div class='mono' style='color:#bbb; font-size:11px'>{_esc(c)}</div>"
+                       for c in node.connections)
+
+    html = ""
+    for c in tabela:
+        janela = f"{_fmt_epoch(c.get('first_seen'))} .. {_fmt_epoch(c.get('last_seen'))}"
+        html += (f"<div class='mono' style='color:#bbb; font-size:11px' title='{janela}'>"
+                 f"{_esc(conn_label(c))} "
+                 f"<span style='color:#fff;font-weight:bold'>[x{c['count']}]</span> "
+                 f"<span style='color:#888'>{format_bytes(c.get('bytes', 0))}</span></div>")
+    omitidos = getattr(node, "connections_omitted", 0) or 0
+    if omitidos:
+        html += f"<div style='color:#777; font-style:italic; margin-left:5px; margin-top:2px'>... and {omitidos} more to other destinations.</div>"
+    return html
+
+
+def _render_enrichment(node):
+    """
+    Linha de enriquecimento que nao terminou (pendente ao fechar a janela ou
+    falho). Sem ela, MD5, conteiner e arquivos vazios seriam lidos como
+    ausencia de achado, quando o agente so nao chegou a le-los.
+    """
+    estado = getattr(node, "enrichment", None)
+    if estado not in ("pending", "failed"):
+        return ""
+    if estado == "pending":
+        texto = "pending: static context not read before the window closed"
+    else:
+        motivo = getattr(node, "enrichment_error", None)
+        texto = f"failed: {_esc(motivo)}" if motivo else "failed"
+    return ("<tr><td class='ctx-lbl'>Enrichment:</td>"
+            f"<td class='ctx-val' style='color:var(--yel)'>{texto}</td></tr>")
+
+
 def _get_details_html(node, mounts, tree=None):
     """Builds the hidden detail row content."""
     html = "<div class='det-grid'><div><table class='ctx-tbl'>"
     html += f"<tr><td class='ctx-lbl'>Full Command:</td><td class='ctx-val'>{_esc(node.cmd)}</td></tr>"
     html += f"<tr><td class='ctx-lbl'>MD5:</td><td class='ctx-val'>{_esc(node.md5)}</td></tr>"
+    sha256 = getattr(node, 'sha256', "")
+    if sha256 and sha256 != node.md5:
+        html += f"<tr><td class='ctx-lbl'>SHA-256:</td><td class='ctx-val'>{_esc(sha256)}</td></tr>"
 
     user_display = f"{_esc(node.username)} ({node.uid})"
     login_user = getattr(node, 'loginuser', None)
@@ -496,6 +603,13 @@ def _get_details_html(node, mounts, tree=None):
     # [v0.70 FEAT] Temporal Details
     html += f"<tr><td class='ctx-lbl'>Started ON:</td><td class='ctx-val' style='color:var(--yel)'>{getattr(node, 'start_ts_abs', 'N/A')}</td></tr>"
     html += f"<tr><td class='ctx-lbl'>Life Time:</td><td class='ctx-val' style='color:var(--grn)'>{getattr(node, 'duration_str', 'N/A')}</td></tr>"
+    # Saida informada pelo kernel durante a janela (sched_process_exit).
+    if getattr(node, 'end_time', 0):
+        status = getattr(node, 'exit_code', None)
+        motivo = ""
+        if status is not None:
+            motivo = f" (signal {status & 0x7f})" if status & 0x7f else f" (exit {(status >> 8) & 0xff})"
+        html += f"<tr><td class='ctx-lbl'>Ended ON:</td><td class='ctx-val' style='color:var(--yel)'>{_fmt_epoch(node.end_time)}{motivo}</td></tr>"
 
     is_sudo = "Yes" if "sudo" in node.cmd else "No"
     is_ssh = "Yes" if "sshd" in node.cmd else "No"
@@ -534,6 +648,20 @@ def _get_details_html(node, mounts, tree=None):
     ops = node.io_ops_count
     avg_lat = (lat_ms / ops) if ops > 0 else 0
     html += f"<tr><td class='ctx-lbl'>Disk Latency:</td><td class='ctx-val'>Total: {lat_ms:.2f}ms | Avg: {avg_lat:.2f}ms | Ops: {ops}</td></tr>"
+    # Percentis medidos no bloco (despacho ao driver -> conclusao), sem page cache.
+    blk = format_latency(getattr(node, 'blk_latency', None))
+    if blk:
+        html += f"<tr><td class='ctx-lbl'>Block Latency:</td><td class='ctx-val'>{blk}</td></tr>"
+    # Tempo dormindo medido no sched_switch; a parte em caminhos de EDR/AV por ponto.
+    off_ms = getattr(node, 'offcpu_ms', 0.0)
+    if off_ms:
+        sitios = getattr(node, 'edr_wait_sites', None) or {}
+        edr = " | ".join(f"{html_lib.escape(s)} {ms:.1f}ms" for s, ms in sorted(sitios.items(), key=lambda i: -i[1]))
+        edr_txt = f" | EDR/AV: {edr}" if edr else ""
+        html += f"<tr><td class='ctx-lbl'>Off-CPU Wait:</td><td class='ctx-val'>{off_ms:.1f}ms{edr_txt}</td></tr>"
+
+    html += _render_suppressed(node)
+    html += _render_enrichment(node)
 
     html += "</table></div>"
 
@@ -545,36 +673,9 @@ def _get_details_html(node, mounts, tree=None):
 
     # [NEW] Active Connections Label
     html += "<div style='font-size:10px; font-weight:bold; color:#777; margin-bottom:2px; text-transform:uppercase'>Active Connections:</div>"
-    if node.connections:
-        for c in node.connections:
-            html += f"<div class='mono' style='color:#bbb; font-size:11px'>{_esc(c)}</div>"
-    else:
-        html += "<div class='d-na' style='margin-left:10px'>No active connections</div>"
-
-    # [NEW] Blocked Packets (Limited to 50 items)
-    if hasattr(node, 'network_drops_details') and node.network_drops_details:
-        html += "<div style='margin-top:10px; border-top:1px dashed #444; padding-top:5px'>"
-        html += "<span style='color:var(--red); font-weight:bold; font-size:11px'> BLOCKED PACKETS SUMMARY:</span>"
-
-        counts = {}
-        for drop in node.network_drops_details:
-            counts[drop] = counts.get(drop, 0) + 1
-
-        sorted_counts = sorted(counts.items(), key=lambda item: item[1], reverse=True)
-
-        # SAFETY LIMIT: 50 items
-        limit = 50
-        display_items = sorted_counts[:limit]
-        remainder = len(sorted_counts) - limit
-
-        html += "<div class='list-box' style='max-height:150px; margin-top:5px'>"
-        for pair, count in display_items:
-            html += f"<div class='mono' style='color:#ff6b6b; font-size:11px; margin-left:5px'>{_esc(pair)} <span style='color:#fff;font-weight:bold'>[x{count}]</span></div>"
-
-        if remainder > 0:
-            html += f"<div style='color:#777; font-style:italic; margin-left:5px; margin-top:2px'>... and {remainder} more unique blocked targets.</div>"
+    html += _render_connections(node)
 
-        html += "</div></div>"
+    html += _render_drop_flows(node)
 
     html += "</div></div>"
 
@@ -797,7 +898,9 @@ def render_disk_block(storage_data):
                 size = child.get('size', '')
                 model = child.get('model', 'HARDDISK')
                 hctl = f"<span class='hctl-tag'>HCTL: {child.get('hctl')}</span>" if child.get('hctl') else ""
-                block += f"<div class='disk-root'><div class='disk-header'><span id='db-{safe_name}' class='disk-icon' onclick='toggleDisk(\"{name}\")'>+</span><span>{name} ({size})</span><span style='font-weight:normal;color:#aaa'>{model}</span>{hctl}</div>"
+                lat = format_latency(child.get('latency'))
+                lat = f"<span class='hctl-tag' title='Block I/O latency (issue -> complete)'>{lat}</span>" if lat else ""
+                block += f"<div class='disk-root'><div class='disk-header'><span id='db-{safe_name}' class='disk-icon' onclick='toggleDisk(\"{name}\")'>+</span><span>{name} ({size})</span><span style='font-weight:normal;color:#aaa'>{model}</span>{hctl}{lat}</div>"
                 block += f"<div id='dd-{safe_name}' class='disk-details'>"
                 if child.get('children'): block += render_disk_recursive(child['children'], level + 1)
                 block += "</div></div>"
@@ -806,6 +909,7 @@ def render_disk_block(storage_data):
                 size = child.get('size', '')
                 mount = f"MNT:{child.get('mountpoint')}" if child.get('mountpoint') else ""
                 uuid = f"UUID:{child.get('uuid')}" if child.get('uuid') else ""
+                if child.get('latency'): uuid += f" LAT: {format_latency(child['latency'])}"
                 prefix = "&lfloor; " if level > 1 else ""
                 block += f"<div class='disk-part' style='padding-left:{padding}px'>{prefix}<b>{name}</b> ({fstype}) <span class='disk-meta'>{mount} Size:{size} {uuid}</span></div>"
                 if child.get('children'): block += render_disk_recursive(child['children'], level + 1)
@@ -883,7 +883,7 @@ HTML_TEMPLATE = r"""<!DOCTYPE html>
                     <span class="filter-btn" onclick="setFilter('SUDO', this)" title="Privileged (Sudo)">🛡️</span>
                     <span class="filter-btn" onclick="setFilter('CONTAINER', this)" title="Containerized">📦</span>
                     <span class="filter-btn" onclick="setFilter('EDR/AV', this)" title="Security Inspectors - EDR (Endpoint Detection and Response) / AV (Antivirus)">💊</span>
-                    <span class="filter-btn" onclick="setFilter('EDR-WAIT', this)" title="Process Frozen by EDR/AV (Wchan Wait)">🧊</span>
+                    <span class="filter-btn" onclick="setFilter('EDR-WAIT', this)" title="Process Blocked by EDR/AV (Measured Off-CPU Wait)">🧊</span>
                     <span class="filter-btn" onclick="setFilter('GPU', this)" title="GPU Activity">🕹️</span>
                     <span class="filter-btn" onclick="setFilter('MINER', this)" title="Mining Signature">⛏️</span>
                     <span class="filter-btn" onclick="setFilter('UNSAFE', this)" title="Unsafe Path">☢️</span>
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/attach.py
+# DESCRIPTION: Modo de anexacao das sondas de openat, connect e I/O de disco.
+#
+# WHY:         Essas sondas eram so kprobes: kprobe em openat e tcp_v4_connect e
+#              o par kprobe/kretprobe em vfs_read/vfs_write. Kretprobe em funcao
+#              quente e o ponto mais caro do agente (toda leitura e escrita do
+#              host passa por ali duas vezes), e qualquer kprobe para de
+#              funcionar quando o simbolo e inline ou muda de nome no kernel.
+#              Tres modos, do preferido ao ultimo recurso:
+#
+#                fentry      fentry/fexit em vfs_*, tcp_v4_connect, tcp_close e
+#                            udp_sendmsg, trampolim sem armadilha; exige BTF (e
+#                            o flag 'btf' de src/core/capabilities.py), kernel
+#                            5.5+ e um BCC que saiba anexar kfunc. openat pelo
+#                            tracepoint.
+#                tracepoint  syscalls:sys_enter/exit_* e sock:inet_sock_set_state:
+#                            ABI estavel, sem simbolo; a latencia de I/O vira a
+#                            da syscall (read/pread64/write/pwrite64).
+#                kprobe      o comportamento anterior.
+#
+#              O modo pedido em engine.attach_mode e respeitado se o host o
+#              suporta; senao cai para o proximo, com aviso. O modo em uso vai
+#              em cada captura (capture_health) e no relatorio de capacidades.
+#
+# BENCH:       syscall_workload() e a carga usada por tools/bench_attach_modes.py
+#              para comparar o custo de cada modo no mesmo host.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import socket
+import tempfile
+import time
+
+MODE_FENTRY = "fentry"
+MODE_TRACEPOINT = "tracepoint"
+MODE_KPROBE = "kprobe"
+
+# Ordem de preferencia do modo "auto".
+MODES = (MODE_FENTRY, MODE_TRACEPOINT, MODE_KPROBE)
+
+# Define passado ao compilador: so os pontos de entrada do modo sao compilados
+# (o BCC anexa sozinho todo TRACEPOINT_PROBE e KFUNC_PROBE que encontra).
+MODE_CFLAGS = {MODE_FENTRY: ["-DSI_ATTACH_FENTRY"],
+               MODE_TRACEPOINT: ["-DSI_ATTACH_TRACEPOINT"],
+               MODE_KPROBE: []}
+
+# fentry/fexit chegaram no 5.5; BCC anexa kfunc desde a 0.15.
+FENTRY_MIN_KERNEL = (5, 5)
+
+# I/O de disco por modo: o que o governador de custo desanexa no nivel
+# no_vfs_probes e anexa de volta.
+IO_TRACEPOINTS = ("syscalls:sys_enter_read", "syscalls:sys_exit_read",
+                  "syscalls:sys_enter_pread64", "syscalls:sys_exit_pread64",
+                  "syscalls:sys_enter_write", "syscalls:sys_exit_write",
+                  "syscalls:sys_enter_pwrite64", "syscalls:sys_exit_pwrite64")
+IO_FUNCTIONS = ("vfs_read", "vfs_write")
+
+# Kprobes de conexao (conn_stats) que o motor anexa em cada modo, como
+# (funcao do kernel, funcao da sonda). Envio UDP nao tem tracepoint estavel, e
+# IPv6 fica em kprobe tambem no modo fentry: com ipv6 como modulo, fentry nele
+# exige BTF de modulo (5.11+). TCP no modo tracepoint vem de
+# sock:inet_sock_set_state (SYN_SENT e CLOSE).
+CONN_KPROBES = {
+    MODE_FENTRY: (("tcp_v6_connect", "trace_tcp_v6_connect"),
+                  ("udpv6_sendmsg", "trace_udpv6_sendmsg")),
+    MODE_TRACEPOINT: (("udp_sendmsg", "trace_udp_sendmsg"),
+                      ("udpv6_sendmsg", "trace_udpv6_sendmsg")),
+    MODE_KPROBE: (("tcp_v4_connect", "trace_tcp_v4_connect"),
+                  ("tcp_v6_connect", "trace_tcp_v6_connect"),
+                  ("tcp_close", "trace_tcp_close"),
+                  ("udp_sendmsg", "trace_udp_sendmsg"),
+                  ("udpv6_sendmsg", "trace_udpv6_sendmsg")),
+}
+
+# Tracepoints que o modo tracepoint exige alem dos que todos os modos usam.
+REQUIRED_TRACEPOINTS = (("syscalls", "sys_enter_openat"),
+                        ("syscalls", "sys_exit_read"),
+                        ("sock", "inet_sock_set_state"))
+
+TRACEFS_ROOTS = ("/sys/kernel/tracing", "/sys/kernel/debug/tracing")
+BTF_PATH = "/sys/kernel/btf/vmlinux"
+
+# Modo em uso pelo motor deste processo (None = sondas ainda nao carregadas),
+# para o relatorio de capacidades que vai no check-in.
+_active_mode = None
+
+
+def set_active_mode(mode):
+    global _active_mode
+    _active_mode = mode
+
+
+def active_mode():
+    return _active_mode
+
+
+def _tracepoint_exists(categoria, evento, roots=TRACEFS_ROOTS):
+    return any(os.path.isdir(os.path.join(r, "events", categoria, evento)) for r in roots)
+
+
+def tracepoints_available(bpf_cls=None, roots=TRACEFS_ROOTS):
+    """Se os tracepoints do modo tracepoint existem (CONFIG_FTRACE_SYSCALLS, 4.16+)."""
+    existe = getattr(bpf_cls, "tracepoint_exists", None)
+    for categoria, evento in REQUIRED_TRACEPOINTS:
+        if existe is not None:
+            if not existe(categoria, evento):
+                return False
+        elif not _tracepoint_exists(categoria, evento, roots):
+            return False
+    return True
+
+
+def fentry_available(kernel, btf=None, bpf_cls=None):
+    """
+    Se fentry/fexit funcionam aqui: BTF do kernel, 5.5+ e, com o BCC
+    presente, o proprio BCC confirmando (support_kfunc).
+    """
+    if btf is None:
+        btf = os.path.exists(BTF_PATH)
+    if not btf or tuple(kernel) < FENTRY_MIN_KERNEL:
+        return False
+    if bpf_cls is None:
+        return True
+    # BCC antigo nao tem support_kfunc: sem como confirmar, fica de fora.
+    suporte = getattr(bpf_cls, "support_kfunc", lambda: False)
+    try:
+        return bool(callable(suporte) and suporte())
+    except Exception:
+        return False
+
+
+def choose_attach_mode(requested="auto", kernel=(0, 0), btf=None, bpf_cls=None,
+                       tracepoints=None):
+    """
+    Modo de anexacao para este host.
+
+    Pedido explicito que o host nao suporta cai para o proximo modo da ordem,
+    com aviso: sonda que nao anexa deixaria o host sem coleta. kprobe e sempre
+    aceito.
+    """
+    requested = (requested or "auto").lower()
+    if requested not in MODES:
+        requested = "auto"
+    if tracepoints is None:
+        tracepoints = tracepoints_available(bpf_cls)
+    capaz = {MODE_FENTRY: fentry_available(kernel, btf, bpf_cls),
+             MODE_TRACEPOINT: tracepoints,
+             MODE_KPROBE: True}
+
+    inicio = 0 if requested == "auto" else MODES.index(requested)
+    for modo in MODES[inicio:]:
+        if capaz[modo]:
+            if requested not in ("auto", modo):
+                print(f"[WARN] Attach mode '{requested}' unsupported here; using '{modo}'.")
+            return modo
+    return MODE_KPROBE
+
+
+def syscall_workload(iterations=20000, block=4096, connects=200, path=None):
+    """
+    Carga rica em syscalls que passam pelas sondas deste modulo: openat, read,
+    write, pread/pwrite e connect em loopback. Devolve os segundos gastos.
+
+    Roda em processo separado do agente (o agente filtra o proprio PID).
+    """
+    dono = path is None
+    if dono:
+        fd, path = tempfile.mkstemp(prefix="si-bench-")
+        os.close(fd)
+    dados = b"\0" * block
+    servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen(128)
+    endereco = servidor.getsockname()
+    try:
+        inicio = time.perf_counter()
+        fd = os.open(path, os.O_RDWR | os.O_CREAT)
+        try:
+            for i in range(iterations):
+                os.pwrite(fd, dados, 0)
+                os.pread(fd, block, 0)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.write(fd, dados)
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.read(fd, block)
+                if i % 16 == 0:
+                    os.close(os.open(path, os.O_RDONLY))
+        finally:
+            os.close(fd)
+        for _ in range(connects):
+            c = socket.create_connection(endereco)
+            servidor.accept()[0].close()
+            c.close()
+        return time.perf_counter() - inicio
+    finally:
+        servidor.close()
+        if dono:
+            os.unlink(path)
@@ -5,13 +5,22 @@
  * Monitors Syscalls, I/O Latency, Network Buffers, and Security Inspection.
  *
  * FEATURES:
- * - Process Execution (execve) & File Access (openat)
+ * - Process Lifecycle (fork/exec/exit tracepoints) & File Access (openat)
  * - Disk I/O Latency Calculation (vfs_read/write entry vs return)
+ * - Block I/O latency histograms per disk and per PID (block_rq_issue/complete)
+ * - In-kernel I/O aggregation per PID/TID (io_stats), per-syscall events only in debug
+ * - On-CPU time per PID from sched_switch (cpu_ns)
+ * - Off-CPU wait time per PID and kernel stack (offcpu_ns), backing EDR-WAIT
  * - Network Interface Buffer Analysis (net_dev_xmit/netif_receive_skb)
  * - TCP Health (Retransmits & Drops via kfree_skb)
  * - Horizontal Inspection Detection (fanotify hooks)
  * - [NEW v0.50.41] Detailed Packet Drop Analysis (L3/L4 extraction)
+ * - Packet drops aggregated per flow and drop reason in the kernel (drop_flows)
+ * - openat/connect/disk I/O attach via fentry, stable tracepoints or kprobes (SI_ATTACH_*)
+ * - TCP/UDP, IPv4/IPv6 connections counted per destination in the kernel (conn_stats)
  * - [NEW v0.50.41] User Provenance Tracking (loginuid/AUID for sudo/ssh tracking)
+ * - Ring buffer transport (5.8+) with compact per-type records, perf buffer fallback
+ * - Per-process token bucket per event type; over-budget events counted, not sent
  *
  * OPTIONS:
  *
@@ -39,74 +48,426 @@
 
 // [PATCH] Compatibility Macro for Memory Reads (SLES 12/15 vs SLES 16)
 // Kernel 5.8+ enforces strict separation between user/kernel memory reads.
+// dst e sempre um ponteiro (&campo): o tamanho lido e o do campo, e nao o do
+// ponteiro. Com sizeof(dst) cada leitura copiava 8 bytes e invadia o campo
+// seguinte, o que os registros compactos abaixo nao toleram.
 #if LINUX_VERSION_CODE >= KERNEL_VERSION(5,8,0)
-    #define SAFE_KREAD(dst, src) bpf_probe_read_kernel(dst, sizeof(dst), src)
+    #define SAFE_KREAD(dst, src) bpf_probe_read_kernel(dst, sizeof(*(dst)), src)
+    #define SAFE_KREAD_STR(dst, size, src) bpf_probe_read_kernel_str(dst, size, src)
 #else
-    #define SAFE_KREAD(dst, src) bpf_probe_read(dst, sizeof(dst), src)
+    #define SAFE_KREAD(dst, src) bpf_probe_read(dst, sizeof(*(dst)), src)
+    #define SAFE_KREAD_STR(dst, size, src) bpf_probe_read_str(dst, size, src)
 #endif
 
-// Placeholder for the Python Agent PID (replaced at runtime by loader.py)
-#define FILTER_PID 00000
+// ============================================================================
+// ATTACH MODES
+// ============================================================================
+// Os pontos de openat, connect e I/O de disco vem em tres formas; so uma e
+// compilada, escolhida pelo motor (engine.attach_mode, src/probes/attach.py):
+//   SI_ATTACH_TRACEPOINT  tracepoints estaveis (syscalls:sys_enter/exit_*,
+//                         sock:inet_sock_set_state), sem depender de simbolo
+//   SI_ATTACH_FENTRY      fentry/fexit em vfs_*, tcp_v4_connect, tcp_close e
+//                         udp_sendmsg (BTF, 5.5+); openat pelo tracepoint
+//   (nenhum)              kprobes/kretprobes, o ultimo recurso: caros em
+//                         funcoes quentes e quebram quando o simbolo e inline
+// fork/exec/exit, rede, CPU, bloco e descartes ja sao tracepoints em todos os modos.
+// Envio UDP (sem tracepoint estavel) e IPv6 no modo fentry ficam em kprobe.
 
 // ============================================================================
 // DATA STRUCTURES
 // ============================================================================
 
-// Structure sent to Python User Space via perf_submit
-struct event_data_t {
+// Records sent to Python User Space.
+// Cada tipo de evento tem o proprio layout, precedido de um cabecalho comum.
+// A estrutura unica anterior levava 256 bytes de filename, campos IPv4 e de
+// memoria em TODO evento, inclusive nos que nao usam nenhum deles. O layout e
+// espelhado em src/probes/records.py; mudar um exige mudar o outro.
+struct rec_hdr_t {
+    u8  type_id;       // 'E'=Exec, 'O'=Open, 'R'=Read, 'W'=Write,
+                       // 'N'=Net e 'D'=Drop (so em gravacoes antigas: ver
+                       // conn_stats e drop_flows),
+                       // 'F'=Fork (header only), 'X'=Exit
+    u8  flags;
+    u16 len;           // Total record size in bytes (header included)
     u32 pid;
     u32 ppid;
     u32 uid;
-    u32 loginuid;      // [NEW] Audit UID (The original user before sudo/su)
+    u32 loginuid;      // Audit UID (The original user before sudo/su)
+    s32 prio;
+    u64 mem_peak_rss;
     char comm[TASK_COMM_LEN];
+};
+
+// 'E' / 'O': only the bytes the path actually uses are submitted.
+struct rec_path_t {
+    struct rec_hdr_t hdr;
     char filename[256];
-    char type_id;      // 'E'=Exec, 'O'=Open, 'N'=Net, 'R'=Read, 'W'=Write, 'D'=Drop
-    
-    // Network Details (Connect & Drops)
-    u32 saddr;
-    u32 daddr;
-    u16 sport;
-    u16 dport;
-    u32 proto;         // [NEW] Protocol (TCP=6/UDP=17) for drops
-    u64 net_len;       // Packet length
-    
-    // Memory & I/O Details
-    u64 mem_vsz;
-    u64 mem_peak_rss;
+};
+
+// 'R' / 'W': per-syscall I/O (debug only, see SETTING_IO_EVENTS)
+struct rec_io_t {
+    struct rec_hdr_t hdr;
     u64 io_bytes;
     u64 io_latency_ns; // Time spent waiting for disk (Delta)
-    
-    // Security / Inspection Details
-    u32 inspector_pid; // Who is inspecting this process?
-    int prio;
+};
+
+// 'X': process exit (thread group leader only)
+struct rec_exit_t {
+    struct rec_hdr_t hdr;
+    u64 exit_ns;       // bpf_ktime_get_ns() (CLOCK_MONOTONIC) at exit
+    s32 exit_code;     // task->exit_code: status << 8 | signal
+    u32 pad;
 };
 
 // ============================================================================
 // BPF MAPS (Storage)
 // ============================================================================
 
-// Event Buffer (High bandwidth events)
-BPF_PERF_OUTPUT(events);
+// 0. Agent Runtime Settings (written by the engine after load)
+// Index -> value. Flags de execucao ficam num mapa, e nao no texto do fonte,
+// para o motor liga-las sem recompilar. Vem antes dos demais mapas porque a
+// geracao (SETTING_GENERATION) entra na chave de todos os contadores.
+#define SETTING_IO_EVENTS   0   // 1 = envia tambem um evento 'R'/'W' por syscall (debug)
+#define SETTING_IO_PER_TID  1   // 1 = agrega I/O por thread, alem do processo
+#define SETTING_AGENT_PID   2   // PID do agente, para nao rastrear a si mesmo
+#define SETTING_OPEN_DEDUPE 3   // 1 = cada processo envia cada caminho uma vez por janela
+#define SETTING_GENERATION  4   // Janela corrente (0/1), ver "Double Buffering"
+#define SETTING_OPEN_SAMPLE 5   // N > 1 = so 1 em N openat segue (governador de custo)
+#define SETTING_OFFCPU_STATES 6 // Bits de prev_state (1 = S, 2 = D) cuja espera e medida
+#define SETTINGS_MAX        8
+
+BPF_ARRAY(agent_settings, u64, SETTINGS_MAX);
+
+static __always_inline u64 get_setting(int idx) {
+    u64 *val = agent_settings.lookup(&idx);
+    return val ? *val : 0;
+}
+
+// Double Buffering
+// No modo continuo as sondas nunca param: a janela e cortada trocando a
+// geracao corrente (uma unica escrita em agent_settings). Cada contador leva
+// a geracao na chave; o motor le e apaga a geracao que acabou de fechar
+// enquanto as sondas ja escrevem na outra. Fora do modo continuo a geracao
+// fica em 0 e os mapas sao zerados a cada start().
+static __always_inline u32 current_gen(void) {
+    return (u32)get_setting(SETTING_GENERATION) & 1;
+}
+
+struct pid_gen_key_t {
+    u32 pid;
+    u32 gen;
+};
+
+// Event Transport
+// Com SI_RINGBUF (kernel 5.8+, escolhido pelo motor) um unico ring buffer
+// compartilhado substitui os buffers de perf por CPU: menos memoria parada em
+// hosts de muitos cores e ordem global dos eventos entre CPUs. Kernels mais
+// antigos (SLES 12/15 SP1) seguem no perf buffer, com os mesmos registros.
+//
+// Envio recusado (buffer cheio, agente atrasado) e contado por CPU em
+// submit_lost. Sem isso o evento sumia e a captura parecia completa; o motor
+// le o contador no stop() e o registra na captura (capture_health).
+BPF_PERCPU_ARRAY(submit_lost, u64, 2);   // Index: generation
+
+static __always_inline void note_lost(void) {
+    int gen = current_gen();
+    u64 *n = submit_lost.lookup(&gen);
+    if (n) (*n)++;    // Per-CPU slot: no atomic needed
+}
+
+#ifdef SI_RINGBUF
+    #ifndef SI_RINGBUF_PAGES
+        #define SI_RINGBUF_PAGES 64
+    #endif
+    BPF_RINGBUF_OUTPUT(events, SI_RINGBUF_PAGES);
+    #define SUBMIT(ctx, rec, size) \
+        do { if (events.ringbuf_output((rec), (size), 0) < 0) note_lost(); } while (0)
+#else
+    BPF_PERF_OUTPUT(events);
+    #define SUBMIT(ctx, rec, size) \
+        do { if (events.perf_submit((ctx), (rec), (size)) < 0) note_lost(); } while (0)
+#endif
 
 // 1. Latency Tracking Maps (Temporary storage for start times)
-// Key: PID, Value: Timestamp (ns)
+// Key: TID, Value: Timestamp (ns)
 BPF_HASH(io_start, u32, u64);
 
 // 2. Traffic Aggregation Maps (To avoid spamming perf buffer for every byte)
-// Key: PID, Value: Bytes
-BPF_HASH(net_bytes_sent, u32, u64);
-BPF_HASH(net_bytes_recv, u32, u64);
+// Key: (PID, generation), Value: Bytes, uma copia por CPU.
+// Estes dois contadores sao tocados a cada pacote, de todas as CPUs. Num hash
+// compartilhado o valor do mesmo PID e uma unica linha de cache disputada
+// pelas CPUs dentro do caminho do pacote (e a soma sem atomico ainda perdia
+// incrementos). Per-CPU cada CPU soma na propria copia; o motor soma as
+// copias ao fechar a janela. Custo: entradas x CPUs x 8 bytes de memoria.
+BPF_PERCPU_HASH(net_bytes_sent, struct pid_gen_key_t, u64);
+BPF_PERCPU_HASH(net_bytes_recv, struct pid_gen_key_t, u64);
 
 // 3. Health Counters
-// Key: PID, Value: Count
-BPF_HASH(tcp_retrans_map, u32, u64);
-BPF_HASH(tcp_drop_map, u32, u64);
+// Key: (PID, generation), Value: Count
+BPF_HASH(tcp_retrans_map, struct pid_gen_key_t, u64);
+BPF_HASH(tcp_drop_map, struct pid_gen_key_t, u64);
+
+// Packet Drops by Flow (kfree_skb)
+// Era um evento por pacote descartado, formatado e guardado um a um no Python:
+// num SYN flood ou com uma placa ruim esse caminho sozinho derrubava o agente.
+// O kernel soma aqui cada fluxo; o motor le o mapa uma vez por janela e guarda
+// os N maiores por processo (src/probes/drop_flows.py). Enderecos e portas em
+// ordem de rede; reason e o skb_drop_reason (5.17+, antes 0). Mapa cheio: o
+// descarte ainda entra em tcp_drop_map, so nao ganha fluxo.
+struct drop_flow_key_t {
+    u32 pid;
+    u32 gen;
+    u32 saddr;
+    u32 daddr;
+    u16 sport;
+    u16 dport;
+    u16 proto;
+    u16 reason;
+};
+
+struct drop_flow_t {
+    u64 count;
+    u64 bytes;
+    u64 first_ns;
+    u64 last_ns;
+};
+
+#ifndef SI_DROP_FLOWS
+    #define SI_DROP_FLOWS 8192
+#endif
+
+BPF_HASH(drop_flows, struct drop_flow_key_t, struct drop_flow_t, SI_DROP_FLOWS);
+
+// Connections per Destination (connect / envio UDP)
+// Era um evento 'N' por connect, so TCP IPv4, virando uma string por evento
+// no Python; IPv6 e UDP nao apareciam. O kernel soma aqui cada (pid,
+// familia, destino, porta, protocolo); o motor le o mapa uma vez por janela
+// e guarda os N destinos mais usados por processo (src/probes/connections.py).
+// daddr: IPv4 nos 4 primeiros bytes; endereco e porta em ordem de rede.
+struct conn_key_t {
+    u32 pid;
+    u32 gen;
+    u8  daddr[16];
+    u16 dport;
+    u8  family;        // AF_INET / AF_INET6
+    u8  proto;         // IPPROTO_TCP / IPPROTO_UDP
+};
+
+struct conn_stats_t {
+    u64 count;         // TCP: connect(); UDP: datagramas enviados
+    u64 bytes;         // TCP: enviados (acked) + recebidos, no fechamento
+    u64 first_ns;
+    u64 last_ns;
+};
+
+#ifndef SI_CONN_ENTRIES
+    #define SI_CONN_ENTRIES 16384
+#endif
+
+BPF_HASH(conn_stats, struct conn_key_t, struct conn_stats_t, SI_CONN_ENTRIES);
+
+// Socket TCP de saida -> chave do connect, ate o fechamento. Atravessa
+// janelas (conexao longa); LRU porque nem todo socket chega a fechar.
+BPF_TABLE("lru_hash", u64, struct conn_key_t, conn_socks, SI_CONN_ENTRIES);
+
+// 4. Disk I/O Aggregation (vfs_read/vfs_write)
+// Um evento por syscall custava milhoes de perf_submit por janela em hosts de
+// banco e de build, e o Python so somava os campos. O kernel soma aqui e o
+// motor le o mapa uma vez, no stop(). tid fica 0 quando a granularidade por
+// thread esta desligada (agent_settings[SETTING_IO_PER_TID]).
+struct io_key_t {
+    u32 pid;
+    u32 tid;
+    u32 gen;
+};
+
+struct io_stats_t {
+    u64 read_bytes;
+    u64 write_bytes;
+    u64 read_ops;
+    u64 write_ops;
+    u64 latency_ns;    // Soma das latencias medidas (entry -> return)
+    u64 latency_ops;   // Operacoes que tiveram a latencia medida
+};
+
+BPF_HASH(io_stats, struct io_key_t, struct io_stats_t, 16384);
+
+// 5. On-CPU Time (sched_switch)
+// O uso de CPU vinha de /proc/PID/stat lido para cada no no start() e de novo
+// no stop(): duas passadas por /proc por ciclo, e nada para o processo que
+// nasceu e morreu dentro da janela. Aqui o kernel soma o tempo em CPU de cada
+// processo a cada troca de contexto.
+// Key: (PID, generation), Value: nanoseconds on CPU
+BPF_HASH(cpu_ns, struct pid_gen_key_t, u64, 32768);
+
+// Instante em que a tarefa atual de cada CPU entrou nela.
+BPF_PERCPU_ARRAY(oncpu_since, u64, 1);
+
+// 5b. Off-CPU Wait Sites (sched_switch + kernel stack)
+// EDR-WAIT vinha de /proc/PID/wchan, lido uma vez por processo no
+// enriquecimento: so pegava quem estivesse bloqueado no instante da leitura.
+// Aqui cada espera num estado de SETTING_OFFCPU_STATES guarda o inicio e a
+// pilha do kernel de quem dormiu; quando a tarefa volta a CPU o tempo entra em
+// offcpu_ns por (processo, pilha). O motor resolve as pilhas uma vez por
+// janela (src/probes/offcpu.py).
+#ifndef SI_OFFCPU_STACKS
+    #define SI_OFFCPU_STACKS 4096
+#endif
+
+BPF_STACK_TRACE(offcpu_stacks, SI_OFFCPU_STACKS);
+
+struct offcpu_start_t {
+    u64 ts;
+    u32 tgid;
+    s32 stack_id;      // < 0: tabela de pilhas cheia, tempo sem ponto de espera
+};
+
+// Key: TID dormindo
+BPF_HASH(offcpu_start, u32, struct offcpu_start_t, 32768);
+
+struct offcpu_key_t {
+    u32 pid;
+    u32 gen;
+    s32 stack_id;
+    u32 pad;
+};
+
+// Key: (PID, generation, pilha), Value: nanoseconds off CPU
+BPF_HASH(offcpu_ns, struct offcpu_key_t, u64, 16384);
+
+// 6. openat Filtering (deny prefixes + per-process dedupe)
+// O Python descartava /proc, /sys, /dev e /run so depois de pagar o envio e a
+// decodificacao, e o conjunto open_files absorvia as repeticoes no fim da
+// linha. Em servicos que abrem o mesmo log milhares de vezes por janela quase
+// todo esse trabalho era desperdicio. Os prefixos vem da configuracao
+// (engine.open_deny_prefixes); entrada com len 0 e vaga.
+#define DENY_PREFIX_MAX     8
+#define DENY_PREFIX_LEN     32
+
+struct deny_prefix_t {
+    u32  len;
+    char prefix[DENY_PREFIX_LEN];
+};
+
+BPF_ARRAY(open_deny_prefixes, struct deny_prefix_t, DENY_PREFIX_MAX);
+
+// (processo, hash do caminho) ja enviados nesta janela. LRU: quando enche, a
+// entrada mais antiga sai e, no pior caso, um caminho chega duas vezes ao
+// Python, que ainda deduplica no conjunto open_files. O motor limpa o mapa no
+// inicio de cada janela, junto com a arvore.
+#ifndef SI_OPEN_SEEN_ENTRIES
+    #define SI_OPEN_SEEN_ENTRIES 16384
+#endif
+
+struct open_key_t {
+    u32 pid;
+    u32 gen;           // Caminho visto nesta janela, nao na anterior
+    u64 path_hash;
+};
+
+BPF_TABLE("lru_hash", struct open_key_t, u8, open_seen, SI_OPEN_SEEN_ENTRIES);
+
+// 7. Per-Process Event Budget (token bucket)
+// Um processo descontrolado (openat em laco, rajada de execs) enchia o buffer
+// de eventos e tirava espaco do resto da janela. Cada evento gasta um token do
+// balde (processo, tipo); sem token ele e descartado aqui e so contado em
+// suppressed_events. Taxa e rajada por tipo vem da configuracao
+// (engine.rate_limits, src/probes/rate_limit.py); rate 0 = sem limite.
+#define RL_EXEC     0
+#define RL_OPEN     1
+#define RL_CONNECT  2   // sem uso: conexoes agregadas em conn_stats
+#define RL_IO       3
+#define RL_DROP     4   // sem uso: descartes agregados em drop_flows
+#define RL_KINDS    8
+
+// Tokens guardados em nanoeventos: o reabastecimento e elapsed_ns * rate,
+// sem divisao. Intervalo, taxa e rajada sao limitados para burst * RL_TOKEN
+// e tokens + elapsed * rate caberem num u64 (MAX_RATE e MAX_BURST em
+// src/probes/rate_limit.py; o mapa pode ter sido escrito por outra ferramenta).
+#define RL_TOKEN        1000000000ULL
+#define RL_MAX_ELAPSED  10000000000ULL
+#define RL_MAX_RATE     1000000ULL
+#define RL_MAX_BURST    10000000ULL
+
+#ifndef SI_RATE_BUCKETS
+    #define SI_RATE_BUCKETS 16384
+#endif
+
+struct rate_limit_t {
+    u64 rate;          // Eventos por segundo
+    u64 burst;         // Eventos acumulaveis
+};
+
+BPF_ARRAY(rate_limits, struct rate_limit_t, RL_KINDS);
+
+struct bucket_key_t {
+    u32 pid;
+    u32 kind;
+};
+
+struct bucket_t {
+    u64 tokens;
+    u64 last_ns;
+};
+
+// LRU: um processo que sumiu libera a vaga sozinho.
+BPF_TABLE("lru_hash", struct bucket_key_t, struct bucket_t, rate_buckets, SI_RATE_BUCKETS);
+
+// Key: (PID, generation, kind), Value: eventos descartados pelo orcamento
+struct suppress_key_t {
+    u32 pid;
+    u32 gen;
+    u32 kind;
+};
+
+BPF_HASH(suppressed_events, struct suppress_key_t, u64);
+
+// 8. Block I/O Latency (block_rq_issue -> block_rq_complete)
+// A latencia de disco vinha so do par vfs_read/vfs_write, que conta acerto de
+// page cache e leitura de pipe, e virava uma soma da qual so saia a media.
+// Aqui cada requisicao de bloco e medida do despacho ao driver ate a
+// conclusao e entra num histograma log2 (microssegundos) por disco e por
+// processo; o motor tira p50/p95/p99 (src/probes/blk_latency.py).
+struct blk_req_key_t {
+    u32 dev;           // dev_t do kernel (major << 20 | minor)
+    u32 pad;
+    u64 sector;
+};
+
+struct blk_req_t {
+    u64 issue_ns;      // 0 = ainda no escalonador (so block_rq_insert)
+    u32 pid;
+    u32 pad;
+};
+
+// Requisicoes em voo. LRU: a que nunca conclui (disco removido) sai sozinha.
+BPF_TABLE("lru_hash", struct blk_req_key_t, struct blk_req_t, blk_inflight, 16384);
+
+struct blk_dev_slot_t {
+    u32 dev;
+    u32 gen;
+    u64 slot;
+};
+
+struct blk_pid_slot_t {
+    u32 pid;
+    u32 gen;
+    u64 slot;
+};
+
+BPF_HISTOGRAM(blk_lat_dev, struct blk_dev_slot_t, 4096);
+BPF_HISTOGRAM(blk_lat_pid, struct blk_pid_slot_t, 32768);
+
+// Python Agent PID, read at runtime from agent_settings.
+// Era um #define reescrito no texto do fonte a cada partida, o que tornava o
+// fonte diferente em todo processo e impedia reaproveitar a compilacao.
+#define FILTER_PID ((u32)get_setting(SETTING_AGENT_PID))
 
 // ============================================================================
 // HELPER FUNCTIONS
 // ============================================================================
 
-static int populate_basic_info(struct event_data_t *data) {
+static int populate_basic_info(struct rec_hdr_t *data) {
     u64 id = bpf_get_current_pid_tgid();
     data->pid = id >> 32;
 
@@ -127,110 +488,464 @@ static int populate_basic_info(struct event_data_t *data) {
     bpf_get_current_comm(&data->comm, sizeof(data->comm));
     
     if (task->mm) {
-        data->mem_vsz = task->mm->total_vm << 12; // Pages to Bytes
-        data->mem_peak_rss = task->mm->hiwater_rss << 12;
+        data->mem_peak_rss = task->mm->hiwater_rss << 12; // Pages to Bytes
+    }
+    return 0;
+}
+
+// 1 when the event fits the (pid, kind) budget; otherwise counts it as
+// suppressed. O balde e atualizado sem trava: duas CPUs do mesmo processo
+// podem gastar o mesmo token, e o limite e aproximado, nunca mais frouxo que
+// uma rajada por CPU.
+static __always_inline int rate_allowed(u32 pid, u32 kind) {
+    struct rate_limit_t *lim = rate_limits.lookup(&kind);
+    if (!lim || lim->rate == 0) return 1;
+
+    u64 now = bpf_ktime_get_ns();
+    u64 rate = lim->rate > RL_MAX_RATE ? RL_MAX_RATE : lim->rate;
+    u64 burst = lim->burst > RL_MAX_BURST ? RL_MAX_BURST : lim->burst;
+    if (burst == 0) burst = 1;
+    u64 cap = burst * RL_TOKEN;
+    struct bucket_key_t key = {.pid = pid, .kind = kind};
+    struct bucket_t *b = rate_buckets.lookup(&key);
+    if (!b) {
+        struct bucket_t cheio = {.tokens = cap - RL_TOKEN, .last_ns = now};
+        rate_buckets.update(&key, &cheio);
+        return 1;
     }
+
+    u64 elapsed = now - b->last_ns;
+    if (elapsed > RL_MAX_ELAPSED) elapsed = RL_MAX_ELAPSED;
+    u64 tokens = b->tokens + elapsed * rate;
+    if (tokens > cap) tokens = cap;
+    b->last_ns = now;
+
+    if (tokens >= RL_TOKEN) {
+        b->tokens = tokens - RL_TOKEN;
+        return 1;
+    }
+    b->tokens = tokens;
+
+    struct suppress_key_t sk = {.pid = pid, .gen = current_gen(), .kind = kind};
+    u64 zero = 0;
+    u64 *n = suppressed_events.lookup_or_try_init(&sk, &zero);
+    if (n) __sync_fetch_and_add(n, 1);
     return 0;
 }
 
+// Reads a user path into a path record. Returns the bytes used (NUL included).
+static __always_inline int read_path(struct rec_path_t *rec,
+                                     const char __user *filename) {
+    int n = bpf_probe_read_user_str(&rec->filename, sizeof(rec->filename), (void *)filename);
+    if (n < 0) n = 0;
+    if (n > sizeof(rec->filename)) n = sizeof(rec->filename);
+    return n;
+}
+
+// Submits a path record with only the bytes the path uses.
+// Devolve < 0 quando o buffer recusou o envio (ja contado em submit_lost).
+static __always_inline int submit_path(void *ctx, struct rec_path_t *rec, int n) {
+    u32 size = sizeof(struct rec_hdr_t) + n;
+    rec->hdr.len = size;
+#ifdef SI_RINGBUF
+    int err = events.ringbuf_output(rec, size, 0);
+#else
+    int err = events.perf_submit(ctx, rec, size);
+#endif
+    if (err < 0) note_lost();
+    return err;
+}
+
 // ============================================================================
 // PROBES: PROCESS & FILE SYSTEM
 // ============================================================================
 
-// 1. EXECVE: New Process Creation
-int syscall__execve(struct pt_regs *ctx, const char __user *filename) {
-    struct event_data_t data = {};
-    if (populate_basic_info(&data)) return 0;
+// 1 when the path starts with one of the configured deny prefixes.
+// Mesmo criterio do startswith() que o Python aplicava: prefixo puro de texto.
+static __always_inline int path_denied(const char *path) {
+    #pragma unroll
+    for (int i = 0; i < DENY_PREFIX_MAX; i++) {
+        int idx = i;
+        struct deny_prefix_t *p = open_deny_prefixes.lookup(&idx);
+        if (!p || p->len == 0 || p->len > DENY_PREFIX_LEN) continue;
 
-    data.type_id = 'E';
-    bpf_probe_read_user_str(&data.filename, sizeof(data.filename), (void *)filename);
-    
-    events.perf_submit(ctx, &data, sizeof(data));
+        int match = 1;
+        #pragma unroll
+        for (int j = 0; j < DENY_PREFIX_LEN; j++) {
+            if (j >= p->len) break;
+            if (path[j] != p->prefix[j]) { match = 0; break; }
+        }
+        if (match) return 1;
+    }
     return 0;
 }
 
-// 2. OPENAT: File Opening
-int syscall__openat(struct pt_regs *ctx, int dfd, const char __user *filename) {
-    struct event_data_t data = {};
-    if (populate_basic_info(&data)) return 0;
+// Hash of the path, 8 bytes at a time. rec_path_t nasce zerada e o read_str
+// so escreve ate o NUL, entao as palavras depois do caminho sao zero e o
+// resultado so depende do texto.
+static __always_inline u64 path_hash(const char *path, int n) {
+    u64 h = 14695981039346656037ULL;   // FNV-1a offset basis
+    #pragma unroll
+    for (int i = 0; i < 256 / 8; i++) {
+        if (i * 8 >= n) break;
+        u64 w = 0;
+        __builtin_memcpy(&w, path + i * 8, 8);
+        h = (h ^ w) * 1099511628211ULL;
+    }
+    return h;
+}
 
-    data.type_id = 'O';
-    bpf_probe_read_user_str(&data.filename, sizeof(data.filename), (void *)filename);
-    
-    events.perf_submit(ctx, &data, sizeof(data));
+// 1 when this process already sent this path in the current window. So
+// consulta: quem marca o caminho como visto e open_mark_seen, depois de um
+// envio aceito. Marcado antes, um envio recusado (buffer cheio, orcamento do
+// processo) calava o caminho pelo resto da janela.
+static __always_inline int open_already_seen(struct open_key_t *key, u32 pid,
+                                             const char *path, int n) {
+    key->pid = pid;
+    key->gen = current_gen();
+    key->path_hash = path_hash(path, n);
+    return open_seen.lookup(key) != 0;
+}
+
+static __always_inline void open_mark_seen(struct open_key_t *key) {
+    u8 one = 1;
+    open_seen.update(key, &one);
+}
+
+// Process Lifecycle (fork / exec / exit)
+// A arvore era refeita varrendo /proc a cada janela: quatro arquivos por PID,
+// o passo mais caro do ciclo em hosts com 20k+ tarefas. Com estes tres eventos
+// o motor mantem a arvore incrementalmente e so reconcilia com /proc de
+// tempos em tempos (engine.proc_reconcile_s).
+
+// 1. FORK: task:task_newtask, no mesmo ponto de sched_process_fork, mas com
+// clone_flags: threads (CLONE_THREAD) nao sao processos e ficam fora daqui.
+// O filho ainda e uma copia do pai; o registro leva o comm e o usuario dele.
+TRACEPOINT_PROBE(task, task_newtask) {
+    if (args->clone_flags & CLONE_THREAD) return 0;
+
+    struct rec_hdr_t rec = {};
+    if (populate_basic_info(&rec)) return 0;
+    if (!rate_allowed(rec.pid, RL_EXEC)) return 0;
+
+    rec.ppid = rec.pid;
+    rec.pid = args->pid;
+    rec.type_id = 'F';
+    rec.len = sizeof(rec);
+    SUBMIT(args, &rec, sizeof(rec));
     return 0;
 }
 
+// 2. EXEC: sched_process_exec so dispara para exec bem-sucedido, ja com o
+// comm novo. O kprobe de execve anterior via tambem as tentativas que falham.
+TRACEPOINT_PROBE(sched, sched_process_exec) {
+    struct rec_path_t rec = {};
+    if (populate_basic_info(&rec.hdr)) return 0;
+    // Cobrado do pai: numa rajada de execs curtos cada filho executa uma vez.
+    if (!rate_allowed(rec.hdr.ppid, RL_EXEC)) return 0;
+
+    rec.hdr.type_id = 'E';
+    unsigned short off = args->data_loc_filename & 0xFFFF;
+    int n = SAFE_KREAD_STR(&rec.filename, sizeof(rec.filename), (void *)args + off);
+    if (n < 0) n = 0;
+    if (n > sizeof(rec.filename)) n = sizeof(rec.filename);
+    submit_path(args, &rec, n);
+    return 0;
+}
+
+// Estado por tarefa que so existe enquanto ela vive. Sem isto o io_start de
+// uma thread que saiu no meio de um read ficava para sempre (hash comum, sem
+// LRU), e os baldes de um PID reciclado herdavam o saldo do processo anterior.
+// Os contadores da janela (net_*, tcp_*, io_stats, cpu_ns) NAO saem aqui: o
+// processo que morreu na janela ainda precisa aparecer nela com o que fez, e
+// a chave sai quando o motor le e apaga a geracao.
+static __always_inline void prune_exited(u64 id) {
+    u32 tid = (u32)id;
+    io_start.delete(&tid);
+    if (tid != (id >> 32)) return;
+
+    struct bucket_key_t key = {.pid = tid};
+    #pragma unroll
+    for (u32 kind = 0; kind < RL_KINDS; kind++) {
+        key.kind = kind;
+        rate_buckets.delete(&key);
+    }
+}
+
+// 3. EXIT: so a saida do lider do grupo encerra o processo; a de cada thread
+// nao interessa a arvore. O instante vem do kernel, nao da leitura do buffer.
+TRACEPOINT_PROBE(sched, sched_process_exit) {
+    u64 id = bpf_get_current_pid_tgid();
+    prune_exited(id);
+    if ((u32)id != (id >> 32)) return 0;
+
+    struct rec_exit_t rec = {};
+    if (populate_basic_info(&rec.hdr)) return 0;
+    if (!rate_allowed(rec.hdr.ppid, RL_EXEC)) return 0;
+
+    struct task_struct *task = (struct task_struct *)bpf_get_current_task();
+    rec.hdr.type_id = 'X';
+    rec.hdr.len = sizeof(rec);
+    rec.exit_ns = bpf_ktime_get_ns();
+    rec.exit_code = task->exit_code;
+    SUBMIT(args, &rec, sizeof(rec));
+    return 0;
+}
+
+// 4. OPENAT: File Opening
+// Filtro e deduplicacao antes do envio: o que e descartado aqui nao custa
+// transporte nem decodificacao. O ponto de entrada depende do modo de
+// anexacao (ver ATTACH MODES no topo); o trabalho e o mesmo em todos.
+static __always_inline int trace_openat(void *ctx, const char __user *filename) {
+    // Amostragem do governador de custo (nivel sampled_opens): decidida antes
+    // de copiar o caminho, que e a parte cara desta sonda.
+    u64 sample = get_setting(SETTING_OPEN_SAMPLE);
+    if (sample > 1 && bpf_get_prandom_u32() % sample) return 0;
+
+    struct rec_path_t rec = {};
+    if (populate_basic_info(&rec.hdr)) return 0;
+
+    int n = read_path(&rec, filename);
+    if (path_denied(rec.filename)) return 0;
+    struct open_key_t seen = {};
+    int dedupe = get_setting(SETTING_OPEN_DEDUPE) != 0;
+    if (dedupe && open_already_seen(&seen, rec.hdr.pid, rec.filename, n)) return 0;
+    if (!rate_allowed(rec.hdr.pid, RL_OPEN)) return 0;
+
+    rec.hdr.type_id = 'O';
+    if (submit_path(ctx, &rec, n) == 0 && dedupe) open_mark_seen(&seen);
+    return 0;
+}
+
+#if defined(SI_ATTACH_TRACEPOINT) || defined(SI_ATTACH_FENTRY)
+TRACEPOINT_PROBE(syscalls, sys_enter_openat) {
+    return trace_openat(args, (const char __user *)args->filename);
+}
+#else
+int syscall__openat(struct pt_regs *ctx, int dfd, const char __user *filename) {
+    return trace_openat(ctx, filename);
+}
+#endif
+
 // ============================================================================
-// PROBES: DISK I/O LATENCY (The "Hot" Metric)
+// PROBES: CPU TIME
 // ============================================================================
 
-// Entry Probe: Record start timestamp
-int kprobe__vfs_read(struct pt_regs *ctx) {
+// Tempo fora da CPU. Quem sai dormindo num estado monitorado guarda inicio e
+// pilha (a pilha corrente e a dele: o tracepoint roda no seu contexto); quem
+// entra fecha a propria espera. Preempcao (prev_state 0) nao e espera.
+static __always_inline void offcpu_switch(void *ctx, long prev_state, u32 next_tid,
+                                          u64 now) {
+    u64 mask = get_setting(SETTING_OFFCPU_STATES);
+    if (!mask) return;
+
+    if (prev_state & mask) {
+        u64 id = bpf_get_current_pid_tgid();
+        u32 tid = id, tgid = id >> 32;
+        if (tgid != 0 && tgid != FILTER_PID) {
+            struct offcpu_start_t st = {.ts = now, .tgid = tgid};
+            st.stack_id = offcpu_stacks.get_stackid(ctx, 0);
+            offcpu_start.update(&tid, &st);
+        }
+    }
+
+    struct offcpu_start_t *st = offcpu_start.lookup(&next_tid);
+    if (!st) return;
+    struct offcpu_key_t key = {.pid = st->tgid, .gen = current_gen(),
+                               .stack_id = st->stack_id};
+    u64 delta = now - st->ts;
+    offcpu_start.delete(&next_tid);
+
+    u64 zero = 0, *val = offcpu_ns.lookup_or_try_init(&key, &zero);
+    if (val) __sync_fetch_and_add(val, delta);
+}
+
+// O tracepoint roda no contexto da tarefa que SAI da CPU: o pid_tgid corrente
+// e dela, e o intervalo desde a ultima troca nesta CPU e o tempo que ela usou.
+// O idle (pid 0) nao e processo e nao entra.
+TRACEPOINT_PROBE(sched, sched_switch) {
+    u64 now = bpf_ktime_get_ns();
+    offcpu_switch(args, args->prev_state, args->next_pid, now);
+
+    int zero_idx = 0;
+    u64 *since = oncpu_since.lookup(&zero_idx);
+    if (!since) return 0;
+
+    u64 start = *since;
+    *since = now;    // Per-CPU slot: no atomic needed
+    if (start == 0) return 0;
+
     u32 pid = bpf_get_current_pid_tgid() >> 32;
-    if (pid == FILTER_PID) return 0;
-    
-    u64 ts = bpf_ktime_get_ns();
-    io_start.update(&pid, &ts);
+    if (pid == 0 || pid == FILTER_PID) return 0;
+
+    u64 zero = 0, *val;
+    struct pid_gen_key_t key = {.pid = pid, .gen = current_gen()};
+    val = cpu_ns.lookup_or_try_init(&key, &zero);
+    if (val) __sync_fetch_and_add(val, now - start);
     return 0;
 }
 
-// Return Probe: Calculate Delta (Latency) and Bytes
-int kretprobe__vfs_read(struct pt_regs *ctx) {
-    struct event_data_t data = {};
-    u32 pid = bpf_get_current_pid_tgid() >> 32;
+// ============================================================================
+// PROBES: DISK I/O LATENCY (The "Hot" Metric)
+// ============================================================================
+
+// Aggregates one completed read/write into io_stats and, only when the debug
+// flag is on, also emits the per-syscall event the engine used to consume.
+static __always_inline int account_io(void *ctx, char type_id, ssize_t ret) {
+    u64 id = bpf_get_current_pid_tgid();
+    u32 pid = id >> 32;
+    u32 tid = (u32)id;
     if (pid == FILTER_PID) return 0;
 
-    // Calculate Latency
-    u64 *tsp = io_start.lookup(&pid);
+    // Latencia medida por thread: duas threads do mesmo processo em I/O
+    // simultaneo sobrescreviam o timestamp uma da outra quando a chave era o PID.
+    u64 latency = 0;
+    u64 *tsp = io_start.lookup(&tid);
     if (tsp) {
-        u64 delta = bpf_ktime_get_ns() - *tsp;
-        // Optimization: Only report if latency > 1ms (1,000,000ns) or large read
-        // to reduce noise, unless it's critical.
-        data.io_latency_ns = delta;
-        io_start.delete(&pid);
+        latency = bpf_ktime_get_ns() - *tsp;
+        io_start.delete(&tid);
     }
 
-    ssize_t ret = PT_REGS_RC(ctx);
-    if (ret > 0) {
-        if (populate_basic_info(&data)) return 0;
-        data.type_id = 'R';
-        data.io_bytes = ret;
-        
-        // Submit if we have significant data
-        if (data.io_bytes > 0) events.perf_submit(ctx, &data, sizeof(data));
+    if (ret <= 0) return 0;
+
+    struct io_key_t key = {};
+    key.pid = pid;
+    key.tid = get_setting(SETTING_IO_PER_TID) ? tid : 0;
+    key.gen = current_gen();
+
+    struct io_stats_t zero = {};
+    struct io_stats_t *st = io_stats.lookup_or_try_init(&key, &zero);
+    if (st) {
+        if (type_id == 'R') {
+            __sync_fetch_and_add(&st->read_bytes, ret);
+            __sync_fetch_and_add(&st->read_ops, 1);
+        } else {
+            __sync_fetch_and_add(&st->write_bytes, ret);
+            __sync_fetch_and_add(&st->write_ops, 1);
+        }
+        if (latency > 0) {
+            __sync_fetch_and_add(&st->latency_ns, latency);
+            __sync_fetch_and_add(&st->latency_ops, 1);
+        }
     }
+
+    // Per-syscall events stay available only behind the explicit debug flag.
+    if (!get_setting(SETTING_IO_EVENTS)) return 0;
+
+    struct rec_io_t rec = {};
+    if (populate_basic_info(&rec.hdr)) return 0;
+    if (!rate_allowed(pid, RL_IO)) return 0;
+    rec.hdr.type_id = type_id;
+    rec.hdr.len = sizeof(rec);
+    rec.io_bytes = ret;
+    rec.io_latency_ns = latency;
+    SUBMIT(ctx, &rec, sizeof(rec));
     return 0;
 }
 
-// Entry Probe: Record start timestamp for Write
-int kprobe__vfs_write(struct pt_regs *ctx) {
-    u32 pid = bpf_get_current_pid_tgid() >> 32;
-    if (pid == FILTER_PID) return 0;
-    
+// Entry Probe: Record start timestamp (per thread)
+static __always_inline int mark_io_start(void) {
+    u64 id = bpf_get_current_pid_tgid();
+    if ((id >> 32) == FILTER_PID) return 0;
+
+    u32 tid = (u32)id;
     u64 ts = bpf_ktime_get_ns();
-    io_start.update(&pid, &ts);
+    io_start.update(&tid, &ts);
     return 0;
 }
 
+#if defined(SI_ATTACH_TRACEPOINT)
+// Tracepoints de syscall: read/pread64 e write/pwrite64 sao as syscalls que
+// chegam a vfs_read/vfs_write. A latencia passa a ser a da syscall inteira.
+TRACEPOINT_PROBE(syscalls, sys_enter_read) { return mark_io_start(); }
+TRACEPOINT_PROBE(syscalls, sys_exit_read) { return account_io(args, 'R', args->ret); }
+TRACEPOINT_PROBE(syscalls, sys_enter_pread64) { return mark_io_start(); }
+TRACEPOINT_PROBE(syscalls, sys_exit_pread64) { return account_io(args, 'R', args->ret); }
+TRACEPOINT_PROBE(syscalls, sys_enter_write) { return mark_io_start(); }
+TRACEPOINT_PROBE(syscalls, sys_exit_write) { return account_io(args, 'W', args->ret); }
+TRACEPOINT_PROBE(syscalls, sys_enter_pwrite64) { return mark_io_start(); }
+TRACEPOINT_PROBE(syscalls, sys_exit_pwrite64) { return account_io(args, 'W', args->ret); }
+
+#elif defined(SI_ATTACH_FENTRY)
+// fentry/fexit (BTF, 5.5+): trampolim direto, sem a armadilha do kprobe nem a
+// pilha de retorno do kretprobe. O fexit ja recebe o valor de retorno.
+KFUNC_PROBE(vfs_read, struct file *file) { return mark_io_start(); }
+KRETFUNC_PROBE(vfs_read, struct file *file, char *buf, size_t count, loff_t *pos, ssize_t ret) {
+    return account_io(ctx, 'R', ret);
+}
+KFUNC_PROBE(vfs_write, struct file *file) { return mark_io_start(); }
+KRETFUNC_PROBE(vfs_write, struct file *file, const char *buf, size_t count, loff_t *pos, ssize_t ret) {
+    return account_io(ctx, 'W', ret);
+}
+
+#else
+// kprobe/kretprobe: ultimo recurso. Nomes sem o prefixo kprobe__ de proposito:
+// com ele o BCC anexa sozinho na carga e o motor anexaria de novo.
+int trace_vfs_read_entry(struct pt_regs *ctx) {
+    return mark_io_start();
+}
+
+// Return Probe: Calculate Delta (Latency) and Bytes
+int trace_vfs_read_return(struct pt_regs *ctx) {
+    return account_io(ctx, 'R', PT_REGS_RC(ctx));
+}
+
+// Entry Probe: Record start timestamp for Write
+int trace_vfs_write_entry(struct pt_regs *ctx) {
+    return mark_io_start();
+}
+
 // Return Probe: Write Latency
-int kretprobe__vfs_write(struct pt_regs *ctx) {
-    struct event_data_t data = {};
-    u32 pid = bpf_get_current_pid_tgid() >> 32;
-    
-    u64 *tsp = io_start.lookup(&pid);
-    if (tsp) {
-        data.io_latency_ns = bpf_ktime_get_ns() - *tsp;
-        io_start.delete(&pid);
-    }
+int trace_vfs_write_return(struct pt_regs *ctx) {
+    return account_io(ctx, 'W', PT_REGS_RC(ctx));
+}
+#endif
 
-    ssize_t ret = PT_REGS_RC(ctx);
-    if (ret > 0) {
-        if (populate_basic_info(&data)) return 0;
-        data.type_id = 'W';
-        data.io_bytes = ret;
-        if (data.io_bytes > 0) events.perf_submit(ctx, &data, sizeof(data));
-    }
+// ============================================================================
+// PROBES: BLOCK I/O LATENCY (Device Level)
+// ============================================================================
+
+// block_rq_issue costuma rodar em quem esvazia a fila (kworker, outra tarefa
+// do mesmo plug). block_rq_insert, quando a requisicao passa pelo
+// escalonador, ainda roda em quem a pediu: o pid dele prevalece. Escrita
+// atrasada (writeback) fica, corretamente, com a thread de flush.
+TRACEPOINT_PROBE(block, block_rq_insert) {
+    struct blk_req_key_t key = {.dev = args->dev, .sector = args->sector};
+    struct blk_req_t req = {.pid = bpf_get_current_pid_tgid() >> 32};
+    blk_inflight.update(&key, &req);
+    return 0;
+}
+
+TRACEPOINT_PROBE(block, block_rq_issue) {
+    struct blk_req_key_t key = {.dev = args->dev, .sector = args->sector};
+    struct blk_req_t req = {};
+    struct blk_req_t *fila = blk_inflight.lookup(&key);
+    req.pid = fila ? fila->pid : bpf_get_current_pid_tgid() >> 32;
+    req.issue_ns = bpf_ktime_get_ns();
+    blk_inflight.update(&key, &req);
+    return 0;
+}
+
+// Roda na interrupcao de conclusao: nada aqui depende da tarefa corrente.
+TRACEPOINT_PROBE(block, block_rq_complete) {
+    struct blk_req_key_t key = {.dev = args->dev, .sector = args->sector};
+    struct blk_req_t *req = blk_inflight.lookup(&key);
+    if (!req) return 0;
+    u64 issue_ns = req->issue_ns;
+    u32 pid = req->pid;
+    blk_inflight.delete(&key);
+    if (!issue_ns) return 0;
+
+    u64 slot = bpf_log2l((bpf_ktime_get_ns() - issue_ns) / 1000);
+    u32 gen = current_gen();
+    struct blk_dev_slot_t dk = {.dev = args->dev, .gen = gen, .slot = slot};
+    blk_lat_dev.increment(dk);
+
+    // O disco conta tudo; o proprio agente e o contexto de interrupcao sem
+    // dono conhecido nao viram processo.
+    if (pid == 0 || pid == FILTER_PID) return 0;
+    struct blk_pid_slot_t pk = {.pid = pid, .gen = gen, .slot = slot};
+    blk_lat_pid.increment(pk);
     return 0;
 }
 
@@ -238,26 +953,208 @@ int kretprobe__vfs_write(struct pt_regs *ctx) {
 // PROBES: NETWORK BUFFER & TRAFFIC (Driver Level)
 // ============================================================================
 
-// 1. TCP Connect (New Connections)
-int kprobe__tcp_v4_connect(struct pt_regs *ctx, struct sock *sk) {
-    struct event_data_t data = {};
-    if (populate_basic_info(&data)) return 0;
+// 1. Connections per Destination (conn_stats)
+// Uma entrada por (processo, familia, destino, porta, protocolo): TCP conta o
+// connect e, no fechamento, os bytes da conexao; UDP conta cada envio e os
+// bytes. Nenhum evento por conexao.
+static __always_inline void conn_account(struct conn_key_t *key, u64 count, u64 bytes) {
+    // first_ns so vale na criacao; somas atomicas, o mesmo destino e usado
+    // de varias CPUs ao mesmo tempo.
+    u64 now = bpf_ktime_get_ns();
+    struct conn_stats_t init = {.first_ns = now};
+    struct conn_stats_t *st = conn_stats.lookup_or_try_init(key, &init);
+    if (st) {
+        if (count) __sync_fetch_and_add(&st->count, count);
+        if (bytes) __sync_fetch_and_add(&st->bytes, bytes);
+        st->last_ns = now;
+    }
+}
 
-    data.type_id = 'N';
-    struct sockaddr_in *daddr = (struct sockaddr_in *)PT_REGS_PARM2(ctx);
-    
+// 1 = processo do proprio agente.
+static __always_inline int conn_key_init(struct conn_key_t *key, u8 proto) {
+    key->pid = bpf_get_current_pid_tgid() >> 32;
+    if (key->pid == FILTER_PID) return 1;
+    key->gen = current_gen();
+    key->proto = proto;
+    return 0;
+}
+
+static __always_inline void conn_key_v4(struct conn_key_t *key, u32 daddr, u16 dport) {
+    key->family = AF_INET;
+    key->dport = dport;
+    __builtin_memcpy(key->daddr, &daddr, sizeof(daddr));
+}
+
+// 1 = IPv4 mapeado (::ffff:a.b.c.d): o kernel o passa adiante para
+// tcp_v4_connect/udp_sendmsg, que ja o contam.
+static __always_inline int conn_key_v6(struct conn_key_t *key, const u8 *daddr, u16 dport) {
+    __builtin_memcpy(key->daddr, daddr, sizeof(key->daddr));
+    u64 alto = 0;
+    __builtin_memcpy(&alto, key->daddr, sizeof(alto));
+    if (alto == 0 && key->daddr[8] == 0 && key->daddr[9] == 0 &&
+        key->daddr[10] == 0xff && key->daddr[11] == 0xff) return 1;
+    key->family = AF_INET6;
+    key->dport = dport;
+    return 0;
+}
+
+// TCP: conta o connect e lembra a chave do socket; no fechamento os bytes da
+// conexao entram na mesma entrada, na geracao em que ela fechou.
+static __always_inline int conn_connected(struct sock *sk, struct conn_key_t *key) {
+    u64 skp = (u64)sk;
+    conn_account(key, 1, 0);
+    conn_socks.update(&skp, key);
+    return 0;
+}
+
+static __always_inline int conn_sock_closed(struct sock *sk) {
+    u64 skp = (u64)sk;
+    struct conn_key_t *salvo = conn_socks.lookup(&skp);
+    if (!salvo) return 0;
+    struct conn_key_t key = *salvo;
+    conn_socks.delete(&skp);
+
+    struct tcp_sock *tp = (struct tcp_sock *)sk;
+    u64 acked = 0, received = 0;
+    SAFE_KREAD(&acked, &tp->bytes_acked);
+    SAFE_KREAD(&received, &tp->bytes_received);
+    key.gen = current_gen();
+    if (acked + received) conn_account(&key, 0, acked + received);
+    return 0;
+}
+
+static __always_inline int trace_connect_v4(struct sock *sk, struct sockaddr_in *uaddr) {
+    struct conn_key_t key = {};
+    if (conn_key_init(&key, IPPROTO_TCP)) return 0;
+    u32 daddr = 0;
+    u16 dport = 0;
     // [PATCH] Using SAFE_KREAD for Kernel 6.x compatibility
-    SAFE_KREAD(&data.daddr, &daddr->sin_addr.s_addr);
-    SAFE_KREAD(&data.dport, &daddr->sin_port);
-    
-    // Get Source Info from Socket
-    data.saddr = sk->__sk_common.skc_rcv_saddr;
-    data.sport = sk->__sk_common.skc_num;
+    SAFE_KREAD(&daddr, &uaddr->sin_addr.s_addr);
+    SAFE_KREAD(&dport, &uaddr->sin_port);
+    conn_key_v4(&key, daddr, dport);
+    return conn_connected(sk, &key);
+}
+
+static __always_inline int trace_connect_v6(struct sock *sk, struct sockaddr_in6 *uaddr) {
+    struct conn_key_t key = {};
+    if (conn_key_init(&key, IPPROTO_TCP)) return 0;
+    u8 daddr[16] = {};
+    u16 family = 0, dport = 0;
+    SAFE_KREAD(&family, &uaddr->sin6_family);
+    if (family != AF_INET6) return 0;
+    SAFE_KREAD(&daddr, &uaddr->sin6_addr);
+    SAFE_KREAD(&dport, &uaddr->sin6_port);
+    if (conn_key_v6(&key, daddr, dport)) return 0;
+    return conn_connected(sk, &key);
+}
 
-    events.perf_submit(ctx, &data, sizeof(data));
+// UDP: destino do sendto() (msg_name) ou, em socket conectado, o do socket.
+static __always_inline int trace_udp_send(struct sock *sk, struct msghdr *msg,
+                                          size_t len, u16 family) {
+    struct conn_key_t key = {};
+    if (conn_key_init(&key, IPPROTO_UDP)) return 0;
+    void *name = NULL;
+    u16 dport = 0;
+    SAFE_KREAD(&name, &msg->msg_name);
+
+    if (family == AF_INET6) {
+        u8 daddr[16] = {};
+        if (name) {
+            struct sockaddr_in6 *sin6 = (struct sockaddr_in6 *)name;
+            u16 sa_family = 0;
+            SAFE_KREAD(&sa_family, &sin6->sin6_family);
+            if (sa_family != AF_INET6) return 0;   // udp_sendmsg conta
+            SAFE_KREAD(&daddr, &sin6->sin6_addr);
+            SAFE_KREAD(&dport, &sin6->sin6_port);
+        } else {
+            SAFE_KREAD(&daddr, &sk->__sk_common.skc_v6_daddr);
+            SAFE_KREAD(&dport, &sk->__sk_common.skc_dport);
+        }
+        if (conn_key_v6(&key, daddr, dport)) return 0;
+    } else {
+        u32 daddr = 0;
+        if (name) {
+            struct sockaddr_in *sin = (struct sockaddr_in *)name;
+            SAFE_KREAD(&daddr, &sin->sin_addr.s_addr);
+            SAFE_KREAD(&dport, &sin->sin_port);
+        } else {
+            SAFE_KREAD(&daddr, &sk->__sk_common.skc_daddr);
+            SAFE_KREAD(&dport, &sk->__sk_common.skc_dport);
+        }
+        conn_key_v4(&key, daddr, dport);
+    }
+    conn_account(&key, 1, len);
     return 0;
 }
 
+// IPv6 fica em kprobe tambem no modo fentry: com ipv6 como modulo, fentry
+// nele exige BTF de modulo (5.11+). O motor anexa as kprobes de conexao de
+// cada modo (attach.CONN_KPROBES) e segue sem a que o kernel nao tiver.
+#if defined(SI_ATTACH_TRACEPOINT)
+// O socket entra em SYN_SENT dentro do proprio tcp_v4/v6_connect(), ainda no
+// contexto do processo que chamou connect(); TCP_CLOSE fecha a conta de bytes.
+// O tracepoint traz as portas em ordem do host.
+TRACEPOINT_PROBE(sock, inet_sock_set_state) {
+    if (args->protocol != IPPROTO_TCP) return 0;
+    struct sock *sk = (struct sock *)args->skaddr;
+    if (args->newstate == TCP_CLOSE) return conn_sock_closed(sk);
+    if (args->newstate != TCP_SYN_SENT) return 0;
+
+    struct conn_key_t key = {};
+    if (conn_key_init(&key, IPPROTO_TCP)) return 0;
+    u32 daddr = 0;
+    u16 dport = htons(args->dport);
+    __builtin_memcpy(&daddr, args->daddr, sizeof(daddr));
+    if (args->family == AF_INET6) {
+        // Mapeado: o socket e IPv6, mas o destino e o IPv4 de args->daddr.
+        if (conn_key_v6(&key, args->daddr_v6, dport)) conn_key_v4(&key, daddr, dport);
+    } else if (args->family == AF_INET) {
+        conn_key_v4(&key, daddr, dport);
+    } else {
+        return 0;
+    }
+    return conn_connected(sk, &key);
+}
+
+#elif defined(SI_ATTACH_FENTRY)
+KFUNC_PROBE(tcp_v4_connect, struct sock *sk, struct sockaddr *uaddr) {
+    return trace_connect_v4(sk, (struct sockaddr_in *)uaddr);
+}
+
+KFUNC_PROBE(tcp_close, struct sock *sk) {
+    return conn_sock_closed(sk);
+}
+
+KFUNC_PROBE(udp_sendmsg, struct sock *sk, struct msghdr *msg, size_t len) {
+    return trace_udp_send(sk, msg, len, AF_INET);
+}
+
+#else
+int trace_tcp_v4_connect(struct pt_regs *ctx, struct sock *sk, struct sockaddr *uaddr) {
+    return trace_connect_v4(sk, (struct sockaddr_in *)uaddr);
+}
+
+int trace_tcp_close(struct pt_regs *ctx, struct sock *sk) {
+    return conn_sock_closed(sk);
+}
+#endif
+
+#if !defined(SI_ATTACH_TRACEPOINT)
+int trace_tcp_v6_connect(struct pt_regs *ctx, struct sock *sk, struct sockaddr *uaddr) {
+    return trace_connect_v6(sk, (struct sockaddr_in6 *)uaddr);
+}
+#endif
+
+#if !defined(SI_ATTACH_FENTRY)
+int trace_udp_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg, size_t len) {
+    return trace_udp_send(sk, msg, len, AF_INET);
+}
+#endif
+
+int trace_udpv6_sendmsg(struct pt_regs *ctx, struct sock *sk, struct msghdr *msg, size_t len) {
+    return trace_udp_send(sk, msg, len, AF_INET6);
+}
+
 // 2. Interface Buffer TX (Queuing) - Replaces simple tcp_sendmsg for lower level view
 TRACEPOINT_PROBE(net, net_dev_xmit) {
     u32 pid = bpf_get_current_pid_tgid() >> 32;
@@ -266,8 +1163,9 @@ TRACEPOINT_PROBE(net, net_dev_xmit) {
     u64 len = args->len;
     u64 zero = 0, *val;
     
-    // Aggregate Total Bytes Sent
-    val = net_bytes_sent.lookup_or_try_init(&pid, &zero);
+    // Aggregate Total Bytes Sent (copia desta CPU: sem atomico, sem disputa)
+    struct pid_gen_key_t key = {.pid = pid, .gen = current_gen()};
+    val = net_bytes_sent.lookup_or_try_init(&key, &zero);
     if (val) { (*val) += len; }
 
     return 0;
@@ -281,8 +1179,9 @@ TRACEPOINT_PROBE(net, netif_receive_skb) {
     u64 len = args->len;
     u64 zero = 0, *val;
 
-    // Aggregate Total Bytes Received
-    val = net_bytes_recv.lookup_or_try_init(&pid, &zero);
+    // Aggregate Total Bytes Received (copia desta CPU)
+    struct pid_gen_key_t key = {.pid = pid, .gen = current_gen()};
+    val = net_bytes_recv.lookup_or_try_init(&key, &zero);
     if (val) { (*val) += len; }
 
     return 0;
@@ -294,20 +1193,23 @@ TRACEPOINT_PROBE(tcp, tcp_retransmit_skb) {
     if (pid == FILTER_PID) return 0;
 
     u64 zero = 0, *val;
-    val = tcp_retrans_map.lookup_or_try_init(&pid, &zero);
+    struct pid_gen_key_t key = {.pid = pid, .gen = current_gen()};
+    val = tcp_retrans_map.lookup_or_try_init(&key, &zero);
     if (val) (*val)++;
     
     return 0;
 }
 
 // 5. Packet Drops (Detailed Analysis) [UPDATED v0.50.41]
-// We now parse the SKB to see WHAT is being dropped (Source/Dest IP)
+// We now parse the SKB to see WHAT is being dropped (Source/Dest IP) and sum
+// it per flow in drop_flows: no event per packet.
 TRACEPOINT_PROBE(skb, kfree_skb) {
     u32 pid = bpf_get_current_pid_tgid() >> 32;
     
     // Always count drops in the aggregated map for stats
     u64 zero = 0, *val;
-    val = tcp_drop_map.lookup_or_try_init(&pid, &zero);
+    struct pid_gen_key_t key = {.pid = pid, .gen = current_gen()};
+    val = tcp_drop_map.lookup_or_try_init(&key, &zero);
     if (val) (*val)++;
 
     // If it's the agent itself, don't analyze headers
@@ -326,43 +1228,46 @@ TRACEPOINT_PROBE(skb, kfree_skb) {
     SAFE_KREAD(&head, &skb->head);
     SAFE_KREAD(&network_header, &skb->network_header);
 
-    // Assume IPv4 for now (version check usually needed but kept simple for perf)
     struct iphdr iph;
     
     // [PATCH] Using SAFE_KREAD for Kernel 6.x compatibility (Reading packet data via ptr)
     SAFE_KREAD(&iph, head + network_header);
 
-    // If protocol is TCP (6) or UDP (17), capture it
-    if (iph.protocol == 6 || iph.protocol == 17) {
-        struct event_data_t data = {};
-        
-        // We use PID 0 if the drop happens in SoftIRQ context (Driver level)
-        // But we still want to report the packet details.
-        data.pid = pid;
-        data.uid = bpf_get_current_uid_gid();
-        bpf_get_current_comm(&data.comm, sizeof(data.comm));
-        
-        data.type_id = 'D'; // Drop Event
-        data.saddr = iph.saddr;
-        data.daddr = iph.daddr;
-        data.proto = iph.protocol;
-        data.net_len = skb->len;
-        
-        // Extract Ports (Offset depends on IHL)
-        // IP Header Length is in 32-bit words
-        u8 ihl = iph.ihl * 4;
-        
-        // Read Transport Header (TCP/UDP ports are at the start)
-        struct tcphdr tcph;
-        // [PATCH] Using SAFE_KREAD for Kernel 6.x compatibility
-        SAFE_KREAD(&tcph, head + network_header + ihl);
-        
-        data.sport = tcph.source;
-        data.dport = tcph.dest;
-        
-        // Submit individual Drop events to Perf Buffer.
-        // The Python engine will filter or aggregate these to show "Process X had Y drops"
-        events.perf_submit(args, &data, sizeof(data));
+    // So IPv4 TCP (6) ou UDP (17): o resto fica so na contagem acima.
+    if (iph.version != 4 || (iph.protocol != 6 && iph.protocol != 17)) return 0;
+
+    // We use PID 0 if the drop happens in SoftIRQ context (Driver level)
+    // But we still want to report the packet details.
+    struct drop_flow_key_t fk = {};
+    fk.pid = pid;
+    fk.gen = key.gen;
+    fk.saddr = iph.saddr;
+    fk.daddr = iph.daddr;
+    fk.proto = iph.protocol;
+#if LINUX_VERSION_CODE >= KERNEL_VERSION(5,17,0)
+    fk.reason = args->reason;
+#endif
+
+    // Extract Ports (Offset depends on IHL)
+    // IP Header Length is in 32-bit words
+    u8 ihl = iph.ihl * 4;
+    
+    // Read Transport Header (TCP/UDP ports are at the start)
+    struct tcphdr tcph;
+    // [PATCH] Using SAFE_KREAD for Kernel 6.x compatibility
+    SAFE_KREAD(&tcph, head + network_header + ihl);
+    fk.sport = tcph.source;
+    fk.dport = tcph.dest;
+
+    // first_ns so vale na criacao da entrada; as somas sao atomicas porque o
+    // mesmo fluxo e descartado em varias CPUs ao mesmo tempo.
+    u64 now = bpf_ktime_get_ns();
+    struct drop_flow_t init = {.first_ns = now};
+    struct drop_flow_t *flow = drop_flows.lookup_or_try_init(&fk, &init);
+    if (flow) {
+        __sync_fetch_and_add(&flow->count, 1);
+        __sync_fetch_and_add(&flow->bytes, (u64)skb->len);
+        flow->last_ns = now;
     }
 
     return 0;
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/batch.py
+# DESCRIPTION: Decoding of kernel records in batches, off the poll thread.
+#
+#              A thread de leitura do perf/ring buffer e uma so. Com o
+#              tratamento inteiro dentro do callback do BCC, cada evento pagava
+#              a copia, a decodificacao e a atualizacao da arvore antes de o
+#              proximo poder sair do kernel; o teto de eventos/s do agente era
+#              o dessa thread. Aqui o callback so copia os bytes para um lote
+#              pre-alocado. Um worker desempacota o lote com os layouts de
+#              records.py, sem copia (memoryview), e entrega cada registro ao
+#              tratador, na ordem em que o callback os copiou.
+#
+# BACKPRESSURE: Os lotes sao um conjunto fixo. Se o worker fica para tras e
+#              todos estao cheios, a thread de leitura espera por um livre e o
+#              kernel passa a recusar envios, que sao contados em submit_lost.
+#              A perda fica visivel na captura, em vez de a memoria do agente
+#              crescer sem limite.
+#
+# DRAIN:       drain() espera os lotes entregues ATE a chamada, nao a fila
+#              vazia: com a leitura ativa a fila nunca esvazia, e quem fecha a
+#              janela (rotate, com o lock do motor) ficaria preso. A espera e
+#              limitada pelo numero de lotes.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import array
+import ctypes as ct
+import queue
+import threading
+
+from src.probes.records import decode
+
+DEFAULT_BATCH_BYTES = 256 * 1024
+DEFAULT_BATCHES = 8
+
+# Maior registro enviado pelas sondas: cabecalho + caminho (rec_path_t).
+MAX_RECORD_BYTES = 48 + 256
+
+
+class _Batch:
+    """Um buffer pre-alocado e os limites de cada registro copiado nele."""
+    __slots__ = ("buf", "view", "addr", "capacity", "used", "sizes")
+
+    def __init__(self, capacity):
+        self.buf = bytearray(capacity)
+        self.view = memoryview(self.buf)
+        self.addr = ct.addressof((ct.c_char * capacity).from_buffer(self.buf))
+        self.capacity = capacity
+        self.used = 0
+        # So os tamanhos: os registros ficam contiguos, o offset de cada um e
+        # a soma dos anteriores e o worker o reconstroi ao percorrer o lote.
+        self.sizes = array.array('I')
+
+    def reset(self):
+        self.used = 0
+        del self.sizes[:]
+
+
+class EventBatcher:
+    """
+    Copia registros brutos em lotes (thread de leitura) e os decodifica em um
+    worker proprio.
+
+    add() e flush() so podem ser chamados pela thread de leitura; drain() por
+    quem precisa de todos os eventos ja entregues tratados (stop, rotate).
+
+    PARAMETER on_batch: chamado pelo worker com (view, sizes) de cada lote
+              antes da decodificacao (gravacao dos registros brutos).
+    PARAMETER cpu_clock: relogio de CPU do worker (overhead.ThreadCpuClock),
+              marcado a cada lote.
+    """
+
+    def __init__(self, handler, batch_bytes=DEFAULT_BATCH_BYTES,
+                 batches=DEFAULT_BATCHES, on_batch=None, cpu_clock=None):
+        self.handler = handler
+        self.on_batch = on_batch
+        self.cpu_clock = cpu_clock
+        batch_bytes = max(int(batch_bytes), MAX_RECORD_BYTES * 16)
+        self._free = queue.Queue()
+        for _ in range(max(2, int(batches))):
+            self._free.put(_Batch(batch_bytes))
+        self._full = queue.Queue()
+        self._current = self._free.get()
+        self._worker = None
+        # Lotes entregues ao worker e lotes que ele terminou, para drain().
+        self._cond = threading.Condition()
+        self._delivered = 0
+        self._done = 0
+        self.errors = 0
+
+    def start(self):
+        """Sobe o worker, uma vez por processo."""
+        if self._worker is not None: return
+        self._worker = threading.Thread(target=self._run, name="si-decode")
+        self._worker.daemon = True
+        self._worker.start()
+
+    def add(self, data, size, _memmove=ct.memmove):
+        """Copia um registro do buffer do kernel para o lote corrente."""
+        if size > MAX_RECORD_BYTES: return
+        lote = self._current
+        used = lote.used
+        if used + size > lote.capacity:
+            self._swap()
+            lote = self._current
+            used = 0
+        _memmove(lote.addr + used, data, size)
+        lote.sizes.append(size)
+        lote.used = used + size
+
+    def flush(self):
+        """Entrega o lote parcial; chamado a cada retorno do poll."""
+        if self._current.used:
+            self._swap()
+
+    def drain(self, timeout=None):
+        """
+        Espera o worker tratar os lotes entregues ate aqui. Devolve False se o
+        tempo acabou ou se o worker nao esta rodando.
+        """
+        with self._cond:
+            alvo = self._delivered
+            if self._done >= alvo: return True
+            if self._worker is None: return False
+            return self._cond.wait_for(lambda: self._done >= alvo, timeout)
+
+    def _swap(self):
+        with self._cond:
+            self._delivered += 1
+        self._full.put(self._current)
+        # Bloqueia se o worker estiver atrasado: ver BACKPRESSURE no topo.
+        self._current = self._free.get()
+
+    def _run(self):
+        if self.cpu_clock is not None:
+            self.cpu_clock.thread_started()
+        while True:
+            lote = self._full.get()
+            try:
+                self._decode(lote)
+            finally:
+                lote.reset()
+                self._free.put(lote)
+                if self.cpu_clock is not None:
+                    self.cpu_clock.tick()
+                with self._cond:
+                    self._done += 1
+                    self._cond.notify_all()
+
+    def _decode(self, lote):
+        view = lote.view
+        if self.on_batch is not None:
+            try:
+                self.on_batch(view, lote.sizes)
+            except Exception:
+                self.errors += 1
+        handler = self.handler
+        off = 0
+        for size in lote.sizes:
+            rec = decode(view[off:off + size])
+            off += size
+            if rec is None: continue
+            try:
+                handler(rec)
+            except Exception:
+                # Um registro que o tratador nao digere nao pode derrubar o
+                # worker: os seguintes ficariam na fila.
+                self.errors += 1
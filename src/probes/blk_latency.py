@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/blk_latency.py
+# DESCRIPTION: Latencia de I/O de bloco em percentis, por disco e por processo.
+#
+# WHY:         A "latencia de disco" era o tempo entre a entrada e o retorno de
+#              vfs_read/vfs_write: conta acerto de page cache e leitura de pipe,
+#              e virava uma soma (io_latency_tot) da qual so sai a media. Num
+#              incidente de storage o que importa e a cauda. O kernel agora mede
+#              cada requisicao de bloco do despacho ao driver (block_rq_issue)
+#              ate a conclusao (block_rq_complete) e soma num histograma log2 em
+#              microssegundos, por disco (blk_lat_dev) e por processo
+#              (blk_lat_pid). Aqui os histogramas viram p50/p95/p99.
+#
+# BUCKETS:     bpf_log2l(us): o balde i cobre [2^(i-1), 2^i - 1] us (o 1 cobre
+#              0 e 1), como o print_log2_hist do BCC. O percentil informado e o
+#              limite superior do balde: o valor real esta entre a metade dele
+#              e ele.
+#
+# DISKS:       O kernel identifica o disco pelo dev_t (major << 20 | minor); o
+#              nome vem de /sys/class/block/<nome>/dev e e o KNAME do lsblk, que
+#              liga o resultado a topologia de get_storage_info().
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+
+PERCENTILES = (50, 95, 99)
+
+SYS_BLOCK = "/sys/class/block"
+
+# MINORBITS do kernel: o dev_t interno nao e o mesmo do stat() em user space.
+MINOR_BITS = 20
+MINOR_MASK = (1 << MINOR_BITS) - 1
+
+
+def slot_upper_us(slot):
+    """Limite superior, em microssegundos, do balde log2 slot."""
+    return (1 << slot) - 1 if slot > 0 else 0
+
+
+def percentiles(hist, pcts=PERCENTILES):
+    """
+    {"ops": n, "p50_us": .., "p95_us": .., "p99_us": ..} de um histograma
+    {balde: contagem}, ou {} sem nenhuma requisicao.
+    """
+    total = sum(hist.values())
+    if not total:
+        return {}
+    resultado = {"ops": total}
+    baldes = sorted(hist.items())
+    for p in pcts:
+        alvo = total * p / 100.0
+        acumulado = 0
+        for slot, n in baldes:
+            acumulado += n
+            if acumulado >= alvo:
+                resultado["p%d_us" % p] = slot_upper_us(slot)
+                break
+    return resultado
+
+
+def devt_name(devt, names=None):
+    """Nome do disco de um dev_t do kernel, ou 'major:minor' se desconhecido."""
+    nome = (names or {}).get(devt)
+    if nome:
+        return nome
+    return "%d:%d" % (devt >> MINOR_BITS, devt & MINOR_MASK)
+
+
+def block_devices(root=SYS_BLOCK):
+    """dev_t do kernel -> nome (KNAME) de cada dispositivo de bloco."""
+    nomes = {}
+    try:
+        entradas = os.listdir(root)
+    except OSError:
+        return nomes
+    for nome in entradas:
+        try:
+            with open(os.path.join(root, nome, "dev"), "r") as f:
+                major, minor = f.read().strip().split(":")
+            nomes[(int(major) << MINOR_BITS) | int(minor)] = nome
+        except (OSError, IOError, ValueError):
+            continue
+    return nomes
+
+
+def attach_disk_latency(storage, latency):
+    """
+    Pendura os percentis de cada disco no dispositivo de mesmo KNAME da
+    topologia de get_storage_info() (campo 'latency'). Devolve storage.
+    """
+    if not storage or not latency:
+        return storage
+
+    def visita(devices):
+        for dev in devices:
+            stats = latency.get(dev.get("kname") or dev.get("name"))
+            if stats:
+                dev["latency"] = stats
+            visita(dev.get("children") or [])
+
+    visita(storage.get("roots") or [])
+    return storage
+
+
+def format_latency(stats):
+    """'p50 512us | p95 4.1ms | p99 16.4ms (1200 ops)', para o laudo."""
+    if not stats:
+        return ""
+    partes = []
+    for p in PERCENTILES:
+        us = stats.get("p%d_us" % p)
+        if us is None:
+            continue
+        valor = "%.1fms" % (us / 1000.0) if us >= 1000 else "%dus" % us
+        partes.append("p%d %s" % (p, valor))
+    return "%s (%d ops)" % (" | ".join(partes), stats.get("ops", 0))
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/bpf_syscall.py
+# DESCRIPTION: Chamadas bpf() minimas (criar mapa, carregar programa) e busca
+#              de funcoes no BTF do kernel, para carregar o objeto das sondas
+#              guardado em cache (src/probes/cache.py) sem passar pelo clang.
+#
+# WHY:         O BCC so carrega programa que ele mesmo acabou de compilar. O
+#              objeto em cache ja traz as instrucoes prontas; falta criar os
+#              mapas e entregar as instrucoes ao kernel, o que sao duas chamadas
+#              de sistema com layout fixo (union bpf_attr).
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6. Arquitetura
+#              sem numero de syscall conhecido levanta OSError(ENOSYS), e o
+#              motor compila a partir do fonte.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import errno
+import os
+import platform
+import re
+import struct
+
+# __NR_bpf por arquitetura (platform.machine()).
+NR_BPF = {"x86_64": 321, "aarch64": 280, "ppc64le": 361, "ppc64": 361,
+          "s390x": 351, "riscv64": 280, "armv7l": 386, "i686": 357}
+
+BPF_MAP_CREATE = 0
+BPF_PROG_LOAD = 5
+
+BPF_PROG_TYPE_TRACING = 26
+BPF_TRACE_FENTRY = 24
+BPF_TRACE_FEXIT = 25
+
+BPF_OBJ_NAME_LEN = 16
+VERIFIER_LOG_SIZE = 64 * 1024
+
+BTF_PATH = "/sys/kernel/btf/vmlinux"
+BTF_MAGIC = 0xEB9F
+BTF_KIND_FUNC = 12
+
+# Bytes que seguem o btf_type de 12 bytes: fixos por kind, ou por membro
+# (vlen) nos kinds com lista. Kinds conhecidos: 1 (INT) a 19 (ENUM64).
+BTF_KIND_MAX = 19
+_BTF_FIXED = {1: 4, 3: 12, 14: 4, 17: 4}
+_BTF_PER_MEMBER = {4: 12, 5: 12, 6: 8, 13: 8, 15: 12, 19: 12}
+
+
+class MapCreateAttr(ct.Structure):
+    """union bpf_attr, parte do BPF_MAP_CREATE (ate map_name, 4.15+)."""
+    _fields_ = [("map_type", ct.c_uint32), ("key_size", ct.c_uint32),
+                ("value_size", ct.c_uint32), ("max_entries", ct.c_uint32),
+                ("map_flags", ct.c_uint32), ("inner_map_fd", ct.c_uint32),
+                ("numa_node", ct.c_uint32), ("map_name", ct.c_char * BPF_OBJ_NAME_LEN)]
+
+
+class ProgLoadAttr(ct.Structure):
+    """union bpf_attr, parte do BPF_PROG_LOAD (ate attach_btf_id, 5.5+)."""
+    _fields_ = [("prog_type", ct.c_uint32), ("insn_cnt", ct.c_uint32),
+                ("insns", ct.c_uint64), ("license", ct.c_uint64),
+                ("log_level", ct.c_uint32), ("log_size", ct.c_uint32),
+                ("log_buf", ct.c_uint64), ("kern_version", ct.c_uint32),
+                ("prog_flags", ct.c_uint32), ("prog_name", ct.c_char * BPF_OBJ_NAME_LEN),
+                ("prog_ifindex", ct.c_uint32), ("expected_attach_type", ct.c_uint32),
+                ("prog_btf_fd", ct.c_uint32), ("func_info_rec_size", ct.c_uint32),
+                ("func_info", ct.c_uint64), ("func_info_cnt", ct.c_uint32),
+                ("line_info_rec_size", ct.c_uint32), ("line_info", ct.c_uint64),
+                ("line_info_cnt", ct.c_uint32), ("attach_btf_id", ct.c_uint32)]
+
+
+def _obj_name(name):
+    """Nome aceito pelo kernel: [A-Za-z0-9_.], ate 15 bytes (como o BCC faz)."""
+    return re.sub(r"[^A-Za-z0-9_.]", "_", name)[:BPF_OBJ_NAME_LEN - 1].encode("ascii")
+
+
+def _bpf(cmd, attr):
+    nr = NR_BPF.get(platform.machine())
+    if nr is None:
+        raise OSError(errno.ENOSYS, "bpf() syscall number unknown for %s" % platform.machine())
+    libc = ct.CDLL(None, use_errno=True)
+    libc.syscall.restype = ct.c_long
+    fd = libc.syscall(ct.c_long(nr), ct.c_int(cmd), ct.byref(attr), ct.c_uint(ct.sizeof(attr)))
+    if fd < 0:
+        err = ct.get_errno()
+        raise OSError(err, os.strerror(err))
+    return fd
+
+
+def map_create(map_type, key_size, value_size, max_entries, flags=0, name=""):
+    """Cria o mapa e devolve o descritor."""
+    attr = MapCreateAttr(map_type=map_type, key_size=key_size, value_size=value_size,
+                         max_entries=max_entries, map_flags=flags, map_name=_obj_name(name))
+    return _bpf(BPF_MAP_CREATE, attr)
+
+
+def prog_load(prog_type, insns, prog_license, kern_version=0, name="",
+              expected_attach_type=0, attach_btf_id=0):
+    """
+    Carrega as instrucoes (bytes de struct bpf_insn) e devolve o descritor.
+    Recusa do verificador vem como OSError com o fim do log na mensagem.
+    """
+    codigo = ct.create_string_buffer(bytes(insns), len(insns))
+    licenca = ct.create_string_buffer(prog_license.encode("ascii"))
+    attr = ProgLoadAttr(prog_type=prog_type, insn_cnt=len(insns) // 8,
+                        insns=ct.addressof(codigo), license=ct.addressof(licenca),
+                        kern_version=kern_version, prog_name=_obj_name(name),
+                        expected_attach_type=expected_attach_type,
+                        attach_btf_id=attach_btf_id)
+    try:
+        return _bpf(BPF_PROG_LOAD, attr)
+    except OSError as exc:
+        if exc.errno not in (errno.EACCES, errno.EINVAL):
+            raise
+    # Segunda tentativa so para ter o log do verificador na mensagem.
+    log = ct.create_string_buffer(VERIFIER_LOG_SIZE)
+    attr.log_level, attr.log_size, attr.log_buf = 1, VERIFIER_LOG_SIZE, ct.addressof(log)
+    try:
+        return _bpf(BPF_PROG_LOAD, attr)
+    except OSError as exc:
+        fim = log.value.decode("utf-8", "replace").strip().splitlines()[-3:]
+        raise OSError(exc.errno, "%s: %s" % (exc.strerror, " | ".join(fim))) from exc
+
+
+def btf_func_ids(names, path=BTF_PATH):
+    """
+    {nome: id do tipo BTF_KIND_FUNC} das funcoes pedidas no BTF do kernel:
+    o attach_btf_id que um programa fentry/fexit precisa na carga. Nomes
+    ausentes ficam fora do resultado.
+    """
+    with open(path, "rb") as fh:
+        data = fh.read()
+    ordem = "<" if struct.unpack_from("<H", data, 0)[0] == BTF_MAGIC else ">"
+    if struct.unpack_from(ordem + "H", data, 0)[0] != BTF_MAGIC:
+        raise ValueError("%s is not BTF" % path)
+    hdr_len, type_off, type_len, str_off = struct.unpack_from(ordem + "IIII", data, 4)
+    tipos, textos = hdr_len + type_off, hdr_len + str_off
+
+    procurados = {n.encode("ascii"): n for n in names}
+    achados = {}
+    pos, fim, tid = tipos, tipos + type_len, 1
+    while pos < fim and len(achados) < len(procurados):
+        name_off, info = struct.unpack_from(ordem + "II", data, pos)
+        kind, vlen = (info >> 24) & 0x1f, info & 0xffff
+        if not 1 <= kind <= BTF_KIND_MAX:
+            raise ValueError("unknown BTF kind %d at type %d" % (kind, tid))
+        if kind == BTF_KIND_FUNC:
+            inicio = textos + name_off
+            nome = data[inicio:data.index(b"\0", inicio)]
+            if nome in procurados and nome not in achados:
+                achados[nome] = tid
+        pos += 12 + _BTF_FIXED.get(kind, 0) + _BTF_PER_MEMBER.get(kind, 0) * vlen
+        tid += 1
+    return {procurados[n]: i for n, i in achados.items()}
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/cache.py
+# DESCRIPTION: Cache em disco do objeto compilado das sondas eBPF.
+#
+# WHY:         A compilacao de base_trace.c (clang/LLVM via BCC) custa segundos
+#              de CPU e centenas de MB em VM pequena, e acontecia a cada partida
+#              do agente, inclusive depois de um CMD_RESTART. O resultado so
+#              depende do kernel em execucao, do BTF/cabecalhos que descrevem
+#              esse kernel, do texto do fonte, das flags de compilacao e do
+#              BCC que compila; com essa identidade igual, o objeto da partida
+#              anterior serve.
+#
+# HOW:         Depois de uma compilacao, o motor guarda (cached_bpf.py) as
+#              instrucoes de cada programa, a descricao de cada mapa e, em cada
+#              instrucao que carrega um mapa (ld_imm64 com BPF_PSEUDO_MAP_FD), o
+#              indice do mapa no lugar do descritor daquele processo. Na partida
+#              seguinte os mapas sao recriados e os descritores novos entram nas
+#              mesmas posicoes (relocate). Qualquer falha cai na compilacao.
+#
+# NOTES:       Uma entrada viva por vez, de dono do agente e sem escrita para
+#              grupo/outros: o conteudo vira programa no kernel. Sem dependencia
+#              de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import struct
+import sys
+import time
+
+LOG = logging.getLogger("ProbeCache")
+
+DEFAULT_CACHE_DIR = "/var/lib/sys-inspector/probe-cache"
+
+BTF_PATH = "/sys/kernel/btf/vmlinux"
+CPU_POSSIBLE = "/sys/devices/system/cpu/possible"
+
+# struct bpf_insn: code, dst_reg:4/src_reg:4, off (s16), imm (s32).
+INSN_SIZE = 8
+LD_IMM64 = 0x18
+PSEUDO_MAP_FD = 1
+PSEUDO_MAP_VALUE = 2
+
+
+def _read_text(path):
+    try:
+        with open(path, "r") as fh:
+            return fh.read().strip()
+    except OSError:
+        return ""
+
+
+def _btf_identity(path=BTF_PATH):
+    """
+    Tamanho do BTF do kernel. O BTF sai do mesmo build que /proc/version
+    descreve; o tamanho pega um blob trocado sem ler 5 MB a cada partida.
+    """
+    try:
+        return str(os.stat(path).st_size)
+    except OSError:
+        return ""
+
+
+def _headers_identity(release):
+    """
+    Cabecalhos que o BCC usara: o destino real do link build e quando mudou.
+    Um kernel-devel atualizado sem troca de release muda o objeto compilado.
+    """
+    build = os.path.join("/lib/modules", release, "build")
+    try:
+        real = os.path.realpath(build)
+        return "%s@%d" % (real, int(os.stat(real).st_mtime))
+    except OSError:
+        return ""
+
+
+def probe_identity(source, cflags=None, release=None, bcc_version=""):
+    """
+    Componentes que determinam o objeto compilado.
+
+    PARAMETER source: texto devolvido por load_probe_source.
+    PARAMETER cflags: flags passadas ao BPF() (transporte, modo de anexacao...).
+    PARAMETER bcc_version: BCC que compila (o codigo gerado muda entre versoes).
+
+    As CPUs possiveis entram porque o BCC dimensiona o mapa de perf por elas.
+    """
+    release = release or os.uname().release
+    return {
+        "kernel_release": release,
+        "kernel_build": _read_text("/proc/version"),
+        "btf": _btf_identity(),
+        "headers": _headers_identity(release),
+        "cpus": _read_text(CPU_POSSIBLE),
+        "bcc": bcc_version,
+        "source_sha256": hashlib.sha256(source.encode("utf-8")).hexdigest(),
+        "cflags": sorted(cflags or []),
+    }
+
+
+def identity_key(identity):
+    """Chave estavel (sha256) de um dicionario de identidade."""
+    canon = json.dumps(identity, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canon.encode("utf-8")).hexdigest()
+
+
+def kfunc_target(name):
+    """
+    (funcao do kernel, 'fentry'/'fexit') de um programa kfunc__/kretfunc__ do
+    BCC (com ou sem o prefixo vmlinux__), ou (None, None). Funcao de modulo
+    (kfunc__<modulo>__<funcao>) nao e suportada pelo cache.
+    """
+    for prefixo, tipo in (("kfunc__", "fentry"), ("kretfunc__", "fexit")):
+        if name.startswith(prefixo):
+            alvo = name[len(prefixo):]
+            if alvo.startswith("vmlinux__"):
+                alvo = alvo[len("vmlinux__"):]
+            if "__" in alvo:
+                raise ValueError("module kfunc %s cannot be cached" % name)
+            return alvo, tipo
+    return None, None
+
+
+def _src_reg(regs):
+    # Campos de bits seguem a ordem de bytes da maquina.
+    return regs >> 4 if sys.byteorder == "little" else regs & 0x0f
+
+
+def map_references(insns, fds):
+    """
+    [(instrucao, indice do mapa)] de cada ld_imm64 que carrega um mapa.
+
+    PARAMETER fds: {descritor no processo que compilou: indice do mapa}.
+    Referencia que nao da para refazer em outro processo (descritor
+    desconhecido, BTF id, chamada de funcao) levanta ValueError: esse objeto
+    nao vai para o cache.
+    """
+    refs = []
+    total = len(insns) // INSN_SIZE
+    i = 0
+    while i < total:
+        code, regs, _off, imm = struct.unpack_from("=BBhi", insns, i * INSN_SIZE)
+        if code != LD_IMM64:
+            i += 1
+            continue
+        src = _src_reg(regs)
+        if src in (PSEUDO_MAP_FD, PSEUDO_MAP_VALUE):
+            if imm not in fds:
+                raise ValueError("instruction %d loads unknown map fd %d" % (i, imm))
+            refs.append((i, fds[imm]))
+        elif src:
+            raise ValueError("instruction %d: ld_imm64 source %d cannot be reused" % (i, src))
+        i += 2
+    return refs
+
+
+def relocate(insns, refs, map_fds):
+    """Instrucoes com o descritor de map_fds[indice] em cada referencia."""
+    saida = bytearray(insns)
+    for pos, indice in refs:
+        struct.pack_into("=i", saida, pos * INSN_SIZE + 4, map_fds[indice])
+    return bytes(saida)
+
+
+def _trusted(path):
+    """Do proprio agente, sem escrita para grupo/outros e sem link simbolico."""
+    st = os.lstat(path)
+    return (not stat.S_ISLNK(st.st_mode) and st.st_uid == os.geteuid() and
+            not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+class ProbeCache:
+    """
+    Objeto compilado por chave sob cache_dir, uma unica entrada viva por vez.
+
+    O agente so roda um kernel por vez; guardar objetos de kernels anteriores
+    so ocuparia disco num host que pode estar sob investigacao. cache_dir
+    vazio desliga o cache.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, "%s.json" % key)
+
+    def lookup(self, key):
+        """Entrada da chave, ou None quando ausente, ilegivel ou nao confiavel."""
+        if not self.cache_dir: return None
+        caminho = self._entry_path(key)
+        try:
+            if not (_trusted(self.cache_dir) and _trusted(caminho)):
+                LOG.warning("Probe cache entry %s is writable by others; ignoring it.", caminho)
+                return None
+            with open(caminho, "r") as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("key") == key else None
+
+    def store(self, key, identity, obj):
+        """
+        Grava o objeto da chave e remove as entradas que ele substitui.
+
+        Falha de escrita nao interrompe nada: o cache e otimizacao, e a coleta
+        segue sem ele.
+        """
+        if not self.cache_dir: return None
+        entry = dict(obj, key=key, identity=identity, stored_at=time.time())
+        caminho = self._entry_path(key)
+        try:
+            os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+            if not _trusted(self.cache_dir):
+                LOG.warning("Probe cache %s is writable by others; not storing.", self.cache_dir)
+                return None
+            tmp = caminho + ".tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, "w") as fh:
+                json.dump(entry, fh)
+            os.replace(tmp, caminho)
+            self._prune(keep=key)
+        except OSError as exc:
+            LOG.warning("Probe cache not writable (%s): %s", self.cache_dir, exc)
+            return None
+        return entry
+
+    def discard(self, key):
+        """Remove a entrada da chave (objeto que o kernel recusou)."""
+        if not self.cache_dir: return
+        try:
+            os.unlink(self._entry_path(key))
+        except OSError:
+            pass
+
+    def _prune(self, keep):
+        for nome in os.listdir(self.cache_dir):
+            if nome.endswith(".json") and nome != "%s.json" % keep:
+                try:
+                    os.unlink(os.path.join(self.cache_dir, nome))
+                except OSError:
+                    pass
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/cached_bpf.py
+# DESCRIPTION: Objeto das sondas tirado de um modulo recem-compilado pelo BCC
+#              (object_from_module) e recarregado na partida seguinte sem
+#              compilar (CachedBPF).
+#
+# WHY:         BPF(text=...) sempre roda o clang. CachedBPF e um BPF do BCC cujo
+#              unico passo diferente e a carga: mapas criados e programas
+#              carregados pelo bpf() (src/probes/bpf_syscall.py) a partir do
+#              objeto em cache (src/probes/cache.py). Tabelas, anexacao
+#              (kprobe, tracepoint, kfunc), buffers de perf/ring e a limpeza sao
+#              os do proprio BCC, e o motor nao distingue um do outro.
+#
+# NOTES:       Precisa do bcc; o motor so importa este modulo quando ele existe.
+#              Tipo de mapa ou programa fora do que base_trace.c usa nao vai
+#              para o cache (ValueError em object_from_module).
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import atexit
+import base64
+import ctypes as ct
+import json
+import os
+
+try:
+    import bcc
+    from bcc import BPF, table as bcc_table
+except ImportError as exc:
+    raise ImportError("the probe object cache needs bcc") from exc
+
+from src.probes import bpf_syscall
+from src.probes.cache import map_references, relocate, kfunc_target
+
+BCC_VERSION = getattr(bcc, "__version__", "")
+
+# Tipos de mapa (enum bpf_map_type) de base_trace.c -> classe de tabela do BCC.
+TABLE_CLASSES = {1: "HashTable", 2: "Array", 4: "PerfEventArray", 5: "PerCpuHash",
+                 6: "PerCpuArray", 7: "StackTrace", 9: "LruHash", 27: "RingBuf"}
+PERCPU_TYPES = (5, 6)
+
+ATTACH_TYPES = {"fentry": bpf_syscall.BPF_TRACE_FENTRY, "fexit": bpf_syscall.BPF_TRACE_FEXIT}
+
+# API C do modulo (bcc_common.h). Handle proprio para nao mexer nos
+# prototipos que o bcc declara no dele.
+_lib = ct.CDLL("libbcc.so.0", use_errno=True)
+for _nome, _res, _args in (
+        ("bpf_num_functions", ct.c_size_t, [ct.c_void_p]),
+        ("bpf_function_name", ct.c_char_p, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_function_start", ct.c_void_p, [ct.c_void_p, ct.c_char_p]),
+        ("bpf_function_size", ct.c_size_t, [ct.c_void_p, ct.c_char_p]),
+        ("bpf_module_license", ct.c_char_p, [ct.c_void_p]),
+        ("bpf_module_kern_version", ct.c_uint, [ct.c_void_p]),
+        ("bpf_num_tables", ct.c_size_t, [ct.c_void_p]),
+        ("bpf_table_name", ct.c_char_p, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_fd_id", ct.c_int, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_type_id", ct.c_int, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_max_entries_id", ct.c_size_t, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_flags_id", ct.c_int, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_key_size_id", ct.c_size_t, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_leaf_size_id", ct.c_size_t, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_key_desc_id", ct.c_char_p, [ct.c_void_p, ct.c_size_t]),
+        ("bpf_table_leaf_desc_id", ct.c_char_p, [ct.c_void_p, ct.c_size_t])):
+    getattr(_lib, _nome).restype = _res
+    getattr(_lib, _nome).argtypes = _args
+
+
+def object_from_module(module):
+    """
+    Objeto compilado de um BPF(text=...) ja carregado, no formato que
+    ProbeCache.store grava: licenca, versao do kernel, mapas na ordem do
+    modulo e programas na ordem do modulo (a mesma da anexacao automatica).
+    """
+    mapas, fds = [], {}
+    for i in range(_lib.bpf_num_tables(module)):
+        tipo = _lib.bpf_table_type_id(module, i)
+        nome = _lib.bpf_table_name(module, i).decode()
+        if tipo not in TABLE_CLASSES:
+            raise ValueError("map %s: type %d not supported by the probe cache" % (nome, tipo))
+        fds[_lib.bpf_table_fd_id(module, i)] = i
+        mapas.append({"name": nome, "type": tipo,
+                      "key_size": _lib.bpf_table_key_size_id(module, i),
+                      "leaf_size": _lib.bpf_table_leaf_size_id(module, i),
+                      "max_entries": _lib.bpf_table_max_entries_id(module, i),
+                      "flags": _lib.bpf_table_flags_id(module, i),
+                      "key_desc": _lib.bpf_table_key_desc_id(module, i).decode(),
+                      "leaf_desc": _lib.bpf_table_leaf_desc_id(module, i).decode()})
+
+    programas, alvos = [], {}
+    for i in range(_lib.bpf_num_functions(module)):
+        nome = _lib.bpf_function_name(module, i)
+        insns = ct.string_at(_lib.bpf_function_start(module, nome),
+                             _lib.bpf_function_size(module, nome))
+        nome = nome.decode()
+        programas.append({"name": nome, "insns": base64.b64encode(insns).decode("ascii"),
+                          "maps": map_references(insns, fds)})
+        alvo, _tipo = kfunc_target(nome)
+        if alvo:
+            alvos[nome] = alvo
+
+    # fentry/fexit carregam com o id BTF da funcao alvo; o BTF faz parte da
+    # chave, entao o id resolvido agora vale enquanto a entrada valer.
+    if alvos:
+        ids = bpf_syscall.btf_func_ids(set(alvos.values()))
+        for prog in programas:
+            if prog["name"] in alvos:
+                if alvos[prog["name"]] not in ids:
+                    raise ValueError("%s not found in kernel BTF" % alvos[prog["name"]])
+                prog["btf_id"] = ids[alvos[prog["name"]]]
+
+    return {"license": _lib.bpf_module_license(module).decode(),
+            "kern_version": _lib.bpf_module_kern_version(module),
+            "maps": mapas, "functions": programas}
+
+
+def _bytes(nome):
+    return nome.encode() if isinstance(nome, str) else nome
+
+
+class CachedBPF(BPF):
+    """
+    BPF montado a partir do objeto em cache. Levanta excecao (com tudo que
+    chegou a criar ja fechado) se o kernel recusar um mapa ou programa.
+    """
+
+    def __init__(self, entry):
+        # Estado que BPF.__init__ cria e que attach_*/cleanup usam; so a
+        # compilacao fica de fora.
+        self.kprobe_fds, self.uprobe_fds, self.tracepoint_fds = {}, {}, {}
+        self.raw_tracepoint_fds, self.kfunc_entry_fds, self.kfunc_exit_fds = {}, {}, {}
+        self.lsm_fds, self.perf_buffers, self.open_perf_events = {}, {}, {}
+        self._ringbuf_manager = None
+        self.tracefile = None
+        self.debug = 0
+        self.funcs, self.tables = {}, {}
+        self.module = None
+
+        self.entry = entry
+        self._programas = {_bytes(p["name"]): p for p in entry["functions"]}
+        self._mapas = {}
+        self._map_fds = []
+        atexit.register(self.cleanup)
+        try:
+            for i, m in enumerate(entry["maps"]):
+                fd = bpf_syscall.map_create(m["type"], m["key_size"], m["leaf_size"],
+                                            m["max_entries"], m["flags"], m["name"])
+                self._map_fds.append(fd)
+                self._mapas[_bytes(m["name"])] = (i, fd, m)
+            self._trace_autoload()
+        except Exception:
+            self.cleanup()
+            raise
+
+    def _trace_autoload(self):
+        # O despacho por prefixo de BPF._trace_autoload, sobre os nomes do
+        # objeto em vez dos do modulo compilado.
+        for prog in self.entry["functions"]:
+            nome = _bytes(prog["name"])
+            if nome.startswith(b"kprobe__"):
+                self.attach_kprobe(event=self.fix_syscall_fnname(nome[8:]), fn_name=nome)
+            elif nome.startswith(b"kretprobe__"):
+                self.attach_kretprobe(event=self.fix_syscall_fnname(nome[11:]), fn_name=nome)
+            elif nome.startswith(b"tracepoint__"):
+                self.attach_tracepoint(tp=nome[12:].replace(b"__", b":"), fn_name=nome)
+            elif nome.startswith(b"raw_tracepoint__"):
+                self.attach_raw_tracepoint(tp=nome[16:], fn_name=nome)
+            elif nome.startswith(b"kfunc__"):
+                self.attach_kfunc(fn_name=nome)
+            elif nome.startswith(b"kretfunc__"):
+                self.attach_kretfunc(fn_name=nome)
+            elif nome.startswith(b"lsm__"):
+                raise ValueError("LSM program %s cannot be loaded from the cache" % prog["name"])
+
+    def load_func(self, func_name, prog_type, device=None, attach_type=-1):
+        func_name = _bytes(func_name)
+        if func_name in self.funcs:
+            return self.funcs[func_name]
+        prog = self._programas.get(func_name)
+        if prog is None:
+            raise ValueError("Unknown program %s" % func_name)
+        insns = relocate(base64.b64decode(prog["insns"]), prog["maps"], self._map_fds)
+        _alvo, tipo = kfunc_target(prog["name"])
+        fd = bpf_syscall.prog_load(prog_type, insns, self.entry["license"],
+                                   self.entry["kern_version"], name=prog["name"],
+                                   expected_attach_type=ATTACH_TYPES.get(tipo, 0),
+                                   attach_btf_id=prog.get("btf_id", 0))
+        fn = BPF.Function(self, func_name, fd)
+        self.funcs[func_name] = fn
+        return fn
+
+    def get_table(self, name, keytype=None, leaftype=None, reducer=None):
+        name = _bytes(name)
+        if name not in self._mapas:
+            raise KeyError(name)
+        indice, fd, m = self._mapas[name]
+        if keytype is None:
+            keytype = BPF._decode_table_type(json.loads(m["key_desc"]))
+        if leaftype is None:
+            leaftype = BPF._decode_table_type(json.loads(m["leaf_desc"]))
+        extra = {"reducer": reducer} if m["type"] in PERCPU_TYPES else {}
+        tabela = getattr(bcc_table, TABLE_CLASSES[m["type"]])(
+            self, indice, fd, keytype, leaftype, name=name, **extra)
+        # TableBase le tipo, flags e tamanho do modulo, que aqui nao existe.
+        tabela.ttype, tabela.flags, tabela.max_entries = m["type"], m["flags"], m["max_entries"]
+        return tabela
+
+    def cleanup(self):
+        BPF.cleanup(self)
+        for fd in self._map_fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._map_fds = []
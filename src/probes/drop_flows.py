@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/drop_flows.py
+# DESCRIPTION: Pacotes descartados agregados por fluxo (mapa drop_flows).
+#
+# WHY:         kfree_skb enviava um evento por pacote TCP/UDP descartado e o
+#              motor anexava uma string por evento numa lista sem limite no no.
+#              Num SYN flood ou com uma placa ruim esse caminho sozinho derruba
+#              o agente e a captura cresce sem teto. O kernel agora soma cada
+#              (pid, origem, destino, portas, protocolo, motivo) num hash, com
+#              contagem, bytes e primeira/ultima ocorrencia; aqui o mapa vira
+#              os N fluxos mais frequentes de cada processo.
+#
+# REASONS:     O motivo e o enum skb_drop_reason do kernel (5.17+; antes fica 0).
+#              Os numeros mudam entre versoes, entao os nomes vem do formato do
+#              proprio tracepoint (print fmt de skb/kfree_skb no tracefs).
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import re
+import socket
+import struct
+
+# Fluxos guardados por processo e por janela; o resto so e contado.
+DEFAULT_TOP_FLOWS = 20
+
+PROTO_NAMES = {1: "ICMP", 6: "TCP", 17: "UDP"}
+
+FORMAT_PATHS = ("/sys/kernel/tracing/events/skb/kfree_skb/format",
+                "/sys/kernel/debug/tracing/events/skb/kfree_skb/format")
+
+# { 2, "NOT_SPECIFIED" } dentro do __print_symbolic de REC->reason. Os enums ja
+# chegam resolvidos em numero no arquivo de formato (TRACE_DEFINE_ENUM).
+_SYMBOL = re.compile(r'\{\s*(\d+)\s*,\s*"([A-Za-z0-9_]+)"\s*\}')
+
+
+def reason_names(paths=FORMAT_PATHS):
+    """
+    Numero -> nome dos motivos de descarte deste kernel.
+
+    Vazio quando o tracefs nao esta montado ou o kernel nao tem motivos; o
+    motivo aparece entao pelo numero.
+    """
+    for path in paths:
+        try:
+            with open(path, "r") as f:
+                fmt = f.read()
+        except (OSError, IOError):
+            continue
+        _, _, simbolos = fmt.partition("REC->reason")
+        return {int(num): nome for num, nome in _SYMBOL.findall(simbolos)}
+    return {}
+
+
+def reason_label(reason, names=None):
+    """Nome do motivo, ou None quando o kernel nao o informou (0)."""
+    if not reason:
+        return None
+    return (names or {}).get(reason, "reason %d" % reason)
+
+
+def _ipv4(addr):
+    return socket.inet_ntop(socket.AF_INET, struct.pack("I", addr))
+
+
+def flow_record(key, count=1, nbytes=0, first_seen=0.0, last_seen=0.0, names=None):
+    """
+    Um fluxo no formato da captura, a partir dos campos do kernel.
+
+    key e a chave de drop_flows (ou um registro 'D' antigo, sem reason):
+    saddr/daddr e as portas chegam em ordem de rede, como no cabecalho do
+    pacote; first_seen/last_seen ja em epoch.
+    """
+    return {
+        "src": _ipv4(key.saddr),
+        "sport": socket.ntohs(key.sport),
+        "dst": _ipv4(key.daddr),
+        "dport": socket.ntohs(key.dport),
+        "proto": PROTO_NAMES.get(key.proto, "IP(%d)" % key.proto),
+        "reason": reason_label(getattr(key, "reason", 0), names),
+        "count": int(count),
+        "bytes": int(nbytes),
+        "first_seen": first_seen,
+        "last_seen": last_seen,
+    }
+
+
+_FLOW_KEY = ("src", "sport", "dst", "dport", "proto", "reason")
+
+
+def add_flow(flows, flow, limit=DEFAULT_TOP_FLOWS, key=_FLOW_KEY):
+    """
+    Soma um fluxo na lista de um processo, sem passar de limit entradas.
+
+    Devolve False quando o fluxo e novo e a lista ja esta cheia: quem chama
+    conta o descarte como omitido. key sao os campos que identificam o fluxo.
+    """
+    chave = tuple(flow[c] for c in key)
+    for atual in flows:
+        if tuple(atual[c] for c in key) == chave:
+            atual["count"] += flow["count"]
+            atual["bytes"] += flow["bytes"]
+            atual["first_seen"] = min(atual["first_seen"], flow["first_seen"])
+            atual["last_seen"] = max(atual["last_seen"], flow["last_seen"])
+            return True
+    if len(flows) >= limit:
+        return False
+    flows.append(flow)
+    return True
+
+
+def top_flows(flows, limit=DEFAULT_TOP_FLOWS):
+    """
+    (N fluxos com mais descartes, descartes dos fluxos que ficaram de fora).
+
+    Empate na contagem vai para o mais recente.
+    """
+    ordenados = sorted(flows, key=lambda f: (f["count"], f["last_seen"]), reverse=True)
+    return ordenados[:limit], sum(f["count"] for f in ordenados[limit:])
+
+
+def flow_label(flow):
+    """'10.0.0.1:443 -> 10.0.0.2:51000 (TCP)', para o laudo."""
+    return "%s:%d -> %s:%d (%s)" % (flow["src"], flow["sport"], flow["dst"],
+                                    flow["dport"], flow["proto"])
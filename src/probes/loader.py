@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 # ===============================================================================
 # FILE: src/probes/loader.py
-# DESCRIPTION: Utility to load and prepare eBPF C source code.
-#              Handles runtime variable replacement (like PID filtering).
+# DESCRIPTION: Utility to load eBPF C source code.
+#              The source text is returned unchanged: runtime values (like
+#              the agent PID filter) live in the agent_settings BPF map, so
+#              the text only changes when the file does.
 #
 # OPTIONS:
 #
@@ -18,16 +20,18 @@ import sys
 
 def load_probe_source(probe_name="base_trace.c"):
     """
-    Reads the C source file from the probes directory and prepares it for BCC.
+    Reads the C source file from the probes directory and returns it unchanged.
 
-    It performs necessary runtime replacements, such as injecting the current
-    PID into the FILTER_PID macro to prevent the agent from tracing itself.
+    No runtime value is patched into the text anymore: the agent PID that
+    FILTER_PID compares against is written by the engine into the
+    agent_settings map after load. A source that changed with every PID would
+    give every start a different probe cache key (src/probes/cache.py).
 
     Args:
         probe_name (str): Filename of the C source (default: base_trace.c).
 
     Returns:
-        str: The complete, compiled-ready C source code.
+        str: The contents of the .c file, unchanged.
 
     Raises:
         FileNotFoundError: If the .c file cannot be found.
@@ -41,17 +45,7 @@ def load_probe_source(probe_name="base_trace.c"):
 
     try:
         with open(source_path, 'r', encoding='utf-8') as f:
-            source_code = f.read()
-
-        # Runtime Injection: Ignore Own PID
-        # We replace the C macro definition directly in the source string.
-        current_pid = os.getpid()
-        source_code = source_code.replace(
-            "#define FILTER_PID 00000",
-            f"#define FILTER_PID {current_pid}"
-        )
-
-        return source_code
+            return f.read()
 
     except Exception as e:
         print(f"[ERROR] Failed to load probe {probe_name}: {e}")
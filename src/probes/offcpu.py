@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/offcpu.py
+# DESCRIPTION: Tempo fora da CPU por ponto de espera do kernel (EDR-WAIT).
+#
+# WHY:         O selo EDR-WAIT vinha de /proc/PID/wchan, lido uma vez por
+#              processo no enriquecimento e so com o estado em S ou D: um
+#              arquivo a mais por processo dormindo, e so pegava quem estivesse
+#              bloqueado no instante exato da leitura. Agora o sched_switch soma
+#              no kernel o tempo que cada processo passa dormindo, por pilha do
+#              kernel no ponto da espera (offcpu_ns, offcpu_stacks). O motor
+#              resolve cada pilha uma vez por janela e conta os milissegundos
+#              passados em caminhos de inspecao de seguranca.
+#
+# STATES:      So as esperas nos estados de engine.offcpu_states ganham pilha:
+#              "D" (ininterrupta, o padrao) cobre a espera de permissao do
+#              fanotify (TASK_KILLABLE); "SD" inclui o sono interrompivel, bem
+#              mais frequente e mais caro; "" desliga a medida.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+# Trechos de simbolo que marcam a espera por inspecao de seguranca (os mesmos
+# que a leitura de wchan procurava).
+EDR_WAIT_SIGNATURES = ("fanotify", "fsnotify", "av_scan", "sophos", "falcon")
+
+# Bits de prev_state do tracepoint sched_switch (S = 1, D = 2).
+STATE_BITS = {"S": 1, "D": 2}
+
+DEFAULT_OFFCPU_STATES = "D"
+
+# Abaixo disso o tempo aparece no processo, mas nao vira selo.
+DEFAULT_EDR_WAIT_MIN_MS = 10.0
+
+# Prefixo da razao gravada no processo; carry_over a descarta na janela seguinte.
+EDR_WAIT_REASON = "Latency: Waiting for"
+
+
+def states_mask(spec):
+    """Mascara de prev_state para SETTING_OFFCPU_STATES ("D" -> 2, "SD" -> 3)."""
+    mask = 0
+    for letra in (spec or "").upper():
+        mask |= STATE_BITS.get(letra, 0)
+    return mask
+
+
+def _nome(simbolo):
+    if isinstance(simbolo, bytes):
+        simbolo = simbolo.decode("utf-8", "replace")
+    return simbolo.split("+", 1)[0]
+
+
+def edr_wait_site(symbols, signatures=EDR_WAIT_SIGNATURES):
+    """Quadro da pilha que e caminho de inspecao de seguranca, ou None."""
+    for simbolo in symbols:
+        nome = _nome(simbolo)
+        if any(s in nome for s in signatures):
+            return nome
+    return None
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/records.py
+# DESCRIPTION: Layouts of the records sent by base_trace.c and their decoder.
+#
+#              Cada tipo de evento tem um registro proprio, precedido de um
+#              cabecalho comum (struct rec_hdr_t). O caminho de 'E'/'O' viaja so
+#              com os bytes que usa, entao o tamanho do registro varia. Os
+#              layouts aqui ESPELHAM as structs do fonte C: mudar um exige mudar
+#              o outro.
+#
+#              Nao depende de bcc: o mesmo decodificador serve ao perf buffer,
+#              ao ring buffer e a qualquer fonte de bytes brutos.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import struct
+
+# Ordem de bytes nativa e sem alinhamento implicito: os campos ja estao
+# dispostos no C para cair nos mesmos offsets. '=' e nao '<' porque o agente
+# tambem roda em s390x.
+#
+# struct rec_hdr_t: type_id, flags, len, pid, ppid, uid, loginuid, prio,
+#                   mem_peak_rss, comm[16]
+HEADER = struct.Struct("=BBHIIIIiQ16s")
+
+# O mesmo cabecalho sem o comm: o decodificador desempacota so os numeros e
+# guarda o comm como fatia, decodificada apenas se alguem a ler.
+FIXED = struct.Struct("=BBHIIIIiQ")
+COMM_OFFSET = FIXED.size
+
+# 'E' / 'O': o restante do registro e o caminho, terminado em NUL.
+PATH_TYPES = (ord('E'), ord('O'))
+
+# 'F': so o cabecalho (pid = filho, ppid = pai).
+HEADER_ONLY_TYPES = (ord('F'),)
+
+# struct rec_conn_t: saddr, daddr, sport, dport, pad. A sonda nao envia mais
+# 'N' (conexoes somadas por destino em conn_stats); o layout fica para ler
+# gravacoes anteriores.
+CONN = struct.Struct("=IIHHI")
+
+# struct rec_io_t: io_bytes, io_latency_ns
+IO = struct.Struct("=QQ")
+
+# struct rec_drop_t: saddr, daddr, sport, dport, proto, net_len. A sonda nao
+# envia mais 'D' (descartes somados por fluxo em drop_flows); o layout fica
+# para ler gravacoes anteriores.
+DROP = struct.Struct("=IIHHIQ")
+
+# struct rec_exit_t: exit_ns, exit_code, pad
+EXIT = struct.Struct("=QiI")
+
+TAILS = {ord('N'): CONN, ord('R'): IO, ord('W'): IO, ord('D'): DROP,
+         ord('X'): EXIT}
+
+
+def _cstr(raw):
+    """Bytes de um char[] do kernel, cortados no primeiro NUL."""
+    return raw.split(b"\0", 1)[0].decode('utf-8', 'replace')
+
+
+class Record(object):
+    """
+    Um evento decodificado.
+
+    Os campos que o tipo nao carrega ficam zerados, para o motor ler qualquer
+    registro da mesma forma que lia a estrutura unica de antes.
+
+    comm e filename sao decodificados na primeira leitura, e so nela: um 'R'
+    ou 'D' nunca paga o UTF-8 do caminho. Ate la guardam bytes crus, e sao
+    copias: o callback do BCC copia o registro do buffer do kernel para um
+    lote (batch.py), e aqui as duas strings saem do lote por copia, porque ele
+    volta a ser preenchido depois de percorrido e um registro guardado nao
+    pode mudar por baixo do motor. Os numeros ja saem copiados do unpack.
+    """
+    __slots__ = ("type_id", "pid", "ppid", "uid", "loginuid", "prio",
+                 "mem_peak_rss", "_comm", "_filename", "saddr", "daddr",
+                 "sport", "dport", "proto", "net_len", "io_bytes",
+                 "io_latency_ns", "exit_ns", "exit_code")
+
+    def __init__(self):
+        self._comm = ""
+        self._filename = ""
+        self.saddr = self.daddr = 0
+        self.sport = self.dport = 0
+        self.proto = 0
+        self.net_len = 0
+        self.io_bytes = 0
+        self.io_latency_ns = 0
+        self.exit_ns = 0
+        self.exit_code = 0
+
+    @property
+    def comm(self):
+        valor = self._comm
+        if not isinstance(valor, str):
+            valor = self._comm = _cstr(valor)
+        return valor
+
+    @comm.setter
+    def comm(self, valor):
+        self._comm = valor
+
+    @property
+    def filename(self):
+        valor = self._filename
+        if not isinstance(valor, str):
+            valor = self._filename = _cstr(valor)
+        return valor
+
+    @filename.setter
+    def filename(self, valor):
+        self._filename = valor
+
+
+def decode(raw):
+    """
+    Decodifica um registro bruto (bytes ou memoryview) vindo do kernel.
+
+    Devolve None para registro truncado ou de tipo desconhecido: um evento
+    ilegivel se descarta, nao derruba o laco de coleta.
+    """
+    if len(raw) < HEADER.size:
+        return None
+
+    (type_id, _flags, length, pid, ppid, uid, loginuid, prio,
+     rss) = FIXED.unpack_from(raw, 0)
+
+    rec = Record()
+    rec.type_id = chr(type_id)
+    rec.pid = pid
+    rec.ppid = ppid
+    rec.uid = uid
+    rec.loginuid = loginuid
+    rec.prio = prio
+    rec.mem_peak_rss = rss
+    rec._comm = bytes(raw[COMM_OFFSET:HEADER.size])
+
+    end = min(length or len(raw), len(raw))
+
+    if type_id in PATH_TYPES:
+        rec._filename = bytes(raw[HEADER.size:end])
+        return rec
+    if type_id in HEADER_ONLY_TYPES:
+        return rec
+
+    tail = TAILS.get(type_id)
+    if tail is None or end < HEADER.size + tail.size:
+        return None
+
+    values = tail.unpack_from(raw, HEADER.size)
+    if tail is CONN:
+        rec.saddr, rec.daddr, rec.sport, rec.dport, _pad = values
+    elif tail is IO:
+        rec.io_bytes, rec.io_latency_ns = values
+    elif tail is EXIT:
+        rec.exit_ns, rec.exit_code, _pad = values
+    else:
+        rec.saddr, rec.daddr, rec.sport, rec.dport, rec.proto, rec.net_len = values
+    return rec
+
+
+# Campos aceitos por encode() e o valor de quem nao os passa.
+_ENCODE_DEFAULTS = {
+    "pid": 0, "ppid": 0, "uid": 0, "loginuid": 0, "prio": 120, "rss": 0,
+    "comm": "", "filename": "", "saddr": 0, "daddr": 0, "sport": 0, "dport": 0,
+    "proto": 0, "net_len": 0, "io_bytes": 0, "io_latency_ns": 0, "exit_ns": 0,
+    "exit_code": 0,
+}
+
+
+def encode(type_id, **fields):
+    """
+    Monta um registro com o mesmo layout que o kernel envia.
+
+    Serve a testes e a fontes sinteticas: o que sai daqui percorre o mesmo
+    decodificador que os eventos reais. Os campos vem por nome (ver
+    _ENCODE_DEFAULTS); nome desconhecido levanta TypeError.
+    """
+    desconhecidos = set(fields) - set(_ENCODE_DEFAULTS)
+    if desconhecidos:
+        raise TypeError("unknown record field(s): %s" % ", ".join(sorted(desconhecidos)))
+    f = dict(_ENCODE_DEFAULTS, **fields)
+
+    code = ord(type_id)
+    if code in PATH_TYPES:
+        tail = f["filename"].encode('utf-8')[:255] + b"\0"
+    elif code in (ord('R'), ord('W')):
+        tail = IO.pack(f["io_bytes"], f["io_latency_ns"])
+    elif code == ord('N'):
+        tail = CONN.pack(f["saddr"], f["daddr"], f["sport"], f["dport"], 0)
+    elif code == ord('D'):
+        tail = DROP.pack(f["saddr"], f["daddr"], f["sport"], f["dport"], f["proto"],
+                         f["net_len"])
+    elif code == ord('X'):
+        tail = EXIT.pack(f["exit_ns"], f["exit_code"], 0)
+    elif code in HEADER_ONLY_TYPES:
+        tail = b""
+    else:
+        raise ValueError("unknown record type: %r" % type_id)
+
+    size = HEADER.size + len(tail)
+    head = HEADER.pack(code, 0, size, f["pid"], f["ppid"], f["uid"], f["loginuid"],
+                       f["prio"], f["rss"], f["comm"].encode('utf-8')[:16])
+    return head + tail
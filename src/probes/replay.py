@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# ===============================================================================
+# FILE: src/probes/replay.py
+# DESCRIPTION: Gravacao e reproducao dos registros brutos das sondas.
+#
+#              Medir ou testar o caminho dos eventos do motor exigia root, bcc
+#              e um kernel gerando carga. Aqui os registros exatamente como o
+#              kernel os entrega (layouts de records.py) sao gravados em
+#              arquivo, ou gerados sinteticamente, e devolvidos ao mesmo
+#              callback que o BCC chama. Dali em diante o caminho e o real:
+#              lote, worker, _handle_record, arvore.
+#
+# FORMAT:      MAGIC (8 bytes), ordem de bytes do host gravador (1 byte, 'l'
+#              ou 'b'), e entao um quadro por registro: FRAME (instante em ns
+#              desde o inicio da gravacao, tamanho) seguido dos bytes. Os
+#              registros estao na ordem nativa de quem gravou; reproduzir em
+#              host de outra ordem e recusado.
+#
+# NOTES:       Sem dependencia de bcc. Compativel com Python 3.6.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import random
+import struct
+import sys
+import threading
+import time
+
+from src.probes import records
+
+MAGIC = b"SIREC\x00\x00\x01"
+FRAME = struct.Struct("=QI")
+
+# Mistura padrao do fluxo sintetico (peso por tipo): o perfil de um host de
+# servico com as sondas no modo normal, em que I/O e agregado no kernel e nao
+# gera evento.
+DEFAULT_MIX = {'O': 60, 'N': 10, 'F': 10, 'E': 10, 'X': 5, 'D': 5}
+
+# PIDs sinteticos acima do pid_max padrao: nunca colidem com um processo real
+# do host em que a reproducao roda.
+SYNTHETIC_PID_BASE = 2 ** 22
+
+
+def _byteorder():
+    return b"l" if sys.byteorder == "little" else b"b"
+
+
+class RecordWriter(object):
+    """
+    Grava registros brutos no formato acima.
+
+    write_batch() e chamado pelo worker do EventBatcher, uma vez por lote: a
+    gravacao nao passa pela thread de leitura do kernel.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "wb")
+        self._fh.write(MAGIC + _byteorder())
+        self._t0 = time.monotonic()
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def write(self, raw):
+        """Grava um registro (bytes ou memoryview)."""
+        with self._lock:
+            self._frame(raw, int((time.monotonic() - self._t0) * 1e9))
+
+    def write_batch(self, view, sizes):
+        """Grava os registros contiguos de um lote, todos com o mesmo instante."""
+        agora = int((time.monotonic() - self._t0) * 1e9)
+        off = 0
+        with self._lock:
+            for size in sizes:
+                self._frame(view[off:off + size], agora)
+                off += size
+
+    def _frame(self, raw, ts_ns):
+        self._fh.write(FRAME.pack(ts_ns, len(raw)))
+        self._fh.write(raw)
+        self.count += 1
+
+    def flush(self):
+        with self._lock:
+            self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+
+def read_records(path):
+    """Gera (ts_ns, bytes) de cada registro de um arquivo gravado."""
+    with open(path, "rb") as fh:
+        head = fh.read(len(MAGIC) + 1)
+        if head[:len(MAGIC)] != MAGIC:
+            raise ValueError("not a sys-inspector record file: %s" % path)
+        if head[len(MAGIC):] != _byteorder():
+            raise ValueError("record file has a different byte order: %s" % path)
+        while True:
+            quadro = fh.read(FRAME.size)
+            if len(quadro) < FRAME.size:
+                return
+            ts_ns, size = FRAME.unpack(quadro)
+            raw = fh.read(size)
+            if len(raw) < size:
+                return  # gravacao interrompida no meio do ultimo registro
+            yield ts_ns, raw
+
+
+def synthetic_records(n, mix=None, pids=256, seed=0):
+    """
+    Gera n registros sinteticos com o layout das sondas.
+
+    Deterministico para uma mesma semente. Os PIDs ficam em
+    SYNTHETIC_PID_BASE + [0, pids); caminhos e destinos variam o bastante para
+    que a arvore cresca como num host real, e nao num unico no.
+    """
+    rnd = random.Random(seed)
+    mix = mix or DEFAULT_MIX
+    tipos = list(mix)
+    pesos = [mix[t] for t in tipos]
+    comms = ("nginx", "postgres", "java", "python3", "bash", "sshd")
+
+    for _ in range(n):
+        tipo = rnd.choices(tipos, pesos)[0]
+        i = rnd.randrange(pids)
+        pid = SYNTHETIC_PID_BASE + i
+        comum = dict(pid=pid, ppid=SYNTHETIC_PID_BASE + i // 8, uid=1000,
+                     loginuid=1000, comm=comms[i % len(comms)])
+        if tipo == 'O':
+            raw = records.encode('O', filename="/var/lib/app/%d/file%d.dat" % (
+                i, rnd.randrange(64)), **comum)
+        elif tipo == 'E':
+            raw = records.encode('E', filename="/usr/bin/%s" % comum["comm"], **comum)
+        elif tipo == 'N':
+            raw = records.encode('N', daddr=0x0a000000 + rnd.randrange(1 << 16),
+                                 dport=rnd.choice((0x5000, 0xbb01, 0x3815)), **comum)
+        elif tipo == 'D':
+            raw = records.encode('D', saddr=0x0100000a, daddr=0x0200000a,
+                                 sport=0x3039, dport=0xbb01, proto=6, **comum)
+        elif tipo == 'X':
+            # exit_ns 0: o motor usa o relogio da reproducao (_wall_clock), e o
+            # fluxo segue deterministico.
+            raw = records.encode('X', exit_code=rnd.choice((0, 9, 256)), **comum)
+        elif tipo in ('R', 'W'):
+            raw = records.encode(tipo, io_bytes=4096, io_latency_ns=20000, **comum)
+        else:
+            raw = records.encode(tipo, **comum)
+        yield raw
+
+
+class ReplaySource(object):
+    """
+    Fonte de eventos que faz o papel do buffer do kernel.
+
+    feed() entrega cada registro ao callback com a assinatura do perf buffer
+    (cpu, data, size) e chama flush() a cada flush_every registros, como o
+    retorno de cada poll(). O ritmo e o maximo: o que se mede e o teto do
+    caminho, nao o ritmo da gravacao.
+    """
+
+    def __init__(self, raws, flush_every=4096):
+        self.raws = raws
+        self.flush_every = max(1, int(flush_every))
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        return cls((raw for _ts, raw in read_records(path)), **kwargs)
+
+    @classmethod
+    def synthetic(cls, n, mix=None, pids=256, seed=0, **kwargs):
+        return cls(synthetic_records(n, mix, pids, seed), **kwargs)
+
+    def feed(self, callback, flush=None):
+        """Devolve quantos registros foram entregues."""
+        n = 0
+        for raw in self.raws:
+            callback(0, raw, len(raw))
+            n += 1
+            if flush is not None and n % self.flush_every == 0:
+                flush()
+        if flush is not None:
+            flush()
+        return n
@@ -19,6 +19,8 @@ import os
 import sys
 import yaml
 
+from src.probes.rate_limit import MAX_BURST, MAX_RATE
+
 # Default configuration structure to ensure the app runs even with minimal config
 DEFAULT_CONFIG = {
     "general": {
@@ -44,6 +46,48 @@ DEFAULT_CONFIG = {
         "gpu_monitoring": False,
         "security_inspection": True
     },
+    "engine": {
+        "io_events_debug": False,
+        "io_per_thread": False,
+        "transport": "auto",
+        "ringbuf_pages": 64,
+        "attach_mode": "auto",
+        "probe_cache_dir": "/var/lib/sys-inspector/probe-cache",
+        "open_deny_prefixes": ["/proc", "/sys", "/dev", "/run"],
+        "open_dedupe": True,
+        "open_seen_entries": 16384,
+        "perf_buffer_max_mb": 64,
+        "decode_batch_kb": 256,
+        "decode_batches": 8,
+        "proc_reconcile_s": 300,
+        "scan_workers": 4,
+        "enrich_workers": 2,
+        "enrich_max_pending": 4096,
+        "enrich_drain_s": 2.0,
+        "enrich_cache_entries": 32768,
+        "hash_cache_entries": 20000,
+        "hash_background_mb": 64,
+        "record_file": "",
+        "overhead_governor": True,
+        "overhead_cpu_pct": 2.0,
+        "overhead_mem_mb": 256,
+        "overhead_recover_windows": 3,
+        "overhead_open_sample": 10,
+        "rate_limit_enabled": True,
+        "rate_buckets": 16384,
+        "rate_limits": {
+            "exec": {"rate": 150, "burst": 600},
+            "open": {"rate": 500, "burst": 2000},
+            "io": {"rate": 1000, "burst": 5000}
+        },
+        "drop_flow_entries": 8192,
+        "drop_flows_top": 20,
+        "conn_entries": 16384,
+        "conn_top": 50,
+        "offcpu_states": "D",
+        "offcpu_stacks": 4096,
+        "edr_wait_min_ms": 10.0
+    },
     "security": {
         "encrypt_sensitive_data": False,
         "key_file": "conf/secrets.key",
@@ -65,6 +109,28 @@ def _merge_defaults(user_config, defaults):
     return user_config
 
 
+def _clamp_rate_limits(config):
+    """
+    Limita rate e burst de engine.rate_limits aos tetos do balde no kernel.
+    Uma rajada grande demais estourava burst * 10^9 num u64 e o processo
+    passava a ter todos os eventos descartados.
+    """
+    limits = (config.get("engine") or {}).get("rate_limits")
+    if not isinstance(limits, dict): return config
+    for kind, cfg in limits.items():
+        if not isinstance(cfg, dict): continue
+        for key, teto in (("rate", MAX_RATE), ("burst", MAX_BURST)):
+            try:
+                valor = int(cfg.get(key, 0))
+            except (TypeError, ValueError):
+                continue
+            if valor > teto:
+                print(f"[WARN] engine.rate_limits.{kind}.{key}={valor} is above "
+                      f"the probe limit; using {teto}.")
+                cfg[key] = teto
+    return config
+
+
 def load_config(config_path):
     """
     Loads the YAML configuration file.
@@ -89,6 +155,7 @@ def load_config(config_path):
 
         # Merge with defaults to guarantee structure
         final_config = _merge_defaults(user_config, DEFAULT_CONFIG)
+        _clamp_rate_limits(final_config)
         # Guarda a origem para que um processo de longa duracao consiga reler o
         # proprio arquivo. Sem isso, so um restart aplicaria qualquer ajuste, e
         # reiniciar um agente descarta a janela de captura em andamento.
@@ -14,3 +14,33 @@ import sys
 _ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 if _ROOT not in sys.path:
     sys.path.insert(0, _ROOT)
+
+import copy    # noqa: E402
+import io      # noqa: E402
+
+import pytest  # noqa: E402
+
+from src.core import engine as engine_mod             # noqa: E402
+from src.utils.config_loader import DEFAULT_CONFIG    # noqa: E402
+
+MOTOR = os.path.join(_ROOT, "src", "core", "engine.py")
+
+
+@pytest.fixture
+def motor(monkeypatch):
+    """
+    Motor sem kernel, com a configuracao padrao: kernel 5.3 (kprobes, sem
+    ring buffer nem operacoes em lote) e enriquecimento que nao le /proc.
+    Cada teste ajusta so o que usa (drop_flows_top, conn_top,
+    _block_devices...).
+    """
+    monkeypatch.setattr(engine_mod, "_kernel_version", lambda release=None: (5, 3))
+    m = engine_mod.SysInspectorEngine(copy.deepcopy(DEFAULT_CONFIG))
+    m.enricher.enrich = lambda node: True
+    return m
+
+
+@pytest.fixture(scope="session")
+def fonte_motor():
+    """Fonte de src/core/engine.py, para os testes que olham o codigo."""
+    return io.open(MOTOR, encoding="utf-8").read()
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_attach_mode.py
+# DESCRIPTION: Modo de anexacao das sondas: fentry, tracepoint ou kprobe.
+#
+#              openat, connect e I/O de disco eram so kprobes, com kretprobe em
+#              vfs_read/vfs_write. O motor agora escolhe o modo mais barato que
+#              o host suporta, compila so os pontos de entrada dele, desanexa o
+#              I/O do jeito certo em cada um e declara o modo na captura e nas
+#              capacidades.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import re
+
+import pytest
+
+from src.core.capabilities import detection_capabilities, summarize
+from src.core.capture_health import CaptureHealth
+from src.probes import attach
+from src.probes.attach import (choose_attach_mode, fentry_available, tracepoints_available,
+                               syscall_workload, MODE_FENTRY, MODE_TRACEPOINT, MODE_KPROBE,
+                               IO_TRACEPOINTS)
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+@pytest.fixture(scope="module")
+def sonda():
+    return io.open(SONDA, encoding="utf-8").read()
+
+
+@pytest.mark.parametrize("pedido,kernel,btf,tps,esperado", [
+    ("auto", (6, 1), True, True, MODE_FENTRY),
+    ("auto", (6, 1), False, True, MODE_TRACEPOINT),
+    ("auto", (5, 4), True, True, MODE_TRACEPOINT),     # BTF, mas sem fentry
+    ("auto", (4, 12), False, False, MODE_KPROBE),
+    ("fentry", (5, 3), False, True, MODE_TRACEPOINT),  # pedido sem suporte cai
+    ("tracepoint", (6, 1), True, False, MODE_KPROBE),
+    ("kprobe", (6, 1), True, True, MODE_KPROBE),        # kprobe e sempre aceito
+    ("qualquer", (6, 1), False, True, MODE_TRACEPOINT),
+])
+def test_mode_selection(pedido, kernel, btf, tps, esperado):
+    assert choose_attach_mode(pedido, kernel, btf=btf, tracepoints=tps) == esperado
+
+
+def test_bcc_without_kfunc_support_rules_out_fentry():
+    class SemKfunc(object):
+        @staticmethod
+        def support_kfunc():
+            return False
+    assert not fentry_available((6, 1), btf=True, bpf_cls=SemKfunc)
+    assert fentry_available((6, 1), btf=True)
+
+
+def test_tracepoints_are_looked_up_in_tracefs(tmp_path):
+    assert not tracepoints_available(roots=(str(tmp_path),))
+    for categoria, evento in attach.REQUIRED_TRACEPOINTS:
+        (tmp_path / "events" / categoria / evento).mkdir(parents=True)
+    assert tracepoints_available(roots=(str(tmp_path),))
+
+
+def test_only_the_chosen_mode_is_compiled(sonda):
+    """O BCC anexa sozinho todo TRACEPOINT_PROBE e KFUNC_PROBE: modo errado compilado e sonda duplicada."""
+    assert attach.MODE_CFLAGS[MODE_TRACEPOINT] == ["-DSI_ATTACH_TRACEPOINT"]
+    assert attach.MODE_CFLAGS[MODE_FENTRY] == ["-DSI_ATTACH_FENTRY"]
+    blocos = re.findall(r"#if defined\(SI_ATTACH_TRACEPOINT\)(.*?)#endif", sonda, re.S)
+    assert len(blocos) == 3        # openat, I/O, connect
+    io_bloco = [b for b in blocos if "sys_exit_read" in b][0]
+    tp, resto = io_bloco.split("#elif defined(SI_ATTACH_FENTRY)")
+    fentry, kprobe = resto.split("#else")
+    assert "KFUNC_PROBE(" not in tp and "TRACEPOINT_PROBE(" not in fentry
+    assert "KRETFUNC_PROBE(vfs_read," in fentry
+    assert "int trace_vfs_read_return(struct pt_regs *ctx)" in kprobe
+    # Sem nomes que o BCC anexaria na carga por conta propria no modo kprobe.
+    for fn in ("vfs_read", "vfs_write", "tcp_v4_connect"):
+        assert not re.search(r"int k(ret)?probe__%s\(" % fn, sonda)
+
+
+def test_every_io_tracepoint_has_its_probe(sonda):
+    for tp in IO_TRACEPOINTS:
+        categoria, evento = tp.split(":")
+        assert "TRACEPOINT_PROBE(%s, %s)" % (categoria, evento) in sonda
+
+
+class _BPF(object):
+    def __init__(self, funcs=()):
+        self.funcs = dict((f, None) for f in funcs)
+        self.chamadas = []
+
+    def __getattr__(self, nome):
+        def chamada(*args, **kw):
+            self.chamadas.append((nome, kw.get("tp") or kw.get("event") or kw.get("fn_name")
+                                  or args[0], kw.get("fn_name")))
+        return chamada
+
+
+def test_tracepoint_mode_detaches_and_reattaches_the_io_tracepoints(motor, sonda):
+    motor._vfs_attached = True
+    motor.attach_mode = MODE_TRACEPOINT
+    motor.bpf = _BPF()
+    motor._detach_vfs()
+    assert motor.bpf.chamadas == [("detach_tracepoint", tp, None) for tp in IO_TRACEPOINTS]
+
+    motor.bpf.chamadas = []
+    motor._attach_vfs()
+    assert [c[1] for c in motor.bpf.chamadas] == list(IO_TRACEPOINTS)
+    assert motor.bpf.chamadas[0][2] == "tracepoint__syscalls__sys_enter_read"
+
+
+def test_fentry_mode_touches_only_the_io_kfuncs(motor):
+    motor._vfs_attached = True
+    motor.attach_mode = MODE_FENTRY
+    motor.bpf = _BPF([b"kfunc__vmlinux__vfs_read", b"kretfunc__vmlinux__vfs_read",
+                      b"kfunc__vfs_write", b"kretfunc__vfs_write",
+                      b"kfunc__vmlinux__tcp_v4_connect", b"tracepoint__sched__sched_switch"])
+    motor._detach_vfs()
+    assert sorted(motor.bpf.chamadas) == [
+        ("detach_kfunc", "kfunc__vfs_write", "kfunc__vfs_write"),
+        ("detach_kfunc", "kfunc__vmlinux__vfs_read", "kfunc__vmlinux__vfs_read"),
+        ("detach_kretfunc", "kretfunc__vfs_write", "kretfunc__vfs_write"),
+        ("detach_kretfunc", "kretfunc__vmlinux__vfs_read", "kretfunc__vmlinux__vfs_read")]
+    assert motor._vfs_attached is False
+
+
+def test_kprobe_mode_uses_the_explicit_names(motor, sonda):
+    motor.attach_mode = MODE_KPROBE
+    motor.bpf = _BPF()
+    motor._vfs_attached = False
+    motor._attach_vfs()
+    nomes = [c[2] for c in motor.bpf.chamadas]
+    assert nomes == ["trace_vfs_read_entry", "trace_vfs_read_return",
+                     "trace_vfs_write_entry", "trace_vfs_write_return"]
+    for nome in nomes:
+        assert "int %s(struct pt_regs *ctx)" % nome in sonda
+    assert ("tcp_v4_connect", "trace_tcp_v4_connect") in attach.CONN_KPROBES[MODE_KPROBE]
+    assert "int trace_tcp_v4_connect(struct pt_regs *ctx" in sonda
+
+
+def test_mode_is_reported_in_the_capture_and_the_capabilities(monkeypatch):
+    health = CaptureHealth(transport="ringbuf", attach_mode=MODE_TRACEPOINT)
+    assert health.close_window(10, {}, 0, 1.0)["attach_mode"] == MODE_TRACEPOINT
+
+    monkeypatch.setattr(attach, "_active_mode", None)
+    caps = detection_capabilities()
+    assert caps["attach_mode"] in attach.MODES
+    assert caps["attach_mode_active"] is False
+
+    monkeypatch.setattr(attach, "_active_mode", MODE_FENTRY)
+    caps = detection_capabilities()
+    assert (caps["attach_mode"], caps["attach_mode_active"]) == (MODE_FENTRY, True)
+    assert "sondas: fentry" in summarize({"detect": caps, "generate": {}})
+
+
+def test_syscall_workload_runs_anywhere():
+    assert syscall_workload(iterations=32, connects=2) > 0
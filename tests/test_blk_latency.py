@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_blk_latency.py
+# DESCRIPTION: Latencia de I/O de bloco em histogramas log2, por disco e PID.
+#
+#              A latencia de disco era o intervalo vfs_read/vfs_write (com page
+#              cache e pipes) somado numa media. block_rq_issue/complete passam
+#              a alimentar histogramas no kernel; o motor tira p50/p95/p99 por
+#              processo e por disco, pendurados na topologia de storage.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+
+from src.core import bpf_maps
+from src.collectors.process_tree import ProcessNode
+from src.probes.blk_latency import (percentiles, slot_upper_us, block_devices,
+                                    devt_name, attach_disk_latency, format_latency)
+from src.probes.replay import SYNTHETIC_PID_BASE
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+SDA = (8 << 20) | 0
+
+
+def test_slots_follow_bpf_log2l():
+    # bpf_log2l(0) = bpf_log2l(1) = 1; 2..3 -> 2; 4..7 -> 3.
+    assert [slot_upper_us(s) for s in (0, 1, 2, 3, 10)] == [0, 1, 3, 7, 1023]
+
+
+def test_percentiles_pick_the_bucket_that_holds_the_rank():
+    # 90 requisicoes ate 1ms (balde 10), 8 ate 8ms (13), 2 ate 64ms (16).
+    p = percentiles({10: 90, 13: 8, 16: 2})
+    assert p == {"ops": 100, "p50_us": 1023, "p95_us": 8191, "p99_us": 65535}
+    assert percentiles({}) == {}
+    assert format_latency(p) == "p50 1.0ms | p95 8.2ms | p99 65.5ms (100 ops)"
+
+
+def test_block_devices_map_the_kernel_devt(tmp_path):
+    for nome, dev in (("sda", "8:0"), ("nvme0n1", "259:0"), ("quebrado", "x")):
+        (tmp_path / nome).mkdir()
+        (tmp_path / nome / "dev").write_text(dev + "\n")
+    nomes = block_devices(str(tmp_path))
+    assert nomes == {SDA: "sda", 259 << 20: "nvme0n1"}
+    assert devt_name(SDA, nomes) == "sda"
+    assert devt_name((253 << 20) | 3, nomes) == "253:3"
+    assert block_devices(str(tmp_path / "ausente")) == {}
+
+
+def test_disk_latency_lands_on_the_storage_topology():
+    storage = {"roots": [{"kname": "sda", "children": [{"kname": "sda1", "children": []}]},
+                         {"kname": "sdb", "children": []}]}
+    attach_disk_latency(storage, {"sda1": {"ops": 3, "p50_us": 7}})
+    assert storage["roots"][0]["children"][0]["latency"]["ops"] == 3
+    assert "latency" not in storage["roots"][0] and "latency" not in storage["roots"][1]
+    assert attach_disk_latency(None, {"sda": {}}) is None
+
+
+class _SlotPid(ct.Structure):
+    _fields_ = [("pid", ct.c_uint), ("gen", ct.c_uint), ("slot", ct.c_ulonglong)]
+
+
+class _SlotDev(ct.Structure):
+    _fields_ = [("dev", ct.c_uint), ("gen", ct.c_uint), ("slot", ct.c_ulonglong)]
+
+
+class _Mapa(object):
+    """Histograma do BCC, sem operacoes em lote."""
+
+    def __init__(self, chave, itens):
+        self.Key = chave
+        self.itens = itens
+
+    def items(self):
+        return list(self.itens)
+
+    def __delitem__(self, k):
+        self.itens = [(c, v) for c, v in self.itens if c is not k]
+
+
+def test_engine_turns_histograms_into_percentiles(motor):
+    motor._block_devices = {SDA: "sda"}
+    pid = SYNTHETIC_PID_BASE + 3
+    motor.tree.add_or_update(pid, 1, "postgres", 0, 0, 0, deferred=True)
+    por_pid = _Mapa(_SlotPid, [(_SlotPid(pid, 0, 10), ct.c_ulonglong(99)),
+                               (_SlotPid(pid, 0, 14), ct.c_ulonglong(1)),
+                               (_SlotPid(pid, 1, 3), ct.c_ulonglong(5)),
+                               (_SlotPid(pid + 1, 0, 3), ct.c_ulonglong(5))])
+    por_disco = _Mapa(_SlotDev, [(_SlotDev(SDA, 0, 10), ct.c_ulonglong(99)),
+                                 (_SlotDev(SDA, 0, 14), ct.c_ulonglong(1))])
+    motor.bpf = {"blk_lat_pid": por_pid, "blk_lat_dev": por_disco}
+    motor._collect_block_latency(gen=0)
+
+    node = motor.tree.get(pid)
+    assert node.blk_latency == {"ops": 100, "p50_us": 1023, "p95_us": 1023, "p99_us": 1023}
+    assert motor.capture_health["disk_latency"]["sda"]["ops"] == 100
+    # A geracao viva fica no mapa.
+    assert [(k.pid, k.gen) for k, _ in por_pid.itens] == [(pid, 1)]
+
+
+def test_window_resets_the_percentiles():
+    node = ProcessNode.from_dict({"context_tags": [], "detection_reasons": [],
+                                  "blk_latency": {"ops": 1}})
+    assert node.carry_over().blk_latency == {}
+
+
+def test_probe_measures_issue_to_complete_per_generation():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    for tp in ("block_rq_insert", "block_rq_issue", "block_rq_complete"):
+        assert "TRACEPOINT_PROBE(block, %s)" % tp in sonda
+    assert "BPF_HISTOGRAM(blk_lat_dev, struct blk_dev_slot_t" in sonda
+    assert "BPF_HISTOGRAM(blk_lat_pid, struct blk_pid_slot_t" in sonda
+    for chave in ("struct blk_dev_slot_t {", "struct blk_pid_slot_t {"):
+        assert "u32 gen;" in sonda.split(chave)[1].split("};")[0]
+    corpo = sonda.split("TRACEPOINT_PROBE(block, block_rq_complete)")[1].split("\n}\n")[0]
+    assert "bpf_log2l(" in corpo and "blk_inflight.delete(" in corpo
+    assert set(bpf_maps.BLOCK_LATENCY_MAPS) == {"blk_lat_dev", "blk_lat_pid"}
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_capture_health.py
+# DESCRIPTION: Eventos perdidos por janela e tamanho do buffer de perf.
+#
+#              Quando o agente ficava para tras, o kernel descartava amostras e
+#              a captura seguia parecendo completa. Agora a perda e contada por
+#              CPU e por janela, viaja na captura e na coluna quente
+#              lost_events, e o buffer cresce a partir da taxa observada.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import tempfile
+
+import pytest
+
+from src.core import engine as engine_mod
+from src.core.capture_health import (CaptureHealth, choose_page_cnt,
+                                     max_page_cnt, MIN_PAGE_CNT)
+from src.core.database import DatabaseManager
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MOTOR = os.path.join("src", "core", "engine.py")
+
+
+def test_idle_host_keeps_the_bcc_default():
+    assert choose_page_cnt(0, 0, ncpu=4, max_mb=64) == MIN_PAGE_CNT
+
+
+def test_busy_host_gets_a_bigger_buffer():
+    pequeno = choose_page_cnt(1000, 0, ncpu=4, max_mb=64)
+    grande = choose_page_cnt(500000, 0, ncpu=4, max_mb=64)
+    assert grande > pequeno
+    assert grande & (grande - 1) == 0  # potencia de dois, exigencia do perf
+
+
+def test_loss_doubles_the_buffer_even_if_the_rate_fits():
+    """Perda e rajada; a media da janela a esconde."""
+    assert choose_page_cnt(10, 5, ncpu=4, max_mb=64, current=16) == 32
+
+
+def test_memory_ceiling_is_respected():
+    teto = max_page_cnt(16, ncpu=64)
+    assert choose_page_cnt(10 ** 9, 1, ncpu=64, max_mb=16, current=4096) == teto
+    assert teto * 4096 * 64 <= 16 * 1024 * 1024
+
+
+def test_window_summary_flags_incomplete_capture():
+    health = CaptureHealth(transport="perf", page_cnt=8)
+    limpo = health.close_window(100, {}, 0, 10)
+    assert limpo["complete"] is True and limpo["lost_events"] == 0
+
+    perdido = health.close_window(100, {0: 3, 2: 4, 1: 0}, 2, 10)
+    assert perdido["lost_events"] == 7
+    assert perdido["lost_per_cpu"] == {0: 3, 2: 4}
+    assert perdido["complete"] is False
+
+
+def test_rate_counts_what_was_lost_too():
+    """Medir so o recebido subestimaria justamente as janelas que transbordaram."""
+    health = CaptureHealth()
+    health.close_window(100, {0: 900}, 0, 10)
+    assert health.peak_rate() == 100.0
+
+
+def test_every_submit_counts_its_failure():
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    assert "BPF_PERCPU_ARRAY(submit_lost" in fonte
+    for macro in fonte.split("#define SUBMIT(")[1:]:
+        assert "note_lost()" in macro.split("#")[0]
+
+
+def test_engine_registers_the_lost_callback_and_page_cnt():
+    codigo = io.open(MOTOR, encoding="utf-8").read()
+    bloco = codigo.split("def _poll_loop(self)")[1]
+    assert "lost_cb=self._handle_lost" in bloco
+    assert "page_cnt=self.page_cnt" in bloco
+    assert "self._close_capture_health(" in codigo.split("def stop(self")[1]
+
+
+@pytest.fixture
+def db():
+    d = tempfile.mkdtemp()
+    return DatabaseManager(db_path=os.path.join(d, "t.db"), max_snapshots=100)
+
+
+def test_lost_events_reach_the_fleet_without_decrypting(db):
+    db.insert_snapshot({"x": 1}, agent_uuid="a", metrics={"score": 0, "lost": 42})
+    assert db.get_fleet_status()[0]["lost_events"] == 42
+    assert db.get_pending_snapshots()[0]["metrics"]["lost"] == 42
+
+
+def test_older_callers_record_zero_loss(db):
+    db.insert_snapshot({"x": 1}, agent_uuid="a", metrics={"score": 0})
+    assert db.get_fleet_status()[0]["lost_events"] == 0
+
+
+class _Chave(object):
+    def __init__(self, valor):
+        self.value = valor
+
+
+class _BufferPorCpu(object):
+    """So a interface publica do PerfEventArray do BCC: keys(), len() e del."""
+
+    def __init__(self, cpus, abertas):
+        self.cpus, self.abertas = cpus, set(abertas)
+
+    def keys(self):
+        return iter([_Chave(c) for c in range(self.cpus)])
+
+    def __len__(self):
+        return self.cpus
+
+    def __delitem__(self, cpu):
+        self.abertas.discard(cpu)
+
+
+def test_resizing_closes_every_cpu_reader_through_the_public_api(motor, monkeypatch):
+    monkeypatch.setattr(engine_mod, "choose_page_cnt", lambda *a, **kw: motor.page_cnt * 4)
+    buffer = _BufferPorCpu(4, {0, 1, 3})
+    motor.bpf, motor.transport, motor._perf_buffer_aberto = {"events": buffer}, "perf", True
+
+    antes = motor.page_cnt
+    motor._resize_perf_buffer()
+    assert buffer.abertas == set() and motor._perf_buffer_aberto is False
+    assert motor.page_cnt == antes * 4
+    assert "_open_key_fds" not in io.open(MOTOR, encoding="utf-8").read()
+
+
+def test_dashboard_keeps_the_lost_badge_in_its_own_variable():
+    painel = io.open(os.path.join("src", "controllers", "server_controller.py"),
+                     encoding="utf-8").read()
+    assert "seen_html = (" not in painel
+    assert "{fqdn_html}{seen_html}{lost_html}" in painel
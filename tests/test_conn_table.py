@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_conn_table.py
+# DESCRIPTION: Conexoes de saida agregadas por destino no kernel.
+#
+#              So tcp_v4_connect era visto, com um evento por connect e uma
+#              string por evento no Python (e o append num set falhava calado).
+#              O kernel passa a somar por (pid, familia, destino, porta,
+#              protocolo), IPv4/IPv6 e TCP/UDP, e cada processo leva so os N
+#              destinos mais usados.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+import re
+import socket
+import struct
+
+from src.core import bpf_maps
+from src.collectors.process_tree import ProcessNode
+from src.exporters.html_report import _render_connections
+from src.probes import attach, records
+from src.probes.connections import (conn_record, add_connection, top_connections,
+                                    conn_label)
+from src.probes.replay import ReplaySource, SYNTHETIC_PID_BASE
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+TCP, UDP = socket.IPPROTO_TCP, socket.IPPROTO_UDP
+
+
+def _v4(texto):
+    return socket.inet_pton(socket.AF_INET, texto)
+
+
+def _v6(texto):
+    return socket.inet_pton(socket.AF_INET6, texto)
+
+
+def _conn(dport, count, last=0.0, proto=TCP):
+    return conn_record(socket.AF_INET, _v4("10.0.0.2"), socket.htons(dport), proto,
+                       count=count, last_seen=last)
+
+
+def test_records_and_labels_cover_ipv6_and_udp():
+    c = conn_record(socket.AF_INET6, _v6("2001:db8::1"), socket.htons(53), UDP,
+                    count=4, nbytes=240)
+    assert conn_label(c) == "IPv6 -> [2001:db8::1]:53 (UDP)"
+    assert (c["count"], c["bytes"]) == (4, 240)
+    # IPv4 chega nos 4 primeiros bytes de daddr[16]; TCP mantem o rotulo antigo.
+    c = conn_record(socket.AF_INET, _v4("10.0.0.9") + b"\0" * 12, socket.htons(443), TCP)
+    assert conn_label(c) == "IPv4 -> 10.0.0.9:443"
+
+
+def test_add_connection_merges_and_stays_bounded():
+    tabela = []
+    assert add_connection(tabela, _conn(80, 1, last=1.0), limit=2)
+    assert add_connection(tabela, _conn(80, 1, last=5.0), limit=2)
+    assert add_connection(tabela, _conn(80, 1, proto=UDP), limit=2)
+    assert not add_connection(tabela, _conn(22, 1), limit=2)
+    assert [(c["dport"], c["proto"], c["count"]) for c in tabela] == [
+        (80, "TCP", 2), (80, "UDP", 1)]
+    assert tabela[0]["last_seen"] == 5.0
+
+
+def test_top_connections_keeps_the_busiest_and_counts_the_rest():
+    topo, omitidos = top_connections([_conn(80, 3), _conn(443, 50), _conn(22, 7)], limit=2)
+    assert [c["dport"] for c in topo] == [443, 22]
+    assert omitidos == 3
+
+
+class _Chave(ct.Structure):
+    _fields_ = [("pid", ct.c_uint), ("gen", ct.c_uint), ("daddr", ct.c_ubyte * 16),
+                ("dport", ct.c_ushort), ("family", ct.c_ubyte), ("proto", ct.c_ubyte)]
+
+
+class _Uso(ct.Structure):
+    _fields_ = [("count", ct.c_ulonglong), ("bytes", ct.c_ulonglong),
+                ("first_ns", ct.c_ulonglong), ("last_ns", ct.c_ulonglong)]
+
+
+class _Mapa(object):
+    """conn_stats do BCC, sem operacoes em lote."""
+    Key = _Chave
+
+    def __init__(self, itens):
+        self.itens = itens
+
+    def items(self):
+        return list(self.itens)
+
+    def __delitem__(self, k):
+        self.itens = [(c, v) for c, v in self.itens if c is not k]
+
+
+def test_engine_keeps_top_destinations_per_process(motor):
+    motor.conn_top = 2
+    pid = SYNTHETIC_PID_BASE + 5
+    motor.tree.add_or_update(pid, 1, "curl", 0, 0, 0, deferred=True)
+
+    def entrada(familia, endereco, dport, proto, count, gen=0, dono=pid):
+        daddr = (ct.c_ubyte * 16)(*bytearray(endereco.ljust(16, b"\0")))
+        return (_Chave(dono, gen, daddr, socket.htons(dport), familia, proto),
+                _Uso(count, count * 100, 1, 2))
+
+    mapa = _Mapa([entrada(socket.AF_INET6, _v6("2001:db8::1"), 443, TCP, 40),
+                  entrada(socket.AF_INET, _v4("10.0.0.53"), 53, UDP, 9),
+                  entrada(socket.AF_INET, _v4("10.0.0.2"), 80, TCP, 2),
+                  entrada(socket.AF_INET, _v4("10.0.0.3"), 80, TCP, 1, gen=1),
+                  entrada(socket.AF_INET, _v4("10.0.0.4"), 80, TCP, 5, dono=pid + 1)])
+    motor.bpf = {"conn_stats": mapa}
+    motor._collect_connections(gen=0)
+
+    node = motor.tree.get(pid)
+    assert [(c["family"], c["proto"], c["count"]) for c in node.connection_table] == [
+        ("IPv6", "TCP", 40), ("IPv4", "UDP", 9)]
+    assert node.connection_table[0]["bytes"] == 4000
+    assert node.connections_omitted == 2
+    assert node.connections == {"IPv6 -> [2001:db8::1]:443", "IPv4 -> 10.0.0.53:53 (UDP)"}
+    # A geracao viva fica no mapa; o PID desconhecido e descartado com a sua.
+    assert [(k.dport, k.gen) for k, _ in mapa.itens] == [(socket.htons(80), 1)]
+
+
+def test_replayed_connect_records_land_in_the_table(motor):
+    """O 'N' de gravacoes antigas fazia append num set e nunca aparecia."""
+    motor.conn_top = 2
+    pid = SYNTHETIC_PID_BASE + 9
+    brutos = [records.encode('F', pid=pid, ppid=1, comm="svc")]
+    for porta in (80, 80, 443, 8080):
+        brutos.append(records.encode('N', pid=pid, comm="svc",
+                                     daddr=struct.unpack("I", _v4("10.0.0.2"))[0],
+                                     dport=socket.htons(porta)))
+    motor.replay(ReplaySource(brutos))
+
+    node = motor.tree.get(pid)
+    assert node.connections == {"IPv4 -> 10.0.0.2:80", "IPv4 -> 10.0.0.2:443"}
+    assert node.connection_table[0]["count"] == 2
+    assert node.connections_omitted == 1
+
+
+def test_report_shows_the_table_and_old_labels():
+    node = ProcessNode.__new__(ProcessNode)
+    node.connections = set()
+    node.connection_table = [_conn(443, 12)]
+    node.connections_omitted = 3
+    html = _render_connections(node)
+    assert "IPv4 -&gt; 10.0.0.2:443" in html and "[x12]" in html
+    assert "3 more to other destinations" in html
+
+    node.connection_table = []
+    node.connections = {"IPv4 -> 1.2.3.4:22"}
+    assert "1.2.3.4:22" in _render_connections(node)
+
+
+def test_window_fields_reset_the_table():
+    node = ProcessNode.from_dict({"context_tags": [], "detection_reasons": [],
+                                  "connection_table": [_conn(80, 1)], "connections": {"x"}})
+    node.connections_omitted = 7
+    novo = node.carry_over()
+    assert novo.connection_table == [] and novo.connections == set()
+    assert novo.connections_omitted == 0
+
+
+def test_probe_counts_in_the_kernel_for_every_family_and_protocol():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    chave = sonda.split("struct conn_key_t {")[1].split("};")[0]
+    for campo in ("u32 gen;", "u8  daddr[16];", "u16 dport;", "u8  family;", "u8  proto;"):
+        assert campo in chave
+    assert "BPF_HASH(conn_stats, struct conn_key_t, struct conn_stats_t, SI_CONN_ENTRIES)" in sonda
+    assert "struct rec_conn_t" not in sonda
+    assert "'N'" not in sonda.split("// 1. Connections per Destination")[1].split("// 2. ")[0]
+    assert "conn_stats" in bpf_maps.NETWORK_COUNTER_MAPS
+
+    # Cada kprobe de conexao anexada pelo motor existe fora do modo que a exclui.
+    for modo, sondas in attach.CONN_KPROBES.items():
+        for _, fn in sondas:
+            assert re.search(r"^int %s\(struct pt_regs \*ctx" % fn, sonda, re.M), (modo, fn)
+    # IPv4 mapeado em IPv6 e contado uma vez so (o kernel o repassa ao caminho IPv4).
+    corpo = sonda.split("static __always_inline int conn_key_v6(")[1].split("\n}\n")[0]
+    assert "0xff" in corpo and "return 1;" in corpo
+
+
+def test_engine_attaches_connection_kprobes_per_mode(motor):
+    chamadas = []
+
+    class _BPF(object):
+        def attach_kprobe(self, event, fn_name):
+            if event == "tcp_v6_connect":
+                raise Exception("no symbol")
+            chamadas.append((event, fn_name))
+
+    motor.bpf = _BPF()
+    motor.attach_mode = attach.MODE_KPROBE
+    motor._attach_conn_probes()
+    assert ("tcp_v4_connect", "trace_tcp_v4_connect") in chamadas
+    assert ("udpv6_sendmsg", "trace_udpv6_sendmsg") in chamadas
+    assert len(chamadas) == len(attach.CONN_KPROBES[attach.MODE_KPROBE]) - 1
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_continuous_mode.py
+# DESCRIPTION: Modo continuo: sondas sempre no ar, janelas cortadas por rotacao.
+#
+#              Com start()/stop() a cada captura, o intervalo do ciclo do
+#              daemon era tempo cego (15s/15s = metade do tempo sem observar) e
+#              cada ciclo pagava subir a thread e varrer /proc. No modo
+#              continuo a janela e cortada trocando a geracao dos contadores no
+#              kernel e girando a arvore em memoria.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import re
+
+import pytest
+
+from src.collectors.process_tree import ProcessTree, ProcessNode
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MOTOR = os.path.join("src", "core", "engine.py")
+DAEMON = os.path.join("src", "controllers", "daemon_controller.py")
+
+VIVO = os.getpid()
+MORTO = 2 ** 22 + 7  # acima do pid_max padrao: nunca existe
+
+
+def _no(pid):
+    return ProcessNode.from_dict({
+        "pid": pid, "ppid": 1, "cmd": "svc", "uid": 0, "context_tags": [],
+        "detection_reasons": [], "drop_flows": [], "io_threads": {},
+        "open_files": set(), "file_metadata": {}, "connections": set()})
+
+
+@pytest.fixture
+def arvore():
+    tree = ProcessTree()
+    for pid in (VIVO, MORTO):
+        tree.nodes[pid] = _no(pid)
+    return tree
+
+
+def test_rotation_returns_the_closed_window(arvore):
+    arvore.nodes[VIVO].read_bytes_delta = 100
+    fechada = arvore.rotate()
+
+    assert set(fechada.nodes) == {VIVO, MORTO}
+    assert fechada.nodes[VIVO].read_bytes_delta == 100
+    assert fechada.boot_time == arvore.boot_time
+
+
+def test_only_live_processes_cross_into_the_next_window(arvore):
+    arvore.rotate()
+    assert set(arvore.nodes) == {VIVO}
+
+
+def test_window_counters_restart_and_static_context_stays(arvore):
+    node = arvore.nodes[VIVO]
+    node.read_bytes_delta = 100
+    node.tcp_drops = 3
+    node.open_files.add("/var/log/app.log")
+    node.context_tags = ["CONTAINER", "NET ERR"]
+    node.container_id = "abc"
+
+    arvore.rotate()
+    novo = arvore.nodes[VIVO]
+    assert novo is not node
+    assert novo.read_bytes_delta == 0 and novo.tcp_drops == 0
+    assert novo.open_files == set()
+    assert novo.context_tags == ["CONTAINER"]
+    assert novo.container_id == "abc"
+
+
+def test_closed_window_lists_are_not_shared(arvore):
+    """aggregate_stats da janela fechada nao pode escrever na seguinte."""
+    fechada = arvore.rotate()
+    fechada.nodes[VIVO].detection_reasons.append("so da janela fechada")
+    assert arvore.nodes[VIVO].detection_reasons == []
+
+
+def test_every_window_counter_is_keyed_by_generation():
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    for mapa in ("net_bytes_sent", "net_bytes_recv", "tcp_retrans_map",
+                 "tcp_drop_map"):
+        assert re.search(r"BPF_(PERCPU_)?HASH\(%s, struct pid_gen_key_t" % mapa, fonte)
+    for struct in ("struct io_key_t {", "struct open_key_t {"):
+        assert "u32 gen;" in fonte.split(struct)[1].split("};")[0]
+    assert "BPF_PERCPU_ARRAY(submit_lost, u64, 2)" in fonte
+
+
+def test_generation_index_matches_the_probe():
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    motor = io.open(MOTOR, encoding="utf-8").read()
+    em_c = re.search(r"#define SETTING_GENERATION\s+(\d+)", fonte).group(1)
+    em_py = re.search(r"^SETTING_GENERATION = (\d+)", motor, re.M).group(1)
+    assert em_c == em_py
+
+
+def test_rotate_swaps_before_reading_and_never_stops():
+    motor = io.open(MOTOR, encoding="utf-8").read()
+    bloco = motor.split("def rotate(self)")[1].split("\n    def ")[0]
+    troca = bloco.index("SETTING_GENERATION")
+    assert troca < bloco.index("_collect_io_counters(")
+    assert troca < bloco.index("_collect_network_counters(")
+    assert "self.running = False" not in bloco
+    assert "_drain_generation(self.bpf[\"open_seen\"]" in bloco
+
+
+def test_daemon_continuous_path_rotates_instead_of_stopping():
+    fonte = io.open(DAEMON, encoding="utf-8").read()
+    bloco = fonte.split("def _collect_continuous")[1].split("\n    def ")[0]
+    assert "engine.rotate()" in bloco
+    assert "engine.stop()" not in bloco
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_cpu_accounting.py
+# DESCRIPTION: Tempo em CPU somado no kernel (sched_switch), sem ler /proc.
+#
+#              O percentual de CPU saia de /proc/PID/stat lido para cada no no
+#              start() e de novo no stop(), dividido por um duration=30 fixo:
+#              numa janela de 10 s todo processo aparecia com um terco do uso
+#              real, e o processo que nasceu e morreu na janela nao tinha uso
+#              nenhum.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+
+
+from src.collectors.process_tree import ProcessNode
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MANAGER = os.path.join("src", "collectors", "manager.py")
+DAEMON = os.path.join("src", "controllers", "daemon_controller.py")
+
+
+def _ler(caminho):
+    return io.open(caminho, encoding="utf-8").read()
+
+
+def _metodo(fonte, nome):
+    return fonte.split("def %s(" % nome)[1].split("\n    def ")[0]
+
+
+def test_switch_charges_the_task_leaving_the_cpu():
+    sonda = _ler(SONDA)
+    corpo = sonda.split("TRACEPOINT_PROBE(sched, sched_switch)")[1].split("\n}\n")[0]
+    # O intervalo e medido por CPU e somado ao processo corrente, na geracao
+    # corrente, como os demais contadores de janela.
+    assert "oncpu_since.lookup(" in corpo
+    assert "bpf_get_current_pid_tgid() >> 32" in corpo
+    assert ".gen = current_gen()" in corpo
+    assert "pid == 0" in corpo
+    assert "BPF_PERCPU_ARRAY(oncpu_since" in sonda
+
+
+def test_no_proc_stat_reads_left(fonte_motor):
+    assert "/proc/{pid}/stat" not in fonte_motor
+    assert "_get_cpu_ticks" not in fonte_motor
+    assert "_update_cpu_stats(duration=30)" not in fonte_motor
+
+
+def test_stop_uses_the_real_window(fonte_motor):
+    corpo = _metodo(fonte_motor, "stop")
+    assert "def stop(self, duration=None)" in fonte_motor
+    assert 'duration or self.capture_health.get("window_seconds")' in corpo
+    assert corpo.index("self._close_capture_health(") < corpo.index("self._collect_cpu_counters(")
+
+
+def test_rotate_and_start_handle_the_cpu_map(fonte_motor):
+    assert "self._collect_cpu_counters(segundos, tree, fechada)" in _metodo(fonte_motor, "rotate")
+    assert "self._reset_cpu_counters()" in _metodo(fonte_motor, "start")
+
+
+def test_callers_pass_the_measured_duration():
+    assert "self.engine.stop(duration=elapsed)" in _ler(MANAGER)
+    assert "engine.stop(duration=duracao)" in _ler(DAEMON)
+
+
+def test_cpu_time_is_a_window_field():
+    node = ProcessNode(10, 1, "x", 0)
+    node.cpu_time_ns = 5 * 10 ** 9
+    node.cpu_usage_pct = 50.0
+    novo = node.carry_over()
+    assert (novo.cpu_time_ns, novo.cpu_usage_pct) == (0, 0.0)
+    assert not hasattr(novo, "cpu_start_ticks")
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_drop_flows.py
+# DESCRIPTION: Pacotes descartados agregados por fluxo no kernel.
+#
+#              kfree_skb enviava um evento por pacote descartado e o motor
+#              guardava uma string por evento, sem limite. O kernel passa a
+#              somar por (pid, enderecos, portas, protocolo, motivo) e cada
+#              processo leva so os N fluxos com mais descartes.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+import socket
+import struct
+import types
+
+from src.core import bpf_maps
+from src.collectors.process_tree import ProcessNode
+from src.exporters.html_report import _render_drop_flows
+from src.probes import records
+from src.probes.drop_flows import (reason_names, flow_record, add_flow, top_flows,
+                                   flow_label)
+from src.probes.replay import ReplaySource, SYNTHETIC_PID_BASE
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+FORMATO = '''name: kfree_skb
+format:
+\tfield:void * skbaddr;\toffset:8;\tsize:8;\tsigned:0;
+\tfield:enum skb_drop_reason reason;\toffset:28;\tsize:4;\tsigned:0;
+
+print fmt: "skbaddr=%p protocol=%u location=%pS reason: %s", REC->skbaddr, REC->protocol, REC->location, __print_symbolic(REC->reason, { 1, "CONSUMED" }, { 2, "NOT_SPECIFIED" }, { 3, "NO_SOCKET" })
+'''
+
+
+def _ip(texto):
+    return struct.unpack("I", socket.inet_aton(texto))[0]
+
+
+def _chave(saddr, daddr, sport, dport, proto, reason=0):
+    """Chave de drop_flows como o BCC a entrega: campos por atributo."""
+    return types.SimpleNamespace(saddr=saddr, daddr=daddr, sport=sport, dport=dport,
+                                 proto=proto, reason=reason)
+
+
+def _fluxo(dport, count, last=0.0):
+    return flow_record(_chave(_ip("10.0.0.1"), _ip("10.0.0.2"), socket.htons(40000),
+                              socket.htons(dport), 6), count=count, last_seen=last)
+
+
+def test_reason_names_come_from_the_tracepoint_format(tmp_path):
+    caminho = tmp_path / "format"
+    caminho.write_text(FORMATO)
+    assert reason_names((str(tmp_path / "ausente"), str(caminho))) == {
+        1: "CONSUMED", 2: "NOT_SPECIFIED", 3: "NO_SOCKET"}
+    assert reason_names((str(tmp_path / "ausente"),)) == {}
+
+
+def test_flow_record_reads_network_order():
+    f = flow_record(_chave(_ip("192.168.1.5"), _ip("10.0.0.9"), socket.htons(443),
+                           socket.htons(51000), 17, reason=3),
+                    count=4, nbytes=240, names={3: "NO_SOCKET"})
+    assert flow_label(f) == "192.168.1.5:443 -> 10.0.0.9:51000 (UDP)"
+    assert (f["reason"], f["count"], f["bytes"]) == ("NO_SOCKET", 4, 240)
+    assert flow_record(_chave(1, 2, 0, 0, 6))["reason"] is None
+    assert flow_record(_chave(1, 2, 0, 0, 6, reason=99))["reason"] == "reason 99"
+    # Registro 'D' de gravacao antiga: mesmos campos, sem motivo.
+    antigo = records.decode(records.encode('D', saddr=1, daddr=2, proto=6, net_len=60))
+    assert flow_record(antigo, nbytes=antigo.net_len)["reason"] is None
+
+
+def test_add_flow_merges_and_stays_bounded():
+    flows = []
+    assert add_flow(flows, _fluxo(80, 1, last=1.0), limit=2)
+    assert add_flow(flows, _fluxo(80, 1, last=5.0), limit=2)
+    assert add_flow(flows, _fluxo(443, 1), limit=2)
+    assert not add_flow(flows, _fluxo(22, 1), limit=2)
+    assert [(f["dport"], f["count"]) for f in flows] == [(80, 2), (443, 1)]
+    assert flows[0]["last_seen"] == 5.0
+
+
+def test_top_flows_keeps_the_busiest_and_counts_the_rest():
+    flows = [_fluxo(80, 3), _fluxo(443, 50), _fluxo(22, 7), _fluxo(53, 1)]
+    topo, omitidos = top_flows(flows, limit=2)
+    assert [f["dport"] for f in topo] == [443, 22]
+    assert omitidos == 4
+
+
+class _Chave(ct.Structure):
+    _fields_ = [("pid", ct.c_uint), ("gen", ct.c_uint), ("saddr", ct.c_uint),
+                ("daddr", ct.c_uint), ("sport", ct.c_ushort), ("dport", ct.c_ushort),
+                ("proto", ct.c_ushort), ("reason", ct.c_ushort)]
+
+
+class _Fluxo(ct.Structure):
+    _fields_ = [("count", ct.c_ulonglong), ("bytes", ct.c_ulonglong),
+                ("first_ns", ct.c_ulonglong), ("last_ns", ct.c_ulonglong)]
+
+
+class _Mapa(object):
+    """drop_flows do BCC, sem operacoes em lote."""
+    Key = _Chave
+
+    def __init__(self, itens):
+        self.itens = itens
+
+    def items(self):
+        return list(self.itens)
+
+    def __delitem__(self, k):
+        self.itens = [(c, v) for c, v in self.itens if c is not k]
+
+
+def test_engine_keeps_top_flows_per_process(motor):
+    motor.drop_flows_top = 2
+    motor._drop_reasons = {3: "NO_SOCKET"}
+    pid = SYNTHETIC_PID_BASE + 5
+    motor.tree.add_or_update(pid, 1, "nginx", 0, 0, 0, deferred=True)
+
+    def entrada(dport, count, gen=0, dono=pid):
+        return (_Chave(dono, gen, _ip("10.0.0.1"), _ip("10.0.0.2"), socket.htons(80),
+                       socket.htons(dport), 6, 3),
+                _Fluxo(count, count * 60, 1, 2))
+
+    mapa = _Mapa([entrada(1000, 9), entrada(1001, 40), entrada(1002, 2),
+                  entrada(1003, 1, gen=1), entrada(1004, 5, dono=pid + 1)])
+    motor.bpf = {"drop_flows": mapa}
+    motor._collect_drop_flows(gen=0)
+
+    node = motor.tree.get(pid)
+    assert [(f["dport"], f["count"]) for f in node.drop_flows] == [(1001, 40), (1000, 9)]
+    assert node.drop_flows[0]["reason"] == "NO_SOCKET"
+    assert node.drop_flows[0]["bytes"] == 2400
+    assert node.drop_flows_omitted == 2
+    # A geracao viva fica no mapa; o PID desconhecido e descartado com a sua.
+    assert [(k.dport, k.gen) for k, _ in mapa.itens] == [(socket.htons(1003), 1)]
+
+
+def test_replayed_drop_records_stay_bounded(motor):
+    motor.drop_flows_top = 2
+    pid = SYNTHETIC_PID_BASE + 9
+    brutos = [records.encode('F', pid=pid, ppid=1, comm="svc")]
+    for porta in range(50):
+        brutos.append(records.encode('D', pid=pid, comm="svc", saddr=_ip("10.0.0.1"),
+                                     daddr=_ip("10.0.0.2"), sport=socket.htons(9),
+                                     dport=socket.htons(porta + 1), proto=6, net_len=60))
+    motor.replay(ReplaySource(brutos))
+
+    node = motor.tree.get(pid)
+    assert len(node.drop_flows) == 2
+    assert node.drop_flows_omitted == 48
+    assert node.tcp_drops == 50
+
+
+def test_report_shows_flows_with_counts():
+    node = ProcessNode.__new__(ProcessNode)
+    node.drop_flows = [_fluxo(443, 12)]
+    node.drop_flows[0]["reason"] = "NO_SOCKET"
+    node.drop_flows_omitted = 3
+    html = _render_drop_flows(node)
+    assert "10.0.0.1:40000 -&gt; 10.0.0.2:443 (TCP) NO_SOCKET" in html
+    assert "[x12]" in html
+    assert "3 more drops in other flows" in html
+
+
+def test_old_captures_still_render_their_drop_strings():
+    node = ProcessNode.__new__(ProcessNode)
+    node.network_drops_details = ["DROP: a -> b (TCP)"] * 3
+    assert "[x3]" in _render_drop_flows(node)
+
+
+def test_probe_aggregates_instead_of_sending_events():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    corpo = sonda.split("TRACEPOINT_PROBE(skb, kfree_skb)")[1].split("\n}\n")[0]
+    assert "SUBMIT(" not in corpo and "rate_allowed(" not in corpo
+    assert "drop_flows.lookup_or_try_init(" in corpo
+    assert "__sync_fetch_and_add(&flow->count, 1)" in corpo
+    # args->reason so existe no tracepoint a partir do 5.17.
+    assert corpo.index("KERNEL_VERSION(5,17,0)") < corpo.index("args->reason")
+    assert "struct rec_drop_t" not in sonda
+    assert "BPF_HASH(drop_flows, struct drop_flow_key_t, struct drop_flow_t, SI_DROP_FLOWS)" in sonda
+    assert "drop_flows" in bpf_maps.NETWORK_COUNTER_MAPS
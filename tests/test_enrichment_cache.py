@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_enrichment_cache.py
+# DESCRIPTION: Fatos estaticos reaproveitados entre ciclos do daemon.
+#
+#              Cada ciclo zera a arvore e relia tudo, MD5 do executavel
+#              inclusive, de processos que nao mudaram. O cache guarda esses
+#              fatos pela identidade do processo (starttime + inode do exe) e
+#              os devolve enquanto ela bate; razoes e selos continuam sendo
+#              produzidos em cada no, porque cada captura descreve a sua janela.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+
+import pytest
+
+from src.collectors import process_tree as pt
+from src.collectors.enrichment import StaticFactsCache, process_identity
+from src.collectors.process_tree import ProcessTree
+
+ENGINE = os.path.join("src", "core", "engine.py")
+
+
+def test_cache_matches_identity_and_stays_bounded():
+    cache = StaticFactsCache(max_entries=2)
+    cache.put(10, ("a",), {"md5": "x"})
+    assert cache.get(10, ("a",)) == {"md5": "x"}
+    assert cache.get(10, ("b",)) is None       # binario trocado
+    cache.put(11, ("a",), {})
+    cache.put(12, ("a",), {})
+    assert len(cache) == 2 and cache.get(10, ("a",)) is None
+    cache.forget(11)
+    cache.prune({99})
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    desligado = StaticFactsCache(max_entries=0)
+    desligado.put(1, ("a",), {})
+    assert len(desligado) == 0
+
+
+def test_identity_uses_kernel_starttime_and_exe_inode():
+    ident = process_identity(os.getpid())
+    with open("/proc/self/stat", "rb") as f:
+        raw = f.read()
+    assert ident[0] == int(raw[raw.rfind(b")") + 1:].split()[19])
+    assert ident[3] == os.stat("/proc/self/exe").st_ino
+    assert process_identity(2 ** 22 + 7) is None
+
+
+@pytest.fixture
+def hashes(monkeypatch):
+    lidos = []
+    monkeypatch.setattr(pt.ExeHashCache, "digests",
+                        lambda self, path, on_done=None: lidos.append(path) or
+                        ("d41d8", "e3b0", os.stat(path)))
+    return lidos
+
+
+def test_reset_keeps_the_facts_but_rebuilds_the_nodes(hashes):
+    arvore = ProcessTree()
+    pid = os.getpid()
+    primeiro = arvore.add_or_update(pid, os.getppid(), "python", 0, 120)
+    assert primeiro.md5 == "d41d8" and len(hashes) == 1
+
+    arvore.reset()
+    segundo = arvore.add_or_update(pid, os.getppid(), "python", 0, 120)
+    assert segundo is not primeiro
+    assert segundo.md5 == "d41d8" and segundo.exe_path == primeiro.exe_path
+    assert len(hashes) == 1
+    assert arvore.static_cache.hits == 1
+
+    # Exec: mesmo PID e starttime, fatos relidos.
+    arvore.static_cache.forget(pid)
+    arvore.enrich(segundo)
+    assert len(hashes) == 2
+
+
+def test_reused_facts_still_produce_reasons_and_tags(hashes):
+    arvore = ProcessTree()
+    pid = os.getpid()
+    ident = process_identity(pid)
+    fatos = dict.fromkeys(pt.ProcessNode.STATIC_FACTS)
+    fatos.update(exe_path="/tmp/implant", exe_deleted=True, exe_memfd=False,
+                 md5="N/A (not on disk)")
+    arvore.static_cache.put(pid, ident, fatos)
+
+    node = arvore.add_or_update(pid, os.getppid(), "python", 0, 120)
+    assert hashes == []
+    assert {"DELETED", "UNSAFE"} <= set(node.context_tags)
+    assert any("deleted from disk" in r for r in node.detection_reasons)
+
+
+def test_fanotify_is_checked_every_cycle_even_with_cached_facts(hashes, monkeypatch):
+    # A marca fanotify abre e fecha sem exec: nao vem do cache.
+    assert "is_inspector" not in pt.ProcessNode.STATIC_FACTS
+    arvore = ProcessTree()
+    pid = os.getpid()
+    arvore.static_cache.put(pid, process_identity(pid),
+                            dict.fromkeys(pt.ProcessNode.STATIC_FACTS, ""))
+    marca = {"found": True, "mode": "ASYNC (Log Only)", "flags": "0x0"}
+    monkeypatch.setattr(pt, "_check_fanotify", lambda p, fds=None: marca)
+
+    node = arvore.add_or_update(pid, os.getppid(), "python", 0, 120)
+    assert node.is_inspector and node.inspector_data["mode"] == "ASYNC (Log Only)"
+    assert "EDR/AV" in node.context_tags
+
+    monkeypatch.setattr(pt, "_check_fanotify", lambda p, fds=None: False)
+    arvore.reset()
+    node = arvore.add_or_update(pid, os.getppid(), "python", 0, 120)
+    assert node.is_inspector is False and node.inspector_data is None
+
+
+def test_fanotify_check_skips_processes_without_a_fanotify_fd(monkeypatch):
+    def proibido(*_a):
+        raise AssertionError("fd listado sem necessidade")
+    monkeypatch.setattr(pt.os, "listdir", proibido)
+    assert pt._check_fanotify(os.getpid(), {"/dev/null", "pipe:[12]"}) is False
+
+
+def test_engine_drops_the_facts_on_exec():
+    fonte = open(ENGINE).read()
+    corpo = fonte.split("if ev_type == 'E':")[1].split("elif ev_type")[0]
+    assert corpo.index("static_cache.forget(node.pid)") < corpo.index("self.tree.enrich(")
+    assert "enrich=functools.partial(enrich_node, cache=self.tree.static_cache," in fonte
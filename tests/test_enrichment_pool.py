@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_enrichment_pool.py
+# DESCRIPTION: Enriquecimento de processos fora do tratamento dos eventos.
+#
+#              update_static_info (cgroup, fds, maps, MD5 do binario inteiro)
+#              rodava dentro do tratamento do primeiro evento de cada PID e de
+#              cada exec. Agora vai para um pool limitado, deduplicado por
+#              (pid, start_time), e o no diz se a leitura terminou antes de a
+#              janela fechar.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import threading
+
+from src.collectors import process_tree as pt
+from src.collectors.enrichment import (EnrichmentPool, enrich_node,
+                                       ENRICH_PENDING, ENRICH_COMPLETE,
+                                       ENRICH_FAILED)
+from src.collectors.process_tree import ProcessNode, ProcessTree
+from src.exporters.html_report import _render_enrichment
+
+MOTOR = os.path.join("src", "core", "engine.py")
+
+MORTO = 2 ** 22 + 7  # acima do pid_max padrao: nunca existe
+
+
+def _no(pid=None, cmd="bash", start=100.0):
+    node = ProcessNode(os.getpid() if pid is None else pid, 1, cmd, 0)
+    node.start_time = start
+    return node
+
+
+def _le(n):
+    """enrich de teste: marca o rascunho, que o pool aplica no no."""
+    n.cgroups = "lido"
+    return True
+
+
+def _corpo(fonte, nome):
+    return fonte.split("def %s(" % nome)[1].split("\n    def ")[0]
+
+
+# ------------------------------------------------------------------------------
+# Pool
+# ------------------------------------------------------------------------------
+def test_requests_for_the_same_process_are_merged_while_queued():
+    pool = EnrichmentPool(enrich=lambda n: True)
+    a = _no()
+    pool.submit(a)
+    pool.submit(a)
+    assert pool.pending() == 1
+    assert a.enrichment == ENRICH_PENDING
+
+    # Mesmo PID, outro start_time: outro processo, outra leitura.
+    pool.submit(_no(start=200.0))
+    assert pool.pending() == 2
+
+
+def test_a_queued_request_fills_the_newest_copy():
+    pool = EnrichmentPool(enrich=_le)
+    antigo = _no()
+    pool.submit(antigo)
+    novo = antigo.carry_over()
+    pool.submit(novo)
+
+    pool.start()
+    assert pool.drain(2.0) == 0
+    assert novo.cgroups == "lido" and pool.completed == 1
+    assert antigo.cgroups == [] and antigo.enrichment == ENRICH_PENDING
+
+
+def test_requests_of_a_closed_window_are_dropped():
+    pool = EnrichmentPool(enrich=_le)
+    node = _no()
+    pool.submit(node, window=0)
+    pool.close_window(1)
+
+    pool.start()
+    assert pool.drain(2.0) == 0
+    assert node.cgroups == [] and node.enrichment == ENRICH_PENDING
+    assert pool.stale == 1 and pool.completed == 0
+
+
+def test_a_read_in_progress_is_not_applied_after_the_window_closes():
+    lendo, liberado = threading.Event(), threading.Event()
+
+    def lento(n):
+        n.cgroups = "lido"
+        n.context_tags.append("CONTAINER")
+        lendo.set()
+        return liberado.wait(2.0)
+
+    pool = EnrichmentPool(workers=1, enrich=lento)
+    pool.start()
+    node = _no()
+    pool.submit(node)
+    assert lendo.wait(2.0)
+    assert pool.drain(0.05) == 1
+
+    pool.close_window(1)
+    liberado.set()
+    assert pool.drain(2.0) == 0
+    assert node.cgroups == [] and node.context_tags == []
+    assert node.enrichment == ENRICH_PENDING and pool.stale == 1
+
+
+def test_the_draft_merges_into_what_events_wrote_meanwhile():
+    node = _no()
+    node.open_files.add("/var/log/app.log")
+    node.context_tags.append("SSH")
+    rascunho = node.enrichment_draft()
+    node.context_tags.append("NET ERR")
+
+    rascunho.open_files.add("/etc/hosts")
+    rascunho.context_tags.extend(["SSH", "CONTAINER"])
+    rascunho.detection_reasons.append("Unsafe Library Path: /tmp/x.so")
+    rascunho.container_id = "abc"
+    node.absorb_enrichment(rascunho)
+
+    assert node.open_files == {"/var/log/app.log", "/etc/hosts"}
+    assert node.context_tags == ["SSH", "NET ERR", "CONTAINER"]
+    assert node.detection_reasons == ["Unsafe Library Path: /tmp/x.so"]
+    assert node.container_id == "abc" and node.cgroups == []
+
+
+def test_a_full_queue_fails_the_node_instead_of_blocking():
+    pool = EnrichmentPool(max_pending=1, enrich=lambda n: True)
+    assert pool.submit(_no(start=1.0)) is True
+    excedente = _no(start=2.0)
+    assert pool.submit(excedente) is False
+    assert excedente.enrichment == ENRICH_FAILED
+    assert "queue full" in excedente.enrichment_error
+    assert pool.dropped == 1
+
+
+def test_drain_gives_up_after_the_timeout():
+    liberado = threading.Event()
+    pool = EnrichmentPool(workers=1, enrich=lambda n: liberado.wait(2.0))
+    pool.start()
+    node = _no()
+    pool.submit(node)
+
+    assert pool.drain(0.05) == 1
+    assert node.enrichment == ENRICH_PENDING
+    liberado.set()
+    assert pool.drain(2.0) == 0
+
+
+def test_enrich_node_reports_a_process_that_is_gone():
+    vivo = _no()
+    assert enrich_node(vivo) is True
+    assert vivo.enrichment == ENRICH_COMPLETE
+
+    # A heuristica sobre a linha de comando vale mesmo sem /proc.
+    sumiu = _no(pid=MORTO, cmd="/tmp/xmrig")
+    assert enrich_node(sumiu) is False
+    assert sumiu.enrichment == ENRICH_FAILED
+    assert "MINER" in sumiu.context_tags
+
+
+# ------------------------------------------------------------------------------
+# Arvore e motor
+# ------------------------------------------------------------------------------
+def test_event_path_only_queues_and_scan_reads_inline(monkeypatch):
+    lidos = []
+    monkeypatch.setattr(pt.ProcessNode, "update_static_info",
+                        lambda self, *_a: lidos.append(self.pid))
+    tree = ProcessTree()
+    tree.enricher = EnrichmentPool(enrich=lambda n: True)
+
+    node = tree.add_or_update(os.getpid(), 1, "python", 0, 120, deferred=True)
+    assert lidos == []
+    assert node.enrichment == ENRICH_PENDING
+    assert tree.enricher.pending() == 1
+
+    tree.scan_proc_fs([os.getppid()])
+    assert lidos == [os.getppid()]
+    assert tree.get(os.getppid()).enrichment == ENRICH_COMPLETE
+
+
+def test_rotation_moves_a_queued_request_to_the_live_copy(monkeypatch):
+    tree = ProcessTree()
+    tree.enricher = EnrichmentPool(enrich=_le)
+    monkeypatch.setattr(pt, "_live_pids", lambda: {os.getpid()})
+    tree.add_or_update(os.getpid(), 1, "python", 0, 120, deferred=True)
+
+    fechada = tree.rotate()
+    tree.enricher.start()
+    tree.enricher.drain(2.0)
+    assert tree.get(os.getpid()).cgroups == "lido"
+    assert fechada.get(os.getpid()).cgroups == []
+    assert fechada.get(os.getpid()).enrichment == ENRICH_PENDING
+
+
+def test_engine_keeps_static_reads_off_the_event_path():
+    fonte = io.open(MOTOR, encoding="utf-8").read()
+    tratador = _corpo(fonte, "_handle_record")
+    assert "update_static_info" not in tratador
+    assert "deferred=True" in tratador
+
+    stop = _corpo(fonte, "stop")
+    assert stop.index("self.batcher.drain()") < stop.index("self._drain_enrichment()")
+    assert stop.index("self._drain_enrichment()") < stop.index("self.tree.close_window()") \
+        < stop.index("self.tree.aggregate_stats()")
+    assert "self.enricher.start()" in _corpo(fonte, "start")
+
+
+def test_report_flags_nodes_that_were_not_enriched():
+    node = _no()
+    assert _render_enrichment(node) == ""
+    node.enrichment = ENRICH_PENDING
+    assert "pending" in _render_enrichment(node)
+    node.enrichment = ENRICH_FAILED
+    node.enrichment_error = "<exited>"
+    assert "&lt;exited&gt;" in _render_enrichment(node)
+    node.enrichment = ENRICH_COMPLETE
+    assert _render_enrichment(node) == ""
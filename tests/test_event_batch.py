@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_event_batch.py
+# DESCRIPTION: Decodificacao em lotes, fora da thread de leitura do motor.
+#
+#              O callback do BCC so copia bytes para um lote; quem decodifica e
+#              trata e um worker. Os riscos sao perder ou trocar a ordem dos
+#              registros na passagem pelo lote, o motor fechar uma janela
+#              (stop/rotate) com lotes ainda na fila do worker, e a espera por
+#              eles nunca terminar com a leitura ainda ativa.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import threading
+import time
+
+from src.probes import records
+from src.probes.batch import EventBatcher, MAX_RECORD_BYTES
+
+
+def _kernel(raw):
+    """Simula o ponteiro que o BCC entrega ao callback."""
+    return ct.create_string_buffer(raw, len(raw))
+
+
+def _corpo(fonte, nome):
+    return fonte.split("def %s(" % nome)[1].split("\n    def ")[0]
+
+
+def test_records_survive_the_trip_through_the_batch_in_order():
+    vistos = []
+    batcher = EventBatcher(vistos.append, batch_bytes=0, batches=2)
+    batcher.start()
+    brutos = [records.encode('O', pid=i, comm="nginx", filename="/var/log/%d" % i)
+              for i in range(200)]
+    brutos.append(records.encode('R', pid=999, io_bytes=4096))
+    for raw in brutos:
+        batcher.add(_kernel(raw), len(raw))
+    batcher.flush()
+    assert batcher.drain(5.0)
+
+    # Lote minimo (16 registros maximos) forca varias trocas no caminho.
+    assert [ev.pid for ev in vistos] == list(range(200)) + [999]
+    assert vistos[7].filename == "/var/log/7"
+    assert vistos[7].comm == "nginx"
+    assert vistos[-1].io_bytes == 4096
+
+
+def test_drain_waits_for_the_worker():
+    liberado = threading.Event()
+    vistos = []
+
+    def lento(ev):
+        liberado.wait(2.0)
+        vistos.append(ev.pid)
+
+    batcher = EventBatcher(lento)
+    batcher.start()
+    raw = records.encode('R', pid=5)
+    batcher.add(_kernel(raw), len(raw))
+    batcher.flush()
+    threading.Timer(0.1, liberado.set).start()
+    assert batcher.drain()
+    assert vistos == [5]
+
+
+def test_drain_returns_while_the_poll_thread_keeps_copying():
+    """rotate() drena com o lock do motor: nao pode esperar a fila esvaziar."""
+    vistos = []
+
+    def tratador(ev):
+        time.sleep(0.0005)
+        vistos.append(ev.pid)
+
+    batcher = EventBatcher(tratador, batch_bytes=0, batches=4)
+    batcher.start()
+    raw = records.encode('R', pid=1)
+    parar = threading.Event()
+
+    def leitura():
+        while not parar.is_set():
+            batcher.add(_kernel(raw), len(raw))
+
+    t = threading.Thread(target=leitura)
+    t.start()
+    try:
+        time.sleep(0.05)
+        assert batcher.drain(5.0)
+    finally:
+        parar.set()
+        t.join()
+    assert vistos
+
+
+def test_drain_without_a_worker_does_not_block():
+    batcher = EventBatcher(lambda ev: None)
+    assert batcher.drain()
+    raw = records.encode('R', pid=5)
+    batcher.add(_kernel(raw), len(raw))
+    batcher.flush()
+    assert batcher.drain() is False
+
+
+def test_a_bad_record_does_not_stop_the_worker():
+    vistos = []
+
+    def tratador(ev):
+        if ev.pid == 1: raise ValueError("registro ruim")
+        vistos.append(ev.pid)
+
+    batcher = EventBatcher(tratador)
+    batcher.start()
+    for pid in (1, 2):
+        raw = records.encode('R', pid=pid)
+        batcher.add(_kernel(raw), len(raw))
+    lixo = b"\0" * 10
+    batcher.add(_kernel(lixo), len(lixo))
+    batcher.flush()
+    batcher.drain()
+    assert vistos == [2]
+    assert batcher.errors == 1
+
+
+def test_oversized_records_are_not_copied():
+    batcher = EventBatcher(lambda ev: None)
+    batcher.add(_kernel(b"\0" * (MAX_RECORD_BYTES + 1)), MAX_RECORD_BYTES + 1)
+    assert batcher._current.used == 0
+
+
+def test_engine_callbacks_only_copy_and_windows_drain_first(fonte_motor):
+    for nome in ("_handle_perf_event", "_handle_ringbuf_event"):
+        corpo = _corpo(fonte_motor, nome)
+        assert "self.batcher.add(data, size)" in corpo
+        assert "decode" not in corpo and "string_at" not in corpo
+
+    stop = _corpo(fonte_motor, "stop")
+    assert stop.index("self.poll_thread.join(") < stop.index("self.batcher.drain()")
+    assert stop.index("self.batcher.drain()") < stop.index("self._close_capture_health(")
+
+    rotate = _corpo(fonte_motor, "rotate")
+    assert rotate.index("self.batcher.drain()") < rotate.index("self.tree.rotate()")
+
+    poll = _corpo(fonte_motor, "_poll_loop")
+    assert "self.batcher.flush()" in poll
+
+
+def test_decode_worker_cpu_is_charged_to_the_probes(motor):
+    assert motor.batcher.cpu_clock is motor.governor.decode_clock
+    motor.governor.poll_clock._total = 1.0
+    motor.governor.decode_clock._total = 2.0
+    assert motor.governor._cpu() == 3.0
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_hash_cache.py
+# DESCRIPTION: Hash de executaveis pela identidade do arquivo, persistente.
+#
+#              Cada no relia o binario inteiro em blocos de 4 KB: o mesmo
+#              bash hasheado uma vez por processo, por ciclo, por partida do
+#              agente. O cache guarda MD5 e SHA-256 por (dev, ino, tamanho,
+#              mtime, ctime) no banco local, e binarios grandes vao para uma
+#              fila em segundo plano.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import hashlib
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from src.core import hash_cache
+from src.core.hash_cache import ExeHashCache, HASH_PENDING, HASH_DENIED
+
+
+@pytest.fixture
+def binario(tmp_path):
+    caminho = tmp_path / "bash"
+    caminho.write_bytes(b"\x7fELF" + os.urandom(3 * 1024 * 1024 + 17))
+    return str(caminho)
+
+
+def _esperado(caminho):
+    dados = open(caminho, "rb").read()
+    return hashlib.md5(dados).hexdigest(), hashlib.sha256(dados).hexdigest()
+
+
+def test_one_pass_gives_md5_and_sha256(binario):
+    cache = ExeHashCache()
+    md5, sha256, st = cache.digests(binario)
+    assert (md5, sha256) == _esperado(binario)
+    assert st.st_size == os.path.getsize(binario)
+
+
+def test_same_file_is_hashed_once_and_survives_restart(binario, tmp_path):
+    banco = str(tmp_path / "agent.db")
+    cache = ExeHashCache(banco)
+    for _ in range(200):
+        cache.digests(binario)
+    assert cache.hashed == 1
+
+    # Novo processo do agente: a memoria esta vazia, o banco nao.
+    outro = ExeHashCache(banco)
+    assert outro.digests(binario)[:2] == _esperado(binario)
+    assert outro.hashed == 0
+
+
+def test_any_change_to_the_file_forces_a_new_hash(binario):
+    cache = ExeHashCache()
+    antes = cache.digests(binario)[0]
+    with open(binario, "ab") as f:
+        f.write(b"payload")
+    depois = cache.digests(binario)[0]
+    assert depois != antes and depois == _esperado(binario)[0]
+    assert cache.hashed == 2
+
+
+def test_table_keeps_the_most_recently_used(tmp_path):
+    banco = str(tmp_path / "agent.db")
+    cache = ExeHashCache(banco, max_entries=2)
+    for nome in ("a", "b", "c"):
+        caminho = tmp_path / nome
+        caminho.write_bytes(nome.encode())
+        cache.digests(str(caminho))
+    with sqlite3.connect(banco) as conn:
+        assert conn.execute("SELECT COUNT(*) FROM exe_hashes").fetchone()[0] == 2
+        md5s = {r[0] for r in conn.execute("SELECT md5 FROM exe_hashes")}
+    assert hashlib.md5(b"a").hexdigest() not in md5s
+
+
+def test_memory_hits_refresh_last_used_in_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(hash_cache, "TOUCH_BATCH", 2)
+    banco = str(tmp_path / "agent.db")
+    cache = ExeHashCache(banco, max_entries=2)
+    a, b, c = (str(tmp_path / n) for n in "abc")
+    for caminho in (a, b, c):
+        open(caminho, "wb").write(caminho.encode())
+    cache.digests(a)
+    cache.digests(b)
+
+    # Acertos so na memoria: o uso chega ao banco em lote (TOUCH_BATCH chaves).
+    def usado(caminho):
+        with sqlite3.connect(banco) as conn:
+            return conn.execute("SELECT last_used FROM exe_hashes WHERE md5 = ?",
+                                (_esperado(caminho)[0],)).fetchone()[0]
+    antes = usado(a)
+    cache.digests(a)
+    cache.digests(a)
+    assert usado(a) == antes and len(cache._touched) == 1
+    cache.digests(b)
+    assert usado(a) > antes and not cache._touched
+
+    # LRU na memoria e no banco: "a" foi usado por ultimo, sai "b".
+    cache.digests(a)
+    cache.digests(c)
+    assert list(cache._mem.values()) == [_esperado(a), _esperado(c)]
+    with sqlite3.connect(banco) as conn:
+        md5s = {r[0] for r in conn.execute("SELECT md5 FROM exe_hashes")}
+    assert md5s == {_esperado(a)[0], _esperado(c)[0]}
+
+
+def test_large_binaries_go_to_the_background(binario):
+    cache = ExeHashCache(background_bytes=1024 * 1024)
+    prontos = []
+    avisado = threading.Event()
+
+    def aviso(md5, sha256):
+        prontos.append((md5, sha256))
+        avisado.set()
+
+    assert cache.digests(binario, on_done=aviso)[:2] == (HASH_PENDING, HASH_PENDING)
+    assert avisado.wait(10)
+    cache.drain()
+    assert prontos == [_esperado(binario)]
+    assert cache.digests(binario)[:2] == _esperado(binario)
+
+
+def test_missing_and_unreadable_files(tmp_path):
+    cache = ExeHashCache()
+    with pytest.raises(FileNotFoundError):
+        cache.digests(str(tmp_path / "sumiu"))
+    if os.geteuid() != 0:
+        fechado = tmp_path / "fechado"
+        fechado.write_bytes(b"x")
+        fechado.chmod(0)
+        assert cache.digests(str(fechado))[0] == HASH_DENIED
+
+
+def test_unusable_db_falls_back_to_memory(binario, tmp_path):
+    cache = ExeHashCache(str(tmp_path / "nao-existe" / "agent.db"))
+    assert cache.db_path is None
+    assert cache.digests(binario)[:2] == _esperado(binario)
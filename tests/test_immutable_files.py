@@ -25,7 +25,7 @@ import stat as stat_mod
 
 import pytest
 
-from src.collectors import process_tree as pt
+from src.collectors import immutable as im
 
 
 class _FakeStat(object):
@@ -75,8 +75,8 @@ def lab(monkeypatch):
     lsattr existe; a arvore e um mapa dir -> lista de _FakeEntry; o Popen falso
     devolve uma linha de lsattr por caminho consultado, de um mapa attrs.
     """
-    monkeypatch.setattr(pt.shutil, "which", lambda _n: "/usr/bin/lsattr")
-    monkeypatch.setattr(pt.os.path, "isdir", lambda _d: True)
+    monkeypatch.setattr(im.shutil, "which", lambda _n: "/usr/bin/lsattr")
+    monkeypatch.setattr(im.os.path, "isdir", lambda _d: True)
 
     estado = {"arvore": {}, "attrs": {}}
 
@@ -92,8 +92,8 @@ def lab(monkeypatch):
             linhas.append("%s %s" % (a, c))
         return _FakeProc("\n".join(linhas))
 
-    monkeypatch.setattr(pt.os, "scandir", _scandir)
-    monkeypatch.setattr(pt.subprocess, "Popen", _popen)
+    monkeypatch.setattr(im.os, "scandir", _scandir)
+    monkeypatch.setattr(im.subprocess, "Popen", _popen)
     return estado
 
 
@@ -106,7 +106,7 @@ def test_arquivo_imutavel_em_subdiretorio_e_detectado(lab):
     lab["attrs"]["/tmp/chaos_artifacts/immutable.dat"] = "----i---------e----"
     lab["attrs"]["/tmp/chaos_artifacts/normal.txt"] = "--------------e----"
 
-    achados = pt._immutable_files_in(["/tmp"])
+    achados = im._immutable_files_in(["/tmp"])
     assert any("immutable.dat" in a for a in achados)
     assert all("normal.txt" not in a for a in achados)
 
@@ -125,14 +125,14 @@ def test_recentes_sao_visitados_primeiro(lab):
         _FakeEntry("/tmp/antigo/x", "file", mtime=1)]
     lab["attrs"]["/tmp/chaos_artifacts/immutable.dat"] = "----i---------e----"
 
-    achados = pt._immutable_files_in(["/tmp"])
+    achados = im._immutable_files_in(["/tmp"])
     assert any("immutable.dat" in a for a in achados)
 
 
 def test_append_only_tambem_conta(lab):
     lab["arvore"]["/var/tmp"] = [_FakeEntry("/var/tmp/log.dat", "file")]
     lab["attrs"]["/var/tmp/log.dat"] = "-----a--------e----"
-    achados = pt._immutable_files_in(["/var/tmp"])
+    achados = im._immutable_files_in(["/var/tmp"])
     assert any("log.dat" in a for a in achados)
 
 
@@ -140,7 +140,7 @@ def test_arquivo_normal_nao_dispara(lab):
     """O flag 'e' (extents) esta em quase todo arquivo ext4 e nao e alarme."""
     lab["arvore"]["/tmp"] = [_FakeEntry("/tmp/qualquer.txt", "file")]
     lab["attrs"]["/tmp/qualquer.txt"] = "--------------e----"
-    assert pt._immutable_files_in(["/tmp"]) == []
+    assert im._immutable_files_in(["/tmp"]) == []
 
 
 def test_socket_e_ignorado_e_nao_trava(lab):
@@ -152,14 +152,14 @@ def test_socket_e_ignorado_e_nao_trava(lab):
         _FakeEntry("/tmp/dbus-ABC", "socket"),
         _FakeEntry("/tmp/immutable.dat", "file")]
     lab["attrs"]["/tmp/immutable.dat"] = "----i---------e----"
-    achados = pt._immutable_files_in(["/tmp"])
+    achados = im._immutable_files_in(["/tmp"])
     assert any("immutable.dat" in a for a in achados)
     assert all("dbus-ABC" not in a for a in achados)
 
 
 def test_symlink_e_ignorado(lab):
     lab["arvore"]["/tmp"] = [_FakeEntry("/tmp/link", "symlink")]
-    assert pt._immutable_files_in(["/tmp"]) == []
+    assert im._immutable_files_in(["/tmp"]) == []
 
 
 def test_o_teto_de_resultados_limita(lab):
@@ -170,13 +170,13 @@ def test_o_teto_de_resultados_limita(lab):
         entradas.append(_FakeEntry(p, "file"))
         lab["attrs"][p] = "----i---------e----"
     lab["arvore"]["/tmp"] = entradas
-    achados = pt._immutable_files_in(["/tmp"], cap=20)
+    achados = im._immutable_files_in(["/tmp"], cap=20)
     assert len(achados) == 20
 
 
 def test_sem_lsattr_nao_quebra(monkeypatch):
-    monkeypatch.setattr(pt.shutil, "which", lambda _n: None)
-    assert pt._immutable_files_in(["/tmp"]) == []
+    monkeypatch.setattr(im.shutil, "which", lambda _n: None)
+    assert im._immutable_files_in(["/tmp"]) == []
 
 
 def test_timeout_do_lsattr_nao_derruba_a_coleta(lab, monkeypatch):
@@ -187,18 +187,18 @@ def test_timeout_do_lsattr_nao_derruba_a_coleta(lab, monkeypatch):
     def _trava(cmd, **kwargs):
         class _T(object):
             def communicate(self, timeout=None):
-                raise pt.subprocess.TimeoutExpired("lsattr", timeout)
+                raise im.subprocess.TimeoutExpired("lsattr", timeout)
             def kill(self):
                 pass
         return _T()
 
-    monkeypatch.setattr(pt.subprocess, "Popen", _trava)
-    assert pt._immutable_files_in(["/tmp"]) == []
+    monkeypatch.setattr(im.subprocess, "Popen", _trava)
+    assert im._immutable_files_in(["/tmp"]) == []
 
 
 def test_diretorio_inacessivel_nao_quebra(lab, monkeypatch):
     """scandir num diretorio sem permissao nao pode derrubar a coleta."""
     def _scandir_erro(_d):
         raise OSError("permission denied")
-    monkeypatch.setattr(pt.os, "scandir", _scandir_erro)
-    assert pt._immutable_files_in(["/tmp"]) == []
+    monkeypatch.setattr(im.os, "scandir", _scandir_erro)
+    assert im._immutable_files_in(["/tmp"]) == []
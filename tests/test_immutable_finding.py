@@ -24,7 +24,7 @@ from src.core.attack import TECHNIQUES
 
 def test_immutable_file_vira_finding(monkeypatch):
     monkeypatch.setattr(
-        "src.collectors.process_tree._immutable_files_in",
+        "src.collectors.immutable._immutable_files_in",
         lambda *_a, **_k: ["/tmp/chaos_artifacts/immutable.dat (----i-----------)"])
     monkeypatch.setattr(pers, "_stat_info", lambda _p: {"mtime": 1})
 
@@ -40,7 +40,7 @@ def test_immutable_file_vira_finding(monkeypatch):
 
 def test_sem_imutavel_nenhum_finding(monkeypatch):
     monkeypatch.setattr(
-        "src.collectors.process_tree._immutable_files_in",
+        "src.collectors.immutable._immutable_files_in",
         lambda *_a, **_k: [])
     assert pers._collect_immutable_files() == []
 
@@ -65,7 +65,7 @@ def test_uma_falha_no_coletor_nao_derruba_os_demais(monkeypatch):
     def _explode(*_a, **_k):
         raise RuntimeError("scanner quebrou")
     monkeypatch.setattr(
-        "src.collectors.process_tree._immutable_files_in", _explode)
+        "src.collectors.immutable._immutable_files_in", _explode)
     # Nao deve levantar: collect_persistence engole a falha por coletor.
     findings = pers.collect_persistence()
     assert isinstance(findings, list)
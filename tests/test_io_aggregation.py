@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_io_aggregation.py
+# DESCRIPTION: O I/O de disco e somado no kernel, nao evento a evento.
+#
+#              Em hosts de banco e de build, vfs_read/vfs_write disparavam
+#              milhoes de perf_submit por janela, cada um com a estrutura
+#              inteira, so para o Python somar dois campos. O agente prendia um
+#              core e o buffer de perf transbordava em silencio.
+#
+#              Estes testes leem o fonte (o motor exige bcc e kernel) e guardam
+#              o contrato: agregado no mapa io_stats, lido uma vez no stop(), e
+#              o evento por syscall apenas atras da flag de depuracao.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import re
+
+import pytest
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+@pytest.fixture(scope="module")
+def sonda():
+    return io.open(SONDA, encoding="utf-8").read()
+
+
+def test_kernel_keeps_the_io_counters(sonda):
+    assert "BPF_HASH(io_stats, struct io_key_t, struct io_stats_t" in sonda
+    for campo in ("read_bytes", "write_bytes", "read_ops", "write_ops",
+                  "latency_ns"):
+        assert campo in sonda.split("struct io_stats_t")[1].split("};")[0]
+
+
+def test_per_syscall_event_only_behind_the_debug_flag(sonda):
+    """
+    O envio por syscall tem de vir DEPOIS da checagem da flag: sem ela, o modo
+    normal voltaria a pagar um evento por leitura.
+    """
+    bloco = sonda.split("static __always_inline int account_io")[1] \
+        .split("static __always_inline int mark_io_start")[0]
+    guarda = bloco.index("get_setting(SETTING_IO_EVENTS)")
+    envio = bloco.index("SUBMIT(")
+    assert guarda < envio
+
+
+def test_return_probes_no_longer_submit_directly(sonda):
+    for nome in ("int trace_vfs_read_return", "int trace_vfs_write_return",
+                 "TRACEPOINT_PROBE(syscalls, sys_exit_read)",
+                 "KRETFUNC_PROBE(vfs_write,"):
+        corpo = sonda.split(nome)[1].split("}")[0]
+        assert "SUBMIT" not in corpo
+        assert "account_io" in corpo
+
+
+def test_engine_reads_the_map_once_at_stop(fonte_motor):
+    bloco = fonte_motor.split("def stop(self")[1]
+    assert "self._collect_io_counters(" in bloco
+
+
+def test_engine_resets_the_map_at_each_window(fonte_motor):
+    """As sondas seguem anexadas no ocioso; a janela so pode contar o proprio I/O."""
+    bloco = fonte_motor.split("def start(self)")[1].split("def stop(self")[0]
+    assert "self._reset_io_counters()" in bloco
+
+
+def test_setting_indices_match_the_probe(sonda, fonte_motor):
+    for nome in ("SETTING_IO_EVENTS", "SETTING_IO_PER_TID", "SETTING_AGENT_PID"):
+        em_c = re.search(r"#define %s\s+(\d+)" % nome, sonda).group(1)
+        em_py = re.search(r"^%s = (\d+)" % nome, fonte_motor, re.M).group(1)
+        assert em_c == em_py, nome
+
+
+def test_debug_flag_defaults_off():
+    pytest.importorskip("yaml", reason="requer PyYAML")
+    from src.utils.config_loader import DEFAULT_CONFIG
+    assert DEFAULT_CONFIG["engine"]["io_events_debug"] is False
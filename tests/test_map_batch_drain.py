@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_map_batch_drain.py
+# DESCRIPTION: Leitura e remocao em lote dos mapas de contadores por janela.
+#
+#              Os mapas de contadores eram lidos com .items(), uma chamada de
+#              sistema por chave, e os de rede nunca eram zerados no inicio da
+#              janela. Agora cada geracao sai do mapa em lote quando o kernel
+#              permite, com a troca de geracoes chave a chave como reserva, e o
+#              exit do processo limpa o estado por tarefa que nao e de janela.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+
+from src.core import bpf_maps
+from src.core import engine as engine_mod
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MOTOR = os.path.join("src", "core", "engine.py")
+MAPAS = os.path.join("src", "core", "bpf_maps.py")
+
+
+class _Chave(ct.Structure):
+    _fields_ = [("pid", ct.c_uint), ("gen", ct.c_uint)]
+
+
+class _Mapa(object):
+    """Mapa do BCC com as operacoes em lote, contando as chamadas."""
+    Key = _Chave
+
+    def __init__(self, entradas):
+        self.dados = {(p, g): ct.c_ulonglong(v) for (p, g), v in entradas.items()}
+        self.chamadas = []
+
+    def _itens(self):
+        return [(_Chave(p, g), v) for (p, g), v in sorted(self.dados.items())]
+
+    def items(self):
+        self.chamadas.append("items")
+        return self._itens()
+
+    def __delitem__(self, k):
+        self.chamadas.append("delete")
+        del self.dados[(k.pid, k.gen)]
+
+    def items_lookup_batch(self):
+        self.chamadas.append("lookup_batch")
+        return self._itens()
+
+    def items_lookup_and_delete_batch(self):
+        self.chamadas.append("lookup_and_delete_batch")
+        itens = self._itens()
+        self.dados.clear()
+        return itens
+
+    def items_delete_batch(self, ckeys=None):
+        self.chamadas.append("delete_batch")
+        if ckeys is None:
+            self.dados.clear()
+            return
+        assert isinstance(ckeys, ct.Array)
+        for k in ckeys:
+            del self.dados[(k.pid, k.gen)]
+
+    def clear(self):
+        self.chamadas.append("clear")
+        self.dados.clear()
+
+
+class _MapaSemLote(_Mapa):
+    def items_lookup_batch(self):
+        self.chamadas.append("lookup_batch")
+        raise OSError(22, "Invalid argument")
+
+
+def _kernel_com_lote(release=None):
+    return (6, 4)
+
+
+ENTRADAS = {(10, 0): 100, (11, 0): 5, (10, 1): 7}
+
+
+def test_rotation_reads_in_batch_and_deletes_only_the_closed_generation(motor, monkeypatch):
+    monkeypatch.setattr(engine_mod, "_kernel_version", _kernel_com_lote)
+    mapa = _Mapa(ENTRADAS)
+    motor.running = True
+    itens = motor._drain_generation(mapa, 0)
+
+    assert sorted((k.pid, v.value) for k, v in itens) == [(10, 100), (11, 5)]
+    assert mapa.chamadas == ["lookup_batch", "delete_batch"]
+    assert list(mapa.dados) == [(10, 1)]      # a geracao viva fica
+
+
+def test_stopped_engine_drains_the_whole_map_at_once(motor, monkeypatch):
+    monkeypatch.setattr(engine_mod, "_kernel_version", _kernel_com_lote)
+    mapa = _Mapa(ENTRADAS)
+    motor.running = False
+    itens = motor._drain_generation(mapa, 1)
+
+    assert [(k.pid, v.value) for k, v in itens] == [(10, 7)]
+    assert mapa.chamadas == ["lookup_and_delete_batch"]
+    assert mapa.dados == {}
+
+
+def test_kernel_without_batch_ops_falls_back_per_key(motor, monkeypatch):
+    monkeypatch.setattr(engine_mod, "_kernel_version", _kernel_com_lote)
+    mapa = _MapaSemLote(ENTRADAS)
+    motor.running = True
+    itens = motor._drain_generation(mapa, 0)
+
+    assert sorted((k.pid, v.value) for k, v in itens) == [(10, 100), (11, 5)]
+    assert motor._batch_ops is False
+    assert mapa.chamadas == ["lookup_batch", "items", "delete", "delete"]
+
+    # Decidido uma vez: a janela seguinte ja vai direto chave a chave.
+    mapa.chamadas = []
+    motor._drain_generation(mapa, 1)
+    assert mapa.chamadas == ["items", "delete"]
+
+
+def test_old_kernel_never_tries_batch(motor):
+    mapa = _Mapa(ENTRADAS)
+    motor._clear_map(mapa)
+    assert mapa.chamadas == ["clear"]
+
+
+def test_clear_uses_batch_delete(motor, monkeypatch):
+    monkeypatch.setattr(engine_mod, "_kernel_version", _kernel_com_lote)
+    mapa = _Mapa(ENTRADAS)
+    motor._clear_map(mapa)
+    assert mapa.chamadas == ["delete_batch"]
+    assert mapa.dados == {}
+
+
+def test_network_counters_restart_with_each_window():
+    fonte = io.open(MOTOR, encoding="utf-8").read()
+    inicio = fonte.split("def start(self)")[1].split("def stop(self")[0]
+    assert "self._reset_network_counters()" in inicio
+    mapas = io.open(MAPAS, encoding="utf-8").read()
+    for nome in bpf_maps.NETWORK_COUNTER_MAPS:
+        assert 'self.bpf["%s"]' % nome in mapas
+    for nome in ("io_stats", "open_seen", "cpu_ns", "suppressed_events"):
+        assert 'self.bpf["%s"].clear()' % nome not in fonte + mapas
+
+
+def test_exit_prunes_per_task_state_but_keeps_window_counters():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    corpo = sonda.split("TRACEPOINT_PROBE(sched, sched_process_exit)")[1].split("\n}\n")[0]
+    # Toda thread que sai limpa o proprio io_start, inclusive as nao lideres.
+    assert corpo.index("prune_exited(id)") < corpo.index("(u32)id != (id >> 32)")
+
+    poda = sonda.split("static __always_inline void prune_exited(")[1].split("\n}\n")[0]
+    assert "io_start.delete(&tid)" in poda
+    assert "rate_buckets.delete(&key)" in poda
+    for contador in ("net_bytes_sent", "io_stats", "cpu_ns", "tcp_drop_map"):
+        assert contador not in poda
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_net_percpu.py
+# DESCRIPTION: Contadores de bytes de rede por CPU, somados no motor.
+#
+#              net_bytes_sent/recv eram um hash compartilhado tocado a cada
+#              pacote por todas as CPUs. Passam a ter uma copia por CPU no
+#              kernel, e o motor soma as copias uma vez por janela.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+
+from src.core.bpf_maps import _counter_total
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MAPAS = os.path.join("src", "core", "bpf_maps.py")
+BANCADA = os.path.join("tools", "bench_net_counters.py")
+
+
+def test_per_cpu_copies_are_summed():
+    # O BCC devolve o valor de um mapa per-CPU como um array, uma posicao por CPU.
+    copias = (ct.c_ulonglong * 4)(1500, 0, 60, 9000)
+    assert _counter_total(copias) == 10560
+
+
+def test_shared_counters_still_read_as_a_single_value():
+    assert _counter_total(ct.c_ulonglong(42)) == 42
+
+
+def test_packet_counters_are_per_cpu_in_the_kernel():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    for nome in ("net_bytes_sent", "net_bytes_recv"):
+        assert "BPF_PERCPU_HASH(%s, struct pid_gen_key_t, u64);" % nome in sonda
+        assert "BPF_HASH(%s," % nome not in sonda
+    # Sem atomico no caminho do pacote: cada CPU soma na propria copia.
+    for tp in ("net_dev_xmit", "netif_receive_skb"):
+        corpo = sonda.split("TRACEPOINT_PROBE(net, %s)" % tp)[1].split("\n}\n")[0]
+        assert "__sync_fetch_and_add" not in corpo
+
+
+def test_engine_sums_the_copies_when_collecting():
+    fonte = io.open(MAPAS, encoding="utf-8").read()
+    corpo = fonte.split("def _collect_network_counters(self")[1].split("\n    def ")[0]
+    assert "_counter_total(v)" in corpo
+    assert "v.value" not in corpo
+
+
+def test_bench_compares_shared_and_per_cpu():
+    bancada = io.open(BANCADA, encoding="utf-8").read()
+    assert "-DMAP_DECL=BPF_HASH" in bancada
+    assert "-DMAP_DECL=BPF_PERCPU_HASH" in bancada
+    assert "bpf_stats_enabled" in bancada
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_node_slots.py
+# DESCRIPTION: ProcessNode compacto: __slots__ com padroes por esquema.
+#
+#              O no nao tem mais __dict__; campo nao gravado devolve o padrao
+#              de NODE_FIELDS, colecoes so nascem quando alguem escreve nelas,
+#              e o JSON sai do esquema (to_dict) em vez de vars(node).copy().
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import json
+import threading
+
+from src.collectors import process_tree as pt
+from src.collectors.process_tree import ProcessNode, ProcessTree
+
+
+def test_node_has_no_dict_and_reads_schema_defaults():
+    node = ProcessNode(42, 1, "[kworker/0:1]", 0)
+    assert not hasattr(node, "__dict__")
+    assert node.md5 == "Calculating..." and node.read_bytes_delta == 0 and node.nice == 0
+    assert [c for c, _ in node._stored()] == ["pid", "ppid", "cmd", "uid", "username"]
+    assert not hasattr(node, "tags_accumulated")
+
+
+def test_collections_are_created_per_node_on_first_use():
+    a = ProcessNode(1, 0, "a", 0)
+    b = ProcessNode(2, 0, "b", 0)
+    a.open_files.add("/etc/passwd")
+    a.context_tags.append("UNSAFE")
+    assert b.open_files == set() and b.context_tags == []
+    assert "open_files" in dict(a._stored())
+
+
+def test_threads_creating_the_same_collection_keep_every_write(monkeypatch):
+    # A fabrica demora: sem a trava, as duas threads criariam cada uma a sua
+    # lista e uma das tags se perderia.
+    encontro = threading.Barrier(2, timeout=0.2)
+
+    class ListaLenta(list):
+        def __init__(self):
+            super().__init__()
+            try:
+                encontro.wait()
+            except threading.BrokenBarrierError:
+                pass
+
+    monkeypatch.setitem(pt._NODE_DEFAULTS, "context_tags", ListaLenta)
+    node = ProcessNode(3, 1, "sshd", 0)
+    threads = [threading.Thread(target=lambda t=t: node.context_tags.append(t))
+               for t in ("SSH", "CONTAINER")]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert sorted(node.context_tags) == ["CONTAINER", "SSH"]
+
+
+def test_to_dict_round_trips_through_json():
+    node = ProcessNode(7, 1, "/usr/sbin/sshd", 0, prio=100)
+    node.open_files.update({"/etc/shadow", "/var/log/secure"})
+    node.connections.add("10.0.0.1:22")
+    node.tags_accumulated = True
+
+    d = json.loads(json.dumps(node.to_dict()))
+    assert set(d) == {campo for campo, _ in pt.NODE_FIELDS}
+    assert "tags_accumulated" not in d and "children" not in d
+    assert sorted(d["open_files"]) == ["/etc/shadow", "/var/log/secure"]
+    # Colecao nunca escrita sai vazia, nao ausente: o laudo le todas.
+    assert d["network_drops_details"] == [] and d["blk_latency"] == {}
+    vazio = ProcessNode(8, 1, "sleep", 0).to_dict()
+    for campo, padrao in pt.NODE_FIELDS:
+        if isinstance(padrao, type):
+            assert vazio[campo] == ({} if padrao is dict else [])
+
+    volta = ProcessNode.from_dict(dict(d, desconhecido=1))
+    assert volta.open_files == node.open_files and volta.connections == {"10.0.0.1:22"}
+    assert (volta.prio, volta.nice, volta.cmd) == (100, -20, "/usr/sbin/sshd")
+    # set -> lista: a ordem muda com a semente de hash de cada processo.
+    de_volta = volta.to_dict()
+    assert sorted(de_volta.pop("open_files")) == sorted(d.pop("open_files"))
+    assert de_volta == d
+
+
+def test_tree_json_and_carry_over_use_the_schema():
+    arvore = ProcessTree()
+    antigo = ProcessNode(9, 1, "java", 1000)
+    antigo.md5 = "abc"
+    antigo.read_bytes_delta = 4096
+    antigo.open_files.add("/tmp/x")
+    antigo.context_tags.append("NET ERR")
+    arvore.nodes[9] = antigo
+
+    assert arvore.to_json()[9]["md5"] == "abc"
+    novo = antigo.carry_over()
+    assert novo.md5 == "abc" and novo.read_bytes_delta == 0
+    assert novo.open_files == set() and "NET ERR" not in novo.context_tags
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_offcpu.py
+# DESCRIPTION: Tempo fora da CPU por ponto de espera, medido no sched_switch.
+#
+#              O EDR-WAIT lia /proc/PID/wchan uma vez por processo dormindo e
+#              so via quem estava bloqueado no instante da leitura. O kernel
+#              passa a somar o tempo de espera por pilha; o motor conta os
+#              milissegundos em caminhos de inspecao e so entao da o selo.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+
+import pytest
+
+from src.collectors.process_tree import ProcessNode
+from src.probes.offcpu import states_mask, edr_wait_site, EDR_WAIT_REASON
+from src.probes.replay import SYNTHETIC_PID_BASE
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+ARVORE = os.path.join("src", "collectors", "process_tree.py")
+
+
+def test_states_mask_follows_prev_state_bits():
+    assert states_mask("D") == 2
+    assert states_mask("sd") == 3
+    assert states_mask("") == 0 and states_mask(None) == 0
+    assert states_mask("RX") == 0
+
+
+def test_edr_wait_site_strips_offsets_and_decodes():
+    pilha = [b"schedule+0x45", b"fanotify_get_response+0x1a0", b"fsnotify+0x2f0"]
+    assert edr_wait_site(pilha) == "fanotify_get_response"
+    assert edr_wait_site(["io_schedule", "folio_wait_bit"]) is None
+    assert edr_wait_site([]) is None
+
+
+class _Chave(ct.Structure):
+    _fields_ = [("pid", ct.c_uint), ("gen", ct.c_uint), ("stack_id", ct.c_int),
+                ("pad", ct.c_uint)]
+
+
+class _Inicio(ct.Structure):
+    _fields_ = [("ts", ct.c_ulonglong), ("tgid", ct.c_uint), ("stack_id", ct.c_int)]
+
+
+class _Mapa(object):
+    """offcpu_ns do BCC, sem operacoes em lote."""
+    Key = _Chave
+
+    def __init__(self, itens):
+        self.itens = itens
+
+    def items(self):
+        return list(self.itens)
+
+    def keys(self):
+        return [c for c, _ in self.itens]
+
+    def values(self):
+        return [v for _, v in self.itens]
+
+    def __delitem__(self, k):
+        self.itens = [(c, v) for c, v in self.itens if c is not k]
+
+
+class _Pilhas(object):
+    """BPF_STACK_TRACE: enderecos por id."""
+
+    def __init__(self, pilhas):
+        self.pilhas = dict(pilhas)
+        self.apagadas = []
+
+    def walk(self, stack_id):
+        return iter(self.pilhas[stack_id])
+
+    def keys(self):
+        return [ct.c_int(i) for i in self.pilhas]
+
+    def __delitem__(self, k):
+        self.apagadas.append(k.value)
+        del self.pilhas[k.value]
+
+
+class _BPF(dict):
+    SIMBOLOS = {1: b"schedule+0x10", 2: b"fanotify_get_response+0x80",
+                3: b"io_schedule+0x5", 4: b"folio_wait_bit+0x30"}
+
+    def ksym(self, addr):
+        return self.SIMBOLOS[addr]
+
+
+def test_engine_measures_edr_wait_per_site(motor):
+    pid = SYNTHETIC_PID_BASE + 11
+    motor.tree.add_or_update(pid, 1, "java", 0, 0, 0, deferred=True)
+    motor.tree.add_or_update(pid + 1, 1, "dd", 0, 0, 0, deferred=True)
+    pilhas = _Pilhas({7: [1, 2], 8: [1, 3, 4], 9: [3], 12: [1, 2]})
+    ns = _Mapa([(_Chave(pid, 0, 7, 0), ct.c_ulonglong(30 * 10 ** 6)),
+                (_Chave(pid, 0, 8, 0), ct.c_ulonglong(5 * 10 ** 6)),
+                (_Chave(pid + 1, 0, 8, 0), ct.c_ulonglong(50 * 10 ** 6)),
+                (_Chave(pid, 1, 9, 0), ct.c_ulonglong(1))])
+    inicio = _Mapa([(ct.c_uint(pid), _Inicio(1, pid, 12))])
+    motor.bpf = _BPF({"offcpu_ns": ns, "offcpu_stacks": pilhas, "offcpu_start": inicio})
+    motor._collect_offcpu(gen=0)
+
+    node = motor.tree.get(pid)
+    assert node.offcpu_ms == pytest.approx(35.0)
+    assert node.edr_wait_sites == {"fanotify_get_response": 30.0}
+    assert node.edr_wait_ms == 30.0
+    assert "EDR-WAIT" in node.context_tags
+    assert any(r.startswith(EDR_WAIT_REASON + " fanotify_get_response") for r in node.detection_reasons)
+
+    # Espera comum (I/O) fica no total, sem selo.
+    outro = motor.tree.get(pid + 1)
+    assert outro.offcpu_ms == pytest.approx(50.0)
+    assert outro.edr_wait_ms == 0.0 and "EDR-WAIT" not in outro.context_tags
+
+    # Sobram a pilha da geracao viva (9) e a da espera aberta (12).
+    assert sorted(pilhas.pilhas) == [9, 12]
+
+
+def test_short_edr_waits_do_not_earn_the_badge():
+    node = ProcessNode.from_dict({"context_tags": [], "detection_reasons": []})
+    node.record_edr_wait({"fanotify_get_response": 2 * 10 ** 6}, min_ms=10.0)
+    assert node.edr_wait_ms == 2.0 and node.context_tags == []
+    node.record_edr_wait({"fanotify_get_response": 20 * 10 ** 6}, min_ms=10.0)
+    assert node.context_tags == ["EDR-WAIT", "🧊"]
+
+
+def test_window_clears_the_badge_and_reason():
+    node = ProcessNode.from_dict({"context_tags": ["SSH"], "detection_reasons": ["outra"]})
+    node.record_edr_wait({"fsnotify": 40 * 10 ** 6}, min_ms=10.0)
+    novo = node.carry_over()
+    assert novo.context_tags == ["SSH"]
+    assert novo.detection_reasons == ["outra"]
+    assert (novo.edr_wait_ms, novo.edr_wait_sites, novo.offcpu_ms) == (0.0, {}, 0.0)
+
+
+def test_probe_accounts_offcpu_per_stack_and_wchan_is_gone():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    assert "BPF_STACK_TRACE(offcpu_stacks, SI_OFFCPU_STACKS)" in sonda
+    assert "u32 gen;" in sonda.split("struct offcpu_key_t {")[1].split("};")[0]
+    corpo = sonda.split("TRACEPOINT_PROBE(sched, sched_switch)")[1].split("\n}\n")[0]
+    assert "offcpu_switch(" in corpo
+    assert "SETTING_OFFCPU_STATES" in sonda
+    arvore = io.open(ARVORE, encoding="utf-8").read()
+    assert "_check_wchan" not in arvore and "/wchan" not in arvore
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_open_filter.py
+# DESCRIPTION: Filtro de prefixos e deduplicacao do openat feitos no kernel.
+#
+#              Cada openat virava um evento, e o Python descartava /proc, /sys,
+#              /dev e /run e as repeticoes so depois de pagar o transporte e a
+#              decodificacao. Em servicos que abrem o mesmo log milhares de
+#              vezes por janela, quase todo esse trabalho era desperdicio.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import re
+
+import pytest
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+@pytest.fixture(scope="module")
+def sonda():
+    return io.open(SONDA, encoding="utf-8").read()
+
+
+def _corpo_openat(sonda):
+    return sonda.split("static __always_inline int trace_openat(")[1].split("\n}\n")[0]
+
+
+def test_openat_filters_before_submitting(sonda):
+    corpo = _corpo_openat(sonda)
+    envio = corpo.index("submit_path(")
+    assert corpo.index("path_denied(") < envio
+    assert corpo.index("open_already_seen(") < envio
+
+
+def test_a_path_is_marked_seen_only_after_the_buffer_took_it(sonda):
+    corpo = _corpo_openat(sonda)
+    assert corpo.index("rate_allowed(") < corpo.index("open_mark_seen(")
+    assert "if (submit_path(ctx, &rec, n) == 0 && dedupe) open_mark_seen(" in corpo
+
+    consulta = sonda.split("static __always_inline int open_already_seen(")[1].split("\n}\n")[0]
+    assert "open_seen.update" not in consulta
+    envio = sonda.split("static __always_inline int submit_path(")[1].split("\n}\n")[0]
+    assert "note_lost()" in envio and "return err;" in envio
+
+
+def test_dedupe_is_behind_its_setting(sonda):
+    corpo = _corpo_openat(sonda)
+    assert corpo.index("get_setting(SETTING_OPEN_DEDUPE)") < corpo.index("open_already_seen(")
+
+
+def test_seen_map_is_lru(sonda):
+    """Um mapa comum lotado recusaria entradas novas e deixaria tudo passar."""
+    assert 'BPF_TABLE("lru_hash", struct open_key_t' in sonda
+
+
+def test_execve_is_not_deduplicated(sonda):
+    corpo = sonda.split("TRACEPOINT_PROBE(sched, sched_process_exec)")[1].split("\n}\n")[0]
+    assert "open_already_seen" not in corpo
+    assert "path_denied" not in corpo
+
+
+def test_limits_and_index_match_the_probe(sonda, fonte_motor):
+    for nome in ("SETTING_OPEN_DEDUPE", "DENY_PREFIX_MAX", "DENY_PREFIX_LEN"):
+        em_c = re.search(r"#define %s\s+(\d+)" % nome, sonda).group(1)
+        em_py = re.search(r"^%s = (\d+)" % nome, fonte_motor, re.M).group(1)
+        assert em_c == em_py, nome
+
+
+def test_seen_paths_are_forgotten_each_window(fonte_motor):
+    bloco = fonte_motor.split("def start(self)")[1].split("def stop(self")[0]
+    assert "self._reset_open_seen()" in bloco
+
+
+def test_user_space_filter_uses_the_configured_prefixes(fonte_motor):
+    bloco = fonte_motor.split("elif ev_type == 'O':")[1].split("elif")[0]
+    assert "self.open_deny_prefixes" in bloco
+    assert '"/proc"' not in bloco
+
+
+def test_defaults_keep_the_previous_prefixes():
+    pytest.importorskip("yaml", reason="requer PyYAML")
+    from src.utils.config_loader import DEFAULT_CONFIG
+    engine = DEFAULT_CONFIG["engine"]
+    assert engine["open_deny_prefixes"] == ["/proc", "/sys", "/dev", "/run"]
+    assert engine["open_dedupe"] is True
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_overhead_governor.py
+# DESCRIPTION: Orcamento de custo do proprio agente e degradacao das sondas.
+#
+#              Nada garantia o teto de CPU prometido aos donos das aplicacoes.
+#              O governador mede o agente por janela, desce de nivel acima do
+#              orcamento, volta sozinho quando a carga cai, e o nivel ativo
+#              viaja em cada captura.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import threading
+import time
+
+from src.core import overhead
+from src.core.overhead import (OverheadGovernor, LEVEL_FULL, LEVEL_NO_IO_EVENTS,
+                               LEVEL_SAMPLED_OPENS, LEVEL_NO_VFS_PROBES)
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+MOTOR = os.path.join("src", "core", "engine.py")
+
+
+class _Relogios(object):
+    """Relogio de parede e CPU do agente controlados pelo teste."""
+
+    def __init__(self):
+        self.parede = 0.0
+        self.cpu = 0.0
+        self.rss = 50 * 1024 * 1024
+        self.bpf = None
+
+    def janela(self, segundos, cpu_pct, bpf_ns=0):
+        self.parede += segundos
+        self.cpu += segundos * cpu_pct / 100.0
+        if bpf_ns:
+            self.bpf = (self.bpf or 0) + bpf_ns
+
+
+def _governador(r, **kw):
+    return OverheadGovernor(clock=lambda: r.parede, cpu=lambda: r.cpu,
+                            rss=lambda: r.rss, bpf_ns=lambda fds: r.bpf, **kw)
+
+
+def test_steps_down_one_level_per_window_over_budget():
+    r = _Relogios()
+    g = _governador(r, cpu_budget_pct=2.0)
+    g.begin()
+    niveis = []
+    for _ in range(5):
+        r.janela(10, cpu_pct=6.0)
+        resumo = g.close()
+        niveis.append((resumo["level"], resumo["next_level"]))
+    assert niveis == [(0, 1), (1, 2), (2, 3), (3, 3), (3, 3)]
+    assert resumo["reduced_signals"] == ["io_events", "open_events", "disk_io"]
+    assert resumo["over_budget"] is True
+
+
+def test_recovers_only_after_calm_windows():
+    r = _Relogios()
+    g = _governador(r, cpu_budget_pct=2.0, recover_windows=3)
+    g.begin()
+    g.level = LEVEL_SAMPLED_OPENS
+
+    # Abaixo do orcamento, mas sem folga: fica onde esta.
+    r.janela(10, cpu_pct=1.5)
+    g.close()
+    assert g.level == LEVEL_SAMPLED_OPENS
+
+    for _ in range(3):
+        r.janela(10, cpu_pct=0.2)
+        g.close()
+    assert g.level == LEVEL_NO_IO_EVENTS
+
+
+def test_bpf_runtime_counts_against_the_budget():
+    r = _Relogios()
+    r.bpf = 1
+    g = _governador(r, cpu_budget_pct=2.0)
+    g.begin()
+    # Agente em 1%, sondas em 1.5% de um core: juntos passam de 2%.
+    r.janela(10, cpu_pct=1.0, bpf_ns=int(0.15 * 1e9))
+    resumo = g.close()
+    assert resumo["bpf_cpu_pct"] == 1.5
+    assert resumo["over_budget"] is True
+    assert g.level == LEVEL_NO_IO_EVENTS
+
+
+def test_memory_over_budget_also_degrades():
+    r = _Relogios()
+    r.rss = 400 * 1024 * 1024
+    g = _governador(r, mem_budget_mb=256)
+    g.begin()
+    r.janela(10, cpu_pct=0.1)
+    assert g.close()["over_budget"] is True
+    assert g.level == LEVEL_NO_IO_EVENTS
+
+
+def test_disabled_governor_only_measures():
+    r = _Relogios()
+    g = _governador(r, enabled=False)
+    g.begin()
+    r.janela(10, cpu_pct=50.0)
+    assert g.close()["over_budget"] is True
+    assert g.level == LEVEL_FULL
+
+
+def test_begin_measures_from_the_first_start_only():
+    r = _Relogios()
+    g = _governador(r)
+    g.begin()
+    r.janela(10, cpu_pct=4.0)   # inclui o intervalo entre capturas
+    g.begin()
+    r.janela(10, cpu_pct=0.0)
+    assert g.close()["poll_cpu_pct"] == 2.0
+
+
+def _gira(segundos):
+    fim = time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID) + segundos
+    while time.clock_gettime(time.CLOCK_THREAD_CPUTIME_ID) < fim:
+        pass
+
+
+def test_only_event_path_thread_cpu_is_charged():
+    relogio = overhead.ThreadCpuClock()
+
+    def leitura():
+        relogio.thread_started()
+        _gira(0.05)
+        relogio.tick()
+
+    # Trabalho de outra thread (enriquecimento, laudo) nao entra.
+    _gira(0.2)
+    for _ in range(2):   # uma thread de leitura por captura
+        t = threading.Thread(target=leitura)
+        t.start()
+        t.join()
+    assert 0.1 <= relogio.seconds() < 0.2
+
+    g = OverheadGovernor()
+    assert g._cpu == g.event_cpu_seconds
+
+
+def test_bpf_runtime_needs_stats_enabled():
+    # Um descritor qualquer nao tem run_time_ns: parcela desconhecida, nao zero.
+    fd = os.open(os.devnull, os.O_RDONLY)
+    try:
+        assert overhead.bpf_run_time_ns([fd]) is None
+    finally:
+        os.close(fd)
+    assert overhead.process_rss_bytes() > 0
+
+
+def test_open_sampling_is_decided_before_copying_the_path():
+    sonda = io.open(SONDA, encoding="utf-8").read()
+    assert "#define SETTING_OPEN_SAMPLE 5" in sonda
+    corpo = sonda.split("static __always_inline int trace_openat(")[1].split("\n}\n")[0]
+    assert corpo.index("SETTING_OPEN_SAMPLE") < corpo.index("read_path(")
+    assert "bpf_get_prandom_u32()" in corpo
+
+
+def test_engine_applies_levels_and_records_them():
+    fonte = io.open(MOTOR, encoding="utf-8").read()
+    assert "SETTING_OPEN_SAMPLE = 5" in fonte
+    assert 'self.capture_health["overhead"] = self.governor.close(' in fonte
+
+    for nome in ("stop", "rotate"):
+        corpo = fonte.split("def %s(self" % nome)[1].split("\n    def ")[0]
+        assert corpo.index("self._close_capture_health(") < corpo.index("self._govern()")
+        assert corpo.index("self._govern()") < corpo.index("self._collect_io_counters(")
+
+    poll = fonte.split("def _poll_loop(self")[1].split("\n    def ")[0]
+    assert "relogio.thread_started()" in poll and "relogio.tick()" in poll
+    assert "OverheadGovernor(" in fonte and "cpu=" not in \
+        fonte.split("OverheadGovernor(")[1].split("self.overhead_open_sample")[0]
+
+    govern = fonte.split("def _govern(self")[1].split("\n    def ")[0]
+    assert "self._detach_vfs()" in govern and "self._attach_vfs()" in govern
+    assert "self._attach_vfs()" in fonte.split("def _attach_probes(self")[1].split("\n    def ")[0]
+    assert LEVEL_NO_VFS_PROBES == 3
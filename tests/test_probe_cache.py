@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_probe_cache.py
+# DESCRIPTION: Cache do objeto compilado das sondas.
+#
+#              Toda partida do agente (e todo CMD_RESTART) rodava o clang sobre
+#              base_trace.c. O objeto compilado agora fica em disco pela
+#              identidade do build, com as referencias a mapas guardadas por
+#              indice, e a partida seguinte recria os mapas e carrega as
+#              instrucoes sem compilar. Objeto recusado volta a compilar.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import struct
+import sys
+import types
+
+import pytest
+
+from src.core import engine as engine_mod
+from src.probes import bpf_syscall
+from src.probes.cache import (ProbeCache, probe_identity, identity_key, kfunc_target,
+                              map_references, relocate, LD_IMM64)
+
+
+def _insn(code, src=0, dst=0, imm=0):
+    regs = (src << 4 | dst) if sys.byteorder == "little" else (dst << 4 | src)
+    return struct.pack("=BBhi", code, regs, 0, imm)
+
+
+def _programa(*fds):
+    """mov r0, 0; um ld_imm64 de mapa por fd; exit."""
+    corpo = _insn(0xb7)
+    for fd in fds:
+        corpo += _insn(LD_IMM64, src=1, dst=1, imm=fd) + _insn(0)
+    return corpo + _insn(0x95)
+
+
+def test_key_is_stable_and_follows_every_input():
+    base = identity_key(probe_identity("int x;", ["-DA"], release="6.4.0", bcc_version="0.29"))
+    assert base == identity_key(probe_identity("int x;", ["-DA"], release="6.4.0",
+                                               bcc_version="0.29"))
+    for variante in (probe_identity("int y;", ["-DA"], release="6.4.0", bcc_version="0.29"),
+                     probe_identity("int x;", ["-DB"], release="6.4.0", bcc_version="0.29"),
+                     probe_identity("int x;", ["-DA"], release="5.3.18", bcc_version="0.29"),
+                     probe_identity("int x;", ["-DA"], release="6.4.0", bcc_version="0.30")):
+        assert identity_key(variante) != base
+
+
+def test_map_references_survive_a_new_process():
+    insns = _programa(7, 9, 7)
+    refs = map_references(insns, {7: 0, 9: 1})
+    assert refs == [(1, 0), (3, 1), (5, 0)]
+
+    novo = relocate(insns, refs, [40, 41])
+    imms = [struct.unpack_from("=i", novo, pos * 8 + 4)[0] for pos, _ in refs]
+    assert imms == [40, 41, 40]
+    assert novo[:8] == insns[:8] and novo[-8:] == insns[-8:]
+
+
+def test_references_that_cannot_be_redone_are_refused():
+    with pytest.raises(ValueError):
+        map_references(_programa(12), {7: 0})
+    btf_id = _insn(LD_IMM64, src=3, dst=1, imm=55) + _insn(0)
+    with pytest.raises(ValueError):
+        map_references(btf_id, {})
+
+
+def test_kfunc_names_resolve_to_the_kernel_function():
+    assert kfunc_target("kfunc__vmlinux__vfs_read") == ("vfs_read", "fentry")
+    assert kfunc_target("kretfunc__vfs_write") == ("vfs_write", "fexit")
+    assert kfunc_target("tracepoint__sched__sched_switch") == (None, None)
+    with pytest.raises(ValueError):
+        kfunc_target("kfunc__ipv6__tcp_v6_connect")
+
+
+def test_one_trusted_entry_at_a_time(tmp_path):
+    cache = ProbeCache(str(tmp_path / "probe-cache"))
+    assert cache.lookup("a") is None
+    assert cache.store("a", {"k": 1}, {"functions": [], "maps": []})
+    assert cache.lookup("a")["identity"] == {"k": 1}
+    assert os.stat(cache._entry_path("a")).st_mode & 0o777 == 0o600
+
+    cache.store("b", {"k": 2}, {"functions": [], "maps": []})
+    assert os.listdir(cache.cache_dir) == ["b.json"]
+
+    os.chmod(cache._entry_path("b"), 0o666)
+    assert cache.lookup("b") is None
+    cache.discard("b")
+    assert os.listdir(cache.cache_dir) == []
+    assert ProbeCache("").store("c", {}, {}) is None
+
+
+def test_bpf_attr_layout_matches_the_kernel():
+    assert bpf_syscall.MapCreateAttr.map_name.offset == 28
+    assert bpf_syscall.ProgLoadAttr.kern_version.offset == 40
+    assert bpf_syscall.ProgLoadAttr.prog_name.offset == 48
+    assert bpf_syscall.ProgLoadAttr.expected_attach_type.offset == 68
+    assert bpf_syscall.ProgLoadAttr.line_info.offset == 96
+    assert bpf_syscall.ProgLoadAttr.attach_btf_id.offset == 108
+    assert bpf_syscall._obj_name("tracepoint__sched__sched_switch") == b"tracepoint__sch"
+
+
+def test_btf_lookup_finds_functions_by_name(tmp_path):
+    textos = b"\0int\0vfs_read\0vfs_write\0"
+    tipos = (struct.pack("<III", 1, 1 << 24, 4) + struct.pack("<I", 32)      # 1 INT
+             + struct.pack("<III", 0, 13 << 24 | 1, 1) + struct.pack("<II", 0, 1)  # 2 PROTO
+             + struct.pack("<III", 5, 12 << 24, 2)                            # 3 FUNC
+             + struct.pack("<III", 14, 12 << 24, 2))                          # 4 FUNC
+    blob = struct.pack("<HBBIIIII", 0xEB9F, 1, 0, 24, 0, len(tipos), len(tipos),
+                       len(textos)) + tipos + textos
+    caminho = tmp_path / "vmlinux"
+    caminho.write_bytes(blob)
+    assert bpf_syscall.btf_func_ids({"vfs_write", "vfs_read", "nope"}, str(caminho)) == \
+        {"vfs_read": 3, "vfs_write": 4}
+
+
+class _Compilado:
+    """BPF(text=...) de mentira: so registra que houve compilacao."""
+    compilacoes = 0
+
+    def __init__(self, text, cflags):
+        type(self).compilacoes += 1
+        self.module = "modulo"
+
+    @staticmethod
+    def tracepoint_exists(categoria, evento):
+        return True
+
+
+class _Carregado:
+    """CachedBPF de mentira: guarda a entrada que recebeu."""
+
+    def __init__(self, entry):
+        self.entry = entry
+
+
+def _motor_com_cache(motor, monkeypatch, tmp_path, carga):
+    _Compilado.compilacoes = 0
+    modulo = types.ModuleType("src.probes.cached_bpf")
+    modulo.BCC_VERSION = "0.29"
+    modulo.CachedBPF = carga
+    modulo.object_from_module = lambda module: {"functions": [], "maps": [], "de": module}
+    monkeypatch.setitem(sys.modules, "src.probes.cached_bpf", modulo)
+    monkeypatch.setattr(engine_mod, "BPF", _Compilado)
+    motor.attach_requested = "tracepoint"
+    motor.probe_cache = ProbeCache(str(tmp_path))
+    motor._attach_probes = lambda: None
+    return motor
+
+
+def test_second_start_loads_the_cached_object(motor, monkeypatch, tmp_path):
+    motor = _motor_com_cache(motor, monkeypatch, tmp_path, _Carregado)
+    motor._init_bpf()
+    assert _Compilado.compilacoes == 1 and isinstance(motor.bpf, _Compilado)
+    assert motor.probe_cache.lookup(motor.probe_key)["de"] == "modulo"
+
+    motor.bpf = None
+    motor._init_bpf()
+    assert _Compilado.compilacoes == 1
+    assert isinstance(motor.bpf, _Carregado) and motor.bpf.entry["key"] == motor.probe_key
+
+
+def test_rejected_object_is_dropped_and_compiled(motor, monkeypatch, tmp_path):
+    def recusa(entry):
+        raise OSError(13, "Permission denied: verifier")
+
+    motor = _motor_com_cache(motor, monkeypatch, tmp_path, recusa)
+    motor._init_bpf()
+    motor.bpf = None
+    motor._init_bpf()
+    assert _Compilado.compilacoes == 2
+    assert isinstance(motor.bpf, _Compilado)
+    assert motor.probe_cache.lookup(motor.probe_key) is not None
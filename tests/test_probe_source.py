@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_probe_source.py
+# DESCRIPTION: Fonte das sondas estavel entre partidas.
+#
+#              O PID do agente era escrito no TEXTO de base_trace.c a cada
+#              partida, e com isso nenhuma partida compilava o mesmo fonte que a
+#              anterior. O PID agora vive no mapa agent_settings e o texto
+#              compilado e o arquivo, sem substituicoes.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+
+from src.probes.loader import load_probe_source
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+def test_loaded_source_is_the_file_verbatim():
+    """Nada dependente do processo pode entrar no texto compilado."""
+    assert load_probe_source("base_trace.c") == io.open(SONDA, encoding="utf-8").read()
+
+
+def test_agent_pid_is_a_runtime_setting():
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    assert "#define FILTER_PID 00000" not in fonte
+    assert "get_setting(SETTING_AGENT_PID)" in fonte
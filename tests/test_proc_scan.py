@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_proc_scan.py
+# DESCRIPTION: Varredura de /proc com openat, parsers pontuais e pool.
+#
+#              Cada PID custava 4-5 open() por caminho completo, um exists, o
+#              status inteiro num dicionario e um getctime a mais. A leitura
+#              agora abre o diretorio uma vez, tira do status so Uid e VmRSS e
+#              divide os PIDs entre threads; o resultado tem de ser o mesmo.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import os
+import threading
+
+import pytest
+
+from src.collectors import process_tree as pt
+from src.collectors import proc_scan
+from src.collectors.process_tree import ProcessTree
+from src.collectors.proc_scan import _parse_stat, _status_field
+
+
+def test_parse_stat_cuts_at_the_last_paren():
+    linha = (b"4242 (a) b (c)) S 1 4242 4242 0 -1 4194560 100 0 0 0 1 2 0 0 "
+             b"20 -5 1 0 987654 1000 200\n")
+    assert _parse_stat(linha) == ("a) b (c)", "S", 1, -5, 987654)
+
+
+def test_status_field_reads_one_line():
+    status = b"Name:\tsshd\nUid:\t1000\t1000\t1000\t1000\nVmRSS:\t    5120 kB\n"
+    assert _status_field(status, b"Uid") == b"1000"
+    assert _status_field(status, b"VmRSS") == b"5120"
+    assert _status_field(status, b"VmSwap") is None
+    assert _status_field(b"Name:\tk\nUid:", b"Uid") is None
+
+
+@pytest.fixture
+def arvore(monkeypatch):
+    monkeypatch.setattr(pt.ProcessNode, "update_static_info", lambda self, *_a: None)
+    return ProcessTree()
+
+
+def test_scan_matches_proc(arvore):
+    pid = os.getppid()
+    assert arvore.scan_proc_fs([pid]) == 1
+    node = arvore.get(pid)
+
+    with open("/proc/%d/status" % pid) as f:
+        info = dict(l.split(":", 1) for l in f.read().splitlines() if ":" in l)
+    assert node.ppid == int(info["PPid"])
+    assert node.uid == int(info["Uid"].split()[0])
+    assert node.state == info["State"].split()[0]
+    assert node.start_time == os.path.getctime("/proc/%d" % pid)
+    assert node.rss == int(info["VmRSS"].split()[0]) * 1024
+    assert node.duration_str and node.start_ts_abs
+
+
+def test_vanished_pid_is_skipped(arvore):
+    assert arvore.scan_proc_fs([2 ** 22 + 7]) == 0
+    assert arvore.nodes == {}
+
+
+def test_large_scans_fan_out_to_the_pool(arvore, monkeypatch):
+    threads = set()
+    original = ProcessTree._scan_pid
+
+    def le(self, pid, up):
+        threads.add(threading.current_thread().name)
+        return original(self, pid, up)
+
+    monkeypatch.setattr(ProcessTree, "_scan_pid", le)
+    monkeypatch.setattr(proc_scan, "_SCAN_POOL_MIN_PIDS", 2)
+    arvore.scan_workers = 3
+    pids = sorted(proc_scan._live_pids())
+    arvore.scan_proc_fs(pids)
+    assert os.getpid() not in arvore.nodes
+    assert os.getppid() in arvore.nodes
+    assert "MainThread" not in threads
+
+    # Com 1 thread a varredura e sequencial, e o resultado o mesmo.
+    seq = ProcessTree()
+    seq.scan_workers = 1
+    seq.scan_proc_fs(pids)
+    comum = set(seq.nodes) & set(arvore.nodes)
+    assert os.getppid() in comum
+    assert all(seq.nodes[p].ppid == arvore.nodes[p].ppid for p in comum)
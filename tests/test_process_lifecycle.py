@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_process_lifecycle.py
+# DESCRIPTION: Arvore de processos mantida por fork/exec/exit do kernel.
+#
+#              A arvore era refeita varrendo /proc a cada janela: status, stat,
+#              loginuid e cmdline de todo PID, o passo mais caro do ciclo em
+#              hosts com 20k+ tarefas. Agora os eventos de ciclo de vida mantem
+#              a arvore, e /proc so e varrido inteiro com a arvore vazia; no
+#              mais, uma listagem diz quem entrou e quem saiu.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import inspect
+import io
+import os
+
+import pytest
+
+from src.probes import records
+from src.collectors import proc_scan
+from src.collectors import process_tree as pt
+from src.collectors.process_tree import ProcessTree
+from src.core.events import events_from_capture, EV_PROCESS_END
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+MORTO = 2 ** 22 + 7  # acima do pid_max padrao: nunca existe
+
+
+@pytest.fixture(scope="module")
+def sonda():
+    return io.open(SONDA, encoding="utf-8").read()
+
+
+@pytest.fixture
+def arvore():
+    tree = ProcessTree()
+    tree.scan_proc_fs([os.getppid()])
+    return tree
+
+
+def _corpo(fonte, assinatura):
+    return fonte.split(assinatura)[1].split("\n}\n")[0]
+
+
+# ------------------------------------------------------------------------------
+# Sondas
+# ------------------------------------------------------------------------------
+def test_fork_skips_threads_in_the_kernel(sonda):
+    corpo = _corpo(sonda, "TRACEPOINT_PROBE(task, task_newtask)")
+    assert corpo.index("CLONE_THREAD") < corpo.index("SUBMIT(")
+    assert "rec.pid = args->pid" in corpo
+
+
+def test_exit_is_reported_once_per_process(sonda):
+    corpo = _corpo(sonda, "TRACEPOINT_PROBE(sched, sched_process_exit)")
+    assert "(u32)id != (id >> 32)" in corpo
+    assert "rec.exit_ns = bpf_ktime_get_ns()" in corpo
+
+
+def test_lifecycle_probes_have_a_budget(sonda):
+    for assinatura in ("TRACEPOINT_PROBE(task, task_newtask)",
+                       "TRACEPOINT_PROBE(sched, sched_process_exit)"):
+        corpo = _corpo(sonda, assinatura)
+        assert corpo.index("rate_allowed(") < corpo.index("SUBMIT(")
+
+
+def test_exec_no_longer_comes_from_the_syscall_kprobe(sonda, fonte_motor):
+    assert "syscall__execve" not in sonda
+    assert 'get_syscall_fnname("execve")' not in fonte_motor
+
+
+def test_exit_record_matches_the_c_struct(sonda):
+    corpo = sonda.split("struct rec_exit_t {")[1].split("};")[0]
+    for campo in ("exit_ns", "exit_code", "pad"):
+        assert campo in corpo
+    assert records.EXIT.size == 16
+
+
+def test_fork_and_exit_records_round_trip():
+    ev = records.decode(records.encode('F', pid=20, ppid=10, comm="bash"))
+    assert (ev.type_id, ev.pid, ev.ppid, ev.comm) == ('F', 20, 10, "bash")
+
+    ev = records.decode(records.encode('X', pid=20, exit_ns=123, exit_code=9))
+    assert (ev.type_id, ev.exit_ns, ev.exit_code) == ('X', 123, 9)
+
+
+# ------------------------------------------------------------------------------
+# Arvore
+# ------------------------------------------------------------------------------
+def test_fork_copies_the_parent_without_reading_proc(arvore, monkeypatch):
+    pai = arvore.get(os.getppid())
+    pai.container_id = "abc"
+    pai.read_bytes_delta = 500
+
+    def proibido(*_a, **_k):
+        raise AssertionError("fork nao deveria ler /proc")
+    monkeypatch.setattr(pt.ProcessNode, "update_static_info", proibido)
+
+    filho = arvore.fork(MORTO, pai.pid, "sh", 0, 120, ts=1000.0)
+    assert filho.ppid == pai.pid
+    assert filho.container_id == "abc"
+    assert filho.read_bytes_delta == 0
+    assert filho.start_time == 1000.0
+    assert filho.is_new is True
+
+
+def test_exit_keeps_the_node_in_this_window_only(arvore):
+    pai = arvore.get(os.getppid())
+    arvore.fork(MORTO, pai.pid, "sh", 0, 120)
+    arvore.mark_exit(MORTO, 2000.0, 256)
+
+    assert arvore.get(MORTO).end_time == 2000.0
+    fechada = arvore.rotate()
+    assert MORTO in fechada.nodes
+    assert MORTO not in arvore.nodes
+    assert pai.pid in arvore.nodes
+
+
+def test_reconcile_reads_only_new_pids(monkeypatch):
+    arvore = ProcessTree()
+    arvore.nodes[MORTO] = pt.ProcessNode(MORTO, 1, "sumiu", 0)
+    lidos = []
+    monkeypatch.setattr(proc_scan, "_live_pids", lambda: {os.getpid(), os.getppid()})
+    monkeypatch.setattr(ProcessTree, "_scan_pid",
+                        lambda self, pid, up: lidos.append(pid) or True)
+
+    novos = arvore.reconcile()
+    assert MORTO not in arvore.nodes
+    assert lidos == [os.getppid()]      # o proprio agente fica de fora
+    assert set(novos) == {os.getpid(), os.getppid()}
+
+
+def test_reconcile_walks_a_copy_of_the_pids():
+    # A thread de eventos insere nos durante a varredura: iterar o dict
+    # direto levantaria "dictionary changed size during iteration".
+    corpo = inspect.getsource(ProcessTree.reconcile)
+    assert "list(self.nodes)" in corpo
+    assert "del self.nodes[" not in corpo
+
+
+def test_engine_scans_in_full_only_an_empty_tree(fonte_motor):
+    inicio = fonte_motor.split("def start(self)")[1].split("def stop(self")[0]
+    assert "self.tree.reconcile()" in inicio
+    assert inicio.index("if self.tree.nodes:") < inicio.index("self.tree.scan_proc_fs()")
+
+    rotacao = fonte_motor.split("def rotate(self)")[1].split("\n    def ")[0]
+    assert "self.proc_reconcile_s" in rotacao
+
+
+def test_lifecycle_events_skip_the_generic_path(fonte_motor):
+    corpo = fonte_motor.split("def _handle_record(")[1].split("\n    def ")[0]
+    assert corpo.index("if ev_type == 'F':") < corpo.index("self.tree.add_or_update(")
+    assert corpo.index("if ev_type == 'X':") < corpo.index("self.tree.add_or_update(")
+
+
+# ------------------------------------------------------------------------------
+# Linha do tempo
+# ------------------------------------------------------------------------------
+def test_exit_becomes_a_process_end_event():
+    payload = {"timestamp": 3000, "processes": {"20": {
+        "pid": 20, "ppid": 10, "cmd": "/tmp/x", "start_time": 1000.0,
+        "end_time": 1004.5, "exit_code": 9}}}
+    fim = [e for e in events_from_capture(payload, "ag") if e["type"] == EV_PROCESS_END]
+    assert len(fim) == 1
+    assert fim[0]["ts"] == 1004.5
+    assert fim[0]["detail"]["signal"] == 9
+    assert fim[0]["detail"]["lifetime_s"] == 4.5
+
+
+def test_a_process_that_only_vanished_has_no_end_event():
+    payload = {"timestamp": 3000, "processes": {"20": {
+        "pid": 20, "cmd": "/tmp/x", "start_time": 1000.0}}}
+    assert not [e for e in events_from_capture(payload, "ag") if e["type"] == EV_PROCESS_END]
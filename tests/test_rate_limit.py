@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_rate_limit.py
+# DESCRIPTION: Orcamento de eventos por processo, aplicado no kernel.
+#
+#              Um processo descontrolado (openat em laco, rajada de execs)
+#              enchia o buffer de eventos e tirava espaco do resto da janela.
+#              O limite precisa valer antes de todo envio, e o que ele corta
+#              precisa continuar visivel: contado no no e citado no laudo.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import re
+
+import pytest
+
+from src.probes import rate_limit
+from src.collectors.process_tree import ProcessNode
+from src.exporters.html_report import _render_suppressed
+from src.utils.config_loader import load_config
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+@pytest.fixture(scope="module")
+def sonda():
+    return io.open(SONDA, encoding="utf-8").read()
+
+
+def _corpo(fonte, assinatura):
+    return fonte.split(assinatura)[1].split("\n}\n")[0]
+
+
+@pytest.mark.parametrize("assinatura,kind", [
+    ("TRACEPOINT_PROBE(sched, sched_process_exec)", "RL_EXEC"),
+    ("static __always_inline int trace_openat(", "RL_OPEN"),
+    ("static __always_inline int account_io(", "RL_IO"),
+])
+def test_every_probe_checks_its_budget_before_sending(sonda, assinatura, kind):
+    corpo = _corpo(sonda, assinatura)
+    verificacao = corpo.index("rate_allowed(")
+    assert kind in corpo[verificacao:verificacao + 60]
+    envio = corpo.index("submit_path(") if "submit_path(" in corpo else corpo.index("SUBMIT(")
+    assert verificacao < envio
+
+
+def test_openat_spends_tokens_only_on_new_paths(sonda):
+    """Repeticao ja deduplicada nao pode gastar o orcamento do processo."""
+    corpo = _corpo(sonda, "static __always_inline int trace_openat(")
+    assert corpo.index("open_already_seen(") < corpo.index("rate_allowed(")
+
+
+def test_exec_is_charged_to_the_parent(sonda):
+    corpo = _corpo(sonda, "TRACEPOINT_PROBE(sched, sched_process_exec)")
+    assert "rate_allowed(rec.hdr.ppid, RL_EXEC)" in corpo
+
+
+def test_buckets_are_lru_and_suppressed_counts_carry_the_generation(sonda):
+    assert 'BPF_TABLE("lru_hash", struct bucket_key_t, struct bucket_t, rate_buckets' in sonda
+    chave = sonda.split("struct suppress_key_t {")[1].split("};")[0]
+    for campo in ("pid", "gen", "kind"):
+        assert campo in chave
+
+
+def test_kind_indexes_match_the_probe(sonda):
+    for idx, kind in enumerate(rate_limit.KINDS):
+        em_c = re.search(r"#define RL_%s\s+(\d+)" % kind.upper(), sonda)
+        assert int(em_c.group(1)) == idx, kind
+    assert int(re.search(r"#define RL_KINDS\s+(\d+)", sonda).group(1)) == rate_limit.RL_KINDS
+
+
+def test_slots_fill_defaults_and_clamp():
+    slots = rate_limit.rate_limit_slots({"open": {"rate": 10, "burst": 0},
+                                         "io": {"rate": 0},
+                                         "exec": {"rate": 10 ** 9}})
+    por_tipo = dict(zip(rate_limit.KINDS, slots))
+    assert por_tipo["open"] == (10, 1)
+    assert por_tipo["io"] == (0, 0)
+    assert por_tipo["exec"][0] == rate_limit.MAX_RATE
+    padrao = rate_limit.DEFAULT_RATE_LIMITS["connect"]
+    assert por_tipo["connect"] == (padrao["rate"], padrao["burst"])
+
+
+def test_burst_is_clamped_so_the_bucket_fits_a_u64(sonda):
+    slots = rate_limit.rate_limit_slots({"open": {"rate": 10, "burst": 10 ** 12}})
+    assert dict(zip(rate_limit.KINDS, slots))["open"] == (10, rate_limit.MAX_BURST)
+    assert (rate_limit.MAX_BURST * 10 ** 9 +
+            10 * 10 ** 9 * rate_limit.MAX_RATE) < 2 ** 64
+
+    for nome, valor in (("RL_MAX_BURST", rate_limit.MAX_BURST),
+                        ("RL_MAX_RATE", rate_limit.MAX_RATE)):
+        assert int(re.search(r"#define %s\s+(\d+)" % nome, sonda).group(1)) == valor
+    corpo = _corpo(sonda, "static __always_inline int rate_allowed(")
+    assert corpo.index("RL_MAX_BURST") < corpo.index("burst * RL_TOKEN")
+    assert "lim->burst * RL_TOKEN" not in corpo
+
+
+def test_config_loader_clamps_rate_limits(tmp_path):
+    caminho = tmp_path / "config.yaml"
+    caminho.write_text("engine:\n  rate_limits:\n    open: {rate: 99999999, burst: 99999999999}\n")
+    cfg = load_config(str(caminho))
+    assert cfg["engine"]["rate_limits"]["open"] == {"rate": rate_limit.MAX_RATE,
+                                                    "burst": rate_limit.MAX_BURST}
+    assert cfg["engine"]["rate_limits"]["exec"] == {"rate": 150, "burst": 600}
+
+
+def test_disabled_budget_turns_every_kind_off():
+    assert set(rate_limit.rate_limit_slots(None, enabled=False)) == {(0, 0)}
+
+
+def test_engine_reads_the_counts_every_window(fonte_motor):
+    for metodo in ("def stop(self", "def rotate(self)"):
+        bloco = fonte_motor.split(metodo)[1].split("\n    def ")[0]
+        assert "self._collect_suppressed(" in bloco, metodo
+    inicio = fonte_motor.split("def start(self)")[1].split("def stop(self")[0]
+    assert "self._reset_suppressed()" in inicio
+
+
+def test_node_counts_reset_on_the_next_window():
+    node = ProcessNode(10, 1, "loop", 0)
+    node.suppressed_events = 900
+    node.suppressed_by_type["open"] = 900
+    novo = node.carry_over()
+    assert novo.suppressed_events == 0
+    assert novo.suppressed_by_type == {}
+    assert node.suppressed_by_type == {"open": 900}
+
+
+def test_report_says_how_many_were_suppressed():
+    node = ProcessNode(10, 1, "loop", 0)
+    assert _render_suppressed(node) == ""
+    node.suppressed_events = 1200
+    node.suppressed_by_type = {"open": 1000, "exec": 200}
+    linha = _render_suppressed(node)
+    assert "1200 events suppressed" in linha
+    assert linha.index("open: 1000") < linha.index("exec: 200")
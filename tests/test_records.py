@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_records.py
+# DESCRIPTION: Registros compactos por tipo, do kernel ao motor.
+#
+#              A estrutura unica de antes levava ~370 bytes em todo evento,
+#              inclusive 256 de filename para uma leitura de disco. Agora cada
+#              tipo tem o proprio layout e o caminho viaja so com os bytes que
+#              usa. O decodificador em Python precisa casar byte a byte com as
+#              structs do C; uma divergencia aqui nao quebra nada de forma
+#              visivel, so produz PIDs e enderecos errados no laudo.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import io
+import os
+import socket
+import struct
+
+import pytest
+
+from src.probes import records
+
+SONDA = os.path.join("src", "probes", "base_trace.c")
+
+
+def test_path_record_carries_only_the_used_bytes():
+    curto = records.encode('O', pid=10, filename="/etc/hosts")
+    assert len(curto) == records.HEADER.size + len("/etc/hosts") + 1
+
+    ev = records.decode(curto)
+    assert ev.type_id == 'O'
+    assert ev.pid == 10
+    assert ev.filename == "/etc/hosts"
+
+
+def test_header_fields_round_trip():
+    raw = records.encode('E', pid=42, ppid=1, uid=1000, loginuid=1000,
+                         prio=110, rss=4096, comm="bash", filename="/bin/ls")
+    ev = records.decode(raw)
+    assert (ev.pid, ev.ppid, ev.uid, ev.loginuid, ev.prio) == (42, 1, 1000, 1000, 110)
+    assert ev.mem_peak_rss == 4096
+    assert ev.comm == "bash"
+    assert ev.filename == "/bin/ls"
+
+
+def test_connect_keeps_network_byte_order():
+    """O motor converte com inet_ntop/ntohs; o decodificador nao pode mexer."""
+    daddr = struct.unpack("I", socket.inet_aton("10.0.0.5"))[0]
+    raw = records.encode('N', pid=7, daddr=daddr, dport=socket.htons(443))
+    ev = records.decode(raw)
+    assert socket.inet_ntop(socket.AF_INET, struct.pack("I", ev.daddr)) == "10.0.0.5"
+    assert socket.ntohs(ev.dport) == 443
+
+
+def test_io_and_drop_tails():
+    ev = records.decode(records.encode('W', pid=3, io_bytes=512, io_latency_ns=900))
+    assert (ev.type_id, ev.io_bytes, ev.io_latency_ns) == ('W', 512, 900)
+
+    ev = records.decode(records.encode('D', pid=0, proto=17, net_len=60))
+    assert (ev.type_id, ev.proto, ev.net_len) == ('D', 17, 60)
+
+
+def test_fields_a_type_does_not_carry_are_zeroed():
+    ev = records.decode(records.encode('R', pid=3, io_bytes=1))
+    assert ev.filename == ""
+    assert ev.daddr == 0
+
+
+def test_truncated_or_unknown_records_are_dropped():
+    """Um evento ilegivel se descarta; nao pode derrubar o laco de coleta."""
+    assert records.decode(b"\0" * 10) is None
+
+    raw = bytearray(records.encode('R', pid=3))
+    raw[0] = ord('?')
+    assert records.decode(bytes(raw)) is None
+
+    assert records.decode(records.encode('D', pid=1)[:records.HEADER.size + 4]) is None
+
+
+def test_encode_refuses_unknown_fields():
+    assert records.decode(records.encode('R', io_bytes=7)).prio == 120
+    with pytest.raises(TypeError):
+        records.encode('R', io_byte=7)
+
+
+def test_header_matches_the_c_struct():
+    """rec_hdr_t: 4 + 5*4 + 8 + 16 = 48 bytes, sem buraco de alinhamento."""
+    assert records.HEADER.size == 48
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    hdr = fonte.split("struct rec_hdr_t {")[1].split("};")[0]
+    for campo in ("type_id", "flags", "len", "pid", "ppid", "uid", "loginuid",
+                  "prio", "mem_peak_rss", "comm"):
+        assert campo in hdr, campo
+
+
+def test_probe_submits_through_the_transport_macro():
+    fonte = io.open(SONDA, encoding="utf-8").read()
+    assert "BPF_RINGBUF_OUTPUT(events" in fonte
+    assert "BPF_PERF_OUTPUT(events)" in fonte
+    # Fora da definicao da macro, nenhum envio direto ao perf buffer.
+    corpo = fonte.split("BPF_PERF_OUTPUT(events);")[1].split("#endif")[1]
+    assert "events.perf_submit(" not in corpo
+    assert "events.ringbuf_output(" not in corpo
+
+
+def test_strings_decode_only_when_read():
+    ev = records.decode(memoryview(records.encode('O', pid=3, comm="cat",
+                                                  filename="/etc/hosts")))
+    assert ev._filename is not None and not isinstance(ev._filename, str)
+    assert ev.filename == "/etc/hosts"
+    assert ev.comm == "cat"
+    ev.filename = "outro"
+    assert ev.filename == "outro"
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_replay.py
+# DESCRIPTION: Gravacao e reproducao de registros brutos, sem kernel.
+#
+#              O caminho dos eventos do motor so podia ser exercitado com root,
+#              bcc e carga real. Os registros passam a poder ser gravados pelo
+#              worker do lote e reproduzidos pelo callback do perf buffer, o que
+#              torna o motor mensuravel em qualquer maquina.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import io
+import os
+
+import pytest
+
+from src.probes import records
+from src.probes.replay import (RecordWriter, ReplaySource, read_records,
+                               synthetic_records, SYNTHETIC_PID_BASE, MAGIC)
+
+MOTOR = os.path.join("src", "core", "engine.py")
+
+
+def test_record_file_round_trip(tmp_path):
+    caminho = str(tmp_path / "cap.sirec")
+    brutos = [records.encode('O', pid=7, comm="cat", filename="/etc/hosts"),
+              records.encode('X', pid=7, exit_ns=5, exit_code=256)]
+    gravador = RecordWriter(caminho)
+    for raw in brutos:
+        gravador.write(memoryview(raw))
+    gravador.close()
+
+    lidos = list(read_records(caminho))
+    assert [raw for _ts, raw in lidos] == brutos
+    assert lidos[0][0] <= lidos[1][0]
+
+
+def test_foreign_files_are_refused(tmp_path):
+    caminho = tmp_path / "lixo.bin"
+    caminho.write_bytes(b"qualquer coisa")
+    with pytest.raises(ValueError):
+        list(read_records(str(caminho)))
+
+
+def test_a_truncated_recording_stops_at_the_last_whole_record(tmp_path):
+    caminho = str(tmp_path / "cap.sirec")
+    gravador = RecordWriter(caminho)
+    gravador.write(records.encode('F', pid=1))
+    gravador.write(records.encode('F', pid=2))
+    gravador.close()
+    with open(caminho, "r+b") as fh:
+        fh.truncate(os.path.getsize(caminho) - 3)
+    assert len(list(read_records(caminho))) == 1
+
+
+def test_synthetic_stream_is_deterministic_and_decodable():
+    a = list(synthetic_records(500, seed=3))
+    assert a == list(synthetic_records(500, seed=3))
+    tipos = set()
+    for raw in a:
+        ev = records.decode(raw)
+        assert ev.pid >= SYNTHETIC_PID_BASE
+        tipos.add(ev.type_id)
+    assert {'O', 'E', 'F', 'X', 'N'} <= tipos
+
+
+def test_engine_records_what_it_decodes(motor, tmp_path):
+    caminho = str(tmp_path / "cap.sirec")
+    motor.recorder = RecordWriter(caminho)
+    brutos = list(synthetic_records(300, seed=1))
+    for raw in brutos:
+        buf = ct.create_string_buffer(raw, len(raw))
+        motor._handle_perf_event(0, buf, len(raw))
+    motor.batcher.start()
+    motor.batcher.flush()
+    assert motor.batcher.drain(5.0)
+    motor.recorder.close()
+
+    assert [raw for _ts, raw in read_records(caminho)] == brutos
+    assert motor._window_events == 300
+    assert io.open(caminho, "rb").read(len(MAGIC)) == MAGIC
+
+
+def test_a_bad_record_does_not_stop_the_decode_worker(motor, monkeypatch):
+    vistos = []
+
+    def tratador(ev):
+        if ev.pid == 1: raise ValueError("registro ruim")
+        vistos.append(ev.pid)
+
+    monkeypatch.setattr(motor, "_handle_record", tratador)
+    brutos = [records.encode('R', pid=1), records.encode('R', pid=2), b"\0" * 10]
+    assert motor.replay(ReplaySource(brutos)) == 3
+    assert vistos == [2]
+    assert motor.event_errors == 1
+
+
+def test_engine_replays_through_the_perf_callback(motor):
+
+    brutos = [records.encode('F', pid=SYNTHETIC_PID_BASE + 1, ppid=1, comm="sh"),
+              records.encode('O', pid=SYNTHETIC_PID_BASE + 1, comm="sh",
+                             filename="/srv/dados.db"),
+              records.encode('X', pid=SYNTHETIC_PID_BASE + 1, exit_ns=1, exit_code=0)]
+    assert motor.replay(ReplaySource(brutos)) == 3
+
+    node = motor.tree.get(SYNTHETIC_PID_BASE + 1)
+    assert "/srv/dados.db" in node.open_files
+    assert node.end_time
+    assert motor._window_events == 3
+
+
+def test_engine_imports_without_bcc():
+    fonte = io.open(MOTOR, encoding="utf-8").read()
+    assert "try:\n    from bcc import BPF\nexcept ImportError:" in fonte
+    corpo = fonte.split("def _init_bpf(")[1].split("\n    def ")[0]
+    assert corpo.index("if BPF is None:") < corpo.index("BPF(text=")
@@ -220,7 +220,7 @@ def test_diff_reads_the_real_field_names():
 
     node = ProcessNode(42, 1, "/usr/bin/nc -l 4444", 0)
     node.anomaly_score = 90
-    resumo = _resumo(vars(node))
+    resumo = _resumo(node.to_dict())
 
     assert resumo["cmd"] == "/usr/bin/nc -l 4444"
     assert resumo["alert_score"] == 90
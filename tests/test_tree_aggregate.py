@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tests/test_tree_aggregate.py
+# DESCRIPTION: aggregate_stats sobre o indice de pais (tree_index.py).
+#
+#              A DFS recursiva virou uma passada por nivel, com NumPy ou com
+#              array('q'). Os campos de saida (tree_*, score, selos, razoes)
+#              tem que sair iguais aos da versao recursiva, que fica em
+#              tools/bench_tree_aggregate.py como referencia, e uma cadeia
+#              funda de processos nao pode mais estourar a recursao.
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import pytest
+
+from src.collectors import tree_index
+from src.collectors.process_tree import ProcessTree, ProcessNode
+from src.collectors.tree_index import TreeIndex
+from tools.bench_tree_aggregate import montar_arvore, agregar_antigo
+
+CAMPOS = ("tree_read", "tree_write", "tree_read_delta", "tree_write_delta",
+          "tree_net_tx", "tree_net_rx", "tree_io_latency", "tree_tcp_drops",
+          "tree_tcp_retrans", "tree_max_score", "tree_has_alert", "anomaly_score",
+          "detection_reasons")
+
+
+@pytest.fixture(params=["numpy", "array"])
+def backend(request, monkeypatch):
+    if request.param == "numpy" and tree_index.np is None:
+        pytest.skip("NumPy ausente")
+    if request.param == "array":
+        monkeypatch.setattr(tree_index, "np", None)
+    return request.param
+
+
+def _retrato(arvore):
+    return {pid: tuple(getattr(n, c) for c in CAMPOS) +
+            (frozenset(n.tags_accumulated), tuple(sorted(n.context_tags)))
+            for pid, n in arvore.nodes.items()}
+
+
+@pytest.mark.parametrize("seed,chain", [(0, 0), (1, 40), (2, 300), (3, 0)])
+def test_same_output_as_the_recursive_dfs(backend, seed, chain):
+    antes, depois = montar_arvore(3000, seed, chain), montar_arvore(3000, seed, chain)
+    for arvore in (antes, depois):
+        arvore.immutable_alert = ["/etc/ld.so.preload"] if seed % 2 else []
+
+    agregar_antigo(antes)
+    depois.aggregate_stats()
+
+    assert depois.kernel_pids == antes.kernel_pids
+    assert _retrato(depois) == _retrato(antes)
+
+
+def test_deep_chain_no_longer_hits_the_recursion_limit(backend):
+    arvore = ProcessTree()
+    arvore.nodes[1] = ProcessNode(1, 0, "/sbin/init", 0)
+    for pid in range(2000, 7000):
+        arvore.nodes[pid] = ProcessNode(pid, pid - 1 if pid > 2000 else 1, "bash", 0)
+    arvore.nodes[6999].read_bytes_delta = 4096
+    arvore.nodes[6999].context_tags = ["UNSAFE"]
+
+    arvore.aggregate_stats()
+    assert arvore.nodes[1].tree_read == 4096
+    assert "UNSAFE" in arvore.nodes[1].tags_accumulated
+    assert arvore.nodes[2000].tree_max_score == arvore.nodes[6999].anomaly_score > 0
+
+
+def test_cycles_are_left_out_like_before(backend):
+    idx = TreeIndex([-1, 0, 3, 2, 4])
+    assert idx.reachable() == [True, True, False, False, False]
+    somas, maximos, selos = idx.accumulate([[1, 2, 4, 8, 16]], [5, 9, 0, 0, 7], [1, 2, 4, 8, 16])
+    assert somas == [[3, 2, 4, 8, 16]]
+    assert maximos == [9, 9, 0, 0, 7] and selos == [3, 2, 4, 8, 16]
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_attach_modes.py
+# DESCRIPTION: Custo das sondas em cada modo de anexacao (fentry, tracepoint,
+#              kprobe) sobre a mesma carga rica em syscalls.
+#
+# WHY:         O modo "auto" prefere fentry a tracepoint e tracepoint a kprobe
+#              (src/probes/attach.py). Esta bancada mostra no host real quanto
+#              cada um custa: a mesma carga (openat, read/write, pread/pwrite,
+#              connect em loopback; attach.syscall_workload) roda sem sondas e
+#              depois com o motor completo em cada modo.
+#
+# METHOD:      Para cada modo o motor e criado com engine.attach_mode fixo e
+#              iniciado (sondas, leitura de eventos, tudo como em producao). A
+#              carga roda em processo filho, porque o agente filtra o proprio
+#              PID, --repeat vezes; vale a mediana. Com bpf_stats_enabled ligado
+#              durante a medida, run_time_ns/run_cnt dos programas dao o custo
+#              por execucao de sonda. Modo que o host nao suporta e pulado.
+#
+# REQUIRES:    root e bcc.
+#
+# USAGE:       sudo python3 tools/bench_attach_modes.py [--iterations 20000]
+#                                                      [--repeat 5]
+#                                                      [--modes fentry,kprobe]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import argparse
+import copy
+import os
+import statistics
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from src.probes.attach import MODES                                  # noqa: E402
+from src.utils.config_loader import DEFAULT_CONFIG                   # noqa: E402
+
+STATS_SYSCTL = "/proc/sys/kernel/bpf_stats_enabled"
+
+
+def carga(iteracoes):
+    """Segundos da carga num processo filho (fora do filtro de PID do agente)."""
+    codigo = ("from src.probes.attach import syscall_workload; "
+              "print(syscall_workload(%d))" % iteracoes)
+    saida = subprocess.check_output([sys.executable, "-c", codigo], cwd=RAIZ,
+                                    universal_newlines=True)
+    return float(saida.strip())
+
+
+def mediana(iteracoes, repeticoes):
+    return statistics.median(carga(iteracoes) for _ in range(repeticoes))
+
+
+def _run_stats(fds):
+    ns = cnt = 0
+    for fd in fds:
+        try:
+            with open("/proc/self/fdinfo/%d" % fd) as f:
+                for linha in f:
+                    chave, _, valor = linha.partition(":")
+                    if chave == "run_time_ns":
+                        ns += int(valor)
+                    elif chave == "run_cnt":
+                        cnt += int(valor)
+        except (OSError, ValueError):
+            continue
+    return ns, cnt
+
+
+def medir_modo(modo, iteracoes, repeticoes):
+    from src.core.engine import SysInspectorEngine
+    cfg = copy.deepcopy(DEFAULT_CONFIG)
+    cfg["engine"]["attach_mode"] = modo
+    cfg["engine"]["overhead_governor"] = False
+    motor = SysInspectorEngine(cfg)
+    motor.start()
+    try:
+        if motor.attach_mode != modo:
+            return None
+        fds = motor._bpf_prog_fds()
+        ns0, cnt0 = _run_stats(fds)
+        segundos = mediana(iteracoes, repeticoes)
+        ns1, cnt1 = _run_stats(fds)
+        execucoes = cnt1 - cnt0
+        return segundos, ((ns1 - ns0) / execucoes if execucoes else 0.0), execucoes
+    finally:
+        motor.stop()
+        if motor.bpf:
+            motor.bpf.cleanup()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Probe overhead per attach mode.")
+    p.add_argument("--iterations", type=int, default=20000)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--modes", default=",".join(MODES))
+    args = p.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit("root is required (BPF).")
+    try:
+        import bcc  # noqa: F401
+    except ImportError:
+        sys.exit("bcc not installed.")
+
+    with open(STATS_SYSCTL) as f:
+        stats_antes = f.read().strip()
+    try:
+        with open(STATS_SYSCTL, "w") as f:
+            f.write("1")
+        base = mediana(args.iterations, args.repeat)
+        print("carga: %d iteracoes, mediana de %d execucoes" % (args.iterations, args.repeat))
+        print("%-12s %9.3f s" % ("sem sondas", base))
+        for modo in [m.strip() for m in args.modes.split(",") if m.strip()]:
+            resultado = medir_modo(modo, args.iterations, args.repeat)
+            if resultado is None:
+                print("%-12s nao suportado neste host" % modo)
+                continue
+            segundos, ns_exec, execucoes = resultado
+            print("%-12s %9.3f s  %+6.1f%%  %8.1f ns/execucao  (%d execucoes)" % (
+                modo, segundos, 100.0 * (segundos - base) / base, ns_exec, execucoes))
+    finally:
+        with open(STATS_SYSCTL, "w") as f:
+            f.write(stats_antes)
+
+
+if __name__ == "__main__":
+    main()
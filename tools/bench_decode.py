@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_decode.py
+# DESCRIPTION: Mede o teto de eventos/s da thread de leitura do motor.
+#
+# WHY:         O que limita o agente num host carregado e quanto tempo a thread
+#              de leitura gasta por evento: enquanto ela trata um, o buffer do
+#              kernel enche. Este script compara o callback original
+#              (bpf["events"].event(data) sobre a struct unica event_data_t e
+#              os decode() por campo) com o atual (o callback so copia o
+#              registro compacto para o lote; o worker decodifica, em ordem).
+#
+# HOW:         Cada caminho recebe o que o kernel da sua versao envia: a struct
+#              de 360 bytes de antes (EventData, o layout que o BCC monta a
+#              partir do base_trace.c original) e os registros de records.py.
+#              Rodadas alternadas, melhor de cada, para o ruido da maquina
+#              pesar igual nos dois. Sem bcc e sem kernel.
+#
+# USAGE:       python3 tools/bench_decode.py [N_EVENTOS]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import ctypes as ct
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.probes import records               # noqa: E402
+from src.probes.batch import EventBatcher    # noqa: E402
+
+RODADAS = 5
+
+
+class EventData(ct.Structure):
+    """struct event_data_t do base_trace.c original, como o BCC a monta."""
+    _fields_ = [("pid", ct.c_uint32), ("ppid", ct.c_uint32), ("uid", ct.c_uint32),
+                ("loginuid", ct.c_uint32), ("comm", ct.c_char * 16),
+                ("filename", ct.c_char * 256), ("type_id", ct.c_char),
+                ("saddr", ct.c_uint32), ("daddr", ct.c_uint32),
+                ("sport", ct.c_uint16), ("dport", ct.c_uint16),
+                ("proto", ct.c_uint32), ("net_len", ct.c_uint64),
+                ("mem_vsz", ct.c_uint64), ("mem_peak_rss", ct.c_uint64),
+                ("io_bytes", ct.c_uint64), ("io_latency_ns", ct.c_uint64),
+                ("inspector_pid", ct.c_uint32), ("prio", ct.c_int)]
+
+
+class _TabelaEventos:
+    """PerfEventArray.event do BCC: cast do endereco para a struct montada."""
+
+    def __init__(self):
+        self._event_class = None
+
+    def event(self, data):
+        if self._event_class is None:
+            self._event_class = EventData
+        return ct.cast(data, ct.POINTER(self._event_class)).contents
+
+
+# Mistura tipica de host de servico: muito I/O e open, pouco exec.
+AMOSTRA = [('R', {"pid": 100, "comm": "postgres", "io_bytes": 8192, "io_latency_ns": 4000}),
+           ('W', {"pid": 100, "comm": "postgres", "io_bytes": 4096, "io_latency_ns": 9000}),
+           ('O', {"pid": 200, "comm": "nginx", "filename": "/var/log/nginx/access.log"}),
+           ('R', {"pid": 200, "comm": "nginx", "io_bytes": 512}),
+           ('E', {"pid": 300, "comm": "bash", "filename": "/usr/bin/ls"})]
+
+
+def _buffers_antigos():
+    saida = []
+    for tipo, ev in AMOSTRA:
+        s = EventData(pid=ev["pid"], ppid=1, uid=1000, loginuid=1000, prio=120,
+                      comm=ev["comm"].encode(), type_id=tipo.encode(),
+                      filename=ev.get("filename", "").encode(),
+                      io_bytes=ev.get("io_bytes", 0),
+                      io_latency_ns=ev.get("io_latency_ns", 0))
+        saida.append(ct.create_string_buffer(bytes(s), ct.sizeof(s)))
+    return saida
+
+
+def _buffers_atuais():
+    saida = []
+    for tipo, ev in AMOSTRA:
+        r = records.encode(tipo, ppid=1, uid=1000, loginuid=1000, **ev)
+        saida.append(ct.create_string_buffer(r, len(r)))
+    return saida
+
+
+def _enderecos(buffers):
+    # O BCC entrega ao callback (cpu, data, size) com data como inteiro.
+    return [(ct.addressof(b), len(b.raw)) for b in buffers]
+
+
+def _tratador(rec):
+    # Os campos que _handle_record le de todo registro, e os do tipo.
+    _ = (rec.pid, rec.ppid, rec.comm, rec.uid, rec.prio, rec.loginuid, rec.mem_peak_rss)
+    tipo = rec.type_id
+    if tipo in ('R', 'W'):
+        _ = (rec.io_bytes, rec.io_latency_ns)
+    elif tipo in ('E', 'O'):
+        _ = rec.filename
+
+
+def caminho_original(buffers, n):
+    """O callback de antes: tudo na thread de leitura."""
+    tabela = _TabelaEventos()
+    enderecos = _enderecos(buffers)
+    inicio = time.perf_counter()
+    for i in range(n):
+        data, _size = enderecos[i % len(enderecos)]
+        event = tabela.event(data)
+        _ = (event.pid, event.ppid, event.comm.decode('utf-8', 'replace'), event.uid,
+             event.prio, event.loginuid, event.mem_peak_rss)
+        ev_type = event.type_id.decode('utf-8', 'replace')
+        filename = event.filename.decode('utf-8', 'replace')
+        if ev_type in ('R', 'W'):
+            _ = (event.io_bytes, event.io_latency_ns)
+        elif ev_type in ('E', 'O'):
+            _ = filename
+    return n / (time.perf_counter() - inicio)
+
+
+def custo_do_callback(buffers, n):
+    """So a copia para o lote, com o worker parado: o que o callback custa."""
+    enderecos = _enderecos(buffers)
+    tamanhos = sum(enderecos[i % len(enderecos)][1] for i in range(n))
+    batcher = EventBatcher(_tratador, batch_bytes=tamanhos + 4096, batches=2)
+    inicio = time.perf_counter()
+    for i in range(n):
+        data, size = enderecos[i % len(enderecos)]
+        batcher.add(data, size)
+    return n / (time.perf_counter() - inicio)
+
+
+def caminho_em_lotes(buffers, n):
+    """Leitura com o worker ativo, e o total ate o ultimo registro tratado."""
+    enderecos = _enderecos(buffers)
+    batcher = EventBatcher(_tratador)
+    batcher.start()
+    inicio = time.perf_counter()
+    for i in range(n):
+        data, size = enderecos[i % len(enderecos)]
+        batcher.add(data, size)
+        if i % 4096 == 4095:
+            batcher.flush()      # equivale ao retorno de cada poll()
+    batcher.flush()
+    leitura = time.perf_counter() - inicio
+    batcher.drain()
+    total = time.perf_counter() - inicio
+    return n / leitura, n / total
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    antigos, atuais = _buffers_antigos(), _buffers_atuais()
+    antigo = callback = leitura = ponta_a_ponta = 0.0
+    for _ in range(RODADAS):
+        antigo = max(antigo, caminho_original(antigos, n))
+        callback = max(callback, custo_do_callback(atuais, n))
+        lido, total = caminho_em_lotes(atuais, n)
+        leitura, ponta_a_ponta = max(leitura, lido), max(ponta_a_ponta, total)
+    print("eventos: %d (melhor de %d rodadas)" % (n, RODADAS))
+    print("callback original (.event())   : %10.0f ev/s" % antigo)
+    print("callback so copiando (lotes)   : %10.0f ev/s  (%.1fx)" % (callback, callback / antigo))
+    # Com o worker ativo as duas threads disputam o GIL; no agente o worker
+    # roda sobretudo enquanto a leitura esta parada no epoll do poll().
+    print("leitura com worker concorrente : %10.0f ev/s" % leitura)
+    print("ponta a ponta (lotes + worker) : %10.0f ev/s" % ponta_a_ponta)
+
+
+if __name__ == "__main__":
+    main()
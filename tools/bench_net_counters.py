@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_net_counters.py
+# DESCRIPTION: Custo por pacote dos contadores de rede: hash compartilhado
+#              (antes) contra hash per-CPU (depois).
+#
+# WHY:         net_dev_xmit e netif_receive_skb rodam a cada pacote, em todas as
+#              CPUs, dentro do caminho de rede. Com um BPF_HASH compartilhado o
+#              valor do PID e uma linha de cache disputada entre CPUs; per-CPU
+#              cada uma soma na sua. Este script mede as duas formas (e o hash
+#              compartilhado com soma atomica, que seria a correcao "ingenua")
+#              com trafego real num par veth, sem depender de placa de rede.
+#
+# METHOD:      Um namespace de rede com uma ponta do veth; iperf3 servidor la
+#              dentro e cliente com -P fluxos paralelos aqui fora, o que poe
+#              varias CPUs no mesmo PID (a chave disputada). Para cada variante
+#              as duas sondas sao carregadas, o trafego roda por --seconds, e o
+#              custo vem de run_time_ns/run_cnt de cada programa (fdinfo, com
+#              kernel.bpf_stats_enabled ligado so durante a medida). A vazao do
+#              iperf3 sem sondas e com cada variante vai junto.
+#
+# REQUIRES:    root, bcc, iproute2 e iperf3. Nao roda em CI: e para a bancada,
+#              antes de levar a mudanca a hosts 25/100GbE.
+#
+# USAGE:       sudo python3 tools/bench_net_counters.py [--seconds 10] [--streams 8]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+NETNS = "si-bench"
+VETH_HOST, VETH_NS = "si-bench0", "si-bench1"
+IP_HOST, IP_NS = "10.199.0.1", "10.199.0.2"
+STATS_SYSCTL = "/proc/sys/kernel/bpf_stats_enabled"
+
+# As mesmas sondas do agente, reduzidas ao contador. MAP_DECL e UPDATE mudam
+# por variante; a chave e o PID, como em base_trace.c.
+PROGRAMA = r"""
+MAP_DECL(net_bytes_sent, u32, u64);
+MAP_DECL(net_bytes_recv, u32, u64);
+
+TRACEPOINT_PROBE(net, net_dev_xmit) {
+    u32 pid = bpf_get_current_pid_tgid() >> 32;
+    u64 zero = 0, len = args->len, *val;
+    val = net_bytes_sent.lookup_or_try_init(&pid, &zero);
+    if (val) { UPDATE(val, len); }
+    return 0;
+}
+
+TRACEPOINT_PROBE(net, netif_receive_skb) {
+    u32 pid = bpf_get_current_pid_tgid() >> 32;
+    u64 zero = 0, len = args->len, *val;
+    val = net_bytes_recv.lookup_or_try_init(&pid, &zero);
+    if (val) { UPDATE(val, len); }
+    return 0;
+}
+"""
+
+VARIANTES = (
+    ("shared_hash (antes)", ["-DMAP_DECL=BPF_HASH", "-DUPDATE(v,n)=(*(v))+=(n)"]),
+    ("shared_hash_atomic", ["-DMAP_DECL=BPF_HASH", "-DUPDATE(v,n)=__sync_fetch_and_add((v),(n))"]),
+    ("percpu_hash (depois)", ["-DMAP_DECL=BPF_PERCPU_HASH", "-DUPDATE(v,n)=(*(v))+=(n)"]),
+)
+
+
+def _sh(*args, check=True):
+    return subprocess.run(list(args), check=check, stdout=subprocess.PIPE,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def montar_veth():
+    desmontar_veth()
+    _sh("ip", "netns", "add", NETNS)
+    _sh("ip", "link", "add", VETH_HOST, "type", "veth", "peer", "name", VETH_NS)
+    _sh("ip", "link", "set", VETH_NS, "netns", NETNS)
+    _sh("ip", "addr", "add", IP_HOST + "/24", "dev", VETH_HOST)
+    _sh("ip", "link", "set", VETH_HOST, "up")
+    _sh("ip", "netns", "exec", NETNS, "ip", "addr", "add", IP_NS + "/24", "dev", VETH_NS)
+    _sh("ip", "netns", "exec", NETNS, "ip", "link", "set", VETH_NS, "up")
+    _sh("ip", "netns", "exec", NETNS, "ip", "link", "set", "lo", "up")
+
+
+def desmontar_veth():
+    _sh("ip", "link", "del", VETH_HOST, check=False)
+    _sh("ip", "netns", "del", NETNS, check=False)
+
+
+def trafego(segundos, fluxos):
+    """Roda o iperf3 e devolve a vazao em Gbit/s."""
+    servidor = subprocess.Popen(["ip", "netns", "exec", NETNS, "iperf3", "-s", "-1"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        time.sleep(0.5)
+        saida = _sh("iperf3", "-c", IP_NS, "-t", str(segundos), "-P", str(fluxos), "-J")
+        fim = json.loads(saida.stdout)["end"]
+        return fim["sum_received"]["bits_per_second"] / 1e9
+    finally:
+        servidor.wait(timeout=segundos + 10)
+
+
+def _run_stats(fd):
+    stats = {}
+    with open("/proc/self/fdinfo/%d" % fd) as f:
+        for linha in f:
+            chave, _, valor = linha.partition(":")
+            if chave in ("run_time_ns", "run_cnt"):
+                stats[chave] = int(valor)
+    return stats.get("run_time_ns", 0), stats.get("run_cnt", 0)
+
+
+def medir_variante(BPF, cflags, segundos, fluxos):
+    bpf = BPF(text=PROGRAMA, cflags=cflags)
+    try:
+        vazao = trafego(segundos, fluxos)
+        ns = cnt = 0
+        for func in bpf.funcs.values():
+            t, c = _run_stats(func.fd)
+            ns += t
+            cnt += c
+        return vazao, (ns / cnt if cnt else 0.0), cnt
+    finally:
+        bpf.cleanup()
+
+
+def main():
+    p = argparse.ArgumentParser(description="Per-packet cost of shared vs per-CPU network counters.")
+    p.add_argument("--seconds", type=int, default=10)
+    p.add_argument("--streams", type=int, default=max(2, min(os.cpu_count() or 2, 16)))
+    args = p.parse_args()
+
+    if os.geteuid() != 0:
+        sys.exit("root is required (netns, veth, BPF).")
+    for binario in ("ip", "iperf3"):
+        if not shutil.which(binario):
+            sys.exit("%s not found." % binario)
+    try:
+        from bcc import BPF
+    except ImportError:
+        sys.exit("bcc not installed.")
+
+    with open(STATS_SYSCTL) as f:
+        stats_antes = f.read().strip()
+    montar_veth()
+    try:
+        with open(STATS_SYSCTL, "w") as f:
+            f.write("1")
+        base = trafego(args.seconds, args.streams)
+        print("veth + iperf3 -P %d, %d s por variante" % (args.streams, args.seconds))
+        print("%-22s %10.2f Gbit/s" % ("sem sondas", base))
+        for nome, cflags in VARIANTES:
+            vazao, ns_pkt, execucoes = medir_variante(BPF, cflags, args.seconds, args.streams)
+            print("%-22s %10.2f Gbit/s  %8.1f ns/execucao  (%d execucoes)" % (
+                nome, vazao, ns_pkt, execucoes))
+    finally:
+        with open(STATS_SYSCTL, "w") as f:
+            f.write(stats_antes)
+        desmontar_veth()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_node_memory.py
+# DESCRIPTION: Pico de memoria do agente com 10k/50k processos: no com
+#              __dict__ (antes) contra no "slotted" com padroes (depois).
+#
+# WHY:         Cada ProcessNode levava ~75 atributos num __dict__ proprio, mais
+#              set/list/dict vazios, mesmo numa thread de kernel ociosa, e o
+#              to_json copiava o __dict__ de cada no antes do json.dumps. Este
+#              script monta uma arvore sintetica (maioria ociosa, parte com
+#              arquivos e bibliotecas, como num host de servico), serializa e
+#              mede o pico de RSS de cada forma num processo separado.
+#
+# USAGE:       python3 tools/bench_node_memory.py [--sizes 10000,50000]
+#                                                 [--busy-pct 20]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.collectors import process_tree as pt   # noqa: E402
+
+
+class NoAntigo(object):
+    """O layout de antes: todo campo do esquema materializado no __dict__."""
+
+    def __init__(self, pid, ppid, cmd, uid):
+        for campo, padrao in pt.NODE_FIELDS:
+            setattr(self, campo, padrao() if isinstance(padrao, type) else padrao)
+        self.pid, self.ppid, self.cmd, self.uid = pid, ppid, cmd, uid
+        self.username = pt.get_username(uid)
+
+
+def to_json_antigo(nodes):
+    saida = {}
+    for pid, node in nodes.items():
+        d = vars(node).copy()
+        if 'tags_accumulated' in d: del d['tags_accumulated']
+        if isinstance(d.get('open_files'), set): d['open_files'] = list(d['open_files'])
+        if isinstance(d.get('connections'), set): d['connections'] = list(d['connections'])
+        saida[pid] = d
+    return saida
+
+
+def montar(classe, n, busy_pct):
+    nodes = {}
+    ocupados = n * busy_pct // 100
+    for i in range(n):
+        pid = 1000 + i
+        if i < ocupados:
+            node = classe(pid, 1, "/usr/sbin/svc --worker %d" % i, 1000)
+            node.open_files.update("/var/lib/svc/data-%d.db" % k for k in range(8))
+            node.libs = ["/usr/lib64/libc.so.6", "/usr/lib64/libssl.so.3"]
+            node.context_tags.append("CONTAINER")
+            node.read_bytes_delta = 4096 * i
+        else:
+            node = classe(pid, 2, "[kworker/%d:1]" % i, 0)
+        nodes[pid] = node
+    return nodes
+
+
+def medir(variante, n, busy_pct):
+    """Roda no processo filho: monta, serializa e devolve o pico de RSS."""
+    inicio = time.perf_counter()
+    if variante == "antigo":
+        nodes = montar(NoAntigo, n, busy_pct)
+        texto = json.dumps(to_json_antigo(nodes))
+    else:
+        arvore = pt.ProcessTree()
+        arvore.nodes = montar(pt.ProcessNode, n, busy_pct)
+        texto = json.dumps(arvore.to_json())
+    tempo = time.perf_counter() - inicio
+    pico_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"peak_kb": pico_kb, "seconds": tempo, "json_bytes": len(texto)}))
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", default="10000,50000")
+    ap.add_argument("--busy-pct", type=int, default=20)
+    ap.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        medir(args.child[0], int(args.child[1]), args.busy_pct)
+        return
+
+    print("%8s  %14s  %14s  %8s" % ("nos", "antes (MB)", "depois (MB)", "reducao"))
+    for n in (int(x) for x in args.sizes.split(",")):
+        picos = {}
+        for variante in ("antigo", "slots"):
+            saida = subprocess.check_output(
+                [sys.executable, os.path.abspath(__file__), "--busy-pct", str(args.busy_pct),
+                 "--child", variante, str(n)], universal_newlines=True)
+            picos[variante] = json.loads(saida.strip().splitlines()[-1])["peak_kb"] / 1024.0
+        print("%8d  %14.1f  %14.1f  %7.0f%%" % (
+            n, picos["antigo"], picos["slots"], 100 * (1 - picos["slots"] / picos["antigo"])))
+
+
+if __name__ == "__main__":
+    main()
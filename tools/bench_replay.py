@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_replay.py
+# DESCRIPTION: Mede o caminho de eventos do motor sem kernel, por reproducao.
+#
+# WHY:         Toda mudanca no caminho quente (callback, lote, worker,
+#              _handle_record, arvore) precisava de root, bcc e carga real.
+#              Aqui o mesmo motor recebe um fluxo gravado (engine.record_file)
+#              ou sintetico (src/probes/replay.py) pelo callback do perf buffer,
+#              em qualquer maquina de CI. Tres medidas, em execucoes separadas
+#              para uma nao distorcer a outra:
+#                - eventos/s ponta a ponta (callback -> lote -> worker -> arvore)
+#                - custo medio por tipo de evento em _handle_record
+#                - memoria de pico e retida pela ProcessTree (tracemalloc)
+#
+# USAGE:       python3 tools/bench_replay.py [--events N] [--file CAPTURA]
+#                                            [--pids N] [--no-enrich]
+#                                            [--save CAPTURA]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.core.engine import SysInspectorEngine                       # noqa: E402
+from src.probes import records                                       # noqa: E402
+from src.probes.replay import (ReplaySource, RecordWriter, read_records,  # noqa: E402
+                               synthetic_records)
+from src.utils.config_loader import DEFAULT_CONFIG                   # noqa: E402
+
+
+def _motor(sem_enriquecimento):
+    motor = SysInspectorEngine(copy.deepcopy(DEFAULT_CONFIG))
+    if sem_enriquecimento:
+        # Isola o caminho dos eventos: nenhum /proc lido no pool.
+        motor.enricher.enrich = lambda node: True
+    return motor
+
+
+def ponta_a_ponta(brutos, sem_enriquecimento):
+    motor = _motor(sem_enriquecimento)
+    inicio = time.perf_counter()
+    n = motor.replay(ReplaySource(brutos))
+    segundos = time.perf_counter() - inicio
+    return n / segundos, len(motor.tree.nodes), motor.event_errors
+
+
+def custo_por_tipo(brutos, sem_enriquecimento):
+    """Segundos e contagem por tipo, so em _handle_record (sem lote/thread)."""
+    motor = _motor(sem_enriquecimento)
+    motor.enricher.start()
+    decodificados = [records.decode(raw) for raw in brutos]
+    tempos, contagem = {}, {}
+    relogio = time.perf_counter
+    tratar = motor._handle_record
+    for ev in decodificados:
+        t0 = relogio()
+        tratar(ev)
+        dt = relogio() - t0
+        tipo = ev.type_id
+        tempos[tipo] = tempos.get(tipo, 0.0) + dt
+        contagem[tipo] = contagem.get(tipo, 0) + 1
+    return tempos, contagem
+
+
+def memoria(brutos, sem_enriquecimento):
+    """Pico durante a reproducao e o que a arvore retem ao fim (bytes)."""
+    motor = _motor(sem_enriquecimento)
+    motor.batcher.start()
+    motor.enricher.start()
+    tracemalloc.start()
+    base = tracemalloc.take_snapshot()
+    motor.replay(ReplaySource(brutos))
+    motor.enricher.drain(10.0)
+    _atual, pico = tracemalloc.get_traced_memory()
+    retido = sum(s.size_diff for s in
+                 tracemalloc.take_snapshot().compare_to(base, "filename"))
+    tracemalloc.stop()
+    return pico, retido, len(motor.tree.nodes)
+
+
+def main():
+    p = argparse.ArgumentParser(description="Replay benchmark of the engine event path.")
+    p.add_argument("--events", type=int, default=200000, help="synthetic events (ignored with --file)")
+    p.add_argument("--file", help="record file written by engine.record_file")
+    p.add_argument("--pids", type=int, default=2048, help="distinct synthetic processes")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--no-enrich", action="store_true", help="skip /proc enrichment in the pool")
+    p.add_argument("--save", help="also write the stream used to this record file")
+    args = p.parse_args()
+
+    # Materializado antes: gerar o fluxo nao pode entrar na conta.
+    if args.file:
+        brutos = [raw for _ts, raw in read_records(args.file)]
+    else:
+        brutos = list(synthetic_records(args.events, pids=args.pids, seed=args.seed))
+    if args.save:
+        gravador = RecordWriter(args.save)
+        for raw in brutos:
+            gravador.write(raw)
+        gravador.close()
+
+    taxa, nos, erros = ponta_a_ponta(brutos, args.no_enrich)
+    tempos, contagem = custo_por_tipo(brutos, args.no_enrich)
+    pico, retido, nos_mem = memoria(brutos, args.no_enrich)
+
+    print("eventos: %d (%s)" % (len(brutos), args.file or "sinteticos"))
+    print("ponta a ponta        : %10.0f ev/s  (%d nos, %d erros)" % (taxa, nos, erros))
+    print("custo por tipo em _handle_record:")
+    for tipo in sorted(contagem, key=lambda t: tempos[t], reverse=True):
+        print("  %s  %8d ev  %8.2f us/ev  %6.1f%% do tempo" % (
+            tipo, contagem[tipo], tempos[tipo] / contagem[tipo] * 1e6,
+            100.0 * tempos[tipo] / (sum(tempos.values()) or 1)))
+    print("memoria (tracemalloc): pico %.1f MB, retida %.1f MB (%d nos, %.0f B/no)" % (
+        pico / 1e6, retido / 1e6, nos_mem, retido / (nos_mem or 1)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+# ==============================================================================
+# FILE: tools/bench_tree_aggregate.py
+# DESCRIPTION: Tempo do aggregate_stats em arvores de 100k processos: DFS
+#              recursiva (antes) contra a passada por nivel sobre o indice de
+#              pais (depois), com NumPy e com array('q').
+#
+# WHY:         A DFS copiava nove contadores e fundia tags por aresta, em
+#              Python puro, e estourava a recursao numa cadeia funda de
+#              processos. Este script monta arvores sinteticas iguais para as
+#              formas (sem /proc, sem sondas), mede cada uma e inclui uma cadeia
+#              de shells para mostrar o limite da versao antiga.
+#
+# USAGE:       python3 tools/bench_tree_aggregate.py [--sizes 10000,100000]
+#                                                    [--chain 5000] [--rounds 3]
+#
+# AUTHOR: Mario Luz (Sys-Inspector Project)
+# ==============================================================================
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.collectors import process_tree as pt   # noqa: E402
+from src.collectors import tree_index           # noqa: E402
+
+CMDS = ("/usr/sbin/sshd -D", "bash", "/usr/bin/python3 worker.py", "/usr/sbin/nginx",
+        "/tmp/.x/payload", "java -jar app.jar", "[defunct-child] <defunct>")
+TAGS = ("UNSAFE", "CONTAINER", "SSH", "SUDO", "EDR-WAIT", "DELETED", "NEW",
+        "WARN: LD_PRELOAD", "LOCAL", "EDR/AV", "GPU")
+
+
+def montar_arvore(n, seed=0, chain=0):
+    """Arvore sintetica: kernel sob o PID 2, usuarios sob o 1, orfaos e zumbis."""
+    rnd = random.Random(seed)
+    arvore = pt.ProcessTree()
+
+    def novo(pid, ppid, cmd):
+        node = pt.ProcessNode(pid, ppid, cmd, 0)
+        arvore.nodes[pid] = node
+        return node
+
+    novo(1, 0, "/sbin/init")
+    novo(2, 0, "[kthreadd]")
+    proximo = 3
+    for _ in range(max(1, n // 10)):
+        kw = novo(proximo, 2, "[kworker/%d]" % proximo)
+        if rnd.random() < 0.05: kw.tcp_retrans = rnd.randint(1, 50)
+        if rnd.random() < 0.01: kw.context_tags.append("NET ERR")
+        proximo += 1
+
+    usuarios = [1]
+    pai = 1
+    for _ in range(chain):
+        novo(proximo, pai, "bash")
+        usuarios.append(proximo)
+        pai = proximo
+        proximo += 1
+
+    while len(arvore.nodes) < n:
+        ppid = rnd.choice(usuarios) if rnd.random() < 0.97 else 4000000 + proximo
+        node = novo(proximo, ppid, rnd.choice(CMDS))
+        node.read_bytes_delta = rnd.randint(0, 1 << 30)
+        node.write_bytes_delta = rnd.randint(0, 1 << 20)
+        node.net_tx_bytes = rnd.randint(0, 1 << 24)
+        node.net_rx_bytes = rnd.randint(0, 1 << 24)
+        node.io_latency_tot = rnd.randint(0, 10 ** 9)
+        if rnd.random() < 0.02: node.tcp_drops = rnd.randint(1, 9)
+        if rnd.random() < 0.01: node.state = 'Z'
+        if rnd.random() < 0.05: node.context_tags.append(rnd.choice(TAGS))
+        usuarios.append(proximo)
+        proximo += 1
+    return arvore
+
+
+def agregar_antigo(self):
+    """O aggregate_stats de antes (DFS recursiva), copiado sem mudancas."""
+
+    # [FIX item1] Identify kernel threads: PID 2 (kthreadd) and its whole
+    # subtree. TCP drop/retransmit events fired in softirq context get
+    # charged to the running kernel thread (ksoftirqd, kthreadd), not to the
+    # socket owner. Those are false-positive NET ERR alerts, so kernel
+    # threads are excluded from NET ERR (badge, score and tree aggregation).
+    # User processes always descend from PID 1, so this set is exact.
+    kthread_children = {}
+    for _pid, _n in self.nodes.items():
+        kthread_children.setdefault(int(_n.ppid), []).append(_pid)
+    self.kernel_pids = set()
+    if 2 in self.nodes:
+        _stack = [2]
+        while _stack:
+            _kp = _stack.pop()
+            if _kp in self.kernel_pids:
+                continue
+            self.kernel_pids.add(_kp)
+            _stack.extend(kthread_children.get(_kp, []))
+
+    for n in self.nodes.values():
+        n.anomaly_score = 0
+
+        if "UNSAFE" in n.context_tags: n.anomaly_score += pt.SCORE_UNSAFE_LIB
+        if "MINER" in n.context_tags or "GPU" in n.context_tags:
+            n.anomaly_score |= pt.SCORE_GPU
+        if "EDR/AV" in n.context_tags: n.anomaly_score += pt.SCORE_INSPECTOR
+        if "NET_TOOL" in n.context_tags: n.anomaly_score += pt.SCORE_NET_TOOL
+        if "DELETED" in n.context_tags: n.anomaly_score += pt.SCORE_DELETED
+        if pt.unsafe_path_in_cmdline(n.cmd): n.anomaly_score += pt.SCORE_MALWARE
+
+        if n.pid not in self.kernel_pids and (n.tcp_retrans > 0 or n.tcp_drops > 0):
+            n.tags_accumulated = set(n.context_tags)
+            n.tags_accumulated.add("NET ERR")
+            n.anomaly_score += pt.SCORE_NET_ISSUE
+        else:
+            n.tags_accumulated = set(n.context_tags)
+            # [FIX item1] Drop any pre-existing NET ERR tag on kernel threads
+            # (set upstream by the collector) so it does not linger in the
+            # filter or bubble up to kthreadd.
+            if n.pid in self.kernel_pids:
+                n.tags_accumulated.discard("NET ERR")
+
+        if n.state == 'Z' or "<defunct>" in n.cmd:
+            n.anomaly_score |= pt.SCORE_ZOMBIE
+            if "ZOMBIE" not in n.tags_accumulated: n.tags_accumulated.add("ZOMBIE")
+            n.detection_reasons.append(f"Process is ZOMBIE/DEFUNCT. Parent: {n.ppid}")
+
+        # [v0.70] EDR Horizontal (Propagate)
+        if "EDR-WAIT" in n.context_tags:
+            n.tags_accumulated.add("EDR-WAIT")
+            n.tags_accumulated.add("🧊")
+
+        n.tree_has_alert = (n.anomaly_score > 0)
+        n.tree_max_score = n.anomaly_score
+
+    children_map = {}
+    for pid, node in self.nodes.items():
+        if node.ppid not in children_map: children_map[node.ppid] = []
+        children_map[node.ppid].append(pid)
+
+    all_pids = set(self.nodes.keys())
+    roots = [pid for pid in all_pids if self.nodes[pid].ppid not in all_pids]
+
+    for root_pid in roots:
+        if root_pid != 1 and root_pid != 2:
+            if 1 in self.nodes:
+                if 1 not in children_map: children_map[1] = []
+                if root_pid not in children_map[1]:
+                    children_map[1].append(root_pid)
+
+    visited = set()
+
+    def accumulate_recursive(pid):
+        if pid in visited: return self.nodes[pid]
+        visited.add(pid)
+        node = self.nodes[pid]
+
+        node.tree_read = node.read_bytes_delta
+        node.tree_write = node.write_bytes_delta
+        node.tree_read_delta = node.read_bytes_delta
+        node.tree_write_delta = node.write_bytes_delta
+        node.tree_net_tx = node.net_tx_bytes
+        node.tree_net_rx = node.net_rx_bytes
+        node.tree_io_latency = node.io_latency_tot
+        # [FIX item1] Kernel threads do not own sockets; drop their softirq-
+        # attributed TCP counters so they neither alert nor bubble up.
+        if node.pid in self.kernel_pids:
+            node.tree_tcp_drops = 0
+            node.tree_tcp_retrans = 0
+        else:
+            node.tree_tcp_drops = node.tcp_drops
+            node.tree_tcp_retrans = node.tcp_retrans
+
+        if pid == 1 and hasattr(self, 'immutable_alert') and self.immutable_alert:
+            for alert in self.immutable_alert:
+                node.detection_reasons.append(f"Filesystem Anomaly: {alert} [+{pt.SCORE_IMMUTABLE}]")
+                node.anomaly_score |= pt.SCORE_IMMUTABLE
+                node.tags_accumulated.add("UNSAFE")
+
+        if pid in children_map:
+            for child_pid in children_map[pid]:
+                if child_pid in self.nodes:
+                    child = accumulate_recursive(child_pid)
+
+                    node.tree_read += child.tree_read
+                    node.tree_write += child.tree_write
+                    node.tree_read_delta += child.tree_read_delta
+                    node.tree_write_delta += child.tree_write_delta
+                    node.tree_net_tx += child.tree_net_tx
+                    node.tree_net_rx += child.tree_net_rx
+                    node.tree_io_latency += child.tree_io_latency
+                    node.tree_tcp_drops += child.tree_tcp_drops
+                    node.tree_tcp_retrans += child.tree_tcp_retrans
+
+                    if child.state == 'Z':
+                        node.anomaly_score |= pt.SCORE_ZOMBIE
+                        if "ZOMBIE_PARENT" not in node.tags_accumulated:
+                            node.tags_accumulated.add("WARN")
+
+                    if child.tree_max_score > node.tree_max_score:
+                        node.tree_max_score = child.tree_max_score
+                    if child.tree_has_alert:
+                        node.tree_has_alert = True
+
+                    whitelist = ["SSH", "SUDO", "UNSAFE", "MINER", "EDR/AV", "CONTAINER", "GPU", "NET ERR", "NEW", "WARN", "ZOMBIE", "EDR-WAIT", "🧊"]
+                    for tag in child.tags_accumulated:
+                        if tag in whitelist or "WARN" in tag:
+                            node.tags_accumulated.add(tag)
+        return node
+
+    if 1 in self.nodes: accumulate_recursive(1)
+    if 2 in self.nodes: accumulate_recursive(2)
+    for r in roots:
+        accumulate_recursive(r)
+
+    for n in self.nodes.values():
+        n.context_tags = list(n.tags_accumulated)
+
+
+def medir(agregar, n, chain, rounds):
+    melhor = None
+    for r in range(rounds):
+        arvore = montar_arvore(n, seed=r, chain=chain)
+        inicio = time.perf_counter()
+        try:
+            agregar(arvore)
+        except RecursionError:
+            return None
+        gasto = time.perf_counter() - inicio
+        melhor = gasto if melhor is None else min(melhor, gasto)
+    return melhor
+
+
+def _com_array(arvore):
+    np, tree_index.np = tree_index.np, None
+    try:
+        arvore.aggregate_stats()
+    finally:
+        tree_index.np = np
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--chain", type=int, default=5000)
+    ap.add_argument("--rounds", type=int, default=3)
+    args = ap.parse_args()
+
+    formas = [("recursiva", agregar_antigo), ("array('q')", _com_array)]
+    if tree_index.np is not None:
+        formas.append(("numpy", pt.ProcessTree.aggregate_stats))
+    else:
+        print("[i] NumPy ausente: so a forma array('q').")
+
+    print("%8s  %7s  " % ("nos", "cadeia") + "  ".join("%12s" % nome for nome, _ in formas))
+    for n in (int(x) for x in args.sizes.split(",")):
+        for chain in (0, args.chain):
+            tempos = [medir(f, n, chain, args.rounds) for _, f in formas]
+            print("%8d  %7d  " % (n, chain) + "  ".join(
+                "%10.1fms" % (t * 1000) if t is not None else "%12s" % "RecursionErr"
+                for t in tempos))
+
+
+if __name__ == "__main__":
+    main()